@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks.py
+
+性能基准（命令行运行，不依赖 GUI）：
+- parse：hosts 解析引擎吞吐（行/秒），使用可复现的合成语料
+- fetch：远程获取吞吐与故障切换（本地 HTTP 替身服务器，不访问外网）
+- dns：原生 asyncio DNS 解析吞吐（域名/秒，本地 DNS 替身服务器）
+- probe：批量 TCP 探测（MassTcpProber）与线程池逐 IP 测速的耗时对比（本机监听端口）
+- http：HTTP 探测阶段（HEAD 首字节）能否识别“能连上但响应慢”的 IP（本地 HTTPS 替身服务器）
+- icmp：进程内 ICMP 引擎的每 IP 开销（Linux 非特权 ping 套接字，ping 本机回环地址）
+
+用法：
+    python benchmarks.py parse [--lines 200000] [--repeat 5]
+    python benchmarks.py fetch [--lines 200000] [--repeat 5]
+    python benchmarks.py dns [--domains 5000]
+    python benchmarks.py probe [--ips 2000]
+    python benchmarks.py http [--ips 60]
+    python benchmarks.py icmp [--ips 2000]
+
+低于目标值（或故障切换失败）时以退出码 1 结束，便于发现性能回退。
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import SPEED_TEST_CONFIG
+from local_servers import LocalHostsServer, LocalHttpsServer, StubDnsServer
+from services import (
+    ConnectRateLimiter,
+    DnsCache,
+    DomainResolver,
+    EnhancedSpeedTester,
+    HostsParser,
+    HostsSnapshotStore,
+    MassTcpProber,
+    RemoteHostsCache,
+    RemoteHostsClient,
+    SourceHealthStore,
+    SpeedTester,
+    TournamentScheduler,
+    get_shared_icmp_engine,
+)
+
+# 解析吞吐目标（行/秒）：以单核、默认配置（后缀树 + "github" 关键字）解析合成语料计
+PARSE_LINES_PER_SEC_TARGET = 1_000_000
+
+# 原生 DNS 解析吞吐目标（域名/秒）：本地替身服务器为纯 Python 实现，实际瓶颈在服务器一侧
+DNS_DOMAINS_PER_SEC_TARGET = 2_000
+
+# 批量探测相对线程池（60 线程，与 GUI 一致）的最低加速比
+PROBE_SPEEDUP_TARGET = 3.0
+
+# HTTP 探测阶段相对只做 TCP + TLS 的额外耗时上限（比例，不含注入的首字节延迟本身）
+HTTP_PROBE_OVERHEAD_TARGET = 0.5
+
+# ICMP 回退每个 IP 的平均开销上限（毫秒，60 线程逐个 ping 本机回环地址；ping 子进程通常要数毫秒以上）
+ICMP_PER_IP_MS_TARGET = 1.0
+
+_GITHUB_HOSTS = [
+    "github.com", "api.github.com", "gist.github.com", "codeload.github.com",
+    "raw.githubusercontent.com", "objects.githubusercontent.com", "avatars.githubusercontent.com",
+    "github.githubassets.com", "github.global.ssl.fastly.net", "github-cloud.s3.amazonaws.com",
+]
+_CDN_SUFFIXES = ["cloudfront.net", "akamaiedge.net", "fastly.net", "edgekey.net", "azureedge.net"]
+_AD_WORDS = ["ads", "track", "pixel", "metrics", "banner", "click", "stat", "beacon", "promo", "tag"]
+
+
+def generate_hosts_corpus(lines: int = 200_000, *, seed: int = 20240101) -> bytes:
+    """生成可复现的多来源 hosts 语料（bytes）。
+
+    组成近似真实的合并列表：广告屏蔽条目（0.0.0.0 / 127.0.0.1 大量重复）、CDN 条目、
+    GitHub 条目（含一行多域名与 IPv6）、注释/空行、以及少量无效行（HTML 片段、坏 IP）。
+    """
+    rnd = random.Random(seed)
+    out = []
+    for i in range(lines):
+        r = rnd.random()
+        if r < 0.55:
+            word = rnd.choice(_AD_WORDS)
+            ip = "0.0.0.0" if rnd.random() < 0.8 else "127.0.0.1"
+            out.append(f"{ip} {word}{i % 5000}.example{i % 97}.com")
+        elif r < 0.75:
+            ip = f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+            out.append(f"{ip}\tedge{i % 3000}.{rnd.choice(_CDN_SUFFIXES)}")
+        elif r < 0.85:
+            ip = f"185.199.{rnd.randint(108, 111)}.{rnd.randint(1, 254)}"
+            hosts = " ".join(rnd.sample(_GITHUB_HOSTS, rnd.randint(1, 3)))
+            out.append(f"{ip} {hosts}  # github")
+        elif r < 0.88:
+            out.append(f"2606:50c0:8000::{rnd.randint(1, 0xffff):x} {rnd.choice(_GITHUB_HOSTS)}")
+        elif r < 0.95:
+            out.append("# " + "comment " * rnd.randint(1, 4) if rnd.random() < 0.7 else "")
+        else:
+            out.append(rnd.choice([
+                "<html><body>not a hosts file</body></html>",
+                "999.1.1.1 github.com",
+                "1.2.3.4 bad_host!.github.com",
+                "localhost",
+            ]))
+    return ("\n".join(out) + "\n").encode("utf-8")
+
+
+def bench_parse(lines: int, repeat: int) -> bool:
+    print("=" * 60)
+    print("hosts 解析引擎基准")
+    print("=" * 60)
+
+    corpus = generate_hosts_corpus(lines)
+    print(f"\n语料：{lines} 行，{len(corpus) / 1024 / 1024:.1f} MB")
+
+    best = float("inf")
+    records = 0
+    for _ in range(max(1, repeat)):
+        parser = HostsParser()  # 每轮新建，避免 IP 缓存跨轮预热
+        t0 = time.perf_counter()
+        records = len(parser.parse_bytes(corpus))
+        best = min(best, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    RemoteHostsClient.parse_github_hosts_text(corpus.decode("utf-8"))
+    text_elapsed = time.perf_counter() - t0
+
+    rate = lines / best if best > 0 else float("inf")
+    print(f"记录数：{records}")
+    print(f"parse_bytes：最佳 {best * 1000:.1f} ms，{rate:,.0f} 行/秒")
+    print(f"parse_github_hosts_text（含编码转换）：{text_elapsed * 1000:.1f} ms")
+    print(f"目标：{PARSE_LINES_PER_SEC_TARGET:,} 行/秒")
+
+    ok = rate >= PARSE_LINES_PER_SEC_TARGET
+    print("\n[SUCCESS] 达到目标" if ok else "\n[FAIL] 低于目标，可能存在性能回退")
+    return ok
+
+
+def _isolated_client(urls, workdir: str) -> RemoteHostsClient:
+    """缓存 / 健康度 / 快照都放在临时目录，避免污染用户数据。"""
+    return RemoteHostsClient(
+        urls=urls,
+        cache=RemoteHostsCache(cache_dir=os.path.join(workdir, "cache"), fresh_seconds=0),
+        health=SourceHealthStore(path=os.path.join(workdir, "health.json")),
+        snapshots=HostsSnapshotStore(snapshot_dir=os.path.join(workdir, "snapshots")),
+    )
+
+
+def bench_fetch(lines: int, repeat: int) -> bool:
+    print("=" * 60)
+    print("远程获取基准（本地替身服务器）")
+    print("=" * 60)
+
+    corpus = generate_hosts_corpus(lines)
+    expected = len(HostsParser().parse_bytes(corpus))
+    ok = True
+
+    with LocalHostsServer() as srv, tempfile.TemporaryDirectory() as workdir:
+        good = srv.route("/hosts", corpus, etag=False, chunk_size=64 * 1024)
+        as_json = srv.route("/hosts.json", json.dumps(HostsParser().parse_bytes(corpus)).encode("utf-8"))
+        broken = srv.route("/broken", b"oops", status=503)
+        html = srv.route("/html", b"<!doctype html><html>mirror down</html>", content_type="text/html")
+        dropped = srv.route("/drop", drop=True)
+        slow = srv.route("/slow", corpus, delay=1.0)
+        print(f"\n语料：{lines} 行，{len(corpus) / 1024 / 1024:.1f} MB，期望记录 {expected} 条")
+
+        async def fetch_once(client, **kw):
+            try:
+                return await client.fetch_github_hosts_async(**kw)
+            finally:
+                await client.aclose()
+
+        # 1) 单源下载 + 解析吞吐（分块传输 + gzip）
+        best = float("inf")
+        records = []
+        for i in range(max(1, repeat)):
+            client = _isolated_client([good], os.path.join(workdir, f"t{i}"))
+            t0 = time.perf_counter()
+            records, _ = asyncio.run(fetch_once(client, url_override=good))
+            best = min(best, time.perf_counter() - t0)
+        mb_s = len(corpus) / 1024 / 1024 / best
+        print(f"单源获取：最佳 {best * 1000:.1f} ms，{mb_s:.1f} MB/s，{lines / best:,.0f} 行/秒，记录 {len(records)}")
+        ok &= len(records) == expected
+
+        # 2) JSON 提供者
+        client = _isolated_client([as_json], os.path.join(workdir, "json"))
+        t0 = time.perf_counter()
+        records, _ = asyncio.run(fetch_once(client, url_override=as_json))
+        print(f"JSON 源：{(time.perf_counter() - t0) * 1000:.1f} ms，记录 {len(records)}")
+        ok &= len(records) == expected
+
+        # 3) 故障切换：前面的源全部失败（503 / HTML / 断连 / 慢），最终应由正常源胜出
+        client = _isolated_client([broken, html, dropped, slow, good], os.path.join(workdir, "race"))
+        t0 = time.perf_counter()
+        try:
+            records, used = asyncio.run(fetch_once(client))
+        except Exception as e:
+            records, used = [], f"失败：{e}"
+        print(f"故障切换：{(time.perf_counter() - t0) * 1000:.1f} ms，胜出 {used}，记录 {len(records)}")
+        for url, diag in client.last_fetch_diagnostics.items():
+            print(f"  - {url.rsplit('/', 1)[-1]:<8} {diag.get('status')}")
+        ok &= used in (good, slow) and len(records) == expected
+
+    print("\n[SUCCESS] 全部通过" if ok else "\n[FAIL] 获取结果与期望不一致")
+    return ok
+
+
+def bench_dns(domains: int) -> bool:
+    print("=" * 60)
+    print("原生 DNS 解析基准（本地替身服务器）")
+    print("=" * 60)
+
+    # 混合：普通 A 记录、CNAME 链、超过截断阈值的大应答（走 TCP）、不存在的域名
+    records = {}
+    names = []
+    for i in range(domains):
+        name = f"h{i}.bench.test"
+        names.append(name)
+        r = i % 20
+        if r == 0:
+            records[name] = {"CNAME": f"edge{i % 50}.cdn.test"}
+            records[f"edge{i % 50}.cdn.test"] = {"A": [f"172.16.{i % 50}.1"]}
+        elif r == 1:
+            records[name] = {"A": [f"10.{k}.{i % 256}.1" for k in range(40)]}
+        elif r == 2:
+            continue  # NXDOMAIN
+        else:
+            records[name] = {"A": [f"10.{i // 256 % 256}.{i % 256}.1"], "AAAA": [f"fd00::{i:x}"]}
+    expected = sum(1 for n in names if n in records)
+
+    with StubDnsServer(records, truncate_over=16) as dns, tempfile.TemporaryDirectory() as workdir:
+        # 使用临时缓存：冷启动测的是真实查询吞吐，第二轮测缓存命中
+        cache = DnsCache(path=os.path.join(workdir, "dns_cache.json"), max_entries=domains * 4)
+        resolver = DomainResolver(upstreams=[dns.address], cache=cache, fanout_upstreams=[])
+        t0 = time.perf_counter()
+        res = resolver.resolve(names)
+        elapsed = time.perf_counter() - t0
+        resolved = len({d for _, d in res})
+        print(f"\n域名：{domains} 个（A + AAAA），耗时 {elapsed * 1000:.1f} ms，{domains / elapsed:,.0f} 域名/秒")
+        print(f"有结果的域名：{resolved}/{expected}，记录 {len(res)} 条；UDP 查询 {dns.udp_queries}，TCP 回退 {dns.tcp_queries}")
+
+        queries = dns.udp_queries + dns.tcp_queries
+        t0 = time.perf_counter()
+        warm = resolver.resolve(names)
+        warm_elapsed = time.perf_counter() - t0
+        extra = dns.udp_queries + dns.tcp_queries - queries
+        print(f"缓存命中轮：耗时 {warm_elapsed * 1000:.1f} ms，新增查询 {extra} 次，缓存条目 {len(cache)}")
+        print(f"目标：{DNS_DOMAINS_PER_SEC_TARGET:,} 域名/秒")
+
+    ok = (
+        resolved == expected
+        and domains / elapsed >= DNS_DOMAINS_PER_SEC_TARGET
+        and extra == 0
+        and sorted(warm) == sorted(res)
+    )
+    print("\n[SUCCESS] 达到目标" if ok else "\n[FAIL] 低于目标或结果不完整")
+    return ok
+
+
+def bench_probe(ips: int) -> bool:
+    print("=" * 60)
+    print("批量 TCP 探测基准（本机监听端口）")
+    print("=" * 60)
+
+    # 监听 0.0.0.0：127.0.0.0/8 内的任意地址都会连到这里，用来模拟大量不同的 IP
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("0.0.0.0", 0))
+    srv.listen(4096)
+    port = srv.getsockname()[1]
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            conn.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    targets = [f"127.{1 + i // 62500}.{i // 250 % 250}.{i % 250 + 1}" for i in range(ips)]
+    # 关闭的端口：验证 SO_ERROR 判定失败
+    refused = [f"127.200.0.{i + 1}" for i in range(min(50, ips))]
+    attempts, interval = 3, 0.02
+    # 对比的是探测方式本身：关闭 connect 限速（127.x 地址都集中在少数 /24 内）
+    unlimited = ConnectRateLimiter()
+
+    try:
+        t0 = time.perf_counter()
+        mass = MassTcpProber(
+            port=port, attempts=attempts, timeout=2.0, interval=interval, limiter=unlimited
+        ).probe(targets)
+        mass_elapsed = time.perf_counter() - t0
+        mass_ok = sum(1 for r in mass if r[2] == "可用")
+
+        # 锦标赛模式：按 20 个“域名”分组逐轮淘汰
+        groups = {f"d{k}.bench.test": targets[k::20] for k in range(20)}
+        tour = TournamentScheduler(port=port, attempts=attempts, timeout=2.0, interval=interval, limiter=unlimited)
+        t0 = time.perf_counter()
+        tour_res = tour.run(targets, groups=groups)
+        tour_elapsed = time.perf_counter() - t0
+        finalists = sum(1 for r in tour_res if r[3].get("tournament_final"))
+
+        tester = SpeedTester(limiter=unlimited)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=60) as pool:
+            pooled = list(pool.map(
+                lambda ip: tester.tcp_advanced_metrics(ip, port=port, attempts=attempts, timeout=2.0), targets
+            ))
+        pool_elapsed = time.perf_counter() - t0
+        pool_ok = sum(1 for m in pooled if m.get("ok"))
+    finally:
+        # 先 shutdown 唤醒阻塞在 accept 的线程，否则监听不会真正关闭
+        try:
+            srv.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        srv.close()
+
+    # 端口已关闭：全部应判定失败
+    failed = MassTcpProber(port=port, attempts=1, timeout=1.0, limiter=unlimited).probe(refused)
+    refused_ok = all(r[2] == "失败" for r in failed)
+
+    speedup = pool_elapsed / mass_elapsed if mass_elapsed > 0 else float("inf")
+    print(f"\nIP：{ips} 个，每个 {attempts} 次 connect")
+    print(f"MassTcpProber：耗时 {mass_elapsed * 1000:.1f} ms，可用 {mass_ok}/{ips}")
+    print(f"线程池(60)：  耗时 {pool_elapsed * 1000:.1f} ms，可用 {pool_ok}/{ips}")
+    print(
+        f"锦标赛：    耗时 {tour_elapsed * 1000:.1f} ms，各轮 {tour.last_rounds}，决赛圈 {finalists}，"
+        f"connect {tour.last_connects}/{tour.last_full_connects} 次"
+    )
+    print(f"加速比：{speedup:.1f}x（目标 {PROBE_SPEEDUP_TARGET:.1f}x）；关闭端口判定失败：{'是' if refused_ok else '否'}")
+
+    ok = mass_ok == ips and refused_ok and speedup >= PROBE_SPEEDUP_TARGET
+    print("\n[SUCCESS] 达到目标" if ok else "\n[FAIL] 低于目标或结果不完整")
+    return ok
+
+
+def bench_http(ips: int) -> bool:
+    print("=" * 60)
+    print("HTTP 探测阶段基准（本地 HTTPS 替身服务器）")
+    print("=" * 60)
+
+    targets = [f"127.0.{i // 250}.{i % 250 + 2}" for i in range(ips)]
+    rnd = random.Random(20240101)
+    # 约 1/5 的 IP 是“近但过载”的边缘节点：建连 / 握手最快，首字节却很慢；
+    # 其余节点远一跳：回环上无法按 IP 注入 TCP RTT，用 TLS 握手延迟模拟（TLS 1.3 握手 ≈ 1 RTT）
+    slow = set(rnd.sample(targets, max(1, ips // 5)))
+    ttfb_delay = 0.4
+    far_delay = 0.15
+    top_k = len(slow)
+
+    def run(srv, http_enabled: bool):
+        cfg = copy.deepcopy(SPEED_TEST_CONFIG)
+        cfg["tls"]["verify_hostname"] = False
+        cfg["http_probe"]["enabled"] = http_enabled
+        tester = EnhancedSpeedTester(config=cfg, limiter=ConnectRateLimiter())
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(
+                lambda ip: tester.test_one_ip_advanced(
+                    ip, port=srv.port, attempts=3, timeout=2.0, sni_hosts=["github.com"]
+                ),
+                targets,
+            ))
+        return results, time.perf_counter() - t0
+
+    def pre_http_ms(metrics) -> float:
+        # 与界面在没有 HTTP 探测结果时一致：建连 + TLS（优先恢复握手）
+        tls = metrics.get("tls_resume_ms")
+        if tls is None:
+            tls = metrics.get("tls_handshake_ms")
+        return float(metrics.get("tcp_connect_ms") or 1e9) + float(tls if tls is not None else 1e9)
+
+    # 排序对比：慢首字节的节点在建连 + 握手上占优
+    with LocalHttpsServer(hosts=["github.com"]) as srv:
+        for ip in targets:
+            if ip in slow:
+                srv.edge(ip, ttfb_delay=ttfb_delay)
+            else:
+                srv.edge(ip, handshake_delay=far_delay)
+        base, _ = run(srv, False)
+        probed, _ = run(srv, True)
+
+    # 额外耗时：不注入任何延迟，只比较 HEAD 本身的开销（各取 3 轮最好成绩，降低抖动）
+    base_elapsed = http_elapsed = float("inf")
+    with LocalHttpsServer(hosts=["github.com"]) as srv:
+        for i in range(3):
+            # 交替先后顺序，避免先跑的一方总是承担预热开销
+            for http_enabled in ((False, True) if i % 2 == 0 else (True, False)):
+                elapsed = run(srv, http_enabled)[1]
+                if http_enabled:
+                    http_elapsed = min(http_elapsed, elapsed)
+                else:
+                    base_elapsed = min(base_elapsed, elapsed)
+
+    weights = SPEED_TEST_CONFIG["http_probe"]["weights"]
+    by_pre = sorted(base, key=lambda r: pre_http_ms(r[3]))[:top_k]
+    by_blend = sorted(
+        probed, key=lambda r: EnhancedSpeedTester.blended_latency_ms(r[3], weights) or 1e9
+    )[:top_k]
+    slow_in_pre = sum(1 for r in by_pre if r[0] in slow)
+    slow_in_blend = sum(1 for r in by_blend if r[0] in slow)
+    answered = sum(1 for r in probed if r[3].get("http_status") == 200)
+
+    overhead = max(0.0, http_elapsed - base_elapsed) / base_elapsed if base_elapsed > 0 else 0.0
+    print(
+        f"\nIP：{ips} 个（其中 {len(slow)} 个握手最快但首字节延迟 {ttfb_delay * 1000:.0f} ms，"
+        f"其余握手延迟 {far_delay * 1000:.0f} ms），前 {top_k} 名"
+    )
+    print(f"不做 HTTP 探测（建连 + TLS）排序：前 {top_k} 名中慢 IP {slow_in_pre} 个")
+    print(f"HTTP 综合排序：前 {top_k} 名中慢 IP {slow_in_blend} 个，HEAD 应答 {answered}/{ips}")
+    print(
+        f"额外耗时（无注入延迟）：{overhead:.0%}，{base_elapsed * 1000:.1f} ms -> {http_elapsed * 1000:.1f} ms"
+        f"（目标 ≤ {HTTP_PROBE_OVERHEAD_TARGET:.0%}）"
+    )
+
+    # 两种排序必须分歧：不探测时前几名全是慢节点，探测后一个都不剩
+    ok = (
+        answered == ips
+        and slow_in_pre == top_k
+        and slow_in_blend == 0
+        and overhead <= HTTP_PROBE_OVERHEAD_TARGET
+    )
+    print("\n[SUCCESS] 达到目标" if ok else "\n[FAIL] 低于目标或结果不完整")
+    return ok
+
+
+def bench_icmp(ips: int) -> bool:
+    print("=" * 60)
+    print("进程内 ICMP 引擎基准（本机回环地址）")
+    print("=" * 60)
+
+    engine = get_shared_icmp_engine()
+    if engine is None:
+        print("\n[SKIP] 非 Linux 或系统未开放非特权 ICMP（net.ipv4.ping_group_range）")
+        return True
+
+    targets = [f"127.{1 + i // 62500}.{i // 250 % 250}.{i % 250 + 1}" for i in range(ips)]
+
+    # 一批同时在途
+    t0 = time.perf_counter()
+    batch = engine.ping_many(targets, timeout_ms=2000)
+    batch_elapsed = time.perf_counter() - t0
+    batch_ok = sum(1 for v in batch.values() if v is not None)
+
+    # 与 GUI 回退路径一致：线程池里逐个调用 icmp_ping_once，共用同一个引擎
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=60) as pool:
+        pooled = list(pool.map(lambda ip: SpeedTester.icmp_ping_once(ip, timeout_ms=2000), targets))
+    pool_elapsed = time.perf_counter() - t0
+    pool_ok = sum(1 for v in pooled if v is not None)
+
+    async def run_async():
+        return await asyncio.gather(*(SpeedTester.icmp_ping_once_async(ip, timeout_ms=2000) for ip in targets))
+
+    t0 = time.perf_counter()
+    gathered = asyncio.run(run_async())
+    async_elapsed = time.perf_counter() - t0
+    async_ok = sum(1 for v in gathered if v is not None)
+
+    per_ip_ms = pool_elapsed * 1000 / ips if ips else 0.0
+    print(f"\nIP：{ips} 个")
+    print(f"ping_many：       耗时 {batch_elapsed * 1000:.1f} ms，回复 {batch_ok}/{ips}")
+    print(f"线程池(60)：      耗时 {pool_elapsed * 1000:.1f} ms，回复 {pool_ok}/{ips}，每 IP {per_ip_ms:.3f} ms")
+    print(f"asyncio.gather：  耗时 {async_elapsed * 1000:.1f} ms，回复 {async_ok}/{ips}")
+    print(f"每 IP 开销目标：≤ {ICMP_PER_IP_MS_TARGET:.1f} ms")
+
+    ok = batch_ok == ips and pool_ok == ips and async_ok == ips and per_ip_ms <= ICMP_PER_IP_MS_TARGET
+    print("\n[SUCCESS] 达到目标" if ok else "\n[FAIL] 低于目标或结果不完整")
+    return ok
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="SmartHostsTool 性能基准")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p_parse = sub.add_parser("parse", help="hosts 解析吞吐")
+    p_parse.add_argument("--lines", type=int, default=200_000)
+    p_parse.add_argument("--repeat", type=int, default=5)
+
+    p_fetch = sub.add_parser("fetch", help="远程获取吞吐与故障切换（本地替身服务器）")
+    p_fetch.add_argument("--lines", type=int, default=200_000)
+    p_fetch.add_argument("--repeat", type=int, default=5)
+
+    p_dns = sub.add_parser("dns", help="原生 DNS 解析吞吐（本地 DNS 替身服务器）")
+    p_dns.add_argument("--domains", type=int, default=5000)
+
+    p_probe = sub.add_parser("probe", help="批量 TCP 探测与线程池测速对比（本机监听端口）")
+    p_probe.add_argument("--ips", type=int, default=2000)
+
+    p_http = sub.add_parser("http", help="HTTP 探测阶段识别慢响应 IP（本地 HTTPS 替身服务器）")
+    p_http.add_argument("--ips", type=int, default=60)
+
+    p_icmp = sub.add_parser("icmp", help="进程内 ICMP 引擎每 IP 开销（本机回环地址）")
+    p_icmp.add_argument("--ips", type=int, default=2000)
+
+    args = ap.parse_args(argv)
+    if args.cmd == "parse":
+        return 0 if bench_parse(args.lines, args.repeat) else 1
+    if args.cmd == "fetch":
+        return 0 if bench_fetch(args.lines, args.repeat) else 1
+    if args.cmd == "dns":
+        return 0 if bench_dns(args.domains) else 1
+    if args.cmd == "probe":
+        return 0 if bench_probe(args.ips) else 1
+    if args.cmd == "http":
+        return 0 if bench_http(args.ips) else 1
+    if args.cmd == "icmp":
+        return 0 if bench_icmp(args.ips) else 1
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -40,6 +40,9 @@ HOSTS_END_MARK = "# === SmartHostsTool End ==="
 REMOTE_FETCH_TIMEOUT = (5, 15)
 
 # 远程 hosts 源（按优先级）
+# 源标识决定提供者类型（见 services.make_hosts_provider）：
+#   - http(s)://.../hosts：纯文本 hosts；路径以 .json 结尾：JSON hosts（如 GitHub520 hosts.json）
+#   - 本地文件/目录路径或 file://...：本地 hosts；dns://域名1,域名2：由 DNS 解析计算出的源
 REMOTE_HOSTS_URLS = [
     "https://github-hosts.tinsfox.com/hosts",
     "https://raw.hellogithub.com/hosts",
@@ -48,11 +51,107 @@ REMOTE_HOSTS_URLS = [
     "https://cdn.jsdelivr.net/gh/521xueweihan/GitHub520@main/hosts",
     "https://ghproxy.com/https://raw.githubusercontent.com/521xueweihan/GitHub520/main/hosts",
     "https://gitlab.com/ineo6/hosts/-/raw/master/hosts",
+    "https://raw.hellogithub.com/hosts.json",
 ]
 
+# 远程 Hosts 合并模式（并发获取全部源，合并去重并记录每条记录的来源）
+# 用途：扩大候选 IP 池；被多个源同时收录的 IP（共识 IP）优先测速
+# 注意：
+#   - deadline_seconds: 合并模式的总截止时间（秒），超时未返回的源直接放弃
+REMOTE_HOSTS_MERGE_ALL = "merge://all"
+REMOTE_MERGE_CONFIG = {
+    "deadline_seconds": 8.0,
+}
+
+# 远程 Hosts 竞速获取（自动模式）
+# 用途：多个源竞速，持续等待直到某个源返回非空的有效记录或总截止时间到达
+# 注意：
+#   - deadline_seconds: 自动模式的总截止时间（秒），覆盖所有源（含对冲启动的源）
+REMOTE_RACE_CONFIG = {
+    "deadline_seconds": 20.0,
+}
+
+# 远程 Hosts 响应缓存（磁盘，按 URL）
+# 用途：刷新时携带 If-None-Match / If-Modified-Since 发条件请求，304 时直接复用已解析记录
+# 注意：
+#   - enabled: 是否启用缓存
+#   - dir_name: 缓存目录名（位于用户数据目录下）
+#   - fresh_seconds: 缓存在该秒数内视为新鲜，直接返回、不发请求（0 表示每次都发条件请求）
+#   - stale_if_error_seconds: 所有源都不可达时，允许兜底使用的最长缓存年龄（秒）
+REMOTE_CACHE_CONFIG = {
+    "enabled": True,
+    "dir_name": "remote_cache",
+    "fresh_seconds": 300,
+    "stale_if_error_seconds": 7 * 24 * 3600,
+}
+
+# 远程 Hosts 快照（版本化存储 + 增量对比）
+# 用途：每次成功获取都保存为压缩、按内容哈希去重的快照，并与上一份快照对比新增/移除的记录；
+#       测速时只重测新出现的 IP，未变化的 IP 复用近期结果；所有源都失败时用最新快照离线兜底
+# 注意：
+#   - enabled: 是否保存快照
+#   - dir_name: 快照目录名（位于用户数据目录下）
+#   - keep: 最多保留的快照份数（按时间淘汰最旧的）
+#   - reuse_results_seconds: 测速结果复用的最长年龄（秒），0 表示不复用
+#   - reuse_on_manual_test: 手动测速是否也复用（默认仅定时测速复用，手动测速总是全量重测）
+SNAPSHOT_CONFIG = {
+    "enabled": True,
+    "dir_name": "snapshots",
+    "keep": 20,
+    "reuse_results_seconds": 1800,
+    "reuse_on_manual_test": False,
+}
+
+# 远程源健康度评分（持久化）与自适应排序
+# 用途：记录每个源的延迟、成功率、内容新鲜度与记录数，按衰减评分排序；并对慢源发起对冲请求
+# 注意：
+#   - enabled: 是否启用健康度评分与自适应排序（关闭则严格按 REMOTE_HOSTS_URLS 顺序）
+#   - file_name: 存储文件名（位于用户数据目录下）
+#   - half_life_hours: 成功/失败计数的衰减半衰期（小时），越小越看重近期表现
+#   - max_samples: 每个源保留的最近延迟样本数（用于中位数 / p90）
+#   - hedge: 是否启用对冲请求（当前源超过其 p90 延迟仍未返回时，提前启动下一个源）
+#   - hedge_min_delay_ms / hedge_default_delay_ms: 对冲等待下限 / 无历史样本时的默认等待
+SOURCE_HEALTH_CONFIG = {
+    "enabled": True,
+    "file_name": "source_health.json",
+    "half_life_hours": 24.0,
+    "max_samples": 20,
+    "hedge": True,
+    "hedge_min_delay_ms": 300,
+    "hedge_default_delay_ms": 2000,
+}
+
+# Hosts 解析引擎配置
+# 用途：控制从远程 hosts 文本中保留哪些域名
+# 注意：
+#   - target_suffixes: 目标域名后缀（后缀树匹配：写 github.com 即匹配 github.com 及其所有子域名）
+#   - keywords: 关键字匹配（域名包含任一关键字即保留），默认 "github" 以兼容原版规则；
+#     清空后仅按 target_suffixes 精确过滤，可用于非 GitHub 的大型 hosts 列表
+#   - ip_cache_size: IP 校验 / 域名判定记忆化缓存上限（大列表中同一 IP 与域名往往重复出现成千上万次）
+HOSTS_PARSER_CONFIG = {
+    "target_suffixes": [
+        "github.com",
+        "githubusercontent.com",
+        "githubassets.com",
+        "github.io",
+        "githubapp.com",
+        "github.blog",
+        "github.community",
+        "github.dev",
+        "githubstatus.com",
+        "github.global.ssl.fastly.net",
+        "github.map.fastly.net",
+        "github-cloud.s3.amazonaws.com",
+        "github-com.s3.amazonaws.com",
+    ],
+    "keywords": ["github"],
+    "ip_cache_size": 65536,
+}
+
 # UI 上用于选择远程 hosts 源的显示项（保留原版文字）
 REMOTE_HOSTS_SOURCE_CHOICES = [
     ("自动（按优先级）", None),
+    ("合并（全部源，共识优先）", REMOTE_HOSTS_MERGE_ALL),
     ("tinsfox（github-hosts.tinsfox.com）", REMOTE_HOSTS_URLS[0]),
     ("GitHub520（raw.hellogithub.com）", REMOTE_HOSTS_URLS[1]),
     ("GitHub520（raw.githubusercontent.com）", REMOTE_HOSTS_URLS[2]),
@@ -60,6 +159,7 @@ REMOTE_HOSTS_SOURCE_CHOICES = [
     ("GitHub520 CDN（cdn.jsdelivr.net）", REMOTE_HOSTS_URLS[4]),
     ("GitHub Raw 代理（ghproxy.com）", REMOTE_HOSTS_URLS[5]),
     ("ineo6 镜像（gitlab.com）", REMOTE_HOSTS_URLS[6]),
+    ("GitHub520 JSON（raw.hellogithub.com）", REMOTE_HOSTS_URLS[7]),
 ]
 
 SPEED_TEST_CONFIG = {
@@ -85,6 +185,12 @@ SPEED_TEST_CONFIG = {
         "strict": False,
         # 尝试域名数量：3个足够，避免尝试太多域名导致测速变慢
         "try_hosts_limit": 3,
+        # 复用测速连接：TLS 握手直接在最后一次测速的 TCP 连接上进行，少建一次连接，
+        # 并单独记录 TLS 握手耗时（tls_handshake_ms）；对端已关闭该连接时自动换新连接
+        "reuse_tcp": True,
+        # 会话恢复：完整握手后用缓存的会话/票据再握手一次，记录恢复握手耗时（tls_resume_ms），
+        # 排序时优先参考它（实际 git/HTTPS 流量大多走恢复握手）；每个 IP 多一次连接
+        "resume": True,
         # 候选域名优先级（存在于该 IP 关联域名列表时优先尝试）
         "preferred_hosts": [
             "github.com",
@@ -94,6 +200,40 @@ SPEED_TEST_CONFIG = {
             "github.githubassets.com",
         ],
     },
+    "http_probe": {
+        # HTTP 探测：TLS 验证通过后，在同一连接上发一个最小的 HEAD 请求（Host 为验证通过的域名），
+        # 记录请求到响应首字节的耗时（http_ttfb_ms），找出“能连上但响应慢”的 IP；每个 IP 多一个往返
+        "enabled": False,
+        # 请求路径
+        "path": "/",
+        # 排序权重：综合延迟 = connect×建连 + tls×TLS 握手（优先恢复握手）+ ttfb×首字节
+        "weights": {"connect": 1.0, "tls": 1.0, "ttfb": 1.0},
+        # 没有拿到 HTTP 响应（超时 / 断开 / 非 HTTP 应答）的 IP 在排序中的惩罚（ms）
+        "failure_penalty_ms": 1000.0,
+    },
+    "bandwidth": {
+        # 带宽测试：延迟测速结束后，对每个域名排名前 top_k 的 IP 各下载一个有限大小的对象，
+        # 测持续吞吐并计入排序 / “一键写入最优”（clone、raw 下载更看重吞吐而不是 RTT）；只测决赛圈，额外流量很小
+        "enabled": False,
+        # 每个域名参与带宽测试的 IP 数
+        "top_k": 3,
+        # 单个 IP 最多下载的字节数 / 最长时间（秒）
+        "max_bytes": 4 * 1024 * 1024,
+        "time_cap": 4.0,
+        # 吞吐从第 skip_bytes 字节之后开始统计（避开 TCP 慢启动）
+        "skip_bytes": 64 * 1024,
+        # HTTPS 端口
+        "port": 443,
+        # 排序时把吞吐折算为下载该大小所需的时间（ms）计入综合分
+        "rank_reference_bytes": 1024 * 1024,
+        # 测试失败（超时 / 非 200 应答）的 IP 在排序中的惩罚（ms）
+        "failure_penalty_ms": 1000.0,
+        # 各域名下载的对象（路径）；不在表中的域名不做带宽测试
+        "objects": {
+            "github.com": "/git/git.git/info/refs?service=git-upload-pack",
+            "raw.githubusercontent.com": "/torvalds/linux/master/MAINTAINERS",
+        },
+    },
     "icmp": {
         # 启用ICMP：作为TCP失败的补充
         "enabled": True,
@@ -116,6 +256,73 @@ SPEED_TEST_CONFIG = {
         # 计算稳定性分数：帮助选择更稳定的IP
         "calculate_stability": True,
     },
+    "mass_probe": {
+        # 启用批量探测：待测 IP 较多时改用单线程 epoll/select 批量 connect，代替逐 IP 占用线程
+        "enabled": True,
+        # 触发阈值：待测 IP 数达到该值才启用（少量 IP 用线程池即可）
+        "threshold": 200,
+        # 同时在途的连接数上限：1000 对家用网络足够，过大可能触发路由器/防火墙限流
+        "max_inflight": 1000,
+        # 保留的已连接 socket 上限：供线程池的 TLS 握手复用（tls.reuse_tcp），超出部分照常关闭
+        "keep_sockets": 128,
+    },
+    "rate_limit": {
+        # 启用 connect 限速：线程池、异步批量、批量探测与 TLS 验证共用同一个令牌桶，
+        # 避免瞬间大量 SYN 挤占上行带宽、抬高测得的延迟或触发上游限流
+        "enabled": True,
+        # 全局每秒最多发起的 connect 次数：500 对大多数网络不构成瓶颈；0 表示不限
+        "connects_per_sec": 500,
+        # 令牌桶容量：允许的瞬时突发次数
+        "burst": 100,
+        # 同一网段内同时进行的 connect 上限：0 表示不限
+        "per_prefix_inflight": 16,
+        # 网段划分：IPv4 按 /24，IPv6 按 /48
+        "ipv4_prefix": 24,
+        "ipv6_prefix": 48,
+    },
+    "adaptive_concurrency": {
+        # 自适应并发（AIMD）：对照组 RTT 平稳时逐步加并发，RTT 抬高或超时时按比例降并发；
+        # 本轮最终并发度保存到用户数据目录，作为下次测速的起点
+        "enabled": True,
+        # 对照 IP 数：优先取上一轮测得最快的可用 IP
+        "control_ips": 3,
+        # 控制周期（秒）：每个周期对照 IP 各 connect 一次
+        "interval": 0.5,
+        # RTT 容忍倍数与余量：对照组 RTT 中位数超过"历史最低 × 倍数 + 余量"即视为拥塞
+        "rtt_tolerance": 1.5,
+        "rtt_slack_ms": 5.0,
+        # 拥塞时的乘性降幅：0.7 表示降到原来的 70%
+        "decrease": 0.7,
+        # 线程池测速：起始并发、上下限与每周期的加性增量
+        "pool": {"initial": 30, "min": 4, "max": 120, "step": 4},
+        # 批量探测：在途连接数的起始值、下限与增量（上限为 mass_probe.max_inflight）
+        "mass": {"initial": 200, "min": 20, "step": 50},
+    },
+    "cluster_probe": {
+        # 网段聚类（批量探测时生效）：同一 /24（IPv6 为 /48）的 IP 延迟几乎相同，
+        # 先每个网段测几个代表，只在有竞争力的网段内完整测速，大列表的 connect 次数显著减少
+        "enabled": True,
+        # 每个网段的代表数
+        "representatives": 2,
+        # 有竞争力：网段得分（代表的最低延迟）≤ 同域名最优网段 × ratio + slack_ms
+        "ratio": 1.5,
+        "slack_ms": 10.0,
+        # 每个域名至少展开的网段数
+        "min_clusters": 2,
+        # 平均每个网段不足该数量的 IP 时不聚类（几乎没有同网段 IP）
+        "min_avg_size": 2.0,
+        "ipv4_prefix": 24,
+        "ipv6_prefix": 48,
+    },
+    "tournament": {
+        # 锦标赛模式：仅在批量探测生效时使用。第 1 轮每个 IP 只测 1 次，之后逐轮只给靠前的 IP 追加采样，
+        # 决赛圈达到完整的 tcp.attempts 次并做 TLS 验证；未入围的 IP 显示为「可用(未入围)」
+        "enabled": True,
+        # 每轮保留比例 1/eta，累计样本数按 eta 倍增长（3：1 -> 3 -> 5 次）
+        "eta": 3,
+        # 每个域名至少保留的 IP 数：保证每个域名的最优 IP 都经过完整采样
+        "min_keep": 3,
+    },
 }
 
 # HTTP 客户端配置
@@ -128,6 +335,10 @@ SPEED_TEST_CONFIG = {
 #   - retry.status_forcelist: 需要重试的 HTTP 状态码列表
 #   - pool.connections: 连接池大小，建议 10-50，根据并发需求调整
 #   - pool.maxsize: 连接池最大大小，建议与 connections 相同
+#   - async.max_redirects: 异步客户端最多跟随的重定向次数
+#   - async.max_body_bytes: 响应体（解压后）最大字节数，超出即中止，防止异常源撑爆内存
+#   - async.max_idle_per_host: 每个主机保留的空闲 keep-alive 连接数
+#   - async.idle_timeout: 空闲连接最长保留秒数，超时后不再复用
 HTTP_CLIENT_CONFIG = {
     "retry": {
         "total": 3,
@@ -140,17 +351,72 @@ HTTP_CLIENT_CONFIG = {
         "connections": 20,
         "maxsize": 20,
     },
+    "async": {
+        "max_redirects": 5,
+        "max_body_bytes": 16 * 1024 * 1024,
+        "max_idle_per_host": 4,
+        "idle_timeout": 30.0,
+    },
 }
 
 # DNS 解析器配置
-# 用途：配置域名解析时的并发工作线程数
+# 用途：配置域名解析引擎与并发
 # 注意：
-#   - max_workers: 最大并发解析线程数，建议 10-50
+#   - max_workers: 系统解析（getaddrinfo）的最大并发线程数，建议 10-50
 #     - 值过小：解析速度慢，用户体验差
 #     - 值过大：占用过多系统资源，可能导致 DNS 服务器限流
 #     - 推荐值：20（平衡速度与资源占用）
+#   - engine: "native" 单线程 asyncio 直接向上游发 UDP 查询（A/AAAA，截断时改用 TCP）；
+#             "system" 使用系统 getaddrinfo（受线程数限制，且会读取本机 hosts 文件）
+#   - upstreams: 上游 DNS 服务器，如 "223.5.5.5"、"1.1.1.1:53"、"[2400:3200::1]:53"；
+#                为空时读取系统 DNS（/etc/resolv.conf），读取不到（如 Windows）时自动退回 system
+#   - timeout: 单次查询超时（秒）；attempts: 每个查询最多尝试次数（依次轮换上游）
+#   - max_inflight: 同时在途的查询数上限
+#   - fanout_upstreams: 额外并行查询的公共解析器（每个域名向每个解析器各查一次），
+#                       CDN 域名在不同解析器下会返回不同地区的节点，合并后候选 IP 更多；为空时不扇出
+#                       默认为空（只询问本机配置的 DNS，不把域名列表发给第三方）；需要时手动开启，例如
+#                       ["223.5.5.5", "119.29.29.29", "1.1.1.1", "8.8.8.8"]
+#   - fanout_attempts: 扇出查询对单个解析器的最多尝试次数（不轮换到其他解析器）
+#   - fanout_max_inflight: 扇出查询同时在途的上限（公共解析器会对突发查询限速丢包）
+#   - fanout_grace: 主解析完成后最多再等扇出应答的秒数（扇出只用来扩充候选，不拖慢整体解析）
+#   - stream_queue_size: 边解析边测速时，已解析但尚未交给测速的域名数上限（背压）
+#   - flag_disagreement: 各解析器应答“严重不一致”时记录告警（疑似 DNS 污染）：
+#       某个解析器返回保留/内网地址而其他解析器返回公网地址（这些保留地址不会进入候选），
+#       或各解析器的应答在 /16（IPv6 为 /32）网段上完全没有交集
 DNS_RESOLVER_CONFIG = {
     "max_workers": 20,
+    "engine": "native",
+    "upstreams": [],
+    "timeout": 2.0,
+    "attempts": 3,
+    "max_inflight": 256,
+    "fanout_upstreams": [],
+    "fanout_attempts": 2,
+    "fanout_max_inflight": 64,
+    "fanout_grace": 1.0,
+    "flag_disagreement": True,
+    "stream_queue_size": 256,
+}
+
+# DNS 缓存配置（所有解析路径共享，持久化到用户数据目录）
+# 用途：按记录 TTL 缓存解析结果，重复解析同一批域名时几乎不产生解析延迟
+# 注意：
+#   - enabled: 是否启用缓存
+#   - file_name: 持久化文件名（位于用户数据目录下）
+#   - max_entries: 最大条目数（按 (域名, A/AAAA) 计），超出按最近最少使用淘汰
+#   - min_ttl / max_ttl: TTL 下限 / 上限（秒），对上游返回的 TTL 进行钳制
+#   - system_ttl: 系统解析（getaddrinfo 不提供 TTL）结果的缓存时长（秒），同样受上下限钳制
+#   - negative_ttl: NXDOMAIN / 无记录的缓存时长（秒）
+#   - failure_ttl: 解析失败（超时等）的缓存时长（秒），避免短时间内反复等待超时
+DNS_CACHE_CONFIG = {
+    "enabled": True,
+    "file_name": "dns_cache.json",
+    "max_entries": 4096,
+    "min_ttl": 30,
+    "max_ttl": 3600,
+    "system_ttl": 300,
+    "negative_ttl": 60,
+    "failure_ttl": 15,
 }
 
 # UI 界面配置
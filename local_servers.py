@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+"""
+local_servers.py
+
+进程内的本地替身服务器（只在本机回环地址上使用），用于离线基准与联调：
+- LocalHostsServer：HTTP/1.1 hosts 源替身，可按路由注入延迟、错误码、HTML、分块传输、断连，
+  支持 ETag 条件请求（304）与 gzip 压缩
+- LocalHttpsServer：HTTPS 边缘节点替身（自签名证书，openssl 命令行生成），可按本机地址
+  （127.x.x.x）分别注入 TLS 握手延迟、首字节延迟与限速，用于 HTTP 探测 / 带宽测试的联调与基准
+- StubDnsServer：DNS 替身（UDP + TCP 同端口），支持 A / AAAA / CNAME 链、NXDOMAIN、
+  延迟、丢包与 TC 截断（迫使客户端改用 TCP）
+
+用法：
+    with LocalHostsServer() as srv:
+        url = srv.route("/hosts", body=b"140.82.112.3 github.com\\n", delay=0.2)
+        ...
+
+    with LocalHttpsServer() as edge:
+        edge.edge("127.0.0.2", ttfb_delay=0.3)   # 能连上但响应慢
+        ...
+
+    with StubDnsServer({"github.com": {"A": ["140.82.112.3"]}}) as dns:
+        resolver = DomainResolver(upstreams=[dns.address], fanout_upstreams=[])
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import http.server
+import os
+import socket
+import socketserver
+import ssl
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class HostsRoute:
+    """单个路由的响应设定。"""
+
+    body: bytes = b""
+    status: int = 200
+    content_type: str = "text/plain; charset=utf-8"
+    # 发送响应头前的延迟（秒）
+    delay: float = 0.0
+    # >0 时使用分块传输，每块大小（字节）；chunk_delay 为块间延迟（秒）
+    chunk_size: int = 0
+    chunk_delay: float = 0.0
+    # 是否携带 ETag（内容哈希）并支持 If-None-Match -> 304
+    etag: bool = True
+    # 客户端声明 Accept-Encoding: gzip 时是否压缩
+    gzip: bool = True
+    # 不发送任何响应直接断开连接（模拟连接被重置）
+    drop: bool = False
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def etag_value(self) -> str:
+        return '"' + hashlib.sha1(self.body).hexdigest()[:16] + '"'
+
+
+class _HostsHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_HostsHTTPServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - 覆盖基类签名
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        owner = self.server.owner
+        with owner.lock:
+            owner.connections += 1
+
+    def do_HEAD(self):
+        self._respond(head_only=True)
+
+    def do_GET(self):
+        self._respond(head_only=False)
+
+    def _respond(self, *, head_only: bool) -> None:
+        path = self.path.split("?", 1)[0]
+        owner = self.server.owner
+        route = owner.routes.get(path)
+        with owner.lock:
+            owner.hits[path] = owner.hits.get(path, 0) + 1
+        if route is None:
+            route = HostsRoute(body=b"not found", status=404)
+
+        if route.delay > 0:
+            time.sleep(route.delay)
+        if route.drop:
+            self.close_connection = True
+            try:
+                self.connection.close()
+            except OSError:
+                pass
+            return
+
+        if route.etag and route.status == 200 and self.headers.get("If-None-Match") == route.etag_value:
+            self.send_response(304)
+            self.send_header("ETag", route.etag_value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = route.body
+        self.send_response(route.status)
+        self.send_header("Content-Type", route.content_type)
+        if route.etag and route.status == 200:
+            self.send_header("ETag", route.etag_value)
+        for k, v in route.headers.items():
+            self.send_header(k, v)
+        if route.gzip and body and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header("Content-Encoding", "gzip")
+
+        if route.chunk_size > 0:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            if head_only:
+                return
+            for i in range(0, len(body), route.chunk_size):
+                piece = body[i:i + route.chunk_size]
+                self.wfile.write(f"{len(piece):x}\r\n".encode("ascii") + piece + b"\r\n")
+                if route.chunk_delay > 0:
+                    self.wfile.flush()
+                    time.sleep(route.chunk_delay)
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+
+class _HostsHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    owner: "LocalHostsServer"
+
+
+class LocalHostsServer:
+    """本地 HTTP hosts 源替身（后台线程运行，端口自动分配）。
+
+    hits 按路径统计请求数，connections 统计接受的 TCP 连接数（用于验证 keep-alive 复用）。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.routes: Dict[str, HostsRoute] = {}
+        self.hits: Dict[str, int] = {}
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._httpd = _HostsHTTPServer((host, port), _HostsHandler)
+        self._httpd.owner = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def route(self, path: str, body: bytes = b"", **options) -> str:
+        """注册（或替换）一个路由，返回其完整 URL；options 见 HostsRoute 字段。"""
+        self.routes[path] = HostsRoute(body=body, **options)
+        return self.url(path)
+
+    def start(self) -> "LocalHostsServer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="LocalHostsServer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join(timeout=2)
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self) -> "LocalHostsServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+# ---------------------------------------------------------------------
+# HTTPS edge stand-in
+# ---------------------------------------------------------------------
+@dataclass
+class EdgeProfile:
+    """某个本机地址（模拟一个边缘节点 IP）的注入延迟（秒）。"""
+
+    # accept 之后、TLS 握手之前的延迟（模拟握手处理慢）
+    handshake_delay: float = 0.0
+    # 收到请求后、发送响应头之前的延迟（模拟“能连上但响应慢”）
+    ttfb_delay: float = 0.0
+    # >0 时按该速率（字节/秒）限速发送响应（模拟带宽不同的节点）
+    bytes_per_sec: float = 0.0
+
+
+class _ThrottledWriter:
+    """按固定速率写出的 wfile 包装（每 16 KB 一片，片间按速率休眠）。"""
+
+    def __init__(self, raw, bytes_per_sec: float) -> None:
+        self._raw = raw
+        self._rate = float(bytes_per_sec)
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        for i in range(0, len(view), 16384):
+            piece = view[i:i + 16384]
+            self._raw.write(piece)
+            self._raw.flush()
+            time.sleep(len(piece) / self._rate)
+        return len(data)
+
+    def flush(self) -> None:
+        self._raw.flush()
+
+
+def make_self_signed_cert(directory: str, hosts: List[str]) -> Tuple[str, str]:
+    """调用 openssl 命令行生成自签名证书，返回 (certfile, keyfile)。"""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    san = ",".join(f"DNS:{h}" for h in hosts) + ",IP:127.0.0.1"
+    cmd = [
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", keyfile, "-out", certfile,
+        "-subj", f"/CN={hosts[0]}", "-addext", f"subjectAltName={san}",
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, timeout=30)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise RuntimeError(f"生成自签名证书失败（需要 openssl 命令行）：{e}") from e
+    return certfile, keyfile
+
+
+class _HttpsHandler(_HostsHandler):
+    def _respond(self, *, head_only: bool) -> None:
+        profile = self.server.owner.profile_for(self.connection.getsockname()[0])
+        if profile.ttfb_delay > 0:
+            time.sleep(profile.ttfb_delay)
+        if profile.bytes_per_sec > 0 and not head_only:
+            raw = self.wfile
+            self.wfile = _ThrottledWriter(raw, profile.bytes_per_sec)
+            try:
+                super()._respond(head_only=head_only)
+            finally:
+                self.wfile = raw
+            return
+        super()._respond(head_only=head_only)
+
+
+class _HttpsHTTPServer(_HostsHTTPServer):
+    owner: "LocalHttpsServer"
+    request_queue_size = 1024
+
+    def finish_request(self, request, client_address):
+        # 在处理线程里做 TLS 握手（ThreadingMixIn），注入的握手延迟不会阻塞 accept
+        owner = self.owner
+        profile = owner.profile_for(request.getsockname()[0])
+        if profile.handshake_delay > 0:
+            time.sleep(profile.handshake_delay)
+        try:
+            request.settimeout(10)
+            tls = owner.ssl_context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        with owner.lock:
+            owner.handshakes += 1
+            if tls.session_reused:
+                owner.resumed += 1
+        try:
+            self.RequestHandlerClass(tls, client_address, self)
+        except OSError:
+            # 客户端读够（带宽测试达到上限）后主动断开
+            pass
+        finally:
+            try:
+                tls.close()
+            except OSError:
+                pass
+
+
+class LocalHttpsServer(LocalHostsServer):
+    """本地 HTTPS 边缘节点替身：自签名证书 + 按本机地址注入握手 / 首字节延迟与限速。
+
+    默认监听 0.0.0.0，127.0.0.0/8 内的每个地址都可当作一个独立的“边缘 IP”，
+    用 edge(ip, ...) 为其设置延迟；路由与 LocalHostsServer 相同（默认注册了 "/"）。
+    """
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 0,
+        *,
+        hosts: Optional[List[str]] = None,
+        certfile: Optional[str] = None,
+        keyfile: Optional[str] = None,
+    ) -> None:
+        self.lock = threading.Lock()
+        self.routes: Dict[str, HostsRoute] = {}
+        self.hits: Dict[str, int] = {}
+        self.connections = 0
+        self.profiles: Dict[str, EdgeProfile] = {}
+        self.default_profile = EdgeProfile()
+        self.handshakes = 0
+        self.resumed = 0
+        self._tmpdir: Optional[tempfile.TemporaryDirectory] = None
+        if certfile is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="local_https_")
+            certfile, keyfile = make_self_signed_cert(self._tmpdir.name, hosts or ["github.com"])
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(certfile, keyfile)
+        self._httpd = _HttpsHTTPServer((host, port), _HttpsHandler)
+        self._httpd.owner = self
+        self._thread = None
+        self.route("/", b"ok", etag=False)
+
+    def url(self, path: str) -> str:
+        return f"https://127.0.0.1:{self.port}{path}"
+
+    def edge(
+        self, ip: str, *, handshake_delay: float = 0.0, ttfb_delay: float = 0.0, bytes_per_sec: float = 0.0
+    ) -> None:
+        """为本机地址 ip 设置注入延迟（秒）与限速（字节/秒）。"""
+        self.profiles[ip] = EdgeProfile(
+            handshake_delay=handshake_delay, ttfb_delay=ttfb_delay, bytes_per_sec=bytes_per_sec
+        )
+
+    def profile_for(self, ip: str) -> EdgeProfile:
+        return self.profiles.get(ip, self.default_profile)
+
+    def stop(self) -> None:
+        super().stop()
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+
+# ---------------------------------------------------------------------
+# Stub DNS
+# ---------------------------------------------------------------------
+_DNS_TYPES = {1: "A", 5: "CNAME", 28: "AAAA"}
+
+
+def _encode_name(name: str) -> bytes:
+    out = b""
+    for label in name.rstrip(".").split("."):
+        raw = label.encode("idna")
+        out += bytes([len(raw)]) + raw
+    return out + b"\x00"
+
+
+class _DnsUDPHandler(socketserver.BaseRequestHandler):
+    server: "_DnsUDPServer"
+
+    def handle(self):
+        data, sock = self.request
+        reply = self.server.owner.answer(data, tcp=False)
+        if reply is not None:
+            try:
+                sock.sendto(reply, self.client_address)
+            except OSError:
+                pass  # 延迟应答发出前服务器已关闭
+
+
+class _DnsTCPHandler(socketserver.BaseRequestHandler):
+    server: "_DnsTCPServer"
+
+    def handle(self):
+        conn = self.request
+        try:
+            while True:
+                head = conn.recv(2, socket.MSG_WAITALL)
+                if len(head) < 2:
+                    return
+                size = struct.unpack("!H", head)[0]
+                data = conn.recv(size, socket.MSG_WAITALL)
+                reply = self.server.owner.answer(data, tcp=True)
+                if reply is None:
+                    return
+                conn.sendall(struct.pack("!H", len(reply)) + reply)
+        except OSError:
+            return
+
+
+class _DnsUDPServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+    owner: "StubDnsServer"
+
+    def process_request(self, request, client_address):
+        # 无注入延迟时直接在服务线程内应答：每个数据报起一个线程跟不上高并发查询，会造成丢包
+        if self.owner.delay > 0:
+            super().process_request(request, client_address)
+        else:
+            self.finish_request(request, client_address)
+
+
+class _DnsTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    owner: "StubDnsServer"
+
+
+class StubDnsServer:
+    """本地 DNS 替身（仅 127.0.0.1，UDP 与 TCP 监听同一端口）。
+
+    records: {名字: {"A": [ip, ...], "AAAA": [ip, ...], "CNAME": 目标名}}，未知名字返回 NXDOMAIN。
+    - ttl: 记录 TTL（秒），可用 ttl_of 按名字覆盖
+    - delay: 每个查询的应答延迟（秒）
+    - truncate_over: UDP 应答地址数超过该值时置 TC 位且不带记录，迫使客户端改用 TCP（0 表示不截断）
+    - truncate_partial: 截断时像真实服务器那样保留 ANCOUNT，并在记录中途切断报文
+    - drop_every: 每 N 个 UDP 查询丢弃一个（0 表示不丢包）
+    """
+
+    def __init__(
+        self,
+        records: Optional[Dict[str, Dict[str, Any]]] = None,
+        *,
+        ttl: int = 300,
+        delay: float = 0.0,
+        truncate_over: int = 0,
+        truncate_partial: bool = False,
+        drop_every: int = 0,
+    ) -> None:
+        self.records: Dict[str, Dict[str, Any]] = {k.rstrip(".").lower(): v for k, v in (records or {}).items()}
+        self.ttl = int(ttl)
+        self.ttl_of: Dict[str, int] = {}
+        self.delay = float(delay)
+        self.truncate_over = int(truncate_over)
+        self.truncate_partial = bool(truncate_partial)
+        self.drop_every = int(drop_every)
+        self.udp_queries = 0
+        self.tcp_queries = 0
+        self._lock = threading.Lock()
+
+        # UDP 与 TCP 需要同一个端口：系统分配的 UDP 端口在 TCP 上可能已被占用，换一个重试
+        for _ in range(20):
+            self._udp = _DnsUDPServer(("127.0.0.1", 0), _DnsUDPHandler)
+            try:
+                self._tcp = _DnsTCPServer(("127.0.0.1", self._udp.server_address[1]), _DnsTCPHandler)
+                break
+            except OSError:
+                self._udp.server_close()
+        else:
+            raise OSError("找不到 UDP / TCP 同时空闲的本地端口")
+        self._udp.owner = self
+        self._tcp.owner = self
+        try:
+            self._udp.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def port(self) -> int:
+        return self._udp.server_address[1]
+
+    @property
+    def address(self) -> str:
+        """可直接作为上游配置使用的地址（"127.0.0.1:端口"）。"""
+        return f"127.0.0.1:{self.port}"
+
+    def _chain(self, name: str) -> Tuple[List[Tuple[str, str]], str]:
+        hops: List[Tuple[str, str]] = []
+        cur = name
+        while "CNAME" in self.records.get(cur, {}) and len(hops) < 16:
+            target = str(self.records[cur]["CNAME"]).rstrip(".").lower()
+            hops.append((cur, target))
+            cur = target
+        return hops, cur
+
+    def _rr(self, owner: str, rtype: int, rdata: bytes) -> bytes:
+        ttl = self.ttl_of.get(owner, self.ttl)
+        return _encode_name(owner) + struct.pack("!HHIH", rtype, 1, ttl, len(rdata)) + rdata
+
+    def answer(self, data: bytes, *, tcp: bool) -> Optional[bytes]:
+        """生成应答报文；返回 None 表示丢弃该查询。"""
+        if len(data) < 12:
+            return None
+        with self._lock:
+            if tcp:
+                self.tcp_queries += 1
+            else:
+                self.udp_queries += 1
+                if self.drop_every and self.udp_queries % self.drop_every == 0:
+                    return None
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+        qid = data[:2]
+        pos = 12
+        labels = []
+        while data[pos] != 0:
+            n = data[pos]
+            labels.append(data[pos + 1:pos + 1 + n].decode("ascii", errors="replace"))
+            pos += 1 + n
+        qtype = struct.unpack("!H", data[pos + 1:pos + 3])[0]
+        question = data[12:pos + 5]
+        name = ".".join(labels).lower()
+
+        if name not in self.records:
+            return qid + struct.pack("!HHHHH", 0x8183, 1, 0, 0, 0) + question
+
+        hops, final = self._chain(name)
+        answers = [self._rr(owner, 5, _encode_name(target)) for owner, target in hops]
+        kind = _DNS_TYPES.get(qtype)
+        addrs = list(self.records.get(final, {}).get(kind, [])) if kind in ("A", "AAAA") else []
+        for ip in addrs:
+            family = socket.AF_INET if kind == "A" else socket.AF_INET6
+            answers.append(self._rr(final, qtype, socket.inet_pton(family, ip)))
+
+        flags = 0x8180
+        if not tcp and self.truncate_over and len(addrs) > self.truncate_over:
+            if self.truncate_partial:
+                body = b"".join(answers)
+                return qid + struct.pack("!HHHHH", flags | 0x0200, 1, len(answers), 0, 0) + question + body[:len(body) - 3]
+            return qid + struct.pack("!HHHHH", flags | 0x0200, 1, 0, 0, 0) + question
+        return qid + struct.pack("!HHHHH", flags, 1, len(answers), 0, 0) + question + b"".join(answers)
+
+    def start(self) -> "StubDnsServer":
+        if not self._threads:
+            for srv in (self._udp, self._tcp):
+                t = threading.Thread(target=srv.serve_forever, name="StubDnsServer", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def stop(self) -> None:
+        for srv in (self._udp, self._tcp):
+            if self._threads:
+                srv.shutdown()
+            srv.server_close()
+        self._threads = []
+
+    def __enter__(self) -> "StubDnsServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
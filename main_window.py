@@ -13,13 +13,16 @@ GUI 层（ttkbootstrap）：
 from __future__ import annotations
 
 import concurrent.futures
+import functools
 import os
 import re
 import socket
+import statistics
 import subprocess
 import sys
 import threading
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
@@ -30,15 +33,31 @@ from config import (
     APP_NAME,
     GITHUB_TARGET_DOMAIN,
     HOSTS_PATH,
+    REMOTE_HOSTS_MERGE_ALL,
     REMOTE_HOSTS_SOURCE_CHOICES,
     REMOTE_HOSTS_URLS,
     UI_CONFIG,
     SPEED_TEST_CONFIG,
     SCHEDULED_TEST_CONFIG,
+    SNAPSHOT_CONFIG,
     TRAY_CONFIG,
 )
 from hosts_file import HostsFileManager
-from services import DomainResolver, RemoteHostsClient, SpeedTester, EnhancedSpeedTester, SpeedTestConfigManager
+from services import (
+    AimdConcurrencyController,
+    ConnectRateLimiter,
+    DomainResolver,
+    EnhancedSpeedTester,
+    MassTcpProber,
+    PrefixClusterScheduler,
+    RemoteHostsClient,
+    SpeedTestConfigManager,
+    SpeedTester,
+    TournamentScheduler,
+    get_shared_connect_limiter,
+    is_fully_probed_ok,
+    pick_best_per_domain,
+)
 from ui_visuals import GlassBackground
 from utils import atomic_write_json, get_logger, is_admin, resource_path, safe_read_json, user_data_path
 
@@ -202,6 +221,13 @@ class HostsOptimizer(ttk.Frame):
         # 远程 Hosts 来源（用于 UI 展示）
         self.remote_hosts_source_url: Optional[str] = None
         self.remote_source_url_override: Optional[str] = None
+        # 合并模式：(ip, domain) -> [提供该记录的源 URL]
+        self.remote_hosts_provenance: Dict[Tuple[str, str], List[str]] = {}
+        # DNS 扇出解析：(ip, domain) -> [给出该地址的上游 DNS]；应答严重不一致的域名 -> 说明
+        self.dns_provenance: Dict[Tuple[str, str], List[str]] = {}
+        self.dns_disagreements: Dict[str, str] = {}
+        # 域名（小写） -> CNAME 目标：目标相同的域名在 SNI 校验时只需取一个代表
+        self.dns_canonical: Dict[str, str] = {}
 
         # 窗口属性
         self.master.title("智能 Hosts 测速工具")
@@ -221,6 +247,8 @@ class HostsOptimizer(ttk.Frame):
         # test_results: (ip, domain, delay_ms, status, selected, jitter, stability)
         self.test_results: List[Tuple[str, str, int, str, bool, float, float]] = []
         self._test_metadata: Dict[str, Dict[str, Any]] = {}
+        # (ip, domain) -> 带宽测试结果（bandwidth_test 的返回值，只含决赛圈）
+        self._bandwidth: Dict[Tuple[str, str], Dict[str, Any]] = {}
 
         self.presets_file = user_data_path(APP_NAME, "presets.json")
         self.current_selected_presets: List[str] = []
@@ -236,6 +264,16 @@ class HostsOptimizer(ttk.Frame):
         self.total_ip_tests = 0
         self.completed_ip_tests = 0
         self._ip_to_domains: Dict[str, List[str]] = {}
+        # ip -> (ms, status, metadata)：已完成测速的结果（流水线模式为后到域名补行）
+        self._ip_results: Dict[str, Tuple[int, str, Dict[str, Any]]] = {}
+        # 本轮直接复用快照期测速结果的 IP（不重复保存）
+        self._reused_ips: Set[str] = set()
+        self._tester = None
+        self._tester_fn = None
+        self._mass_prober: Optional[Union[MassTcpProber, TournamentScheduler, PrefixClusterScheduler]] = None
+        self._limiter_baseline: Tuple[int, float] = (0, 0.0)
+        self._concurrency: Optional[AimdConcurrencyController] = None
+        self._stream_source_done: Optional[bool] = None
 
         # 结果排序节流
         self._sort_after_id = None
@@ -428,7 +466,11 @@ class HostsOptimizer(ttk.Frame):
         
         # 清空旧数据，准备新测速
         self.remote_hosts_data = []
+        self.remote_hosts_provenance = {}
         self.smart_resolved_ips = []
+        self.dns_provenance = {}
+        self.dns_disagreements = {}
+        self.dns_canonical = {}
         
         # 使用配置的域名列表进行解析
         self.current_selected_presets = list(self._scheduled_test_domains)
@@ -455,11 +497,17 @@ class HostsOptimizer(ttk.Frame):
         try:
             async def fetch_async():
                 try:
-                    records, used_url = await self.remote_client.fetch_github_hosts_async(concurrent=True)
+                    if self.remote_source_url_override == REMOTE_HOSTS_MERGE_ALL:
+                        records, provenance = await self.remote_client.fetch_github_hosts_merged_async()
+                        self.remote_hosts_provenance = provenance
+                    else:
+                        records, used_url = await self.remote_client.fetch_github_hosts_async(concurrent=True)
                     self.remote_hosts_data = records
                     self.logger.info(f"定时测速：获取到 {len(records)} 条远程Hosts记录")
                 except Exception as e:
                     self.logger.error(f"定时测速：获取远程Hosts失败: {e}")
+                finally:
+                    await self.remote_client.aclose()
             
             asyncio.run(fetch_async())
         except Exception as e:
@@ -477,6 +525,9 @@ class HostsOptimizer(ttk.Frame):
                 self.logger.info(f"定时测速：解析 {len(non_github_domains)} 个域名...")
                 resolved = self.resolver.resolve(non_github_domains)
                 self.smart_resolved_ips = resolved
+                self.dns_provenance = dict(self.resolver.last_provenance)
+                self.dns_disagreements = dict(self.resolver.last_disagreements)
+                self.dns_canonical = {d.lower(): r.canonical_name for d, r in self.resolver.last_results.items()}
                 self.logger.info(f"定时测速：解析到 {len(resolved)} 个IP")
             
             # 在主线程中启动测速
@@ -876,6 +927,8 @@ class HostsOptimizer(ttk.Frame):
         more_menu = Menu(self.more_btn, tearoff=0)
         more_menu.add_command(label="🧹刷新 DNS", command=self.flush_dns)
         more_menu.add_command(label="📄查看 Hosts 文件", command=self.view_hosts_file)
+        more_menu.add_command(label="⚡ 边下载边测速（GitHub）", command=self.fetch_and_test)
+        more_menu.add_command(label="⚡ 边解析边测速（自定义预设）", command=self.resolve_and_test)
         more_menu.add_checkbutton(label="📡 TCP失败时使用ICMP补充", variable=self.icmp_fallback_var)
         more_menu.add_checkbutton(label="📊 启用高级测速指标", variable=self.advanced_metrics_var)
         more_menu.add_separator()
@@ -1216,6 +1269,14 @@ class HostsOptimizer(ttk.Frame):
         try_hosts_limit_entry.grid(row=4, column=1, sticky=W, padx=10)
         ttk.Label(tls_frame, text="(默认: 3)", font=("Segoe UI", 9), bootstyle="secondary").grid(row=4, column=2, sticky=W, padx=10)
         
+        http_probe_var = BooleanVar(value=self.speed_test_config.get("http_probe", {}).get("enabled", False))
+        http_probe_check = ttk.Checkbutton(
+            tls_frame,
+            text="HTTP 探测 (TLS 通过后发 HEAD，按 建连+TLS+首字节 综合排序)",
+            variable=http_probe_var
+        )
+        http_probe_check.grid(row=5, column=0, columnspan=3, sticky=W, pady=12, padx=10)
+        
         # 添加TLS标签页到Notebook
         notebook.add(tls_frame, text="TLS 设置")
         
@@ -1302,6 +1363,14 @@ class HostsOptimizer(ttk.Frame):
         )
         stability_check.grid(row=1, column=0, columnspan=3, sticky=W, pady=12, padx=10)
         
+        bandwidth_var = BooleanVar(value=self.speed_test_config.get("bandwidth", {}).get("enabled", False))
+        bandwidth_check = ttk.Checkbutton(
+            advanced_frame,
+            text="带宽测试 (延迟测速后对每个域名前几名 IP 下载测吞吐，计入排序)",
+            variable=bandwidth_var
+        )
+        bandwidth_check.grid(row=2, column=0, columnspan=3, sticky=W, pady=12, padx=10)
+        
         # 添加高级设置标签页到Notebook
         notebook.add(advanced_frame, text="高级设置")
         
@@ -1414,6 +1483,8 @@ class HostsOptimizer(ttk.Frame):
             else:
                 errors.append(result)
             
+            config["http_probe"] = {"enabled": http_probe_var.get()}
+            
             # ICMP 配置验证
             config["icmp"] = {}
             config["icmp"]["enabled"] = icmp_enabled_var.get()
@@ -1445,6 +1516,7 @@ class HostsOptimizer(ttk.Frame):
             config["advanced"] = {}
             config["advanced"]["measure_jitter"] = measure_jitter_var.get()
             config["advanced"]["calculate_stability"] = calculate_stability_var.get()
+            config["bandwidth"] = {"enabled": bandwidth_var.get()}
             
             return len(errors) == 0, errors, config
         
@@ -1474,6 +1546,10 @@ class HostsOptimizer(ttk.Frame):
                 new_config["tls"] = new_config.get("tls", {}).copy()
                 new_config["tls"].update(validated_config["tls"])
                 
+                # 更新 HTTP 探测配置（保留 path / weights）
+                new_config["http_probe"] = new_config.get("http_probe", {}).copy()
+                new_config["http_probe"].update(validated_config["http_probe"])
+                
                 # 更新 ICMP 配置
                 new_config["icmp"] = new_config.get("icmp", {}).copy()
                 new_config["icmp"].update(validated_config["icmp"])
@@ -1486,6 +1562,10 @@ class HostsOptimizer(ttk.Frame):
                 new_config["advanced"] = new_config.get("advanced", {}).copy()
                 new_config["advanced"].update(validated_config["advanced"])
                 
+                # 更新带宽测试配置（保留 objects 等其他配置）
+                new_config["bandwidth"] = new_config.get("bandwidth", {}).copy()
+                new_config["bandwidth"].update(validated_config["bandwidth"])
+                
                 # 保存配置
                 if self.speed_test_config_manager.save_config(new_config):
                     self.speed_test_config = new_config
@@ -1637,7 +1717,14 @@ class HostsOptimizer(ttk.Frame):
 
         async def fetch_async():
             try:
-                if self.remote_source_url_override:
+                self.remote_hosts_provenance = {}
+                if self.remote_source_url_override == REMOTE_HOSTS_MERGE_ALL:
+                    self.logger.info("合并模式：并发获取全部源")
+                    records, provenance = await self.remote_client.fetch_github_hosts_merged_async()
+                    self.remote_hosts_provenance = provenance
+                    n_sources = len({u for urls in provenance.values() for u in urls})
+                    used_url = f"合并 {n_sources} 个源"
+                elif self.remote_source_url_override:
                     self.logger.info(f"从指定源获取Hosts: {self.remote_source_url_override}")
                     records, used_url = await self.remote_client.fetch_github_hosts_async(
                         url_override=self.remote_source_url_override,
@@ -1646,9 +1733,12 @@ class HostsOptimizer(ttk.Frame):
                 else:
                     self.logger.info("从自动源获取Hosts（按优先级）")
                     records, used_url = await self.remote_client.fetch_github_hosts_async(concurrent=True)
+                    for url, diag in self.remote_client.last_fetch_diagnostics.items():
+                        self.logger.debug(f"源 {url}: {diag}")
                 self.remote_hosts_data = records
                 self.remote_hosts_source_url = used_url
-                self.logger.info(f"成功获取远程Hosts: {len(records)} 条记录，来源: {used_url}")
+                cache_note = f"，缓存: {self.remote_client.last_cache_status}" if self.remote_client.last_cache_status else ""
+                self.logger.info(f"成功获取远程Hosts: {len(records)} 条记录，来源: {used_url}{cache_note}")
                 self.master.after(0, self._update_remote_hosts_ui)
             except Exception as e:
                 self.logger.error(f"获取远程Hosts失败: {e}", exc_info=True)
@@ -1656,6 +1746,8 @@ class HostsOptimizer(ttk.Frame):
                 self.master.after(0, lambda: self.progress.configure(mode="determinate", value=0))
                 self.master.after(0, lambda: self.refresh_remote_btn.config(state=NORMAL))
                 self.master.after(0, lambda: messagebox.showerror("获取失败", f"无法获取远程Hosts:\n{e}"))
+            finally:
+                await self.remote_client.aclose()
 
         try:
             asyncio.run(fetch_async())
@@ -1700,13 +1792,19 @@ class HostsOptimizer(ttk.Frame):
     def _resolve_ips_thread(self):
         res = self.resolver.resolve(self.current_selected_presets)
         self.smart_resolved_ips = res
+        self.dns_provenance = dict(self.resolver.last_provenance)
+        self.dns_disagreements = dict(self.resolver.last_disagreements)
+        self.dns_canonical = {d.lower(): r.canonical_name for d, r in self.resolver.last_results.items()}
         self.master.after(0, self._update_resolve_ui)
 
     def _update_resolve_ui(self):
         self.all_resolved_tree.delete(*self.all_resolved_tree.get_children())
         for idx, x in enumerate(self.smart_resolved_ips):
             self._tv_insert(self.all_resolved_tree, x, idx)
-        self.status_label.config(text=f"解析完成，共找到 {len(self.smart_resolved_ips)} 个IP", bootstyle=SUCCESS)
+        text = f"解析完成，共找到 {len(self.smart_resolved_ips)} 个IP"
+        if self.dns_disagreements:
+            text += f"（{len(self.dns_disagreements)} 个域名的 DNS 应答不一致，疑似污染，详见日志）"
+        self.status_label.config(text=text, bootstyle=WARNING if self.dns_disagreements else SUCCESS)
         self.resolve_preset_btn.config(state=NORMAL)
         self.check_start_btn()
 
@@ -1724,6 +1822,8 @@ class HostsOptimizer(ttk.Frame):
         # 清空旧结果
         self.result_tree.delete(*self.result_tree.get_children())
         self.test_results = []
+        self._test_metadata = {}
+        self._bandwidth = {}
 
         raw_pairs = list(self.remote_hosts_data) + list(self.smart_resolved_ips)
         if not raw_pairs:
@@ -1747,112 +1847,585 @@ class HostsOptimizer(ttk.Frame):
 
         ip_list = list(self._ip_to_domains.keys())
 
-        # UI 状态
-        self.start_test_btn.config(state=DISABLED)
-        self.pause_test_btn.config(state=NORMAL)
-        self.stop_test = False
-        self._stop_event.clear()
+        # 合并模式 / DNS 扇出：被多个源（远程源或上游 DNS）给出的共识 IP 先测（线程池按提交顺序执行）
+        provenance: Dict[Tuple[str, str], List[str]] = {}
+        for source in (self.remote_hosts_provenance, self.dns_provenance):
+            for key, urls in source.items():
+                provenance.setdefault(key, []).extend(urls)
+        if provenance:
+            consensus = RemoteHostsClient.consensus_by_ip(provenance)
+            ip_list.sort(key=lambda ip: -consensus.get(ip, 0))
+
+        reused = self._reusable_results(ip_list)
+        pending = [ip for ip in ip_list if ip not in reused]
+        mass_cfg = self.speed_test_config.get("mass_probe", {})
+        use_mass = bool(mass_cfg.get("enabled", True)) and len(pending) >= int(mass_cfg.get("threshold", 200))
+
+        # 自适应并发：对照 IP 优先取上一轮测得最快的可用 IP（_prepare_speedtest 会清空上一轮结果）
+        concurrency = self._make_concurrency_controller("mass" if use_mass else "pool", ip_list)
+        workers = None
+        if concurrency is not None and not use_mass:
+            workers = min(concurrency.max_level, max(1, len(ip_list)))
+        self._prepare_speedtest(len(ip_list), workers=workers)
+        if concurrency is not None:
+            self._concurrency = concurrency.start()
+            self.logger.info(
+                f"自适应并发（{concurrency.key}）：起始 {concurrency.level}，范围 {concurrency.min_level}-{concurrency.max_level}，"
+                f"对照 IP {', '.join(concurrency.control_ips)}"
+            )
+        if reused:
+            self.logger.info(f"hosts 列表相对上次变化不大：复用 {len(reused)} 个 IP 的近期测速结果，仅测试 {len(ip_list) - len(reused)} 个")
+            for ip, (ms, st, metadata) in reused.items():
+                self._on_one_ip_finished(ip, self._ip_to_domains.get(ip, [""]), ms, st, metadata)
+            self._reused_ips = set(reused)
+
+        tcp_cfg = self.speed_test_config.get("tcp", {})
+        self.logger.info(
+            f"开始测速，使用配置: TCP端口={tcp_cfg.get('port', 443)}, "
+            f"尝试次数={tcp_cfg.get('attempts', 5)}, 超时={tcp_cfg.get('timeout', 2.0)}秒"
+        )
 
-        self.total_ip_tests = len(ip_list)
-        self.completed_ip_tests = 0
-        self.progress.configure(mode="determinate", value=0)
-        self.status_label.config(text=f"正在测速… 0/{self.total_ip_tests} (IP)", bootstyle=INFO)
+        if use_mass:
+            # IP 很多：TCP 阶段交给单线程批量探测，线程池只做 TLS/ICMP 收尾
+            self._stream_source_done = False
+            threading.Thread(target=self._mass_probe_thread, args=(pending,), daemon=True).start()
+            return
 
+        for ip in pending:
+            self._futures.append(self._submit_ip_test(ip))
+        threading.Thread(target=self._collect_speedtest_results, daemon=True).start()
+
+    def _make_concurrency_controller(self, key: str, ip_list: List[str]) -> Optional[AimdConcurrencyController]:
+        """按配置创建自适应并发控制器（未启用或没有可用作对照的 IP 时返回 None）。"""
+        cfg = self.speed_test_config.get("adaptive_concurrency", {})
+        if not isinstance(cfg, dict) or not cfg.get("enabled", True) or not ip_list:
+            return None
+        level_cfg = cfg.get(key, {}) if isinstance(cfg.get(key), dict) else {}
+        if key == "mass":
+            max_level = int(self.speed_test_config.get("mass_probe", {}).get("max_inflight", 1000))
+        else:
+            max_level = int(level_cfg.get("max", 120))
+
+        in_list = set(ip_list)
+        previous = sorted(
+            (r[0], ip) for ip, r in self._ip_results.items() if ip in in_list and str(r[1]).startswith("可用")
+        )
+        control = [ip for _, ip in previous] + [ip for ip in ip_list if ip not in self._ip_results]
+        tcp_cfg = self.speed_test_config.get("tcp", {})
+        ctrl = AimdConcurrencyController(
+            key=key,
+            control_ips=control[:max(1, int(cfg.get("control_ips", 3)))],
+            port=tcp_cfg.get("port", 443),
+            initial=level_cfg.get("initial", 30),
+            min_level=level_cfg.get("min", 4),
+            max_level=max_level,
+            step=level_cfg.get("step", 4),
+            decrease=cfg.get("decrease", 0.7),
+            rtt_tolerance=cfg.get("rtt_tolerance", 1.5),
+            rtt_slack_ms=cfg.get("rtt_slack_ms", 5.0),
+            interval=cfg.get("interval", 0.5),
+            timeout=min(1.0, float(tcp_cfg.get("timeout", 2.0))),
+        )
+        ctrl.on_change = self._on_concurrency_change
+        return ctrl
+
+    def _on_concurrency_change(self, old: int, new: int, reason: str):
+        """控制器线程回调：降并发记 info，升并发记 debug（每个控制周期都可能升一次）。"""
+        if new < old:
+            self.logger.info(f"自适应并发：{old} -> {new}（{reason}）")
+        else:
+            self.logger.debug(f"自适应并发：{old} -> {new}（{reason}）")
+
+    def _gated_ip_test(self, ip: str, **kwargs):
+        """线程池任务：先经自适应并发闸门，再测速。"""
+        ctrl = self._concurrency
+        if ctrl is None:
+            return self._tester_fn(ip, **kwargs)
+        if not ctrl.acquire(stop=lambda: self.stop_test or self._stop_event.is_set()):
+            return ip, 9999, "已停止"
+        try:
+            return self._tester_fn(ip, **kwargs)
+        finally:
+            ctrl.release()
+
+    def _mass_probe_thread(self, ips: List[str]):
+        """后台线程：MassTcpProber 批量完成 TCP 阶段，每个 IP 完成即提交收尾。
+
+        TCP 可用（或基础模式）的 IP 在线程池里做 TLS/SNI 验证与 ICMP 回退；
+        高级模式下 TCP 失败的 IP 走原来的逐 IP 流程，保留重试逻辑。
+        锦标赛模式（tournament.enabled）改用 TournamentScheduler：未入围的 IP 直接出结果，
+        只有决赛圈做 TLS 验证，失败的 IP 也不再重试。
+        网段聚类（cluster_probe.enabled）套在以上两者外面：先测各网段代表，只在有竞争力的网段内完整测速，
+        其余网段的 IP 直接以「可用(未入围)」/「未测(同网段)」出结果。
+        结果经 _on_stream_future_done 回到主线程，收尾复用流水线的 _maybe_finish_stream_test。
+        """
+        tcp_cfg = self.speed_test_config.get("tcp", {})
+        mass_cfg = self.speed_test_config.get("mass_probe", {})
+        tour_cfg = self.speed_test_config.get("tournament", {})
+        cluster_cfg = self.speed_test_config.get("cluster_probe", {})
+        icmp_cfg = self.speed_test_config.get("icmp", {})
+        port = tcp_cfg.get("port", 443)
+        timeout = tcp_cfg.get("timeout", 2.0)
         use_advanced = bool(self.advanced_metrics_var.get())
+        tournament = bool(tour_cfg.get("enabled", True))
+        common = dict(
+            port=port,
+            attempts=tcp_cfg.get("attempts", 5),
+            timeout=timeout,
+            interval=tcp_cfg.get("interval", 0.02),
+            max_inflight=mass_cfg.get("max_inflight", 1000),
+            # 保留连接供 TLS 握手复用
+            keep_sockets=int(mass_cfg.get("keep_sockets", 128)) if self._tester._tls_reuse_enabled() else 0,
+            limiter=self._tester.limiter or ConnectRateLimiter(),
+            concurrency=self._concurrency,
+            stop_event=self._stop_event,
+            stop_flag=lambda: self.stop_test,
+        )
+        if tournament:
+            prober = TournamentScheduler(eta=tour_cfg.get("eta", 3), min_keep=tour_cfg.get("min_keep", 3), **common)
+        else:
+            prober = MassTcpProber(**common)
+        clustered = isinstance(cluster_cfg, dict) and bool(cluster_cfg.get("enabled", True))
+        if clustered:
+            prober = PrefixClusterScheduler(
+                prober,
+                representatives=cluster_cfg.get("representatives", 2),
+                ratio=cluster_cfg.get("ratio", 1.5),
+                slack_ms=cluster_cfg.get("slack_ms", 10.0),
+                min_clusters=cluster_cfg.get("min_clusters", 2),
+                min_avg_size=cluster_cfg.get("min_avg_size", 2.0),
+                ipv4_prefix=cluster_cfg.get("ipv4_prefix", 24),
+                ipv6_prefix=cluster_cfg.get("ipv6_prefix", 48),
+            )
+
+        def on_result(result):
+            ip, ms, st, metrics = result
+            if st in ("可用(未入围)", "未测(同网段)"):
+                # 探测线程不写 _test_metadata：随 after() 交给主线程（_on_one_ip_finished）
+                self.master.after(0, lambda: self._on_stream_ip_finished(ip, ms, st, metrics))
+                return
+            try:
+                if use_advanced and not tournament and not metrics.get("ok"):
+                    fut = self._submit_ip_test(ip)
+                else:
+                    fut = self.executor.submit(
+                        lambda ip=ip, metrics=metrics: self._tester.finish_tcp_metrics(
+                            ip,
+                            metrics,
+                            port=port,
+                            timeout=timeout,
+                            icmp_timeout_ms=icmp_cfg.get("timeout_ms", 2000),
+                            sni_hosts=self._build_sni_candidates(self._ip_to_domains.get(ip, [])),
+                            # 在工作线程里才取出保留的连接：排队期间仍计入 keep_sockets 上限
+                            sock=prober.take_socket(ip),
+                        )
+                    )
+            except RuntimeError:
+                # 已停止：线程池已关闭
+                return
+            fut.add_done_callback(functools.partial(self._on_stream_future_done, ip))
+
+        self._mass_prober = prober
+        started = time.perf_counter()
+        err: Optional[Exception] = None
+        try:
+            if tournament or clustered:
+                groups: Dict[str, List[str]] = {}
+                for ip in ips:
+                    for dom in self._ip_to_domains.get(ip, []):
+                        groups.setdefault(dom, []).append(ip)
+                prober.run(ips, groups=groups, on_result=on_result)
+            else:
+                prober.probe(ips, on_result=on_result)
+        except Exception as e:
+            err = e
+            self.logger.error(f"批量 TCP 探测失败: {e}")
+            prober.close()
+        else:
+            self.logger.info(f"批量 TCP 探测完成：{len(ips)} 个 IP，耗时 {time.perf_counter() - started:.2f}s")
+            if clustered:
+                self.logger.info(
+                    f"网段聚类：{prober.last_clusters} 个网段，展开 {prober.last_expanded_clusters} 个"
+                    f"（{prober.last_expanded_ips}/{len(ips)} 个 IP 完整测速），connect {prober.last_connects} 次"
+                    f"（全量采样需 {prober.last_full_connects} 次）"
+                )
+            if tournament:
+                tour = prober.inner if clustered else prober
+                self.logger.info(
+                    f"锦标赛测速：各轮参赛 IP {tour.last_rounds}，connect {tour.last_connects} 次"
+                    f"（全量采样需 {tour.last_full_connects} 次）"
+                )
+        self.master.after(0, lambda: self._on_mass_probe_done(err))
 
-        # TLS/SNI: 为同一 IP 生成候选域名列表（按优先级），避免只用第一个域名导致误判全失败
-        # 使用自定义配置
+    def _on_mass_probe_done(self, err: Optional[Exception]):
+        self._stream_source_done = True
+        if self._stop_event.is_set() or self.stop_test:
+            # 已停止：排队中的收尾任务不会再取走保留的连接
+            self._mass_prober.close()
+        if err is not None:
+            self.stop_test = True
+            self._stop_event.set()
+        self._maybe_finish_stream_test()
+
+    def _result_profile(self) -> str:
+        """测速方式标识：只有相同方式下的历史结果才可复用。"""
+        tcp_cfg = self.speed_test_config.get("tcp", {})
+        mode = "advanced" if self.advanced_metrics_var.get() else "basic"
+        return f"{tcp_cfg.get('port', 443)}|{mode}|icmp={int(bool(self.icmp_fallback_var.get()))}"
+
+    def _reusable_results(self, ip_list: List[str]) -> Dict[str, Tuple[int, str, Dict[str, Any]]]:
+        """远程 hosts 相对上一份快照未变化的 IP：返回可复用的近期测速结果。"""
+        max_age = float(SNAPSHOT_CONFIG.get("reuse_results_seconds", 0) or 0)
+        if max_age <= 0 or not (self._is_scheduled_test_running or SNAPSHOT_CONFIG.get("reuse_on_manual_test", False)):
+            return {}
+        delta = self.remote_client.last_delta
+        snapshots = self.remote_client.snapshots
+        if delta is None or not delta.has_previous or snapshots is None:
+            return {}
+        remote_ips = {ip for ip, _ in self.remote_hosts_data}
+        eligible = [ip for ip in ip_list if ip in remote_ips and ip not in delta.new_ips]
+        return snapshots.reusable_results(eligible, max_age=max_age, profile=self._result_profile())
+
+    def _store_probe_results(self):
+        """保存本轮新测得的结果（复用的结果不重复保存，避免无限续期）。"""
+        snapshots = self.remote_client.snapshots
+        if snapshots is None:
+            return
+        # 网段聚类中未测的 IP 只有估计值，不保存
+        fresh = {
+            ip: r for ip, r in self._ip_results.items()
+            if ip not in self._reused_ips and not str(r[1]).startswith("未测")
+        }
+        try:
+            snapshots.store_results(fresh, profile=self._result_profile())
+        except Exception as e:
+            self.logger.debug(f"保存测速结果失败: {e}")
+
+    def _build_sni_candidates(self, domains: List[str]) -> List[str]:
+        """TLS/SNI: 为同一 IP 生成候选域名列表（按优先级），避免只用第一个域名导致误判全失败。
+
+        CNAME 指向同一目标的域名只保留优先级最高的一个，候选名额留给不同的目标。
+        """
         tls_cfg = self.speed_test_config.get("tls", {}) if isinstance(self.speed_test_config, dict) else {}
         preferred_hosts = tls_cfg.get("preferred_hosts", []) if isinstance(tls_cfg, dict) else []
         try_hosts_limit = int(tls_cfg.get("try_hosts_limit", 3)) if isinstance(tls_cfg, dict) else 3
 
-        def build_sni_candidates(domains: List[str]) -> List[str]:
-            cleaned: List[str] = []
-            seen_l: set = set()
-            for d in domains or []:
-                dd = str(d).strip()
-                if not dd:
-                    continue
-                dl = dd.lower()
-                if dl in seen_l:
-                    continue
-                seen_l.add(dl)
-                cleaned.append(dd)
-            if not cleaned:
-                return []
-            lower_to_orig = {c.lower(): c for c in cleaned}
-            out: List[str] = []
-            for p in preferred_hosts or []:
-                pl = str(p).strip().lower()
-                if pl in lower_to_orig and lower_to_orig[pl] not in out:
-                    out.append(lower_to_orig[pl])
-            for c in cleaned:
-                if c not in out:
-                    out.append(c)
-            return out[:max(1, try_hosts_limit)]
-        if use_advanced:
+        cleaned: List[str] = []
+        seen_l: set = set()
+        for d in domains or []:
+            dd = str(d).strip()
+            if not dd:
+                continue
+            dl = dd.lower()
+            if dl in seen_l:
+                continue
+            seen_l.add(dl)
+            cleaned.append(dd)
+        if not cleaned:
+            return []
+        lower_to_orig = {c.lower(): c for c in cleaned}
+        out: List[str] = []
+        for p in preferred_hosts or []:
+            pl = str(p).strip().lower()
+            if pl in lower_to_orig and lower_to_orig[pl] not in out:
+                out.append(lower_to_orig[pl])
+        for c in cleaned:
+            if c not in out:
+                out.append(c)
+        targets: set = set()
+        distinct: List[str] = []
+        for c in out:
+            target = self.dns_canonical.get(c.lower(), c.lower())
+            if target not in targets:
+                targets.add(target)
+                distinct.append(c)
+        return distinct[:max(1, try_hosts_limit)]
+
+    def _speedtest_running(self) -> bool:
+        """是否有测速正在进行（含带宽测试阶段）：停止按钮从开始到 _complete_speedtest 一直可用。"""
+        return str(self.pause_test_btn.cget("state")) == NORMAL
+
+    def _prepare_speedtest(self, total: int, *, workers: Optional[int] = None):
+        """重置测速状态、创建测速器与线程池。
+
+        total 为已知的唯一 IP 数；流水线模式下初始为 0，随提交递增。
+        """
+        self.stop_test = False
+        self._stop_event.clear()
+        self._futures = []
+        if self._concurrency is not None:
+            self._concurrency.stop(save=False)
+            self._concurrency = None
+        self._ip_results = {}
+        self._reused_ips = set()
+
+        self.start_test_btn.config(state=DISABLED)
+        self.pause_test_btn.config(state=NORMAL)
+
+        self.total_ip_tests = int(total)
+        self.completed_ip_tests = 0
+        self.progress.configure(mode="determinate", value=0)
+        self.status_label.config(text=f"正在测速… 0/{self.total_ip_tests} (IP)", bootstyle=INFO)
+
+        if self.advanced_metrics_var.get():
             # 使用自定义配置创建 EnhancedSpeedTester
-            tester = EnhancedSpeedTester(
+            self._tester = EnhancedSpeedTester(
                 config=self.speed_test_config.copy(),  # 传入自定义配置
                 stop_event=self._stop_event,
                 stop_flag=lambda: self.stop_test,
             )
-            workers = min(60, max(1, self.total_ip_tests))
-            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
-            self._futures = []
-            
-            # 获取 TCP 配置
-            tcp_cfg = self.speed_test_config.get("tcp", {})
-            port = tcp_cfg.get("port", 443)
-            attempts = tcp_cfg.get("attempts", 5)
-            timeout = tcp_cfg.get("timeout", 2.0)
-            
-            for ip in ip_list:
-                doms = self._ip_to_domains.get(ip, [])
-                cands = build_sni_candidates(doms)
-                self._futures.append(self.executor.submit(
-                    tester.test_with_retry, 
-                    ip, 
-                    sni_hosts=cands,
-                    port=port,
-                    attempts=attempts,
-                    timeout=timeout
-                ))
+            self._tester_fn = self._tester.test_with_retry
         else:
             # 获取 ICMP 配置
             icmp_cfg = self.speed_test_config.get("icmp", {})
             icmp_enabled = icmp_cfg.get("enabled", True) and bool(self.icmp_fallback_var.get())
-            
-            tester = SpeedTester(
+            self._tester = SpeedTester(
                 icmp_fallback=icmp_enabled,
                 stop_event=self._stop_event,
                 stop_flag=lambda: self.stop_test,
+                # 限速参数同样取自界面中的测速配置；关闭时传入不限速的实例
+                limiter=get_shared_connect_limiter(self.speed_test_config) or ConnectRateLimiter(),
             )
+            self._tester_fn = self._tester.test_one_ip
+
+        limiter = self._tester.limiter
+        self._limiter_baseline = (limiter.acquired, limiter.total_wait) if limiter is not None else (0, 0.0)
+
+        if workers is None:
             workers = min(60, max(1, self.total_ip_tests))
-            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
-            self._futures = []
-            
-            # 获取 TCP 配置
-            tcp_cfg = self.speed_test_config.get("tcp", {})
-            port = tcp_cfg.get("port", 443)
-            attempts = tcp_cfg.get("attempts", 5)
-            timeout = tcp_cfg.get("timeout", 2.0)
-            
-            for ip in ip_list:
-                doms = self._ip_to_domains.get(ip, [])
-                cands = build_sni_candidates(doms)
-                self._futures.append(self.executor.submit(
-                    tester.test_one_ip, 
-                    ip, 
-                    sni_hosts=cands,
-                    port=port,
-                    attempts=attempts,
-                    timeout=timeout
-                ))
-        
-        self.logger.info(f"开始测速，使用配置: TCP端口={port}, 尝试次数={attempts}, 超时={timeout}秒")
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def _submit_ip_test(self, ip: str) -> concurrent.futures.Future:
+        """把单个 IP 提交到线程池测速（SNI 候选取自 ip -> domains 映射）。"""
+        tcp_cfg = self.speed_test_config.get("tcp", {})
+        cands = self._build_sni_candidates(self._ip_to_domains.get(ip, []))
+        return self.executor.submit(
+            self._gated_ip_test,
+            ip,
+            sni_hosts=cands,
+            port=tcp_cfg.get("port", 443),
+            attempts=tcp_cfg.get("attempts", 5),
+            timeout=tcp_cfg.get("timeout", 2.0),
+        )
 
-        threading.Thread(target=self._collect_speedtest_results, daemon=True).start()
+    # -----------------------------------------------------------------
+    # Fetch-and-test pipeline
+    # -----------------------------------------------------------------
+    def fetch_and_test(self):
+        """边下载边测速：流式获取远程 Hosts，每出现一个新 IP 立即提交测速。"""
+        # _prepare_speedtest 会重置计数并替换线程池，旧测速的结果会混进新表
+        if self._speedtest_running():
+            messagebox.showinfo("提示", "测速正在进行，请先停止当前测速")
+            return
+        if not self.is_github_selected:
+            messagebox.showinfo("提示", "请先在自定义预设中选中 github.com")
+            return
+        self.logger.info("开始边下载边测速...")
+        self.result_tree.delete(*self.result_tree.get_children())
+        self.test_results = []
+        self._test_metadata = {}
+        self._bandwidth = {}
+        self.remote_hosts_data = []
+        self.remote_hosts_provenance = {}
+        self._ip_to_domains = {}
+        self.remote_tree.delete(*self.remote_tree.get_children())
+
+        self.refresh_remote_btn.config(state=DISABLED)
+        self._stream_source_done = False
+        # 总数未知：线程池按上限创建，线程按需启动
+        self._prepare_speedtest(0, workers=60)
+        self.status_label.config(text="正在下载并测速…", bootstyle=INFO)
+        threading.Thread(target=self._stream_fetch_thread, daemon=True).start()
+
+    def _stream_fetch_thread(self):
+        import asyncio
+
+        async def stream_async():
+            try:
+                # 流式模式不支持合并，合并源按“自动”处理
+                override = self.remote_source_url_override
+                if override == REMOTE_HOSTS_MERGE_ALL:
+                    override = None
+                async for batch in self.remote_client.stream_github_hosts_async(url_override=override):
+                    if self._stop_event.is_set() or self.stop_test:
+                        break
+                    self.master.after(0, lambda b=batch: self._on_stream_records(b))
+            finally:
+                await self.remote_client.aclose()
+
+        err: Optional[Exception] = None
+        try:
+            asyncio.run(stream_async())
+        except Exception as e:
+            err = e
+            self.logger.error(f"边下载边测速：获取远程Hosts失败: {e}")
+        self.master.after(0, lambda: self._on_stream_source_done(err))
+
+    def _on_stream_records(self, batch: List[Tuple[str, str]]):
+        """主线程：合并一批流式记录，新 IP 立即提交测速。"""
+        if self._stop_event.is_set() or self.stop_test:
+            return
+        base = len(self.remote_hosts_data)
+        for offset, (ip, dom) in enumerate(batch):
+            self.remote_hosts_data.append((ip, dom))
+            self._tv_insert(self.remote_tree, (ip, dom), base + offset)
+        self._submit_stream_pairs(batch)
+
+        self.status_label.config(
+            text=f"边下载边测速… {self.completed_ip_tests}/{self.total_ip_tests} (IP)，已获取 {len(self.remote_hosts_data)} 条",
+            bootstyle=INFO,
+        )
+
+    def _submit_stream_pairs(self, pairs: List[Tuple[str, str]]):
+        """主线程：把流式到达的 (ip, domain) 并入 ip -> domains 映射；新 IP 立即提交测速。"""
+        for ip, dom in pairs:
+            doms = self._ip_to_domains.get(ip)
+            if doms is None:
+                self._ip_to_domains[ip] = [dom]
+                fut = self._submit_ip_test(ip)
+                self._futures.append(fut)
+                self.total_ip_tests += 1
+                fut.add_done_callback(functools.partial(self._on_stream_future_done, ip))
+                continue
+            if dom in doms:
+                continue
+            doms.append(dom)
+            # 该 IP 已测完：为后到的域名直接补一行结果
+            done = self._ip_results.get(ip)
+            if done is not None:
+                ms, st, metadata = done
+                jitter = metadata.get("jitter", 0.0) or 0.0
+                stability = metadata.get("stability_score", 0.0) or 0.0
+                self._add_test_results_batch([(ip, dom, ms, st, jitter, stability)])
+
+    def resolve_and_test(self):
+        """边解析边测速：每个域名解析完成立即把新 IP 提交测速，解析与测速重叠进行。"""
+        if self._speedtest_running():
+            messagebox.showinfo("提示", "测速正在进行，请先停止当前测速")
+            return
+        domains = list(self.current_selected_presets)
+        if not domains:
+            messagebox.showinfo("提示", "请先在自定义预设中选择要解析的域名")
+            return
+        self.logger.info(f"开始边解析边测速：{len(domains)} 个域名")
+        self.result_tree.delete(*self.result_tree.get_children())
+        self.test_results = []
+        self._test_metadata = {}
+        self._bandwidth = {}
+        self.smart_resolved_ips = []
+        self.dns_provenance = {}
+        self.dns_disagreements = {}
+        self.dns_canonical = {}
+        self._ip_to_domains = {}
+        self.all_resolved_tree.delete(*self.all_resolved_tree.get_children())
+
+        self.resolve_preset_btn.config(state=DISABLED)
+        self._stream_source_done = False
+        # 总数未知：线程池按上限创建，线程按需启动
+        self._prepare_speedtest(0, workers=60)
+        self.status_label.config(text="正在解析并测速…", bootstyle=INFO)
+        threading.Thread(target=self._stream_resolve_thread, args=(domains,), daemon=True).start()
+
+    def _stream_resolve_thread(self, domains: List[str]):
+        import asyncio
+
+        async def stream_async():
+            try:
+                async for resolved in self.resolver.resolve_stream_async(domains):
+                    if self._stop_event.is_set() or self.stop_test:
+                        break
+                    pairs = [(ip, resolved.domain) for ip in resolved.sources]
+                    self.master.after(
+                        0, lambda r=resolved, p=pairs: self._on_resolved_pairs(r.domain, r.canonical_name, p)
+                    )
+            finally:
+                await self.resolver.aclose()
+
+        err: Optional[Exception] = None
+        try:
+            asyncio.run(stream_async())
+        except Exception as e:
+            err = e
+            self.logger.error(f"边解析边测速：解析失败: {e}")
+        self.master.after(0, lambda: self._on_stream_resolve_done(err))
+
+    def _on_resolved_pairs(self, domain: str, canonical: str, pairs: List[Tuple[str, str]]):
+        """主线程：一个域名解析完成，新的 (ip, domain) 进入结果页并立即提交测速。"""
+        if self._stop_event.is_set() or self.stop_test:
+            return
+        # 先登记 CNAME 目标，提交测速时 SNI 候选即可按目标去重
+        self.dns_canonical[domain.lower()] = canonical
+        new = [(ip, dom) for ip, dom in pairs if dom not in self._ip_to_domains.get(ip, ())]
+        base = len(self.smart_resolved_ips)
+        for offset, pair in enumerate(new):
+            self.smart_resolved_ips.append(pair)
+            self._tv_insert(self.all_resolved_tree, pair, base + offset)
+        self._submit_stream_pairs(new)
+
+        self.status_label.config(
+            text=f"边解析边测速… {self.completed_ip_tests}/{self.total_ip_tests} (IP)，已解析 {len(self.smart_resolved_ips)} 个IP",
+            bootstyle=INFO,
+        )
+
+    def _on_stream_resolve_done(self, err: Optional[Exception]):
+        self._stream_source_done = True
+        self.resolve_preset_btn.config(state=NORMAL)
+        self.dns_provenance = dict(self.resolver.last_provenance)
+        self.dns_disagreements = dict(self.resolver.last_disagreements)
+        self.dns_canonical = {d.lower(): r.canonical_name for d, r in self.resolver.last_results.items()}
+        if err is not None and not self.smart_resolved_ips:
+            messagebox.showerror("解析失败", f"无法解析所选域名:\n{err}")
+        else:
+            self.logger.info(f"边解析边测速：解析完成，共 {len(self.smart_resolved_ips)} 个IP")
+        self._maybe_finish_stream_test()
+
+    def _on_stream_future_done(self, ip: str, fut: concurrent.futures.Future):
+        """线程池回调（工作线程）：把结果转交主线程。
+
+        ip 在挂回调时绑定：测速抛异常时也按失败计数，否则 completed_ip_tests 追不上总数，
+        _maybe_finish_stream_test 永远不会收尾（与 _collect_speedtest_results 对失败任务的处理一致）。
+        """
+        if fut.cancelled():
+            return
+        try:
+            result = fut.result()
+        except Exception as e:
+            self.logger.error(f"流水线测速：{ip} 测速异常: {e}")
+            st = f"失败:{str(e)[:12]}"
+            self.master.after(0, lambda: self._on_stream_ip_finished(ip, 9999, st, {}))
+            return
+        ip, ms, st = result[:3]
+        metadata = result[3] if len(result) == 4 and isinstance(result[3], dict) else {}
+        # _test_metadata 只在主线程读写（_on_one_ip_finished），这里不直接写
+        self.master.after(0, lambda: self._on_stream_ip_finished(ip, ms, st, metadata))
+
+    def _on_stream_ip_finished(self, ip: str, ms: int, status: str, metadata: Dict[str, Any]):
+        self._on_one_ip_finished(ip, self._ip_to_domains.get(ip, [""]), ms, status, metadata)
+        self._maybe_finish_stream_test()
+
+    def _on_stream_source_done(self, err: Optional[Exception]):
+        self._stream_source_done = True
+        self.refresh_remote_btn.config(state=NORMAL)
+        src = self.remote_client.last_stream_url
+        self.remote_hosts_source_url = src
+        if err is not None and not self.remote_hosts_data:
+            messagebox.showerror("获取失败", f"无法获取远程Hosts:\n{err}")
+        else:
+            self.logger.info(f"边下载边测速：获取完成，共 {len(self.remote_hosts_data)} 条记录，来源: {src}")
+        self._maybe_finish_stream_test()
+
+    def _maybe_finish_stream_test(self):
+        if not getattr(self, "_stream_source_done", True):
+            return
+        if self._stop_event.is_set() or self.stop_test or self.completed_ip_tests >= self.total_ip_tests:
+            self._stream_source_done = None  # 只收尾一次
+            if self.executor:
+                try:
+                    self.executor.shutdown(wait=False)
+                except Exception:
+                    pass
+            self._finish_speedtest_ui()
+            self.check_start_btn()
 
     def _collect_speedtest_results(self):
         """后台收集测速结果：按完成顺序逐个更新 UI（保证进度条实时）。"""
@@ -1865,7 +2438,6 @@ class HostsOptimizer(ttk.Frame):
                     result = fut.result()
                     if use_advanced and len(result) == 4:
                         ip, ms, st, metadata = result
-                        self._test_metadata[ip] = metadata
                     else:
                         ip, ms, st = result[:3]
                         metadata = {}
@@ -1890,17 +2462,54 @@ class HostsOptimizer(ttk.Frame):
         if self._stop_event.is_set() or self.stop_test:
             return
         metadata = metadata or {}
+        if metadata:
+            # 主线程写入：排序与收尾在主线程遍历 _test_metadata，工作线程不直接修改
+            self._test_metadata[ip] = metadata
+        self._ip_results[ip] = (ms, status, metadata)
         jitter = metadata.get("jitter", 0.0) or 0.0
         stability = metadata.get("stability_score", 0.0) or 0.0
         rows = [(ip, dom, ms, status, jitter, stability) for dom in domains]
         self._add_test_results_batch(rows, ip_completed_increment=1)
 
     def _finish_speedtest_ui(self):
+        ctrl = self._concurrency
+        if ctrl is not None:
+            self._concurrency = None
+            ctrl.stop(save=True)
+            levels = [lv for _, lv, _ in ctrl.history]
+            self.logger.info(
+                f"自适应并发（{ctrl.key}）：起始 {levels[0]}，最终 {ctrl.level}，区间 {min(levels)}-{max(levels)}，"
+                f"调整 {len(levels) - 1} 次；已保存为下次起点"
+            )
+        limiter = self._tester.limiter if self._tester is not None else None
+        if limiter is not None and (limiter.rate > 0 or limiter.per_prefix > 0):
+            connects = limiter.acquired - self._limiter_baseline[0]
+            waited = limiter.total_wait - self._limiter_baseline[1]
+            if connects > 0:
+                self.logger.info(
+                    f"connect 限速：本轮 {connects} 次 connect，累计排队 {waited:.2f}s"
+                    f"（平均 {waited * 1000 / connects:.1f} ms/次，不计入延迟）"
+                )
+        resumes = [m for m in self._test_metadata.values() if isinstance(m, dict) and m.get("tls_resume_ms") is not None]
+        if resumes:
+            full = [m["tls_handshake_ms"] for m in resumes if m.get("tls_handshake_ms") is not None]
+            self.logger.info(
+                f"TLS 会话恢复：{sum(1 for m in resumes if m.get('tls_resumed'))}/{len(resumes)} 个 IP 接受恢复，"
+                f"握手中位数 完整 {statistics.median(full) if full else 0:.1f} ms / "
+                f"恢复 {statistics.median(m['tls_resume_ms'] for m in resumes):.1f} ms"
+            )
+        if not (self._stop_event.is_set() or self.stop_test) and self._start_bandwidth_phase():
+            return
+        self._complete_speedtest()
+
+    def _complete_speedtest(self):
+        """测速（含带宽测试阶段）全部结束：更新状态、保存结果、恢复按钮并触发定时测速回调。"""
         if self._stop_event.is_set() or self.stop_test:
             self.status_label.config(text=f"测速已停止（完成 {self.completed_ip_tests}/{self.total_ip_tests} 个IP）", bootstyle=WARNING)
         else:
             self.progress.configure(value=100)
             self.status_label.config(text=f"测速完成，共测试 {self.total_ip_tests} 个IP", bootstyle=SUCCESS)
+            self._store_probe_results()
 
         self.start_test_btn.config(state=NORMAL)
         self.pause_test_btn.config(state=DISABLED)
@@ -1911,6 +2520,91 @@ class HostsOptimizer(ttk.Frame):
             self._on_scheduled_test_complete()
             self._schedule_next_test()
 
+    def _start_bandwidth_phase(self) -> bool:
+        """延迟测速结束后，对每个域名排名前 top_k 的 IP 做带宽测试（后台线程逐个进行）。
+
+        只测 bandwidth.objects 中配置了下载对象的域名；TLS 通过的 IP 优先入选（与 write_best_ip_to_hosts 一致）。
+        有任务时返回 True，结束后由 _on_bandwidth_done 继续收尾。
+        """
+        bw_cfg = self.speed_test_config.get("bandwidth", {})
+        if not isinstance(bw_cfg, dict) or not bw_cfg.get("enabled", False) or self._tester is None:
+            return False
+        objects = {str(d).lower(): p for d, p in (bw_cfg.get("objects") or {}).items()}
+        top_k = max(1, int(bw_cfg.get("top_k", 3)))
+
+        by_domain: Dict[str, List[tuple]] = {}
+        for row in self.test_results:
+            ip, d, _, st = row[:4]
+            st_s = str(st)
+            if not is_fully_probed_ok(st_s) or "ICMP" in st_s:
+                continue
+            if str(d).lower() in objects:
+                by_domain.setdefault(d, []).append(row)
+        jobs: List[Tuple[str, str, str]] = []
+        for d, rows in by_domain.items():
+            rows.sort(key=lambda r: (0 if "(TLS)" in str(r[3]) else 1, self._rank_key_for_result_row(r)))
+            for row in rows[:top_k]:
+                jobs.append((row[0], d, objects[str(d).lower()]))
+        if not jobs:
+            return False
+
+        self.logger.info(f"带宽测试：{len(by_domain)} 个域名，共 {len(jobs)} 个 IP（每个域名前 {top_k} 名）")
+        self.status_label.config(text=f"带宽测试中… 0/{len(jobs)}", bootstyle=INFO)
+        # 以本轮的结果字典作为标识：停止后立即开始新一轮时，旧线程的回调会被忽略
+        store = self._bandwidth
+        threading.Thread(target=self._bandwidth_thread, args=(jobs, dict(bw_cfg), store), daemon=True).start()
+        return True
+
+    def _bandwidth_thread(
+        self, jobs: List[Tuple[str, str, str]], bw_cfg: Dict[str, Any], store: Dict[Tuple[str, str], Dict[str, Any]]
+    ):
+        # 逐个测：并行下载会互相争抢带宽，测得的吞吐没有可比性
+        tls_cfg = self.speed_test_config.get("tls", {})
+        for i, (ip, domain, path) in enumerate(jobs, 1):
+            if self._stop_event.is_set() or self.stop_test:
+                break
+            try:
+                res = self._tester.bandwidth_test(
+                    ip,
+                    domain,
+                    path,
+                    port=int(bw_cfg.get("port", 443)),
+                    max_bytes=int(bw_cfg.get("max_bytes", 4 * 1024 * 1024)),
+                    time_cap=float(bw_cfg.get("time_cap", 4.0)),
+                    skip_bytes=int(bw_cfg.get("skip_bytes", 64 * 1024)),
+                    timeout=float(tls_cfg.get("timeout", 3.0)),
+                    verify_hostname=bool(tls_cfg.get("verify_hostname", False)),
+                )
+            except Exception as e:
+                res = {"bw_error": f"err:{e}"}
+            self.master.after(
+                0, lambda ip=ip, d=domain, r=res, i=i: self._on_bandwidth_result(store, ip, d, r, i, len(jobs))
+            )
+        self.master.after(0, lambda: self._on_bandwidth_done(store))
+
+    def _on_bandwidth_result(
+        self, store: Dict[Tuple[str, str], Dict[str, Any]], ip: str, domain: str, res: Dict[str, Any], done: int, total: int
+    ):
+        if store is not self._bandwidth or res.get("bw_error") == "stopped":
+            return
+        store[(ip, domain)] = res
+        if res.get("bw_mbps") is not None:
+            self.logger.info(
+                f"带宽测试 {ip} ({domain})：{res['bw_mbps']:.1f} Mbps，"
+                f"{res.get('bw_bytes', 0) / 1024:.0f} KB / {res.get('bw_seconds', 0):.2f}s"
+            )
+        else:
+            self.logger.info(f"带宽测试 {ip} ({domain}) 失败：{res.get('bw_error')}")
+        self.status_label.config(text=f"带宽测试中… {done}/{total}", bootstyle=INFO)
+        if not self._sort_after_id:
+            self._sort_after_id = self.master.after(200, self._flush_sort_results)
+
+    def _on_bandwidth_done(self, store: Dict[Tuple[str, str], Dict[str, Any]]):
+        if store is not self._bandwidth:
+            return
+        self._flush_sort_results()
+        self._complete_speedtest()
+
     def _add_test_results_batch(self, rows, ip_completed_increment: int = 0):
         for row in rows:
             if len(row) == 6:
@@ -1926,10 +2620,10 @@ class HostsOptimizer(ttk.Frame):
                 self.progress["value"] = (self.completed_ip_tests / self.total_ip_tests) * 100.0
             else:
                 self.progress["value"] = 0
-            self.status_label.config(
-                text=f"测速中… {self.completed_ip_tests}/{self.total_ip_tests} (IP)",
-                bootstyle=INFO,
-            )
+            text = f"测速中… {self.completed_ip_tests}/{self.total_ip_tests} (IP)"
+            if self._concurrency is not None:
+                text += f" · 并发 {self._concurrency.level}"
+            self.status_label.config(text=text, bootstyle=INFO)
 
         # 节流排序，避免界面卡顿
         if not self._sort_after_id:
@@ -1942,7 +2636,11 @@ class HostsOptimizer(ttk.Frame):
         - 延迟(ms)：越低越好
         - 抖动(jitter)：越低越好（若可用）
         - 稳定性(stability_score)：越高越好（若可用）
+        - TLS 握手：超出一个 TCP RTT 的部分计入惩罚（优先用恢复握手耗时，实际流量大多走恢复握手）
+        - HTTP 探测（若开启）：改用 建连 + TLS + 首字节 的加权和（http_probe.weights），无响应则加罚
+        - 带宽测试（若开启）：测得吞吐的决赛圈 IP 排在前面，并加上按吞吐折算的下载耗时
         - TLS 通过：在接近情况下略微优先
+        - 锦标赛 / 网段聚类中未入围：排在所有完整采样的结果之后
         """
         try:
             ms = int(row[2])
@@ -1978,12 +2676,47 @@ class HostsOptimizer(ttk.Frame):
         if stability and stability > 0:
             score += (100.0 - stability) * 2.0
 
+        # TLS 握手耗时（来自 _test_metadata）：恢复握手 ≈ 1 RTT，超出部分多为服务器处理慢或多一轮往返
+        meta = self._test_metadata.get(str(row[0])) if row else None
+        if isinstance(meta, dict):
+            http_cfg = self.speed_test_config.get("http_probe", {})
+            blended = SpeedTester.blended_latency_ms(meta, http_cfg.get("weights"))
+            if blended is not None:
+                # 有 HTTP 探测结果：以 建连 + TLS + 首字节 的加权和代替 TCP 延迟
+                score += blended - float(ms)
+            elif meta.get("http_error"):
+                score += float(http_cfg.get("failure_penalty_ms", 1000.0))
+            else:
+                tls_ms = meta.get("tls_resume_ms")
+                if tls_ms is None:
+                    tls_ms = meta.get("tls_handshake_ms")
+                try:
+                    score += max(0.0, float(tls_ms) - float(ms))
+                except (TypeError, ValueError):
+                    pass
+
         # TLS 通过（可用(TLS)）轻微加分：仅在分数接近时更偏向它
         if "(TLS)" in status:
             score -= 15.0
 
-        # 二级排序：延迟更低优先
-        return (score, float(ms))
+        # 锦标赛 / 网段聚类中未入围的 IP 只有 1~2 个筛选样本，始终排在完整采样的结果之后
+        if "未入围" in status:
+            return (2, score, float(ms))
+
+        # 带宽测试（决赛圈）：测得吞吐的排在前面，吞吐折算为下载 rank_reference_bytes 所需的时间（ms）
+        tier = 1
+        bw = self._bandwidth.get((str(row[0]), str(row[1]))) if len(row) >= 2 else None
+        if bw is not None:
+            bw_cfg = self.speed_test_config.get("bandwidth", {})
+            mbps = bw.get("bw_mbps")
+            if mbps:
+                tier = 0
+                score += float(bw_cfg.get("rank_reference_bytes", 1024 * 1024)) * 8 / (mbps * 1_000_000.0) * 1000.0
+            else:
+                score += float(bw_cfg.get("failure_penalty_ms", 1000.0))
+
+        # 三级排序：延迟更低优先
+        return (tier, score, float(ms))
 
 
     def _flush_sort_results(self):
@@ -2055,40 +2788,13 @@ class HostsOptimizer(ttk.Frame):
     # Write / rollback hosts
     # -----------------------------------------------------------------
     def write_best_ip_to_hosts(self):
-        # 优先写入 TLS/SNI 验证通过的结果；若某域名没有 TLS 通过项，再回退到普通“可用”项
-        best_tls: Dict[str, Tuple[str, int, tuple]] = {}
-        best_any: Dict[str, Tuple[str, int, tuple]] = {}
-
-        for row in self.test_results:
-            if len(row) == 7:
-                ip, d, ms, st, _, _, _ = row
-            else:
-                ip, d, ms, st, _ = row[:5]
-
-            st_s = str(st)
-            if not st_s.startswith("可用"):
-                continue
-
-            # 记录任意可用
-            rk = self._rank_key_for_result_row((ip, d, ms, st, False, 0.0, 0.0) if len(row) < 7 else row)
-            if (d not in best_any) or (rk < best_any[d][2]):
-                best_any[d] = (ip, ms, rk)
-
-            # 记录 TLS 可用（更可信）
-            if "(TLS)" in st_s:
-                rk = self._rank_key_for_result_row((ip, d, ms, st, False, 0.0, 0.0) if len(row) < 7 else row)
-                if (d not in best_tls) or (rk < best_tls[d][2]):
-                    best_tls[d] = (ip, ms, rk)
-
-        # 合并：TLS 优先
-        best: Dict[str, Tuple[str, int, tuple]] = {}
-        for d, v in best_any.items():
-            best[d] = best_tls.get(d, v)
-
+        # 优先写入 TLS/SNI 验证通过的结果；若某域名没有 TLS 通过项，再回退到普通“可用”项。
+        # 锦标赛 / 网段聚类中未入围的 IP 只有筛选样本，不参与选优
+        best = pick_best_per_domain(self.test_results, self._rank_key_for_result_row)
         if not best:
             messagebox.showinfo("提示", "没有可用的IP地址")
             return
-        self._do_write([(ip, d) for d, (ip, _, _) in best.items()])
+        self._do_write([(ip, d) for d, (ip, _) in best.items()])
 
     def write_selected_to_hosts(self):
         sel = []
@@ -6,7 +6,7 @@ services.py
 
 说明：
 - 本文件不依赖 tkinter/ttkbootstrap，避免与 UI 层耦合。
-- Windows 专用能力（ICMP ping / flushdns 等）在需要时做平台判断。
+- 平台相关能力（ICMP ping：Linux 用进程内非特权 ICMP 套接字，Windows 用 ping 命令；flushdns 等）在需要时做平台判断。
 - 支持异步和同步两种调用方式。
 - 支持 IPv4 和 IPv6 双栈。
 """
@@ -15,16 +15,31 @@ from __future__ import annotations
 
 import asyncio
 import concurrent.futures
+import contextvars
+import email.utils
+import errno
+import gzip
+import hashlib
+import heapq
 import ipaddress
 import json
 import os
+import random
 import re
+import select
+import selectors
 import socket
 import ssl
 import statistics
+import struct
 import subprocess
 import sys
+import threading
 import time
+import urllib.parse
+import zlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 from typing import Callable, Iterable, List, Optional, Tuple, Dict, Any, Union, Set
 
 import requests
@@ -34,31 +49,1578 @@ from urllib3.util.retry import Retry
 from config import (
     APP_NAME,
     REMOTE_FETCH_TIMEOUT,
+    REMOTE_HOSTS_MERGE_ALL,
     REMOTE_HOSTS_URLS,
     SPEED_TEST_CONFIG,
     HTTP_CLIENT_CONFIG,
     DNS_RESOLVER_CONFIG,
+    DNS_CACHE_CONFIG,
+    REMOTE_CACHE_CONFIG,
+    HOSTS_PARSER_CONFIG,
+    REMOTE_MERGE_CONFIG,
+    REMOTE_RACE_CONFIG,
+    SNAPSHOT_CONFIG,
+    SOURCE_HEALTH_CONFIG,
 )
-from utils import get_logger
+from utils import atomic_write_bytes, atomic_write_json, get_logger, safe_read_json, user_data_path
+
+
+# ---------------------------------------------------------------------
+# Async HTTP
+# ---------------------------------------------------------------------
+@dataclass
+class AsyncHTTPResponse:
+    """完整读取后的 HTTP 响应（headers 键统一为小写）。"""
+
+    status: int
+    headers: Dict[str, str]
+    url: str
+    body: bytes = b""
+
+    def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding, errors="ignore")
+
+
+class AsyncHTTPStream:
+    """流式 HTTP 响应：按块读取已解压的响应体。
+
+    读完（或 aclose）后，若连接可复用则自动归还连接池。
+    """
+
+    def __init__(
+        self,
+        client: "AsyncHTTPClient",
+        pool_key: Tuple[str, str, int],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        *,
+        status: int,
+        headers: Dict[str, str],
+        url: str,
+        method: str,
+        keep_alive: bool,
+    ) -> None:
+        self._client = client
+        self._pool_key = pool_key
+        self._reader = reader
+        self._writer = writer
+        self.status = status
+        self.headers = headers
+        self.url = url
+        self._method = method
+        self._keep_alive = keep_alive
+        self._finished = False
+        self._closed = False
+
+    def _has_body(self) -> bool:
+        if self._method == "HEAD":
+            return False
+        return not (100 <= self.status < 200 or self.status in (204, 304))
+
+    async def _read(self, n: int) -> bytes:
+        return await asyncio.wait_for(self._reader.read(n), timeout=self._client.read_timeout)
+
+    async def _readexactly(self, n: int) -> bytes:
+        return await asyncio.wait_for(self._reader.readexactly(n), timeout=self._client.read_timeout)
+
+    async def _readline(self) -> bytes:
+        return await asyncio.wait_for(self._reader.readline(), timeout=self._client.read_timeout)
+
+    async def _iter_raw(self):
+        """按 HTTP/1.1 分帧规则（chunked / Content-Length / EOF）读取原始响应体。"""
+        if not self._has_body():
+            return
+        chunk_size = self._client.chunk_size
+        te = self.headers.get("transfer-encoding", "").lower()
+        if "chunked" in te:
+            while True:
+                line = await self._readline()
+                if not line:
+                    raise ConnectionError("chunked 响应体提前结束")
+                size_str = line.split(b";", 1)[0].strip()
+                try:
+                    size = int(size_str, 16)
+                except ValueError:
+                    raise ConnectionError(f"无效的 chunk 长度：{size_str[:20]!r}")
+                if size == 0:
+                    # 跳过 trailer，直到空行
+                    while True:
+                        trailer = await self._readline()
+                        if trailer in (b"\r\n", b"\n", b""):
+                            break
+                    return
+                remaining = size
+                while remaining > 0:
+                    data = await self._readexactly(min(remaining, chunk_size))
+                    remaining -= len(data)
+                    yield data
+                await self._readexactly(2)  # chunk 结尾的 CRLF
+        elif "content-length" in self.headers:
+            try:
+                remaining = int(self.headers["content-length"])
+            except ValueError:
+                raise ConnectionError("无效的 Content-Length")
+            while remaining > 0:
+                data = await self._read(min(remaining, chunk_size))
+                if not data:
+                    raise ConnectionError("响应体长度不足 Content-Length")
+                remaining -= len(data)
+                yield data
+        else:
+            # 无长度信息：读到连接关闭为止，连接不可复用
+            self._keep_alive = False
+            while True:
+                data = await self._read(chunk_size)
+                if not data:
+                    return
+                yield data
+
+    def _make_decoder(self):
+        enc = self.headers.get("content-encoding", "").lower().strip()
+        if enc in ("gzip", "x-gzip"):
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if enc == "deflate":
+            return "deflate"
+        return None
+
+    def _inflate(self, decoder, raw: bytes, budget: int):
+        """解压一块原始数据：每次最多产出 min(chunk_size, budget) 字节（zlib 的 max_length），
+        剩余输入留在 unconsumed_tail 里继续解压，避免高压缩比的响应体在检查上限之前就整块展开。"""
+        step = max(1, min(self._client.chunk_size, budget))
+        data = raw
+        while True:
+            out = decoder.decompress(data, step)
+            data = decoder.unconsumed_tail
+            if out:
+                yield out
+            if not data and len(out) < step:
+                return
+
+    async def iter_chunks(self):
+        """逐块产出解压后的响应体；超过 max_body_bytes 时抛出异常（解压输出按剩余额度分段，不会先整块展开）。"""
+        if self._finished or self._closed:
+            return
+        limit = self._client.max_body_bytes
+        total = 0
+        decoder = self._make_decoder()
+
+        def check(n: int) -> None:
+            nonlocal total
+            total += n
+            if limit and total > limit:
+                raise ValueError(f"响应体超过上限 {limit} 字节")
+
+        try:
+            async for raw in self._iter_raw():
+                if decoder == "deflate":
+                    # deflate 有 zlib 包装与裸流两种实现，按首块的 2 字节 zlib 头自动识别
+                    try:
+                        zlib.decompressobj(zlib.MAX_WBITS).decompress(raw[:2])
+                        decoder = zlib.decompressobj(zlib.MAX_WBITS)
+                    except zlib.error:
+                        decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                if decoder is None:
+                    check(len(raw))
+                    if raw:
+                        yield raw
+                    continue
+                # 额度多给 1 字节：恰好超过上限时能触发异常
+                for data in self._inflate(decoder, raw, limit - total + 1 if limit else self._client.chunk_size):
+                    check(len(data))
+                    yield data
+            if decoder is not None and decoder != "deflate":
+                tail = decoder.flush()
+                if tail:
+                    check(len(tail))
+                    yield tail
+            self._finished = True
+        except BaseException:
+            self._keep_alive = False
+            await self.aclose()
+            raise
+        await self.aclose()
+
+    async def read(self) -> bytes:
+        """读取完整响应体（已解压）。"""
+        buf = bytearray()
+        async for data in self.iter_chunks():
+            buf.extend(data)
+        return bytes(buf)
+
+    async def aclose(self) -> None:
+        """结束响应：读完且可复用则归还连接，否则关闭连接。"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._finished and self._keep_alive:
+            self._client._release(self._pool_key, self._reader, self._writer)
+        else:
+            await self._client._close_writer(self._writer)
+
+
+class AsyncHTTPClient:
+    """基于 asyncio 的轻量 HTTP/1.1 客户端。
+
+    - 按 (scheme, host, port) 维护 keep-alive 连接池（绑定当前事件循环）
+    - Accept-Encoding: gzip/deflate，自动解压
+    - 支持 chunked / Content-Length / EOF 三种分帧
+    - 自动跟随重定向，限制响应体大小，支持流式读取
+    - SSLContext 在实例内复用，避免每次请求重复加载证书
+    """
+
+    _REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 15.0,
+        user_agent: str = f"{APP_NAME}/1.0",
+        max_redirects: Optional[int] = None,
+        max_body_bytes: Optional[int] = None,
+        max_idle_per_host: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        chunk_size: int = 64 * 1024,
+    ) -> None:
+        cfg = HTTP_CLIENT_CONFIG.get("async", {})
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+        self.user_agent = user_agent
+        self.max_redirects = int(cfg.get("max_redirects", 5) if max_redirects is None else max_redirects)
+        self.max_body_bytes = int(cfg.get("max_body_bytes", 16 * 1024 * 1024) if max_body_bytes is None else max_body_bytes)
+        self.max_idle_per_host = int(cfg.get("max_idle_per_host", 4) if max_idle_per_host is None else max_idle_per_host)
+        self.idle_timeout = float(cfg.get("idle_timeout", 30.0) if idle_timeout is None else idle_timeout)
+        self.chunk_size = max(1024, int(chunk_size))
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._pool: Dict[Tuple[str, str, int], List[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def _bind_loop(self) -> None:
+        """连接与事件循环绑定：换了事件循环（例如新的 asyncio.run）则丢弃旧连接。"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        for conns in self._pool.values():
+            for _, writer, _ in conns:
+                try:
+                    writer.transport.abort()
+                except Exception:
+                    pass
+        self._pool.clear()
+        self._loop = loop
+
+    @staticmethod
+    def _split_url(url: str) -> Tuple[str, str, int, str]:
+        p = urllib.parse.urlsplit(url)
+        scheme = (p.scheme or "http").lower()
+        if scheme not in ("http", "https"):
+            raise ValueError(f"不支持的协议：{scheme}")
+        host = p.hostname
+        if not host:
+            raise ValueError(f"无效的 URL：{url}")
+        port = p.port or (443 if scheme == "https" else 80)
+        target = p.path or "/"
+        if p.query:
+            target += "?" + p.query
+        return scheme, host, port, target
+
+    async def _acquire(self, key: Tuple[str, str, int]) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        """取一个空闲连接（返回 reused=True），没有则新建。"""
+        conns = self._pool.get(key) or []
+        now = time.monotonic()
+        while conns:
+            reader, writer, idle_since = conns.pop()
+            if now - idle_since > self.idle_timeout or writer.is_closing() or reader.at_eof():
+                await self._close_writer(writer)
+                continue
+            return reader, writer, True
+
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host,
+                port,
+                ssl=self.ssl_context if scheme == "https" else None,
+                server_hostname=host if scheme == "https" else None,
+            ),
+            timeout=self.connect_timeout,
+        )
+        return reader, writer, False
+
+    def _release(self, key: Tuple[str, str, int], reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self._loop is not None and self._loop.is_closed():
+            return
+        conns = self._pool.setdefault(key, [])
+        if len(conns) >= self.max_idle_per_host or writer.is_closing():
+            try:
+                writer.transport.abort()
+            except Exception:
+                pass
+            return
+        conns.append((reader, writer, time.monotonic()))
+
+    @staticmethod
+    async def _close_writer(writer: asyncio.StreamWriter) -> None:
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), timeout=1.0)
+        except Exception:
+            pass
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> Tuple[str, int, Dict[str, str]]:
+        """读取状态行与响应头，返回 (http_version, status, headers)。"""
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=self.read_timeout)
+            if not line:
+                raise ConnectionError("连接在响应头之前关闭")
+            m = re.match(rb"(HTTP/\d(?:\.\d)?)\s+(\d{3})", line)
+            if not m:
+                raise ConnectionError(f"无效的状态行：{line[:60]!r}")
+            version, status = m.group(1).decode("ascii"), int(m.group(2))
+
+            headers: Dict[str, str] = {}
+            header_bytes = 0
+            while True:
+                h = await asyncio.wait_for(reader.readline(), timeout=self.read_timeout)
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                header_bytes += len(h)
+                if header_bytes > 64 * 1024:
+                    raise ConnectionError("响应头过大")
+                if b":" not in h:
+                    continue
+                k, v = h.decode("latin-1").split(":", 1)
+                k = k.strip().lower()
+                v = v.strip()
+                headers[k] = f"{headers[k]}, {v}" if k in headers else v
+
+            # 100 Continue 等中间响应：继续读取最终响应
+            if 100 <= status < 200 and status != 101:
+                continue
+            return version, status, headers
+
+    async def _send_once(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]],
+    ) -> AsyncHTTPStream:
+        scheme, host, port, target = self._split_url(url)
+        key = (scheme, host, port)
+        default_port = 443 if scheme == "https" else 80
+        host_header = host if port == default_port else f"{host}:{port}"
+        if ":" in host and not host.startswith("["):
+            host_header = f"[{host}]" if port == default_port else f"[{host}]:{port}"
+
+        req_headers = {
+            "Host": host_header,
+            "User-Agent": self.user_agent,
+            "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        }
+        for k, v in (headers or {}).items():
+            req_headers[k] = v
+        head = f"{method} {target} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in req_headers.items()) + "\r\n"
+
+        # 复用的连接可能已被服务器关闭：失败时用新连接重试一次
+        for _ in range(2):
+            reader, writer, reused = await self._acquire(key)
+            try:
+                writer.write(head.encode("latin-1"))
+                await writer.drain()
+                version, status, resp_headers = await self._read_head(reader)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                await self._close_writer(writer)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                await self._close_writer(writer)
+                raise
+
+            conn_hdr = resp_headers.get("connection", "").lower()
+            keep_alive = version == "HTTP/1.1" and "close" not in conn_hdr
+            return AsyncHTTPStream(
+                self,
+                key,
+                reader,
+                writer,
+                status=status,
+                headers=resp_headers,
+                url=url,
+                method=method,
+                keep_alive=keep_alive,
+            )
+        raise ConnectionError(f"连接 {host}:{port} 失败")
+
+    async def open_stream(
+        self,
+        url: str,
+        *,
+        method: str = "GET",
+        headers: Optional[Dict[str, str]] = None,
+        follow_redirects: bool = True,
+    ) -> AsyncHTTPStream:
+        """发送请求并返回流式响应（已处理重定向）。调用方负责读完或 aclose。"""
+        self._bind_loop()
+        method = method.upper()
+        current = url
+        for _ in range(self.max_redirects + 1):
+            stream = await self._send_once(method, current, headers)
+            location = stream.headers.get("location")
+            if not (follow_redirects and stream.status in self._REDIRECT_STATUSES and location):
+                return stream
+            # 读掉重定向响应体以便复用连接（体积通常很小）
+            try:
+                await stream.read()
+            except Exception:
+                await stream.aclose()
+            current = urllib.parse.urljoin(current, location)
+            if stream.status == 303:
+                method = "GET"
+        raise RuntimeError(f"重定向次数超过上限（{self.max_redirects}）：{url}")
+
+    async def request(
+        self,
+        url: str,
+        *,
+        method: str = "GET",
+        headers: Optional[Dict[str, str]] = None,
+        follow_redirects: bool = True,
+    ) -> AsyncHTTPResponse:
+        """发送请求并读取完整响应体。"""
+        stream = await self.open_stream(url, method=method, headers=headers, follow_redirects=follow_redirects)
+        body = await stream.read()
+        return AsyncHTTPResponse(status=stream.status, headers=stream.headers, url=stream.url, body=body)
+
+    async def aclose(self) -> None:
+        """关闭所有空闲连接。"""
+        conns = [w for lst in self._pool.values() for _, w, _ in lst]
+        self._pool.clear()
+        for writer in conns:
+            await self._close_writer(writer)
 
 
 # ---------------------------------------------------------------------
 # Remote Hosts
 # ---------------------------------------------------------------------
+def _filter_records_by_family(
+    records: Iterable[Tuple[str, str]],
+    *,
+    ipv4_only: bool = False,
+    ipv6_only: bool = False,
+) -> List[Tuple[str, str]]:
+    """按 IP 版本过滤 (ip, domain) 列表（不做过滤时原样返回副本）。"""
+    if not ipv4_only and not ipv6_only:
+        return [(ip, d) for ip, d in records]
+    out: List[Tuple[str, str]] = []
+    for ip, d in records:
+        is_v6 = ":" in ip
+        if ipv4_only and is_v6:
+            continue
+        if ipv6_only and not is_v6:
+            continue
+        out.append((ip, d))
+    return out
+
+
+class DomainSuffixTrie:
+    """按标签反向存储的域名后缀树。
+
+    add("github.com") 后，github.com 与 *.github.com 均匹配，而 notgithub.com 不匹配。
+    查询按标签从右到左逐级下钻，复杂度与域名层级数成正比，与后缀数量无关。
+    内部以 bytes 标签存储，解析引擎可在未解码的字节上直接查询。
+    """
+
+    _END = b""
+
+    def __init__(self, suffixes: Iterable[str] = ()) -> None:
+        self._root: Dict[bytes, Any] = {}
+        self.size = 0
+        for s in suffixes:
+            self.add(s)
+
+    def add(self, suffix: str) -> None:
+        labels = [x for x in str(suffix).strip().strip(".").lower().encode("idna").split(b".") if x]
+        if not labels:
+            return
+        node = self._root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        if self._END not in node:
+            node[self._END] = True
+            self.size += 1
+
+    def matches_bytes(self, host_lower: bytes) -> bool:
+        """host_lower 需为小写 ASCII 字节；命中任一后缀返回 True。"""
+        node = self._root
+        end = self._END
+        for label in reversed(host_lower.split(b".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if end in node:
+                return True
+        return False
+
+    def matches(self, host: str) -> bool:
+        try:
+            return self.matches_bytes(host.strip().lower().encode("ascii"))
+        except UnicodeEncodeError:
+            return False
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class HostsParser:
+    """高吞吐 hosts 解析引擎（字节级扫描）。
+
+    - 先用后缀/关键字组成的锚点正则在整个字节块上定位候选行，不含锚点的行不进入 Python 循环
+    - 直接在 bytes 上去注释、分词，只对保留下来的域名解码为 str
+    - 先做域名过滤再做字符校验：大列表中绝大多数行在过滤阶段即被丢弃
+    - IP 校验与域名判定结果按原始字节记忆化（同一 IP / 域名在大列表中重复极多）；
+      IPv4 走预编译正则，仅 IPv6 交给 ipaddress
+    - 域名过滤：后缀树（target_suffixes）+ 可选关键字（keywords）；两者皆空则不过滤
+
+    解析规则与原版一致：支持一行多个域名、行内注释、严格 IP 校验、(ip, 小写域名) 去重。
+    """
+
+    _HOST_RE = re.compile(rb"[A-Za-z0-9.-]+")
+    # str.splitlines() / str.split() 认作换行 / 空白、bytes 却不认的字符（原版按 str 逐行解析）
+    _ODD_SEPARATOR_RE = re.compile(
+        rb"[\x0b\x0c\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80"
+    )
+    _ODD_LINE_BREAK_RE = re.compile(rb"[\x0b\x0c\x1c-\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+    _ODD_ASCII_BYTES = (b"\x0b", b"\x0c", b"\x1c", b"\x1d", b"\x1e", b"\x1f")
+    # 上面多字节序列的首字节；先用单字符类扫一遍，命中再跑完整正则
+    _ODD_LEAD_RE = re.compile(rb"[\x0b\x0c\x1c-\x1f\xc2\xe1\xe2\xe3]")
+    _IPV4_RE = re.compile(rb"(?:(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])")
+
+    def __init__(
+        self,
+        *,
+        target_suffixes: Optional[Iterable[str]] = None,
+        keywords: Optional[Iterable[str]] = None,
+        ip_cache_size: Optional[int] = None,
+    ) -> None:
+        if target_suffixes is None:
+            target_suffixes = HOSTS_PARSER_CONFIG.get("target_suffixes", [])
+        if keywords is None:
+            keywords = HOSTS_PARSER_CONFIG.get("keywords", [])
+        if ip_cache_size is None:
+            ip_cache_size = HOSTS_PARSER_CONFIG.get("ip_cache_size", 65536)
+        self.trie = DomainSuffixTrie(target_suffixes)
+        self.keywords: Tuple[bytes, ...] = tuple(str(k).lower().encode("ascii", errors="ignore") for k in keywords if k)
+        self.match_all = not len(self.trie) and not self.keywords
+        # 预过滤：任何目标域名必然包含某个后缀或关键字，不含这些子串的行无需逐行解析
+        # （包含其他锚点的锚点是冗余的，去掉以缩短正则）
+        anchors: List[bytes] = []
+        candidates = {a for a in self.keywords if a} | {
+            str(x).strip().strip(".").lower().encode("idna") for x in target_suffixes if str(x).strip(".")
+        }
+        for a in sorted(candidates, key=len):
+            if not any(b in a for b in anchors):
+                anchors.append(a)
+        self._anchor_re = None if self.match_all else re.compile(b"|".join(re.escape(a) for a in anchors))
+        self.ip_cache_size = max(0, int(ip_cache_size))
+        # 原始 IP 字节 -> (str, 版本)；版本 0 表示无效
+        self._ip_cache: Dict[bytes, Tuple[str, int]] = {}
+        # 原始域名字节 -> (原样域名, 小写域名)；False 表示被过滤或不合法
+        self._host_cache: Dict[bytes, Any] = {}
+
+    def _ip_version(self, ip_b: bytes) -> Tuple[str, int]:
+        hit = self._ip_cache.get(ip_b)
+        if hit is not None:
+            return hit
+        if self._IPV4_RE.fullmatch(ip_b):
+            res = (ip_b.decode("ascii"), 4)
+        elif b":" in ip_b:
+            try:
+                ip_str = ip_b.decode("ascii")
+                res = (ip_str, ipaddress.ip_address(ip_str).version)
+            except Exception:
+                res = ("", 0)
+        else:
+            res = ("", 0)
+        if len(self._ip_cache) >= self.ip_cache_size:
+            self._ip_cache.clear()
+        if self.ip_cache_size:
+            self._ip_cache[ip_b] = res
+        return res
+
+    def host_wanted_bytes(self, host_lower: bytes) -> bool:
+        if self.match_all:
+            return True
+        if self.trie.matches_bytes(host_lower):
+            return True
+        for k in self.keywords:
+            if k in host_lower:
+                return True
+        return False
+
+    def host_wanted(self, host: str) -> bool:
+        """域名是否属于目标集合。"""
+        try:
+            return self.host_wanted_bytes(host.strip().lower().encode("ascii"))
+        except UnicodeEncodeError:
+            return False
+
+    def parse_lines(
+        self,
+        lines: Iterable[bytes],
+        seen: Set[Tuple[str, str]],
+        out: List[Tuple[str, str]],
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+    ) -> None:
+        """解析若干行（bytes），把新的 (ip, domain) 追加到 out，seen 用于跨调用去重。"""
+        host_ok = self._HOST_RE.fullmatch
+        wanted = self.host_wanted_bytes
+        match_all = self.match_all
+        ip_cache = self._ip_cache
+        ip_version = self._ip_version
+        host_cache = self._host_cache
+        cache_limit = max(1, self.ip_cache_size)
+        for line in lines:
+            hash_pos = line.find(b"#")
+            if hash_pos == 0:
+                continue
+            if hash_pos > 0:
+                line = line[:hash_pos]
+            parts = line.split()
+            if len(parts) < 2:
+                continue
+
+            ip_b = parts[0]
+            hit = ip_cache.get(ip_b)
+            ip_str, version = hit if hit is not None else ip_version(ip_b)
+            if not version:
+                continue
+            # 根据 IP 版本过滤
+            if ipv4_only and version != 4:
+                continue
+            if ipv6_only and version != 6:
+                continue
+
+            for host_b in parts[1:]:
+                verdict = host_cache.get(host_b)
+                if verdict is None:
+                    host_lb = host_b.lower()
+                    # 目标过滤 + hostname 基本校验
+                    if (not match_all and not wanted(host_lb)) or b"." not in host_b or host_ok(host_b) is None:
+                        verdict = False
+                    else:
+                        verdict = (host_b.decode("ascii"), host_lb.decode("ascii"))
+                    if len(host_cache) >= cache_limit:
+                        host_cache.clear()
+                    host_cache[host_b] = verdict
+                if verdict is False:
+                    continue
+                key = (ip_str, verdict[1])
+                if key in seen:
+                    continue
+                seen.add(key)
+                out.append((ip_str, verdict[0]))
+
+    def _candidate_lines(self, data: bytes):
+        """借助预编译的锚点正则，只产出可能含目标域名的行（其余行在 C 层被跳过）。"""
+        if self._anchor_re is None:
+            yield from data.splitlines()
+            return
+        # 在小写副本上查找（bytes.lower 不改变长度，下标与原数据一致）
+        search = self._anchor_re.search
+        lowered = data.lower()
+        pos = 0
+        n = len(data)
+        while pos < n:
+            m = search(lowered, pos)
+            if m is None:
+                return
+            start = data.rfind(b"\n", 0, m.start()) + 1
+            end = data.find(b"\n", m.end())
+            if end < 0:
+                end = n
+            line = data[start:end]
+            if b"\r" in line.rstrip(b"\r"):
+                # 旧式 CR 换行：拆开后逐行处理
+                yield from line.splitlines()
+            else:
+                yield line
+            pos = end + 1
+
+    def parse_chunk(
+        self,
+        data: bytes,
+        seen: Set[Tuple[str, str]],
+        out: List[Tuple[str, str]],
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+    ) -> None:
+        """解析一段由完整行组成的字节块（带预过滤），结果追加到 out。"""
+        self.parse_lines(
+            self._candidate_lines(self._normalize_separators(data)), seen, out, ipv4_only=ipv4_only, ipv6_only=ipv6_only
+        )
+
+    @classmethod
+    def _normalize_separators(cls, data: bytes) -> bytes:
+        """把 \\v、\\f、\\x1c-\\x1f 与 Unicode 换行 / 空白统一为 \\n / 空格，与原版按 str 分行、分词的结果一致。
+
+        绝大多数列表是纯 ASCII 且不含这些字符：isascii + 几次 memchr 级别的查找即可原样返回。
+        """
+        if data.isascii():
+            if not any(b in data for b in cls._ODD_ASCII_BYTES):
+                return data
+        elif cls._ODD_LEAD_RE.search(data) is None or cls._ODD_SEPARATOR_RE.search(data) is None:
+            return data
+        return cls._ODD_SEPARATOR_RE.sub(b" ", cls._ODD_LINE_BREAK_RE.sub(b"\n", data))
+
+    def parse_bytes(
+        self,
+        data: bytes,
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+    ) -> List[Tuple[str, str]]:
+        out: List[Tuple[str, str]] = []
+        self.parse_chunk(data, set(), out, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+        return out
+
+    def parse_text(
+        self,
+        txt: str,
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+    ) -> List[Tuple[str, str]]:
+        return self.parse_bytes((txt or "").encode("utf-8", errors="ignore"), ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+
+
+_default_hosts_parser: Optional[HostsParser] = None
+
+
+def get_default_hosts_parser() -> HostsParser:
+    """按 HOSTS_PARSER_CONFIG 构建的共享解析引擎（惰性创建）。"""
+    global _default_hosts_parser
+    if _default_hosts_parser is None:
+        _default_hosts_parser = HostsParser()
+    return _default_hosts_parser
+
+
+class HostsStreamParser:
+    """增量 hosts 解析器：按字节块喂入，按行产出新的 (ip, domain) 记录。
+
+    规则与 RemoteHostsClient.parse_github_hosts_text 一致（共用 HostsParser 引擎），
+    跨块的半行会缓存到下一次 feed。
+
+    用法：
+        parser = HostsStreamParser()
+        for chunk in chunks:
+            new_records = parser.feed(chunk)
+        new_records = parser.close()
+    """
+
+    def __init__(
+        self,
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+        parser: Optional[HostsParser] = None,
+    ) -> None:
+        self.ipv4_only = ipv4_only
+        self.ipv6_only = ipv6_only
+        self.parser = parser or get_default_hosts_parser()
+        self.records: List[Tuple[str, str]] = []
+        self.bytes_seen = 0
+        self._seen: Set[Tuple[str, str]] = set()
+        self._buf = b""
+        self._head = b""
+
+    @property
+    def head(self) -> bytes:
+        """响应体开头的若干字节（用于识别 HTML 错误页）。"""
+        return self._head
+
+    def _parse_chunk(self, data: bytes) -> List[Tuple[str, str]]:
+        new: List[Tuple[str, str]] = []
+        self.parser.parse_chunk(data, self._seen, new, ipv4_only=self.ipv4_only, ipv6_only=self.ipv6_only)
+        self.records.extend(new)
+        return new
+
+    def feed(self, data: bytes) -> List[Tuple[str, str]]:
+        """喂入一块字节，返回本块中新出现的记录。"""
+        if not data:
+            return []
+        self.bytes_seen += len(data)
+        if len(self._head) < 512:
+            self._head += data[: 512 - len(self._head)]
+        buf = self._buf + data
+        nl = buf.rfind(b"\n")
+        if nl < 0:
+            self._buf = buf
+            return []
+        self._buf = buf[nl + 1:]
+        return self._parse_chunk(buf[:nl])
+
+    def close(self) -> List[Tuple[str, str]]:
+        """结束输入，解析残留的最后一行。"""
+        rest, self._buf = self._buf, b""
+        return self._parse_chunk(rest) if rest else []
+
+
+class RemoteHostsCache:
+    """远程 hosts 的磁盘响应缓存（按 URL 一个文件）。
+
+    每个条目保存：
+    - etag / last_modified：用于下一次条件请求（If-None-Match / If-Modified-Since）
+    - records：已解析好的 (ip, domain) 列表（不做 IPv4/IPv6 过滤，读取时再过滤）
+    - fetched_at：最近一次确认内容有效的时间戳（200 或 304）
+
+    新鲜期内直接返回缓存；所有源都失败时，允许在 stale_if_error_seconds 内兜底返回。
+    """
+
+    def __init__(
+        self,
+        *,
+        app_name: str = APP_NAME,
+        cache_dir: Optional[str] = None,
+        fresh_seconds: Optional[float] = None,
+        stale_if_error_seconds: Optional[float] = None,
+    ) -> None:
+        self.cache_dir = cache_dir or user_data_path(app_name, REMOTE_CACHE_CONFIG.get("dir_name", "remote_cache"))
+        if fresh_seconds is None:
+            fresh_seconds = REMOTE_CACHE_CONFIG.get("fresh_seconds", 300)
+        if stale_if_error_seconds is None:
+            stale_if_error_seconds = REMOTE_CACHE_CONFIG.get("stale_if_error_seconds", 7 * 24 * 3600)
+        self.fresh_seconds = max(0.0, float(fresh_seconds))
+        self.stale_if_error_seconds = max(0.0, float(stale_if_error_seconds))
+
+    def _path_for(self, url: str) -> str:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """读取 URL 对应的缓存条目，不存在或损坏返回 None。"""
+        entry = safe_read_json(self._path_for(url), None)
+        if not isinstance(entry, dict) or entry.get("url") != url:
+            return None
+        if not isinstance(entry.get("records"), list):
+            return None
+        return entry
+
+    @staticmethod
+    def records_of(entry: Dict[str, Any]) -> List[Tuple[str, str]]:
+        out: List[Tuple[str, str]] = []
+        for item in entry.get("records") or []:
+            try:
+                ip, dom = item
+                out.append((str(ip), str(dom)))
+            except Exception:
+                continue
+        return out
+
+    @staticmethod
+    def age_of(entry: Dict[str, Any]) -> float:
+        try:
+            return max(0.0, time.time() - float(entry.get("fetched_at", 0)))
+        except Exception:
+            return float("inf")
+
+    def is_fresh(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return bool(entry) and self.fresh_seconds > 0 and self.age_of(entry) <= self.fresh_seconds
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """根据缓存条目生成条件请求头（无缓存时返回空字典）。"""
+        headers: Dict[str, str] = {}
+        if not entry:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = str(entry["etag"])
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = str(entry["last_modified"])
+        return headers
+
+    def store(
+        self,
+        url: str,
+        records: List[Tuple[str, str]],
+        *,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+            "records": [[ip, d] for ip, d in records],
+        }
+        try:
+            atomic_write_json(self._path_for(url), entry, indent=0)
+        except Exception as e:
+            get_logger().debug(f"写入远程 hosts 缓存失败：{url} {e}")
+
+    def touch(self, url: str, entry: Dict[str, Any]) -> None:
+        """304 Not Modified：仅刷新时间戳，沿用已解析记录。"""
+        self.store(url, self.records_of(entry), etag=entry.get("etag"), last_modified=entry.get("last_modified"))
+
+    def freshest(self, urls: Iterable[str]) -> Optional[Tuple[Dict[str, Any], str]]:
+        """在允许的兜底年龄内，返回最新的缓存条目 (entry, url)。"""
+        best: Optional[Tuple[Dict[str, Any], str]] = None
+        for url in urls:
+            entry = self.get(url)
+            if not entry or not entry.get("records"):
+                continue
+            if self.age_of(entry) > self.stale_if_error_seconds:
+                continue
+            if best is None or self.age_of(entry) < self.age_of(best[0]):
+                best = (entry, url)
+        return best
+
+
+class SourceHealthStore:
+    """远程源健康度的持久化存储与评分。
+
+    每个源记录：最近延迟样本、随时间衰减的成功/尝试计数、最近一次的内容时间（Last-Modified）
+    与记录数。cost() 越小越好，综合“期望延迟 / 成功率”，并对陈旧内容与记录偏少的源加罚。
+    """
+
+    _UNKNOWN_LATENCY_MS = 1500.0
+
+    def __init__(
+        self,
+        *,
+        app_name: str = APP_NAME,
+        path: Optional[str] = None,
+        half_life_hours: Optional[float] = None,
+        max_samples: Optional[int] = None,
+    ) -> None:
+        self.path = path or user_data_path(app_name, SOURCE_HEALTH_CONFIG.get("file_name", "source_health.json"))
+        if half_life_hours is None:
+            half_life_hours = SOURCE_HEALTH_CONFIG.get("half_life_hours", 24.0)
+        if max_samples is None:
+            max_samples = SOURCE_HEALTH_CONFIG.get("max_samples", 20)
+        self.half_life_s = max(60.0, float(half_life_hours) * 3600.0)
+        self.max_samples = max(1, int(max_samples))
+        self._lock = threading.Lock()
+        data = safe_read_json(self.path, {})
+        self._data: Dict[str, Dict[str, Any]] = data if isinstance(data, dict) else {}
+
+    def _decayed(self, st: Dict[str, Any], now: float) -> Tuple[float, float]:
+        dt = max(0.0, now - float(st.get("updated_at", now)))
+        k = 0.5 ** (dt / self.half_life_s)
+        return float(st.get("success", 0.0)) * k, float(st.get("attempts", 0.0)) * k
+
+    def record(
+        self,
+        url: str,
+        *,
+        ok: bool,
+        latency_ms: Optional[float] = None,
+        record_count: Optional[int] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """记录一次获取结果（线程安全）。"""
+        now = time.time()
+        with self._lock:
+            st = self._data.setdefault(url, {})
+            success, attempts = self._decayed(st, now)
+            st["success"] = success + (1.0 if ok else 0.0)
+            st["attempts"] = attempts + 1.0
+            st["updated_at"] = now
+            if ok and latency_ms is not None:
+                samples = list(st.get("latencies") or [])
+                samples.append(round(float(latency_ms), 1))
+                st["latencies"] = samples[-self.max_samples:]
+            if ok:
+                st["last_success"] = now
+            if record_count is not None:
+                st["record_count"] = int(record_count)
+            if last_modified:
+                try:
+                    st["content_ts"] = email.utils.parsedate_to_datetime(last_modified).timestamp()
+                except Exception:
+                    pass
+
+    def save(self) -> None:
+        with self._lock:
+            snapshot = json.loads(json.dumps(self._data))
+        try:
+            atomic_write_json(self.path, snapshot, indent=0)
+        except Exception as e:
+            get_logger().debug(f"保存源健康度失败：{e}")
+
+    def _stats(self, url: str) -> Dict[str, Any]:
+        """某个源记录的浅拷贝（record() 只整体替换字段值，浅拷贝即可在锁外读取）。"""
+        with self._lock:
+            return dict(self._data.get(url) or {})
+
+    @staticmethod
+    def _percentile(samples: Optional[List[float]], q: float) -> Optional[float]:
+        samples = sorted(samples or [])
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+        return float(samples[idx])
+
+    def _rate(self, st: Dict[str, Any]) -> float:
+        success, attempts = self._decayed(st, time.time())
+        return (success + 1.0) / (attempts + 2.0)
+
+    def latency_percentile(self, url: str, q: float) -> Optional[float]:
+        return self._percentile(self._stats(url).get("latencies"), q)
+
+    def success_rate(self, url: str) -> float:
+        """带先验的衰减成功率（无记录时为 0.5）。"""
+        return self._rate(self._stats(url))
+
+    def cost(self, url: str) -> float:
+        """期望代价（越小越好）。"""
+        with self._lock:
+            st = dict(self._data.get(url) or {})
+            counts = [int(v.get("record_count", 0)) for v in self._data.values() if v.get("record_count")]
+        latency = self._percentile(st.get("latencies"), 0.5)
+        if latency is None:
+            latency = self._UNKNOWN_LATENCY_MS
+        cost = latency / self._rate(st)
+
+        # 内容新鲜度：Last-Modified 越旧越罚（按周线性增加）
+        content_ts = st.get("content_ts")
+        if content_ts:
+            age_days = max(0.0, (time.time() - float(content_ts)) / 86400.0)
+            cost *= 1.0 + age_days / 7.0
+
+        # 记录数明显少于最多的源：内容可能不完整
+        if counts and st.get("record_count"):
+            coverage = int(st["record_count"]) / max(counts)
+            cost /= max(0.25, coverage) ** 0.5
+        return cost
+
+    def ordered(self, urls: Iterable[str]) -> List[str]:
+        """按期望代价排序（稳定排序：代价相同保持原顺序）。"""
+        lst = list(urls)
+        return sorted(lst, key=self.cost)
+
+    def hedge_delay(self, url: str) -> float:
+        """对冲等待时间（秒）：该源的 p90 延迟，不低于下限；无样本时用默认值。"""
+        p90 = self.latency_percentile(url, 0.9)
+        min_ms = float(SOURCE_HEALTH_CONFIG.get("hedge_min_delay_ms", 300))
+        if p90 is None:
+            p90 = float(SOURCE_HEALTH_CONFIG.get("hedge_default_delay_ms", 2000))
+        return max(min_ms, p90) / 1000.0
+
+
+@dataclass
+class HostsDelta:
+    """两份快照之间的增量：新增 / 移除的 (ip, domain) 记录。"""
+
+    added: List[Tuple[str, str]]
+    removed: List[Tuple[str, str]]
+    # 上一份快照中完全没有出现过的 IP（需要重新测速）
+    new_ips: Set[str]
+    # 是否存在可对比的上一份快照（首次保存时为 False，此时所有 IP 都视为新 IP）
+    has_previous: bool = True
+
+    @property
+    def unchanged(self) -> bool:
+        return self.has_previous and not self.added and not self.removed
+
+
+class HostsSnapshotStore:
+    """远程 hosts 快照的版本化存储（gzip 压缩，按内容哈希去重）。
+
+    目录结构：
+    - index.json：快照索引 [{"sha", "file", "source", "count", "created_at", "last_seen"}, ...]（旧 -> 新）
+    - <sha 前 16 位>.json.gz：快照内容 {"sha", "source", "created_at", "records": [[ip, domain], ...]}
+    - probe_results.json：按 IP 保存的近期测速结果，用于未变化 IP 的结果复用
+    """
+
+    _INDEX = "index.json"
+    _RESULTS = "probe_results.json"
+
+    def __init__(
+        self,
+        *,
+        app_name: str = APP_NAME,
+        snapshot_dir: Optional[str] = None,
+        keep: Optional[int] = None,
+    ) -> None:
+        self.snapshot_dir = snapshot_dir or user_data_path(app_name, SNAPSHOT_CONFIG.get("dir_name", "snapshots"))
+        if keep is None:
+            keep = SNAPSHOT_CONFIG.get("keep", 20)
+        self.keep = max(1, int(keep))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(records: Iterable[Tuple[str, str]]) -> str:
+        """与顺序无关的内容哈希（域名不区分大小写）。"""
+        lines = sorted({f"{ip} {dom.lower()}" for ip, dom in records})
+        return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def diff(old: Iterable[Tuple[str, str]], new: Iterable[Tuple[str, str]]) -> HostsDelta:
+        old_keys = {(ip, dom.lower()): (ip, dom) for ip, dom in old}
+        new_keys = {(ip, dom.lower()): (ip, dom) for ip, dom in new}
+        old_ips = {ip for ip, _ in old_keys}
+        added = [rec for k, rec in new_keys.items() if k not in old_keys]
+        removed = [rec for k, rec in old_keys.items() if k not in new_keys]
+        new_ips = {ip for ip, _ in added if ip not in old_ips}
+        return HostsDelta(added=added, removed=removed, new_ips=new_ips)
+
+    def _index(self) -> List[Dict[str, Any]]:
+        data = safe_read_json(os.path.join(self.snapshot_dir, self._INDEX), [])
+        return [x for x in data if isinstance(x, dict) and x.get("sha") and x.get("file")] if isinstance(data, list) else []
+
+    def _load_file(self, name: str) -> Optional[List[Tuple[str, str]]]:
+        try:
+            with gzip.open(os.path.join(self.snapshot_dir, name), "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+            return RemoteHostsCache.records_of(data)
+        except Exception:
+            return None
+
+    def latest(self) -> Optional[Tuple[List[Tuple[str, str]], Dict[str, Any]]]:
+        """返回最新一份可读快照 (records, meta)，没有则返回 None。"""
+        for meta in reversed(self._index()):
+            records = self._load_file(meta["file"])
+            if records:
+                return records, meta
+        return None
+
+    def save(self, records: List[Tuple[str, str]], source: str) -> HostsDelta:
+        """保存快照并返回相对上一份快照的增量；内容未变化时只刷新 last_seen，不写新文件。"""
+        with self._lock:
+            sha = self.content_hash(records)
+            now = time.time()
+            index = self._index()
+            prev = self.latest()
+
+            if prev is not None and prev[1].get("sha") == sha:
+                for meta in index:
+                    if meta.get("sha") == sha:
+                        meta["last_seen"] = now
+                delta = HostsDelta(added=[], removed=[], new_ips=set())
+            else:
+                name = f"{sha[:16]}.json.gz"
+                payload = {"sha": sha, "source": source, "created_at": now, "records": [[ip, d] for ip, d in records]}
+                atomic_write_bytes(
+                    os.path.join(self.snapshot_dir, name),
+                    gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8")),
+                )
+                index = [m for m in index if m.get("sha") != sha]
+                index.append({
+                    "sha": sha, "file": name, "source": source, "count": len(records),
+                    "created_at": now, "last_seen": now,
+                })
+                if prev is None:
+                    delta = HostsDelta(added=list(records), removed=[], new_ips={ip for ip, _ in records}, has_previous=False)
+                else:
+                    delta = self.diff(prev[0], records)
+
+            # 淘汰最旧的快照（同一内容哈希只保留一份文件）
+            for meta in index[:-self.keep]:
+                try:
+                    os.remove(os.path.join(self.snapshot_dir, meta["file"]))
+                except OSError:
+                    pass
+            index = index[-self.keep:]
+            atomic_write_json(os.path.join(self.snapshot_dir, self._INDEX), index, indent=0)
+            return delta
+
+    def store_results(self, results: Dict[str, Tuple[int, str, Dict[str, Any]]], *, profile: str = "") -> None:
+        """保存测速结果 {ip: (ms, status, metadata)}；profile 区分测速方式（端口/高级指标等）。"""
+        if not results:
+            return
+        path = os.path.join(self.snapshot_dir, self._RESULTS)
+        with self._lock:
+            data = safe_read_json(path, {})
+            if not isinstance(data, dict):
+                data = {}
+            now = time.time()
+            for ip, (ms, status, metadata) in results.items():
+                data[ip] = {"ms": int(ms), "status": str(status), "metadata": metadata or {}, "profile": profile, "tested_at": now}
+            # 清理过旧的结果，避免文件无限增长
+            max_age = max(3600.0, float(SNAPSHOT_CONFIG.get("reuse_results_seconds", 1800)) * 4)
+            data = {ip: v for ip, v in data.items() if now - float(v.get("tested_at", 0)) <= max_age}
+            try:
+                atomic_write_json(path, json.loads(json.dumps(data, default=str)), indent=0)
+            except Exception as e:
+                get_logger().debug(f"保存测速结果失败：{e}")
+
+    def reusable_results(
+        self,
+        ips: Iterable[str],
+        *,
+        max_age: float,
+        profile: str = "",
+    ) -> Dict[str, Tuple[int, str, Dict[str, Any]]]:
+        """返回可复用的近期测速结果 {ip: (ms, status, metadata)}（年龄不超过 max_age 且测速方式一致）。"""
+        if max_age <= 0:
+            return {}
+        data = safe_read_json(os.path.join(self.snapshot_dir, self._RESULTS), {})
+        if not isinstance(data, dict):
+            return {}
+        now = time.time()
+        out: Dict[str, Tuple[int, str, Dict[str, Any]]] = {}
+        for ip in ips:
+            v = data.get(ip)
+            if not isinstance(v, dict) or v.get("profile", "") != profile:
+                continue
+            if now - float(v.get("tested_at", 0)) > max_age:
+                continue
+            out[ip] = (int(v.get("ms", 9999)), str(v.get("status", "")), dict(v.get("metadata") or {}))
+        return out
+
+
+class HostsSourceProvider:
+    """hosts 源提供者（插件接口）。
+
+    每个源由一个字符串标识（URL / 路径 / dns://...），RemoteHostsClient 按标识选择提供者。
+    子类声明：
+    - kind: 源类型
+    - cacheable: 是否使用 RemoteHostsCache（条件请求、新鲜期、失败兜底）
+    - streamable: 是否支持边下载边解析（否则流式获取时一次性产出全部记录）
+    - cost_hint: 相对获取代价（普通远程 hosts 为 1.0），参与自动模式的源排序
+    并实现 parse()（原始内容 -> 记录）与 fetch_async() / fetch()（返回未按 IP 版本过滤的记录）。
+    """
+
+    kind = "base"
+    cacheable = False
+    streamable = False
+    cost_hint = 1.0
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+
+    def parse(self, data: bytes) -> List[Tuple[str, str]]:
+        return get_default_hosts_parser().parse_bytes(data)
+
+    async def fetch_async(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.fetch, client)
+
+    def fetch(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.source!r})"
+
+
+class HttpHostsProvider(HostsSourceProvider):
+    """HTTP(S) 纯文本 hosts 文件。"""
+
+    kind = "hosts"
+    cacheable = True
+    streamable = True
+    cost_hint = 1.0
+
+    async def fetch_async(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        return await client._fetch_http_records_async(self.source, self.parse)
+
+    def fetch(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        return client._fetch_http_records_sync(self.source, self.parse)
+
+
+class JsonHostsProvider(HttpHostsProvider):
+    """HTTP(S) JSON hosts（如 GitHub520 的 hosts.json）。
+
+    支持的格式：[[ip, domain], ...]、[{"ip": ..., "host"/"domain": ...}, ...]、{domain: ip 或 [ip, ...]}。
+    记录经过与纯文本相同的 IP 校验与域名过滤。
+    """
+
+    kind = "json"
+    streamable = False
+
+    @staticmethod
+    def _pairs(obj: Any) -> Iterable[Tuple[Any, Any]]:
+        if isinstance(obj, dict):
+            for host, ips in obj.items():
+                for ip in ips if isinstance(ips, list) else [ips]:
+                    yield ip, host
+            return
+        for item in obj if isinstance(obj, list) else []:
+            if isinstance(item, (list, tuple)) and len(item) >= 2:
+                yield item[0], item[1]
+            elif isinstance(item, dict):
+                yield item.get("ip"), item.get("host") or item.get("domain") or item.get("name")
+
+    @classmethod
+    def parse_json(cls, data: bytes) -> List[Tuple[str, str]]:
+        try:
+            obj = json.loads(data.decode("utf-8-sig", errors="ignore"))
+        except ValueError:
+            return []
+        lines = [f"{ip} {host}".encode("utf-8", errors="ignore") for ip, host in cls._pairs(obj) if ip and host]
+        out: List[Tuple[str, str]] = []
+        get_default_hosts_parser().parse_lines(lines, set(), out)
+        return out
+
+    def parse(self, data: bytes) -> List[Tuple[str, str]]:
+        return self.parse_json(data)
+
+
+class LocalHostsProvider(HostsSourceProvider):
+    """本地 hosts 文件或目录（目录下所有非隐藏文件，*.json 按 JSON 解析）。
+
+    按文件的 (路径, 大小, 修改时间) 记忆化：内容未变化时不重复读取与解析。
+    """
+
+    kind = "local"
+    cost_hint = 0.05
+
+    def __init__(self, source: str) -> None:
+        super().__init__(source)
+        path = source[len("file://"):] if source.startswith("file://") else source
+        self.path = os.path.expanduser(urllib.parse.unquote(path))
+        self._memo: Optional[Tuple[Tuple[Any, ...], List[Tuple[str, str]]]] = None
+
+    def _files(self) -> List[str]:
+        if os.path.isdir(self.path):
+            names = sorted(n for n in os.listdir(self.path) if not n.startswith("."))
+            return [os.path.join(self.path, n) for n in names if os.path.isfile(os.path.join(self.path, n))]
+        return [self.path]
+
+    def fetch(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        files = self._files()
+        signature = tuple((f, os.path.getsize(f), os.path.getmtime(f)) for f in files)
+        if self._memo is not None and self._memo[0] == signature:
+            return list(self._memo[1])
+
+        seen: Set[Tuple[str, str]] = set()
+        out: List[Tuple[str, str]] = []
+        for f in files:
+            with open(f, "rb") as fp:
+                data = fp.read()
+            parse = JsonHostsProvider.parse_json if f.lower().endswith(".json") else get_default_hosts_parser().parse_bytes
+            for ip, dom in parse(data):
+                key = (ip, dom.lower())
+                if key not in seen:
+                    seen.add(key)
+                    out.append((ip, dom))
+        self._memo = (signature, out)
+        return list(out)
+
+
+class DnsHostsProvider(HostsSourceProvider):
+    """由 DNS 解析计算出的源：dns://github.com,api.github.com（不写域名则使用解析引擎的目标后缀）。
+
+    每个提供者复用同一个 DomainResolver（缺省时首次获取才创建，使用共享 DnsCache），
+    每次获取结束后 aclose() 释放 UDP 端点，下次获取时按需重建。
+    """
+
+    kind = "dns"
+    cost_hint = 2.0
+
+    def __init__(self, source: str, *, resolver: Optional["DomainResolver"] = None) -> None:
+        super().__init__(source)
+        spec = source[len("dns://"):] if source.startswith("dns://") else source
+        self.domains = [d.strip() for d in spec.split(",") if d.strip()] or [
+            d for d in HOSTS_PARSER_CONFIG.get("target_suffixes", []) if "." in d
+        ]
+        self._resolver = resolver
+
+    @property
+    def resolver(self) -> "DomainResolver":
+        if self._resolver is None:
+            self._resolver = DomainResolver()
+        return self._resolver
+
+    async def fetch_async(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        resolver = self.resolver
+        try:
+            return await resolver.resolve_async(self.domains)
+        finally:
+            await resolver.aclose()
+
+    def fetch(self, client: "RemoteHostsClient") -> List[Tuple[str, str]]:
+        # 同步 resolve 在自己的事件循环里运行，结束时已 aclose
+        return self.resolver.resolve(self.domains)
+
+
+# 源标识前缀 -> 提供者类型（按注册顺序匹配；都不匹配时按 HTTP 纯文本 hosts 处理）
+_HOSTS_PROVIDER_PREFIXES: List[Tuple[str, type]] = [
+    ("dns://", DnsHostsProvider),
+    ("file://", LocalHostsProvider),
+]
+
+
+def register_hosts_provider(prefix: str, provider_cls: type) -> None:
+    """注册自定义提供者：以 prefix 开头的源标识交给 provider_cls 处理（后注册的优先）。"""
+    _HOSTS_PROVIDER_PREFIXES.insert(0, (prefix, provider_cls))
+
+
+def make_hosts_provider(source: str) -> HostsSourceProvider:
+    """根据源标识创建提供者。"""
+    for prefix, cls in _HOSTS_PROVIDER_PREFIXES:
+        if source.startswith(prefix):
+            return cls(source)
+    if "://" not in source and os.path.exists(os.path.expanduser(source)):
+        return LocalHostsProvider(source)
+    if urllib.parse.urlsplit(source).path.lower().endswith(".json"):
+        return JsonHostsProvider(source)
+    return HttpHostsProvider(source)
+
+
+class _SourceRace:
+    """多源竞速的调度与诊断（与传输方式无关，同步线程版与 asyncio 版共用）。
+
+    每个源有一个计划启动偏移（秒）：0 表示立即启动，None 表示仅在前面的源失败时才启动。
+    某个源失败或返回空记录时，下一个尚未启动的源被提前到“现在”启动。
+    第一个返回非空记录的源胜出；总截止时间到达则结束。
+    """
+
+    def __init__(self, urls: List[str], offsets: List[Optional[float]], deadline: Optional[float]) -> None:
+        self.urls = list(urls)
+        self.t0 = time.monotonic()
+        self.deadline_at = self.t0 + deadline if deadline is not None else None
+        self._start_at: Dict[str, Optional[float]] = {
+            url: (self.t0 + off if off is not None else None) for url, off in zip(self.urls, offsets)
+        }
+        self._started_at: Dict[str, float] = {}
+        self.diagnostics: Dict[str, Dict[str, Any]] = {url: {"status": "not_started"} for url in self.urls}
+
+    def expired(self) -> bool:
+        return self.deadline_at is not None and time.monotonic() >= self.deadline_at
+
+    def due(self) -> List[str]:
+        """返回到期应启动的源，并标记为已启动。"""
+        now = time.monotonic()
+        out = []
+        for url in self.urls:
+            at = self._start_at.get(url)
+            if url not in self._started_at and at is not None and at <= now:
+                self._started_at[url] = now
+                self.diagnostics[url] = {"status": "running", "start_ms": round((now - self.t0) * 1000.0, 1)}
+                out.append(url)
+        return out
+
+    def pending_starts(self) -> bool:
+        return any(url not in self._started_at and self._start_at.get(url) is not None for url in self.urls)
+
+    def wait_timeout(self) -> Optional[float]:
+        """距离下一次计划启动或截止时间的秒数（都没有则为 None）。"""
+        now = time.monotonic()
+        points = [at for url, at in self._start_at.items() if at is not None and url not in self._started_at]
+        if self.deadline_at is not None:
+            points.append(self.deadline_at)
+        return max(0.0, min(points) - now) if points else None
+
+    def on_done(
+        self,
+        url: str,
+        records: Optional[List[Tuple[str, str]]] = None,
+        error: Optional[BaseException] = None,
+    ) -> bool:
+        """登记一个源的结果；返回该结果是否胜出（非空记录）。"""
+        now = time.monotonic()
+        diag = self.diagnostics[url]
+        diag["elapsed_ms"] = round((now - self._started_at.get(url, now)) * 1000.0, 1)
+        if error is not None:
+            diag["status"] = "error"
+            diag["error"] = str(error)
+        else:
+            diag["records"] = len(records or [])
+            diag["status"] = "ok" if records else "empty"
+        if diag["status"] == "ok":
+            return True
+        for nxt in self.urls:
+            if nxt not in self._started_at:
+                at = self._start_at.get(nxt)
+                if at is None or at > now:
+                    self._start_at[nxt] = now
+                break
+        return False
+
+    def finish(self) -> Dict[str, Dict[str, Any]]:
+        """结束竞速：仍在运行的源标记为 timeout（截止）或 cancelled（已有胜者）。"""
+        expired = self.expired()
+        for diag in self.diagnostics.values():
+            if diag["status"] == "running":
+                diag["status"] = "timeout" if expired else "cancelled"
+        return self.diagnostics
+
+    def summary(self) -> str:
+        parts = []
+        for url, d in self.diagnostics.items():
+            desc = d["status"]
+            if d.get("error"):
+                desc += f"（{d['error']}）"
+            parts.append(f"{url}: {desc}")
+        return "；".join(parts)
+
+
+# 异步竞速中当前任务的缓存命中情况（[status]），不在竞速中时为 None
+_async_cache_status: "contextvars.ContextVar[Optional[List[Optional[str]]]]" = contextvars.ContextVar(
+    "_async_cache_status", default=None
+)
+
+
 class RemoteHostsClient:
-    """获取远程 hosts 并解析出 GitHub 相关域名的 (ip, domain) 列表。"""
+    """获取远程 hosts 并解析出 GitHub 相关域名的 (ip, domain) 列表。
+
+    urls 中的每一项可以是源标识字符串（HTTP(S) hosts / *.json / 本地路径或 file:// / dns://），
+    也可以是 HostsSourceProvider 实例；字符串按 make_hosts_provider() 选择提供者。
+    """
 
     def __init__(
         self,
         *,
-        urls: Optional[List[str]] = None,
+        urls: Optional[List[Union[str, HostsSourceProvider]]] = None,
         timeout: Tuple[int, int] = REMOTE_FETCH_TIMEOUT,
         app_name: str = APP_NAME,
         session: Optional[requests.Session] = None,
+        cache: Optional[RemoteHostsCache] = None,
+        http_client: Optional[AsyncHTTPClient] = None,
+        health: Optional[SourceHealthStore] = None,
+        snapshots: Optional[HostsSnapshotStore] = None,
     ) -> None:
-        self.urls = urls or list(REMOTE_HOSTS_URLS)
+        self._providers: Dict[str, HostsSourceProvider] = {}
+        self.urls: List[str] = []
+        for src in urls or list(REMOTE_HOSTS_URLS):
+            if isinstance(src, HostsSourceProvider):
+                self._providers[src.source] = src
+                src = src.source
+            self.urls.append(src)
         self.timeout = timeout
         self.session = session or self._build_http_session(app_name)
+        if http_client is None:
+            connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            http_client = AsyncHTTPClient(
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                user_agent=f"{app_name}/1.0",
+            )
+        self.http = http_client
+        if health is None and SOURCE_HEALTH_CONFIG.get("enabled", True):
+            health = SourceHealthStore(app_name=app_name)
+        self.health = health
+        if cache is None and REMOTE_CACHE_CONFIG.get("enabled", True):
+            cache = RemoteHostsCache(app_name=app_name)
+        self.cache = cache
+        if snapshots is None and SNAPSHOT_CONFIG.get("enabled", True):
+            snapshots = HostsSnapshotStore(app_name=app_name)
+        self.snapshots = snapshots
+        # 最近一次获取的缓存命中情况：None / "fresh" / "not_modified" / "stale" / "snapshot"
+        self.last_cache_status: Optional[str] = None
+        # 最近一次成功获取相对上一份快照的增量（未启用快照或兜底结果时为 None）
+        self.last_delta: Optional[HostsDelta] = None
+        # 最近一次流式获取实际使用的源
+        self.last_stream_url: Optional[str] = None
+        # 最近一次竞速获取的各源诊断：{url: {"status", "elapsed_ms", "records", "error", ...}}
+        self.last_fetch_diagnostics: Dict[str, Dict[str, Any]] = {}
+        # 同步竞速的工作线程上下文：cancel（胜者产生后置位）、cache_status（该请求自己的缓存命中情况）
+        self._fetch_ctx = threading.local()
+        # 落败请求的“检查取消 + 写共享状态”与竞速结束时的取消互斥，取消之后不会再有迟到的写入
+        self._race_lock = threading.Lock()
 
     @staticmethod
     def _build_retry() -> Retry:
@@ -113,61 +1675,21 @@ class RemoteHostsClient:
         规则与原版一致：
         - 按行解析，支持一行多个域名
         - 严格校验 IP 地址（支持 IPv4 和 IPv6），避免误解析 HTML/杂内容
-        - 仅保留 host 中包含 "github" 的记录
+        - 仅保留目标域名（HOSTS_PARSER_CONFIG：后缀树 + 关键字，默认等价于包含 "github"）
         """
-        out: List[Tuple[str, str]] = []
-        seen: Set[Tuple[str, str]] = set()
+        return get_default_hosts_parser().parse_text(txt, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
 
-        for raw in (txt or "").splitlines():
-            line = (raw or "").strip()
-            if not line or line.startswith("#"):
-                continue
+    def provider_for(self, url: str) -> HostsSourceProvider:
+        provider = self._providers.get(url)
+        if provider is None:
+            provider = self._providers[url] = make_hosts_provider(url)
+        return provider
 
-            # 去掉行内注释
-            if "#" in line:
-                line = line.split("#", 1)[0].strip()
-            if not line:
-                continue
-
-            parts = line.split()
-            if len(parts) < 2:
-                continue
-
-            ip_str = parts[0].strip()
-            try:
-                ip_obj = ipaddress.ip_address(ip_str)
-
-                # 根据 IP 版本过滤
-                if ipv4_only and ip_obj.version != 4:
-                    continue
-                if ipv6_only and ip_obj.version != 6:
-                    continue
-
-            except Exception:
-                # 不是有效的 IP 地址，跳过
-                continue
-
-            for host in parts[1:]:
-                host = host.strip()
-                if not host:
-                    continue
-
-                # hostname 基本校验
-                if not re.fullmatch(r"[A-Za-z0-9.-]+", host):
-                    continue
-                if "." not in host:
-                    continue
-
-                if "github" not in host.lower():
-                    continue
-
-                key = (ip_str, host.lower())
-                if key in seen:
-                    continue
-                seen.add(key)
-                out.append((ip_str, host))
-
-        return out
+    def ordered_urls(self) -> List[str]:
+        """自动模式下的源顺序：按“健康度评分 × 提供者代价”排序（未启用健康度时只看代价，同代价保持配置顺序）。"""
+        if self.health is None:
+            return sorted(self.urls, key=lambda u: self.provider_for(u).cost_hint)
+        return sorted(self.urls, key=lambda u: self.health.cost(u) * self.provider_for(u).cost_hint)
 
     def fetch_github_hosts(
         self,
@@ -181,33 +1703,315 @@ class RemoteHostsClient:
         返回：(records, used_url)
         - records: [(ip, domain), ...]
         - used_url: 最终成功的 URL
+
+        启用缓存时：新鲜期内直接返回缓存；否则发条件请求，304 复用已解析记录；
+        所有源失败时在允许的年龄内兜底返回缓存。
+        自动模式按源健康度排序，并在当前源超过其 p90 延迟时对冲启动下一个源。
         """
-        urls = [url_override] if url_override else list(self.urls)
-        last_err: Optional[Exception] = None
+        urls = [url_override] if url_override else self.ordered_urls()
+        self.last_cache_status = None
+        self.last_delta = None
 
+        try:
+            result, race = self._race_fetch_sync(urls, self._hedge_offsets(urls), ipv4_only, ipv6_only)
+        finally:
+            self._save_health()
+        if result:
+            self._record_snapshot(*result)
+            return result
+
+        stale = self._stale_fallback(urls, ipv4_only, ipv6_only)
+        if stale:
+            return stale
+
+        raise RuntimeError(f"所有远程 hosts 源均获取失败：{race.summary()}")
+
+    def _hedge_offsets(self, urls: List[str]) -> List[Optional[float]]:
+        """各源的计划启动偏移：启用对冲时为前序源 p90 延迟的累加，否则仅在前一个源失败后启动。"""
+        if self.health is None or not SOURCE_HEALTH_CONFIG.get("hedge", True):
+            return [0.0] + [None] * (len(urls) - 1)
+        offsets: List[Optional[float]] = []
+        acc = 0.0
         for url in urls:
+            offsets.append(acc)
+            acc += self.health.hedge_delay(url)
+        return offsets
+
+    def _race_fetch_sync(
+        self,
+        urls: List[str],
+        offsets: List[Optional[float]],
+        ipv4_only: bool,
+        ipv6_only: bool,
+        deadline: Optional[float] = None,
+    ) -> Tuple[Optional[Tuple[List[Tuple[str, str]], str]], _SourceRace]:
+        """同步竞速（线程）：返回 (胜出结果或 None, 竞速诊断)。
+
+        落败的请求在后台自然结束，不阻塞返回；竞速结束后它们不再写共享状态（见 _race_write），
+        last_cache_status 只取胜出请求的缓存命中情况。
+        """
+        if deadline is None:
+            deadline = float(REMOTE_RACE_CONFIG.get("deadline_seconds", 20.0))
+        race = _SourceRace(urls, offsets, deadline)
+        ex = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(urls)))
+        running: Dict[concurrent.futures.Future, str] = {}
+        cancel = threading.Event()
+
+        def fetch(url: str) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+            self._fetch_ctx.cancel = cancel
+            self._fetch_ctx.cache_status = None
             try:
-                r = self.session.get(url, timeout=self.timeout)
-                r.raise_for_status()
-                txt = r.text or ""
-
-                # 尽量避免把 HTML 当成 hosts
-                ctype = (r.headers.get("content-type") or "").lower()
-                head = txt[:500].lower()
-                if "text/html" in ctype and ("<html" in head or "<!doctype" in head):
-                    continue
+                return self._fetch_one_sync(url, ipv4_only, ipv6_only), self._fetch_ctx.cache_status
+            finally:
+                self._fetch_ctx.cancel = None
 
-                parsed = self.parse_github_hosts_text(txt, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
-                if parsed:
-                    return parsed, url
-            except (requests.RequestException, socket.timeout, OSError) as e:
-                last_err = e
-                continue
-            except Exception as e:
-                last_err = e
-                continue
+        try:
+            while not race.expired():
+                for url in race.due():
+                    running[ex.submit(fetch, url)] = url
+                if not running and not race.pending_starts():
+                    break
+                timeout = race.wait_timeout()
+                if running:
+                    done, _ = concurrent.futures.wait(
+                        running.keys(), timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                else:
+                    time.sleep(timeout or 0.0)
+                    done = set()
+                for fut in done:
+                    url = running.pop(fut)
+                    try:
+                        records, cache_status = fut.result()
+                    except Exception as e:
+                        race.on_done(url, error=e)
+                        continue
+                    if race.on_done(url, records):
+                        self.last_cache_status = cache_status
+                        return (records, url), race
+            return None, race
+        finally:
+            # 落败的请求在后台自然结束，但此后不再写健康度 / 缓存 / last_cache_status
+            with self._race_lock:
+                cancel.set()
+            ex.shutdown(wait=False)
+            self.last_fetch_diagnostics = race.finish()
 
-        raise RuntimeError(f"所有远程 hosts 源均获取失败：{last_err}" if last_err else "所有远程 hosts 源均获取失败")
+    async def _race_fetch_async(
+        self,
+        urls: List[str],
+        offsets: List[Optional[float]],
+        ipv4_only: bool,
+        ipv6_only: bool,
+        deadline: Optional[float] = None,
+    ) -> Tuple[Optional[Tuple[List[Tuple[str, str]], str]], _SourceRace]:
+        """异步竞速：返回 (胜出结果或 None, 竞速诊断)；结束时取消所有未完成的请求。
+
+        每个请求在自己的任务上下文里记录缓存命中情况，last_cache_status 只取胜出请求的。
+        """
+        race = _SourceRace(urls, offsets, deadline)
+        running: Dict[asyncio.Task, str] = {}
+
+        async def fetch(url: str) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+            # 任务创建时复制了上下文，这里的 set 只对本任务可见
+            holder: List[Optional[str]] = [None]
+            _async_cache_status.set(holder)
+            records = await self._fetch_records_async(url, ipv4_only, ipv6_only)
+            return records, holder[0]
+
+        try:
+            while not race.expired():
+                for url in race.due():
+                    task = asyncio.create_task(fetch(url), name=f"fetch_{url}")
+                    running[task] = url
+                if not running and not race.pending_starts():
+                    break
+                timeout = race.wait_timeout()
+                if running:
+                    done, _ = await asyncio.wait(running.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(timeout or 0.0)
+                    done = set()
+                for task in done:
+                    url = running.pop(task)
+                    try:
+                        records, cache_status = task.result()
+                    except Exception as e:
+                        race.on_done(url, error=e)
+                        continue
+                    if race.on_done(url, records):
+                        self.last_cache_status = cache_status
+                        return (records, url), race
+            return None, race
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running.keys(), return_exceptions=True)
+            self.last_fetch_diagnostics = race.finish()
+
+    def _fetch_one_sync(
+        self,
+        url: str,
+        ipv4_only: bool,
+        ipv6_only: bool,
+    ) -> List[Tuple[str, str]]:
+        """同步获取单个源（交给对应的提供者）；无有效记录返回空列表，获取失败抛出异常。"""
+        provider = self.provider_for(url)
+        if provider.cacheable:
+            records = provider.fetch(self)
+        else:
+            t0 = time.perf_counter()
+            try:
+                records = provider.fetch(self)
+            except Exception:
+                self._record_health(url, False)
+                raise
+            self._record_health(url, bool(records), (time.perf_counter() - t0) * 1000.0, len(records))
+        return _filter_records_by_family(records, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+
+    def _fetch_http_records_sync(
+        self,
+        url: str,
+        parse: Callable[[bytes], List[Tuple[str, str]]],
+    ) -> List[Tuple[str, str]]:
+        """HTTP(S) 源的同步获取（条件请求缓存 + 健康度记录），返回未按 IP 版本过滤的记录。"""
+        entry = self.cache.get(url) if self.cache else None
+        if self.cache and self.cache.is_fresh(entry):
+            records = self.cache.records_of(entry)
+            if records:
+                self._set_cache_status("fresh")
+                return records
+
+        t0 = time.perf_counter()
+        try:
+            headers = RemoteHostsCache.conditional_headers(entry)
+            r = self.session.get(url, timeout=self.timeout, headers=headers or None)
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+            if r.status_code == 304 and entry:
+                self._race_write(self.cache.touch, url, entry)
+                records = self.cache.records_of(entry)
+                self._record_health(url, True, elapsed_ms, len(records), entry.get("last_modified"))
+                if records:
+                    self._set_cache_status("not_modified")
+                return records
+
+            r.raise_for_status()
+            data = r.content or b""
+
+            # 尽量避免把 HTML 当成 hosts
+            ctype = (r.headers.get("content-type") or "").lower()
+            head = data[:500].lower()
+            if "text/html" in ctype and (b"<html" in head or b"<!doctype" in head):
+                self._record_health(url, False)
+                return []
+
+            parsed = self._parse_and_cache(url, data, r.headers.get("ETag"), r.headers.get("Last-Modified"), parse)
+            self._record_health(url, bool(parsed), elapsed_ms, len(parsed), r.headers.get("Last-Modified"))
+            return parsed
+        except (requests.RequestException, socket.timeout, OSError):
+            self._record_health(url, False)
+            raise
+
+    def _record_health(
+        self,
+        url: str,
+        ok: bool,
+        latency_ms: Optional[float] = None,
+        record_count: Optional[int] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        if self.health is not None:
+            self._race_write(
+                self.health.record, url, ok=ok, latency_ms=latency_ms, record_count=record_count, last_modified=last_modified
+            )
+
+    def _race_write(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        """写一次共享状态（健康度 / 缓存）；当前线程是同步竞速中已落败的请求时跳过。返回是否写入。"""
+        with self._race_lock:
+            cancel = getattr(self._fetch_ctx, "cancel", None)
+            if cancel is not None and cancel.is_set():
+                return False
+            fn(*args, **kwargs)
+            return True
+
+    def _set_cache_status(self, status: str) -> None:
+        """竞速中的请求只记在线程 / 任务上下文，由竞速在选出胜者后写入 last_cache_status。"""
+        holder = _async_cache_status.get()
+        if getattr(self._fetch_ctx, "cancel", None) is not None:
+            self._fetch_ctx.cache_status = status
+        elif holder is not None:
+            holder[0] = status
+        else:
+            self.last_cache_status = status
+
+    def _save_health(self) -> None:
+        if self.health is not None:
+            self.health.save()
+
+    def _parse_and_cache(
+        self,
+        url: str,
+        data: bytes,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        parse: Optional[Callable[[bytes], List[Tuple[str, str]]]] = None,
+    ) -> List[Tuple[str, str]]:
+        """解析完整响应内容（不过滤 IP 版本）并写入缓存。"""
+        parsed = (parse or get_default_hosts_parser().parse_bytes)(data)
+        if parsed and self.cache:
+            self._race_write(self.cache.store, url, parsed, etag=etag, last_modified=last_modified)
+        return parsed
+
+    def _stale_fallback(
+        self,
+        urls: List[str],
+        ipv4_only: bool,
+        ipv6_only: bool,
+    ) -> Optional[Tuple[List[Tuple[str, str]], str]]:
+        """所有源都失败时，返回允许年龄内最新的缓存结果；没有缓存时用最新快照离线兜底。"""
+        hit = self.cache.freshest(urls) if self.cache else None
+        if not hit:
+            return self._snapshot_fallback(ipv4_only, ipv6_only)
+        entry, url = hit
+        parsed = _filter_records_by_family(self.cache.records_of(entry), ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+        if not parsed:
+            return None
+        self.last_cache_status = "stale"
+        get_logger().warning(f"所有远程 hosts 源均不可达，使用缓存结果：{url}（{int(self.cache.age_of(entry))} 秒前）")
+        return parsed, url
+
+    def _snapshot_fallback(self, ipv4_only: bool, ipv6_only: bool) -> Optional[Tuple[List[Tuple[str, str]], str]]:
+        if not self.snapshots:
+            return None
+        latest = self.snapshots.latest()
+        if not latest:
+            return None
+        records, meta = latest
+        parsed = _filter_records_by_family(records, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+        if not parsed:
+            return None
+        self.last_cache_status = "snapshot"
+        source = str(meta.get("source") or "snapshot")
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(float(meta.get("created_at", 0))))
+        get_logger().warning(f"所有远程 hosts 源均不可达，使用离线快照：{source}（{created}）")
+        return parsed, source
+
+    def _record_snapshot(self, records: List[Tuple[str, str]], source: str) -> None:
+        """成功获取后保存快照并记录增量（兜底结果不保存）。"""
+        if not self.snapshots or not records or self.last_cache_status in ("stale", "snapshot"):
+            return
+        try:
+            delta = self.snapshots.save(records, source)
+        except Exception as e:
+            get_logger().debug(f"保存 hosts 快照失败：{e}")
+            return
+        self.last_delta = delta
+        if delta.has_previous:
+            get_logger().info(
+                f"hosts 快照：新增 {len(delta.added)} 条、移除 {len(delta.removed)} 条，新 IP {len(delta.new_ips)} 个"
+            )
 
     async def fetch_github_hosts_async(
         self,
@@ -227,12 +2031,162 @@ class RemoteHostsClient:
 
         返回：(records, used_url)
         """
-        if url_override:
-            return await self._fetch_single_url_async(url_override, ipv4_only, ipv6_only)
-        elif concurrent:
-            return await self._fetch_concurrent_async(ipv4_only, ipv6_only)
+        self.last_cache_status = None
+        self.last_delta = None
+        urls = [url_override] if url_override else self.ordered_urls()
+        try:
+            if url_override:
+                result = await self._fetch_single_url_async(url_override, ipv4_only, ipv6_only)
+            elif concurrent:
+                result = await self._fetch_concurrent_async(ipv4_only, ipv6_only)
+            else:
+                result = await self._fetch_sequential_async(ipv4_only, ipv6_only)
+            self._record_snapshot(*result)
+            return result
+        except Exception:
+            stale = self._stale_fallback(urls, ipv4_only, ipv6_only)
+            if stale:
+                return stale
+            raise
+        finally:
+            self._save_health()
+
+    async def fetch_github_hosts_merged_async(
+        self,
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+        deadline: Optional[float] = None,
+    ) -> Tuple[List[Tuple[str, str]], Dict[Tuple[str, str], List[str]]]:
+        """合并模式：在截止时间内并发获取全部源，合并去重。
+
+        返回：(records, provenance)
+        - records: [(ip, domain), ...]，按收录该记录的源数量降序（共识优先），同数量保持首次出现顺序
+        - provenance: {(ip, domain): [url, ...]}，记录每条记录由哪些源提供
+
+        截止时间到达时仍未返回的源被取消；一个源都没有成功时按缓存兜底，仍无结果则抛出 RuntimeError。
+        """
+        urls = list(self.urls)
+        if not urls:
+            raise RuntimeError("没有可用的 hosts 源")
+        if deadline is None:
+            deadline = float(REMOTE_MERGE_CONFIG.get("deadline_seconds", 8.0))
+        self.last_cache_status = None
+        self.last_delta = None
+
+        tasks = {
+            asyncio.create_task(self._fetch_records_async(url, ipv4_only, ipv6_only), name=f"merge_{url}"): url
+            for url in urls
+        }
+        done, pending = await asyncio.wait(tasks.keys(), timeout=deadline)
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._save_health()
+
+        # 按源的优先级顺序合并，保证结果稳定
+        provenance: Dict[Tuple[str, str], List[str]] = {}
+        order: List[Tuple[str, str]] = []
+        canonical: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        errors: List[str] = []
+        for task, url in tasks.items():
+            if task not in done:
+                errors.append(f"{url}: 超时")
+                continue
+            try:
+                records = task.result()
+            except Exception as e:
+                errors.append(f"{url}: {e}")
+                continue
+            for ip, dom in records:
+                key = (ip, dom.lower())
+                rec = canonical.get(key)
+                if rec is None:
+                    rec = canonical[key] = (ip, dom)
+                    order.append(rec)
+                    provenance[rec] = []
+                if url not in provenance[rec]:
+                    provenance[rec].append(url)
+
+        if not order:
+            stale = self._stale_fallback(urls, ipv4_only, ipv6_only)
+            if stale:
+                return stale[0], {rec: [stale[1]] for rec in stale[0]}
+            raise RuntimeError("所有远程 hosts 源均获取失败：" + "；".join(errors[:3]))
+
+        get_logger().info(
+            f"合并模式：{len(urls) - len(errors)}/{len(urls)} 个源成功，合并得到 {len(order)} 条记录"
+        )
+        order.sort(key=lambda rec: -len(provenance[rec]))
+        self._record_snapshot(order, REMOTE_HOSTS_MERGE_ALL)
+        return order, provenance
+
+    @staticmethod
+    def consensus_by_ip(provenance: Dict[Tuple[str, str], List[str]]) -> Dict[str, int]:
+        """统计每个 IP 被多少个不同的源收录（任一域名下出现即计入）。"""
+        sources: Dict[str, Set[str]] = {}
+        for (ip, _), urls in provenance.items():
+            sources.setdefault(ip, set()).update(urls)
+        return {ip: len(v) for ip, v in sources.items()}
+
+    async def _fetch_records_async(
+        self,
+        url: str,
+        ipv4_only: bool,
+        ipv6_only: bool,
+    ) -> List[Tuple[str, str]]:
+        """异步获取单个源（交给对应的提供者）并按 IP 版本过滤。"""
+        provider = self.provider_for(url)
+        if provider.cacheable:
+            records = await provider.fetch_async(self)
         else:
-            return await self._fetch_sequential_async(ipv4_only, ipv6_only)
+            t0 = time.perf_counter()
+            try:
+                records = await provider.fetch_async(self)
+            except Exception:
+                self._record_health(url, False)
+                raise
+            self._record_health(url, bool(records), (time.perf_counter() - t0) * 1000.0, len(records))
+        return _filter_records_by_family(records, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+
+    async def _fetch_http_records_async(
+        self,
+        url: str,
+        parse: Callable[[bytes], List[Tuple[str, str]]],
+    ) -> List[Tuple[str, str]]:
+        """HTTP(S) 源的异步获取（条件请求缓存 + 健康度记录），返回未按 IP 版本过滤的记录。"""
+        entry = self.cache.get(url) if self.cache else None
+        if self.cache and self.cache.is_fresh(entry):
+            records = self.cache.records_of(entry)
+            if records:
+                self._set_cache_status("fresh")
+                return records
+
+        t0 = time.perf_counter()
+        try:
+            status, headers, data = await self._fetch_url_response_async(
+                url, extra_headers=RemoteHostsCache.conditional_headers(entry)
+            )
+        except Exception:
+            self._record_health(url, False)
+            raise
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+        if status == 304 and entry:
+            self.cache.touch(url, entry)
+            records = self.cache.records_of(entry)
+            self._record_health(url, True, elapsed_ms, len(records), entry.get("last_modified"))
+            if records:
+                self._set_cache_status("not_modified")
+            return records
+        if status >= 400:
+            self._record_health(url, False)
+            raise RuntimeError(f"URL {url} 返回 HTTP {status}")
+
+        parsed = self._parse_and_cache(url, data, headers.get("etag"), headers.get("last-modified"), parse)
+        self._record_health(url, bool(parsed), elapsed_ms, len(parsed), headers.get("last-modified"))
+        return parsed
 
     async def _fetch_single_url_async(
         self,
@@ -242,163 +2196,832 @@ class RemoteHostsClient:
     ) -> Tuple[List[Tuple[str, str]], str]:
         """异步获取单个 URL 的 hosts 内容。"""
         try:
-            parsed = self.parse_github_hosts_text(
-                await self._fetch_url_content_async(url),
-                ipv4_only=ipv4_only,
-                ipv6_only=ipv6_only
-            )
+            parsed = await self._fetch_records_async(url, ipv4_only, ipv6_only)
             if parsed:
                 return parsed, url
             raise RuntimeError(f"URL {url} 返回的 hosts 内容为空或无效")
         except Exception as e:
             raise RuntimeError(f"从 {url} 获取 hosts 失败：{e}")
 
-    async def _fetch_sequential_async(
-        self,
-        ipv4_only: bool,
-        ipv6_only: bool,
-    ) -> Tuple[List[Tuple[str, str]], str]:
-        """顺序获取多个 URL 的 hosts 内容。"""
-        urls = list(self.urls)
+    async def _fetch_sequential_async(
+        self,
+        ipv4_only: bool,
+        ipv6_only: bool,
+    ) -> Tuple[List[Tuple[str, str]], str]:
+        """顺序获取多个 URL 的 hosts 内容（按源健康度排序，前一个源失败才尝试下一个）。"""
+        urls = self.ordered_urls()
+        result, race = await self._race_fetch_async(urls, [0.0] + [None] * (len(urls) - 1), ipv4_only, ipv6_only)
+        if result:
+            return result
+        raise RuntimeError(f"所有远程 hosts 源均获取失败：{race.summary()}")
+
+    async def _fetch_concurrent_async(
+        self,
+        ipv4_only: bool,
+        ipv6_only: bool,
+        *,
+        deadline: Optional[float] = None,
+    ) -> Tuple[List[Tuple[str, str]], str]:
+        """并发竞速获取多个 URL：持续等待直到某个源返回非空记录或总截止时间到达。
+
+        快速失败（404 / HTML / 空内容）的源不会结束竞速；各源的诊断记录在 last_fetch_diagnostics。
+        """
+        urls = self.ordered_urls()
+        if not urls:
+            raise RuntimeError("没有可用的 hosts 源")
+        if deadline is None:
+            deadline = float(REMOTE_RACE_CONFIG.get("deadline_seconds", 20.0))
+
+        result, race = await self._race_fetch_async(urls, [0.0] * len(urls), ipv4_only, ipv6_only, deadline)
+        if result:
+            return result
+        if race.expired():
+            raise RuntimeError(f"获取 hosts 超时（{deadline:g}秒）：{race.summary()}")
+        raise RuntimeError(f"所有远程 hosts 源均获取失败：{race.summary()}")
+
+    async def stream_github_hosts_async(
+        self,
+        *,
+        url_override: Optional[str] = None,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+    ):
+        """流式获取远程 hosts：边下载边解析，按批次产出新记录 List[(ip, domain)]。
+
+        - 依次尝试各个源；某个源在产出任何记录之前失败，则切换到下一个源
+        - 已产出记录后再失败，则保留已产出部分并结束（调用方已开始使用这些记录）
+        - 命中新鲜缓存 / 304 时一次性产出缓存记录
+        - 全部失败时按缓存兜底策略产出；仍无结果则抛出 RuntimeError
+
+        成功的源记录在 self.last_stream_url。
+        """
+        urls = [url_override] if url_override else self.ordered_urls()
+        self.last_cache_status = None
+        self.last_stream_url = None
+        self.last_delta = None
         last_err: Optional[Exception] = None
 
         for url in urls:
+            if not self.provider_for(url).streamable:
+                # 不支持流式解析的源：整体获取后一次性产出
+                try:
+                    records = await self._fetch_records_async(url, ipv4_only, ipv6_only)
+                except Exception as e:
+                    last_err = e
+                    continue
+                self._save_health()
+                if records:
+                    self.last_stream_url = url
+                    self._record_snapshot(records, url)
+                    yield records
+                    return
+                continue
+
+            entry = self.cache.get(url) if self.cache else None
+            if self.cache and self.cache.is_fresh(entry):
+                cached = _filter_records_by_family(self.cache.records_of(entry), ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+                if cached:
+                    self.last_cache_status = "fresh"
+                    self.last_stream_url = url
+                    self._record_snapshot(cached, url)
+                    yield cached
+                    return
+
+            parser = HostsStreamParser()
+            yielded = False
+            t0 = time.perf_counter()
             try:
-                parsed = self.parse_github_hosts_text(
-                    await self._fetch_url_content_async(url),
-                    ipv4_only=ipv4_only,
-                    ipv6_only=ipv6_only
+                stream = await self.http.open_stream(url, headers=RemoteHostsCache.conditional_headers(entry))
+                if stream.status == 304 and entry:
+                    await stream.aclose()
+                    self.cache.touch(url, entry)
+                    self._record_health(
+                        url, True, (time.perf_counter() - t0) * 1000.0,
+                        len(entry.get("records") or []), entry.get("last_modified"),
+                    )
+                    self._save_health()
+                    cached = _filter_records_by_family(self.cache.records_of(entry), ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+                    if cached:
+                        self.last_cache_status = "not_modified"
+                        self.last_stream_url = url
+                        self._record_snapshot(cached, url)
+                        yield cached
+                        return
+                    continue
+                if stream.status >= 400:
+                    await stream.aclose()
+                    raise RuntimeError(f"URL {url} 返回 HTTP {stream.status}")
+
+                is_html = "text/html" in stream.headers.get("content-type", "").lower()
+                async for chunk in stream.iter_chunks():
+                    new = parser.feed(chunk)
+                    if is_html and not parser.records:
+                        head = parser.head.lower()
+                        if b"<html" in head or b"<!doctype" in head:
+                            await stream.aclose()
+                            raise RuntimeError(f"URL {url} 返回的是 HTML 内容而非 hosts 文件")
+                    new = _filter_records_by_family(new, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+                    if new:
+                        yielded = True
+                        self.last_stream_url = url
+                        yield new
+                new = _filter_records_by_family(parser.close(), ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+                if new:
+                    yielded = True
+                    self.last_stream_url = url
+                    yield new
+
+                if parser.records and self.cache:
+                    self.cache.store(
+                        url,
+                        parser.records,
+                        etag=stream.headers.get("etag"),
+                        last_modified=stream.headers.get("last-modified"),
+                    )
+                self._record_health(
+                    url, bool(parser.records), (time.perf_counter() - t0) * 1000.0,
+                    len(parser.records), stream.headers.get("last-modified"),
                 )
-                if parsed:
-                    return parsed, url
+                self._save_health()
+                if yielded:
+                    self._record_snapshot(
+                        _filter_records_by_family(parser.records, ipv4_only=ipv4_only, ipv6_only=ipv6_only), url
+                    )
+                    return
             except Exception as e:
                 last_err = e
+                self._record_health(url, False)
+                self._save_health()
+                if yielded:
+                    get_logger().warning(f"流式获取 {url} 中途失败，保留已解析的 {len(parser.records)} 条记录：{e}")
+                    return
                 continue
 
+        stale = self._stale_fallback(urls, ipv4_only, ipv6_only)
+        if stale:
+            self.last_stream_url = stale[1]
+            yield stale[0]
+            return
         raise RuntimeError(f"所有远程 hosts 源均获取失败：{last_err}" if last_err else "所有远程 hosts 源均获取失败")
 
-    async def _fetch_concurrent_async(
+    async def _fetch_url_content_async(self, url: str, max_retries: int = 3) -> str:
+        """异步获取单个 URL 的内容（不带缓存），支持重试机制。"""
+        status, _, data = await self._fetch_url_response_async(url, max_retries=max_retries)
+        if status >= 400:
+            raise RuntimeError(f"URL {url} 返回 HTTP {status}")
+        return data.decode("utf-8", errors="ignore")
+
+    async def _fetch_url_response_async(
         self,
-        ipv4_only: bool,
-        ipv6_only: bool,
-    ) -> Tuple[List[Tuple[str, str]], str]:
-        """并发获取多个 URL，优先返回第一个成功的结果。"""
-        urls = list(self.urls)
-        if not urls:
-            raise RuntimeError("没有可用的 hosts 源")
+        url: str,
+        *,
+        extra_headers: Optional[Dict[str, str]] = None,
+        max_retries: int = 3,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """异步获取单个 URL，返回 (status, headers, body)，body 为原始字节。
+
+        headers 的键统一为小写；HTTP 层（分帧/解压/重定向/连接复用）由 AsyncHTTPClient 负责。
+        只有超时 / 网络错误 / TLS 错误会重试；HTML 内容、响应体超限等确定性失败直接抛出。
+        """
+        for attempt in range(max_retries):
+            try:
+                resp = await self.http.request(url, headers=extra_headers)
+            except (asyncio.TimeoutError, socket.timeout, OSError, ssl.SSLError) as e:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(0.5 * (attempt + 1))
+                    continue
+                raise RuntimeError(f"从 {url} 获取内容失败（重试 {max_retries} 次后）：{e}")
 
-        timeout = self.timeout[1] if isinstance(self.timeout, tuple) else 10.0
-        tasks = []
-        task_map = {}
+            # 尽量避免把 HTML 当成 hosts
+            data = resp.body
+            head = data[:500].lower()
+            if "text/html" in resp.headers.get("content-type", "").lower() and (b"<html" in head or b"<!doctype" in head):
+                raise RuntimeError(f"URL {url} 返回的是 HTML 内容而非 hosts 文件")
+            return resp.status, resp.headers, data
+        raise RuntimeError(f"从 {url} 获取内容失败：max_retries={max_retries}")
 
-        for url in urls:
-            task = asyncio.create_task(
-                self._fetch_url_content_async(url),
-                name=f"fetch_{url}"
-            )
-            tasks.append(task)
-            task_map[task] = url
+    async def aclose(self) -> None:
+        """释放异步 HTTP 连接池（在 asyncio.run 结束前调用）。"""
+        await self.http.aclose()
+
+
+# ---------------------------------------------------------------------
+# DNS Resolver
+# ---------------------------------------------------------------------
+DNS_TYPE_A = 1
+DNS_TYPE_CNAME = 5
+DNS_TYPE_AAAA = 28
+_DNS_TYPE_OPT = 41
+DNS_RCODE_NOERROR = 0
+DNS_RCODE_SERVFAIL = 2
+DNS_RCODE_NXDOMAIN = 3
+DNS_RCODE_REFUSED = 5
+
+
+@dataclass
+class DnsAnswer:
+    """一次 DNS 查询的结果。"""
+
+    name: str
+    qtype: int
+    rcode: int
+    addresses: List[str]
+    # 整条应答（CNAME 链 + 地址记录）中最小的 TTL（秒）
+    ttl: int
+    # CNAME 链（按跳转顺序，不含查询名本身）
+    cnames: List[str]
+    upstream: str = ""
+    truncated: bool = False
+
+    @property
+    def canonical_name(self) -> str:
+        return self.cnames[-1] if self.cnames else self.name
+
+
+def _dns_encode_name(name: str) -> bytes:
+    out = bytearray()
+    for label in name.rstrip(".").split("."):
+        raw = label.encode("idna") if label else b""
+        if not raw or len(raw) > 63:
+            raise ValueError(f"无效的域名：{name}")
+        out.append(len(raw))
+        out += raw
+    out.append(0)
+    return bytes(out)
+
+
+def _dns_build_query(qid: int, name: str, qtype: int) -> Tuple[bytes, bytes]:
+    """构造查询报文（RD=1，附带 EDNS0 以接收更大的 UDP 应答）。返回 (报文, 问题段)。"""
+    header = qid.to_bytes(2, "big") + b"\x01\x00" + b"\x00\x01\x00\x00\x00\x00\x00\x01"
+    question = _dns_encode_name(name) + qtype.to_bytes(2, "big") + b"\x00\x01"
+    opt = b"\x00" + _DNS_TYPE_OPT.to_bytes(2, "big") + (1232).to_bytes(2, "big") + b"\x00\x00\x00\x00\x00\x00"
+    return header + question + opt, question
+
+
+def _dns_read_name(data: bytes, pos: int) -> Tuple[str, int]:
+    """读取（可能带压缩指针的）域名，返回 (域名, 名字之后的偏移)。"""
+    labels: List[str] = []
+    end = -1
+    jumps = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("DNS 报文截断")
+        n = data[pos]
+        if n & 0xC0 == 0xC0:
+            if pos + 1 >= len(data) or jumps > 32:
+                raise ValueError("DNS 压缩指针无效")
+            if end < 0:
+                end = pos + 2
+            pos = ((n & 0x3F) << 8) | data[pos + 1]
+            jumps += 1
+            continue
+        if n == 0:
+            pos += 1
+            break
+        labels.append(data[pos + 1:pos + 1 + n].decode("ascii", errors="replace"))
+        pos += 1 + n
+    return ".".join(labels).lower(), end if end >= 0 else pos
+
+
+def _dns_parse_response(data: bytes, name: str, qtype: int) -> DnsAnswer:
+    """解析应答报文：提取 CNAME 链与目标类型的地址记录。"""
+    if len(data) < 12:
+        raise ValueError("DNS 应答过短")
+    flags = int.from_bytes(data[2:4], "big")
+    qdcount = int.from_bytes(data[4:6], "big")
+    ancount = int.from_bytes(data[6:8], "big")
+    pos = 12
+    for _ in range(qdcount):
+        _, pos = _dns_read_name(data, pos)
+        pos += 4
+
+    cname_of: Dict[str, Tuple[str, int]] = {}
+    addrs: Dict[str, List[Tuple[str, int]]] = {}
+    for _ in range(ancount):
+        owner, pos = _dns_read_name(data, pos)
+        if pos + 10 > len(data):
+            raise ValueError("DNS 应答截断")
+        rtype = int.from_bytes(data[pos:pos + 2], "big")
+        ttl = int.from_bytes(data[pos + 4:pos + 8], "big")
+        rdlen = int.from_bytes(data[pos + 8:pos + 10], "big")
+        rdata_pos = pos + 10
+        pos = rdata_pos + rdlen
+        if pos > len(data):
+            raise ValueError("DNS 应答截断")
+        if rtype == DNS_TYPE_CNAME:
+            target, _ = _dns_read_name(data, rdata_pos)
+            cname_of[owner] = (target, ttl)
+        elif rtype == qtype == DNS_TYPE_A and rdlen == 4:
+            addrs.setdefault(owner, []).append((socket.inet_ntop(socket.AF_INET, data[rdata_pos:pos]), ttl))
+        elif rtype == qtype == DNS_TYPE_AAAA and rdlen == 16:
+            addrs.setdefault(owner, []).append((socket.inet_ntop(socket.AF_INET6, data[rdata_pos:pos]), ttl))
+
+    # 沿 CNAME 链走到最终名字
+    qname = name.rstrip(".").lower()
+    chain: List[str] = []
+    ttls: List[int] = []
+    cur = qname
+    while cur in cname_of and len(chain) < 16:
+        cur, ttl = cname_of[cur]
+        chain.append(cur)
+        ttls.append(ttl)
+    found = addrs.get(cur, [])
+    addresses: List[str] = []
+    for ip, ttl in found:
+        if ip not in addresses:
+            addresses.append(ip)
+        ttls.append(ttl)
+    return DnsAnswer(
+        name=qname,
+        qtype=qtype,
+        rcode=flags & 0x000F,
+        addresses=addresses,
+        ttl=min(ttls) if ttls else 0,
+        cnames=chain,
+        truncated=bool(flags & 0x0200),
+    )
+
+
+def _dns_is_truncated(data: bytes) -> bool:
+    """只看头部的 TC 位（不解析记录段）。"""
+    return len(data) >= 4 and bool(data[2] & 0x02)
+
+
+def _parse_dns_upstream(spec: str) -> Tuple[str, int]:
+    """解析 "1.1.1.1" / "1.1.1.1:53" / "[2400:3200::1]:53" / "2400:3200::1"。"""
+    spec = str(spec).strip()
+    if spec.startswith("["):
+        host, _, rest = spec[1:].partition("]")
+        return host, int(rest.lstrip(":") or 53)
+    if spec.count(":") == 1:
+        host, port = spec.split(":")
+        return host, int(port)
+    return spec, 53
+
+
+def system_dns_upstreams() -> List[str]:
+    """读取系统配置的 DNS 服务器（POSIX: /etc/resolv.conf）；读取不到返回空列表。"""
+    out: List[str] = []
+    try:
+        with open("/etc/resolv.conf", "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    ip = parts[1].split("%", 1)[0]
+                    try:
+                        ipaddress.ip_address(ip)
+                    except ValueError:
+                        continue
+                    out.append(f"[{ip}]:53" if ":" in ip else ip)
+    except OSError:
+        pass
+    return out
+
+
+def _dns_prefix(ip: str) -> str:
+    """IPv4 取 /16、IPv6 取 /32 网段，用于比较不同上游的应答是否落在同一片网络。"""
+    bits = 32 if ":" in ip else 16
+    return str(ipaddress.ip_network(f"{ip}/{bits}", strict=False))
+
+
+def _dns_disagreement(by_upstream: Dict[str, Set[str]]) -> Tuple[str, Set[str]]:
+    """比较各上游对同一域名的应答，返回 (不一致说明, 应剔除的保留地址)；一致时说明为空串。
 
+    CDN 按地区返回不同节点属于正常现象，只有以下“严重不一致”才告警：
+    - 有上游返回公网地址，同时其他上游返回保留 / 内网 / 回环地址（典型的污染应答）
+    - 各上游的应答在网段上两两没有交集
+    """
+    answered = {u: ips for u, ips in by_upstream.items() if ips}
+    if len(answered) < 2:
+        return "", set()
+
+    def is_public(ip: str) -> bool:
         try:
-            done, pending = await asyncio.wait(
-                tasks,
-                return_when=asyncio.FIRST_COMPLETED,
-                timeout=timeout
-            )
+            return ipaddress.ip_address(ip).is_global
+        except ValueError:
+            return False
+
+    reasons: List[str] = []
+    bogus: Set[str] = set()
+    if any(is_public(ip) for ips in answered.values() for ip in ips):
+        for upstream, ips in answered.items():
+            bad = {ip for ip in ips if not is_public(ip)}
+            if bad:
+                bogus |= bad
+                reasons.append(f"{upstream} 返回保留地址 {', '.join(sorted(bad))}")
+
+    prefixes = [{_dns_prefix(ip) for ip in ips - bogus} for ips in answered.values()]
+    prefixes = [p for p in prefixes if p]
+    if len(prefixes) >= 2:
+        seen: Dict[str, int] = {}
+        for p in prefixes:
+            for net in p:
+                seen[net] = seen.get(net, 0) + 1
+        if max(seen.values()) < 2:
+            reasons.append(f"{len(prefixes)} 个上游的应答网段互不重叠")
+    return "；".join(reasons), bogus
+
+
+class _DnsUdpProtocol(asyncio.DatagramProtocol):
+    """单个上游的 UDP 端点：按查询 ID 把应答分发给等待中的 Future，并校验问题段防止串包。"""
+
+    def __init__(self) -> None:
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: Dict[int, Tuple[asyncio.Future, bytes]] = {}
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) < 12:
+            return
+        entry = self.pending.get(int.from_bytes(data[:2], "big"))
+        if entry is None:
+            return
+        fut, question = entry
+        if fut.done() or data[12:12 + len(question)].lower() != question.lower():
+            return
+        fut.set_result(data)
+
+    def _fail_all(self, exc: BaseException) -> None:
+        for fut, _ in list(self.pending.values()):
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def error_received(self, exc: Exception) -> None:
+        self._fail_all(exc)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._fail_all(exc or ConnectionError("DNS UDP 端点已关闭"))
+
+
+class AsyncDnsClient:
+    """单线程 asyncio DNS 客户端：UDP 直连上游查询 A/AAAA，应答截断（TC）时改用 TCP。
+
+    - 每个上游一个已连接的 UDP 端点，所有查询复用，按 16 位随机 ID 分发应答
+    - 超时 / SERVFAIL / REFUSED 时轮换到下一个上游重试
+    - 与 AsyncHTTPClient 一样绑定到当前事件循环，循环变化时自动丢弃旧端点
+    """
+
+    def __init__(
+        self,
+        upstreams: Optional[Iterable[str]] = None,
+        *,
+        timeout: Optional[float] = None,
+        attempts: Optional[int] = None,
+        max_inflight: Optional[int] = None,
+    ) -> None:
+        if upstreams is None:
+            upstreams = DNS_RESOLVER_CONFIG.get("upstreams") or system_dns_upstreams()
+        self.upstreams: List[Tuple[str, int]] = [_parse_dns_upstream(u) for u in upstreams if str(u).strip()]
+        self.timeout = float(timeout if timeout is not None else DNS_RESOLVER_CONFIG.get("timeout", 2.0))
+        self.attempts = max(1, int(attempts if attempts is not None else DNS_RESOLVER_CONFIG.get("attempts", 3)))
+        self.max_inflight = max(1, int(max_inflight if max_inflight is not None else DNS_RESOLVER_CONFIG.get("max_inflight", 256)))
+        self._endpoints: Dict[Tuple[str, int], _DnsUdpProtocol] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._rr = 0
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        for proto in self._endpoints.values():
+            try:
+                if proto.transport is not None:
+                    proto.transport.close()
+            except Exception:
+                pass
+        self._endpoints = {}
+        self._loop = loop
+        self._sem = asyncio.Semaphore(self.max_inflight)
+
+    async def _endpoint(self, upstream: Tuple[str, int]) -> _DnsUdpProtocol:
+        proto = self._endpoints.get(upstream)
+        if proto is not None and proto.transport is not None and not proto.transport.is_closing():
+            return proto
+        host, port = upstream
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        transport, proto = await self._loop.create_datagram_endpoint(
+            _DnsUdpProtocol, remote_addr=(host, port), family=family
+        )
+        # 大量查询同时在途时应答会成批到达，放大接收缓冲区避免内核丢包
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+            except OSError:
+                pass
+        self._endpoints[upstream] = proto
+        return proto
+
+    async def _udp_exchange(self, upstream: Tuple[str, int], name: str, qtype: int) -> bytes:
+        proto = await self._endpoint(upstream)
+        qid = random.getrandbits(16)
+        while qid in proto.pending:
+            qid = random.getrandbits(16)
+        msg, question = _dns_build_query(qid, name, qtype)
+        fut = self._loop.create_future()
+        proto.pending[qid] = (fut, question)
+        try:
+            proto.transport.sendto(msg)
+            return await asyncio.wait_for(fut, self.timeout)
+        finally:
+            proto.pending.pop(qid, None)
+
+    async def _tcp_exchange(self, upstream: Tuple[str, int], name: str, qtype: int) -> bytes:
+        host, port = upstream
+        qid = random.getrandbits(16)
+        msg, question = _dns_build_query(qid, name, qtype)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        try:
+            writer.write(len(msg).to_bytes(2, "big") + msg)
+            await writer.drain()
+            size = int.from_bytes(await asyncio.wait_for(reader.readexactly(2), self.timeout), "big")
+            data = await asyncio.wait_for(reader.readexactly(size), self.timeout)
+        finally:
+            writer.close()
+        # 与 UDP 分发一致：ID 与问题段都必须对应本次查询
+        if len(data) < 12 or int.from_bytes(data[:2], "big") != qid or data[12:12 + len(question)].lower() != question.lower():
+            raise ValueError("DNS TCP 应答与查询不匹配")
+        return data
+
+    async def query(self, name: str, qtype: int, *, upstream: Optional[Tuple[str, int]] = None) -> DnsAnswer:
+        """查询单个名字；所有尝试都失败时抛出 RuntimeError。NXDOMAIN / 无记录正常返回。
 
-            for task in done:
-                url = task_map[task]
+        指定 upstream 时所有尝试都发给该上游（扇出查询），否则依次轮换上游。
+        """
+        if not self.upstreams:
+            raise RuntimeError("没有可用的上游 DNS 服务器")
+        self._bind_loop()
+        name = name.strip().rstrip(".").lower()
+        last_err: Optional[BaseException] = None
+        candidates = [upstream] if upstream is not None else self.upstreams
+        start = 0 if upstream is not None else self._rr
+        self._rr = (self._rr + 1) % len(self.upstreams)
+        async with self._sem:
+            for attempt in range(self.attempts):
+                upstream = candidates[(start + attempt) % len(candidates)]
                 try:
-                    content = task.result()
-                    parsed = self.parse_github_hosts_text(content, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
-                    if parsed:
-                        for p in pending:
-                            p.cancel()
-                        return parsed, url
-                except Exception:
+                    data = await self._udp_exchange(upstream, name, qtype)
+                    # 先看头部 TC 位：截断的应答段可能不完整，解析会抛 ValueError 而错过 TCP 重试
+                    if _dns_is_truncated(data):
+                        data = await self._tcp_exchange(upstream, name, qtype)
+                    ans = _dns_parse_response(data, name, qtype)
+                except (asyncio.TimeoutError, OSError, ValueError, asyncio.IncompleteReadError) as e:
+                    last_err = e
                     continue
+                if ans.rcode in (DNS_RCODE_SERVFAIL, DNS_RCODE_REFUSED):
+                    last_err = RuntimeError(f"{upstream[0]} 返回 rcode={ans.rcode}")
+                    continue
+                ans.upstream = f"{upstream[0]}:{upstream[1]}"
+                return ans
+        raise RuntimeError(f"DNS 查询失败：{name}：{last_err or '超时'}")
+
+    async def resolve(self, name: str, *, ipv4_only: bool = False, ipv6_only: bool = False) -> List[DnsAnswer]:
+        """并发查询 A / AAAA（按 IP 版本过滤），返回各类型的应答。"""
+        qtypes = []
+        if not ipv6_only:
+            qtypes.append(DNS_TYPE_A)
+        if not ipv4_only:
+            qtypes.append(DNS_TYPE_AAAA)
+        results = await asyncio.gather(*(self.query(name, t) for t in qtypes), return_exceptions=True)
+        answers = [r for r in results if isinstance(r, DnsAnswer)]
+        if not answers:
+            err = next((r for r in results if isinstance(r, BaseException)), None)
+            raise RuntimeError(str(err) if err else f"DNS 查询失败：{name}")
+        return answers
+
+    async def aclose(self) -> None:
+        for proto in self._endpoints.values():
+            try:
+                if proto.transport is not None:
+                    proto.transport.close()
+            except Exception:
+                pass
+        self._endpoints = {}
 
-            for p in pending:
-                p.cancel()
-
-            raise RuntimeError("所有远程 hosts 源均获取失败")
 
-        except asyncio.TimeoutError:
-            for task in tasks:
-                task.cancel()
-            raise RuntimeError(f"获取 hosts 超时（{timeout}秒）")
+class DnsCache:
+    """TTL 感知的 DNS 缓存（LRU + 负缓存，线程安全，可持久化）。
 
-    async def _fetch_url_content_async(self, url: str, max_retries: int = 3) -> str:
-        """异步获取单个 URL 的内容，支持重试机制。"""
-        import urllib.parse
+    条目按 (域名, 记录类型) 存储：{"addresses", "cnames", "sources", "expires_at", "negative"}，
+    sources 为 ip -> 给出该地址的上游列表（多上游扇出时的来源）。
+    - 上游应答按其 TTL 缓存（钳制到 [min_ttl, max_ttl]）；系统解析没有 TTL，使用 system_ttl
+    - NXDOMAIN / 无记录按 negative_ttl、解析失败按 failure_ttl 缓存为负条目
+    - expires_at 使用墙上时间，重启后仍然有效
+    """
 
-        for attempt in range(max_retries):
+    def __init__(self, *, path: Optional[str] = None, app_name: str = APP_NAME, max_entries: Optional[int] = None) -> None:
+        cfg = DNS_CACHE_CONFIG
+        self.path = path or user_data_path(app_name, cfg.get("file_name", "dns_cache.json"))
+        self.max_entries = max(1, int(max_entries if max_entries is not None else cfg.get("max_entries", 4096)))
+        self.min_ttl = float(cfg.get("min_ttl", 30))
+        self.max_ttl = float(cfg.get("max_ttl", 3600))
+        self.system_ttl = float(cfg.get("system_ttl", 300))
+        self.negative_ttl = float(cfg.get("negative_ttl", 60))
+        self.failure_ttl = float(cfg.get("failure_ttl", 15))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        data = safe_read_json(self.path, [])
+        now = time.time()
+        for item in data if isinstance(data, list) else []:
             try:
-                parsed_url = urllib.parse.urlparse(url)
-                host = parsed_url.hostname
-                port = 443 if parsed_url.scheme == "https" else 80
-                path = parsed_url.path or "/"
+                key = (str(item["name"]), int(item["qtype"]))
+                if float(item["expires_at"]) > now:
+                    self._entries[key] = {
+                        "addresses": list(item.get("addresses") or []),
+                        "cnames": list(item.get("cnames") or []),
+                        "sources": dict(item.get("sources") or {}),
+                        "expires_at": float(item["expires_at"]),
+                        "negative": bool(item.get("negative")),
+                    }
+            except (KeyError, TypeError, ValueError):
+                continue
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        """有变更时写回磁盘（只保存未过期条目）。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            data = [
+                {"name": name, "qtype": qtype, **entry}
+                for (name, qtype), entry in self._entries.items()
+                if entry["expires_at"] > now
+            ]
+            self._dirty = False
+        try:
+            atomic_write_json(self.path, data, indent=0)
+        except Exception as e:
+            get_logger().debug(f"保存 DNS 缓存失败：{e}")
+
+    def clamp_ttl(self, ttl: float) -> float:
+        return min(self.max_ttl, max(self.min_ttl, float(ttl)))
+
+    def get(self, name: str, qtype: int) -> Optional[Dict[str, Any]]:
+        """返回未过期的条目（命中即移到 LRU 末尾），未命中返回 None。"""
+        key = (name.strip().rstrip(".").lower(), qtype)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                    self._dirty = True
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(
+        self,
+        name: str,
+        qtype: int,
+        addresses: List[str],
+        *,
+        ttl: Optional[float] = None,
+        cnames: Optional[List[str]] = None,
+        sources: Optional[Dict[str, List[str]]] = None,
+        failure: bool = False,
+    ) -> None:
+        """写入条目；ttl 为 None 表示来自系统解析。无地址时写入负条目。"""
+        if failure:
+            lifetime = self.failure_ttl
+        elif not addresses:
+            lifetime = self.negative_ttl
+        elif ttl is None:
+            lifetime = self.clamp_ttl(self.system_ttl)
+        else:
+            lifetime = self.clamp_ttl(ttl)
+        key = (name.strip().rstrip(".").lower(), qtype)
+        with self._lock:
+            self._entries[key] = {
+                "addresses": list(addresses),
+                "cnames": list(cnames or []),
+                "sources": {ip: list(v) for ip, v in (sources or {}).items()},
+                "expires_at": time.time() + lifetime,
+                "negative": not addresses,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
 
-                ssl_context = ssl.create_default_context()
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
 
-                reader, writer = await asyncio.wait_for(
-                    asyncio.open_connection(host, port, ssl=ssl_context if parsed_url.scheme == "https" else None),
-                    timeout=self.timeout[1] if isinstance(self.timeout, tuple) else 10.0
-                )
+    def __len__(self) -> int:
+        return len(self._entries)
 
-                request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: {APP_NAME}/1.0\r\nConnection: close\r\n\r\n"
-                writer.write(request.encode())
-                await writer.drain()
 
-                response_data = await reader.read()
-                writer.close()
-                await writer.wait_closed()
-
-                response_text = response_data.decode('utf-8', errors='ignore')
-                lines = response_text.split('\r\n')
-                headers_end = False
-                content = []
-                is_html = False
-
-                for line in lines:
-                    if not headers_end:
-                        if line.lower().startswith('content-type:'):
-                            if 'text/html' in line.lower():
-                                is_html = True
-                        if line == '':
-                            headers_end = True
-                    else:
-                        content.append(line)
+_shared_dns_cache: Optional[DnsCache] = None
+_shared_dns_cache_lock = threading.Lock()
+
 
-                txt = '\n'.join(content)
+def get_shared_dns_cache() -> Optional[DnsCache]:
+    """进程内共享的 DNS 缓存（手动解析、异步解析、定时测速、DNS 源共用）；未启用时返回 None。"""
+    global _shared_dns_cache
+    if not DNS_CACHE_CONFIG.get("enabled", True):
+        return None
+    with _shared_dns_cache_lock:
+        if _shared_dns_cache is None:
+            _shared_dns_cache = DnsCache()
+        return _shared_dns_cache
 
-                if is_html and ('<html' in txt[:500].lower() or '<!doctype' in txt[:500].lower()):
-                    raise RuntimeError(f"URL {url} 返回的是 HTML 内容而非 hosts 文件")
 
-                return txt
+@dataclass
+class ResolvedDomain:
+    """单个域名的解析结果（合并主解析与各扇出上游的应答）。"""
 
-            except (asyncio.TimeoutError, socket.timeout, OSError, ssl.SSLError) as e:
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(0.5 * (attempt + 1))
-                    continue
-                raise RuntimeError(f"从 {url} 获取内容失败（重试 {max_retries} 次后）：{e}")
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(0.5 * (attempt + 1))
-                    continue
-                raise RuntimeError(f"从 {url} 获取内容失败（重试 {max_retries} 次后）：{e}")
+    domain: str
+    # ip -> 给出该地址的上游（"host:port"；"system" 表示系统 getaddrinfo）
+    sources: Dict[str, List[str]] = field(default_factory=dict)
+    # CNAME 链（按跳转顺序，不含域名本身）
+    cnames: List[str] = field(default_factory=list)
+    # 各上游应答严重不一致时的说明（疑似 DNS 污染），一致时为空串
+    disagreement: str = ""
+
+    @property
+    def ips(self) -> List[str]:
+        return list(self.sources)
+
+    @property
+    def canonical_name(self) -> str:
+        """CNAME 链的终点（没有 CNAME 时为域名本身，小写）。"""
+        return self.cnames[-1] if self.cnames else self.domain.strip().rstrip(".").lower()
 
 
-# ---------------------------------------------------------------------
-# DNS Resolver
-# ---------------------------------------------------------------------
 class DomainResolver:
-    """并发 DNS 解析：输入域名列表，输出 (ip, domain) 列表。"""
+    """并发 DNS 解析：输入域名列表，输出 (ip, domain) 列表。
 
-    def __init__(self, *, max_workers: Optional[int] = None) -> None:
+    engine="native" 时由 AsyncDnsClient 在单线程内直接向上游发查询，成千上万个域名可同时在途；
+    某个域名的原生查询失败（超时 / 无上游）时，该域名退回系统 getaddrinfo。
+    配置了 fanout_upstreams 时，每个域名还会并行询问这些解析器，合并各自返回的地区节点，
+    来源记录在 last_provenance，应答严重不一致的域名记录在 last_disagreements。
+
+    CNAME 指向同一目标的域名（如多个 GitHub 静态资源域名指向同一 CDN 边缘）按目标归并：
+    扇出只针对每个目标查询一次，组内所有域名共享合并后的 IP，见 last_results / canonical_groups()。
+    """
+
+    def __init__(
+        self,
+        *,
+        max_workers: Optional[int] = None,
+        engine: Optional[str] = None,
+        upstreams: Optional[Iterable[str]] = None,
+        cache: Optional[DnsCache] = None,
+        fanout_upstreams: Optional[Iterable[str]] = None,
+    ) -> None:
         if max_workers is None:
             max_workers = DNS_RESOLVER_CONFIG.get("max_workers", 20)
         self.max_workers = max(1, int(max_workers))
+        self.engine = engine or DNS_RESOLVER_CONFIG.get("engine", "native")
+        self.dns: Optional[AsyncDnsClient] = None
+        if self.engine == "native":
+            self.dns = AsyncDnsClient(upstreams)
+            if not self.dns.upstreams:
+                get_logger().info("未找到可用的上游 DNS，使用系统解析（getaddrinfo）")
+                self.dns = None
+
+        if fanout_upstreams is None:
+            fanout_upstreams = DNS_RESOLVER_CONFIG.get("fanout_upstreams") or []
+        self.fanout: Optional[AsyncDnsClient] = AsyncDnsClient(
+            fanout_upstreams,
+            attempts=DNS_RESOLVER_CONFIG.get("fanout_attempts", 2),
+            max_inflight=DNS_RESOLVER_CONFIG.get("fanout_max_inflight", 64),
+        )
+        # 与主解析相同的上游不再重复询问
+        primary = set(self.dns.upstreams) if self.dns is not None else set()
+        self.fanout.upstreams = [u for u in self.fanout.upstreams if u not in primary]
+        if not self.fanout.upstreams:
+            self.fanout = None
+        self.fanout_grace = float(DNS_RESOLVER_CONFIG.get("fanout_grace", 1.0))
+        self.flag_disagreement = bool(DNS_RESOLVER_CONFIG.get("flag_disagreement", True))
+
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.cache = cache if cache is not None else get_shared_dns_cache()
+        # 最近一次解析：(ip, 域名) -> 给出该应答的上游；域名 -> 不一致说明
+        self.last_provenance: Dict[Tuple[str, str], List[str]] = {}
+        self.last_disagreements: Dict[str, str] = {}
+        # 最近一次解析：域名 -> 解析结果（含 CNAME 链）
+        self.last_results: Dict[str, ResolvedDomain] = {}
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """系统解析使用的共享线程池（惰性创建，跨调用复用）。"""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="dns")
+        return self._executor
 
     def resolve(
         self,
@@ -412,18 +3035,18 @@ class DomainResolver:
         if not ds:
             return []
 
-        res: List[Tuple[str, str]] = []
-        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as ex:
-            fmap = {ex.submit(self._resolve_single_domain, d, ipv4_only, ipv6_only): d for d in ds}
-            for f in concurrent.futures.as_completed(fmap):
-                dom = fmap.get(f, "")
-                try:
-                    ips = f.result()
-                    for ip in ips:
-                        res.append((ip, dom))
-                except Exception:
-                    pass
-        return res
+        async def run() -> List[Tuple[str, str]]:
+            try:
+                return await self.resolve_async(ds, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+            finally:
+                await self.aclose()
+
+        return asyncio.run(run())
+
+    async def aclose(self) -> None:
+        for client in (self.dns, self.fanout):
+            if client is not None:
+                await client.aclose()
 
     @staticmethod
     def _resolve_single_domain(domain: str, ipv4_only: bool, ipv6_only: bool) -> List[str]:
@@ -465,62 +3088,939 @@ class DomainResolver:
         if not ds:
             return []
 
-        # 创建异步任务
-        tasks = [self._resolve_single_domain_async(d, ipv4_only, ipv6_only) for d in ds]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        hits0 = self.cache.hits if self.cache is not None else 0
+        # 每个扇出上游的可达性只探测一次，与主解析并行进行
+        probes = self._probe_fanout_upstreams(ds[0]) if self.fanout is not None else {}
+        # CNAME 目标 -> 该目标的扇出任务（同一目标的域名共享）
+        targets: Dict[str, Tuple["asyncio.Future[None]", List[DnsAnswer]]] = {}
+        # 创建异步任务
+        tasks = [self._resolve_single_domain_async(d, ipv4_only, ipv6_only, probes, targets) for d in ds]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self._cancel_batch(probes, targets)
+        resolved = {dom: r for dom, r in zip(ds, results) if isinstance(r, ResolvedDomain)}
+        return await self._finish_batch(ds, resolved, hits0)
+
+    async def resolve_stream_async(
+        self,
+        domains: Iterable[str],
+        *,
+        ipv4_only: bool = False,
+        ipv6_only: bool = False,
+        queue_size: Optional[int] = None,
+    ):
+        """流式解析：每个域名解析完成立即产出其 ResolvedDomain，供下游边解析边测速。
+
+        - 结果经有界队列传递，下游消费不过来时解析任务在入队处等待（背压）
+        - 全部完成后，CNAME 同组的域名共享了新 IP 的会再产出一次（sources 已合并）
+        - 结束后 last_* 与 resolve_async 一致
+        """
+        ds = [str(d).strip() for d in domains if str(d).strip()]
+        if not ds:
+            return
+
+        hits0 = self.cache.hits if self.cache is not None else 0
+        probes = self._probe_fanout_upstreams(ds[0]) if self.fanout is not None else {}
+        targets: Dict[str, Tuple["asyncio.Future[None]", List[DnsAnswer]]] = {}
+        size = queue_size if queue_size is not None else DNS_RESOLVER_CONFIG.get("stream_queue_size", 256)
+        queue: "asyncio.Queue[Tuple[str, Optional[ResolvedDomain]]]" = asyncio.Queue(max(1, int(size)))
+
+        async def worker(domain: str) -> None:
+            try:
+                r: Optional[ResolvedDomain] = await self._resolve_single_domain_async(
+                    domain, ipv4_only, ipv6_only, probes, targets
+                )
+            except Exception as e:
+                get_logger().debug(f"流式解析失败：{domain} {e}")
+                r = None
+            await queue.put((domain, r))
+
+        workers = [asyncio.ensure_future(worker(d)) for d in ds]
+        resolved: Dict[str, ResolvedDomain] = {}
+        emitted: Dict[str, int] = {}
+        try:
+            for _ in range(len(ds)):
+                dom, r = await queue.get()
+                if r is None:
+                    continue
+                resolved[dom] = r
+                emitted[dom] = len(r.sources)
+                yield r
+        finally:
+            for w in workers:
+                w.cancel()
+            self._cancel_batch(probes, targets)
+
+        await self._finish_batch(ds, resolved, hits0)
+        for dom, r in resolved.items():
+            if len(r.sources) > emitted.get(dom, 0):
+                yield r
+
+    @staticmethod
+    def _cancel_batch(probes: Dict[Any, "asyncio.Future[Any]"], targets: Dict[str, Tuple["asyncio.Future[None]", Any]]) -> None:
+        """批次结束：取消仍在等待的可达性探测与扇出查询。"""
+        for pending in [*probes.values(), *(task for task, _ in targets.values())]:
+            pending.cancel()
+
+    async def _finish_batch(
+        self,
+        ds: List[str],
+        resolved: Dict[str, ResolvedDomain],
+        hits0: int,
+    ) -> List[Tuple[str, str]]:
+        """批次收尾：保存缓存、按 CNAME 目标共享 IP、记录来源与不一致，返回 (ip, domain) 列表。"""
+        if self.cache is not None:
+            get_logger().debug(f"DNS 缓存：{len(ds)} 个域名，命中 {self.cache.hits - hits0} 项")
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.save)
+
+        resolved_by_domain = {dom: resolved[dom] for dom in ds if dom in resolved}
+        groups = self.canonical_groups(resolved_by_domain)
+        self._share_group_addresses(resolved_by_domain, groups)
+        merged = sum(len(members) for members in groups.values() if len(members) > 1)
+        if merged:
+            get_logger().info(f"CNAME 归并：{len(resolved_by_domain)} 个域名指向 {len(groups)} 个不同目标（{merged} 个域名共享目标）")
+
+        res: List[Tuple[str, str]] = []
+        provenance: Dict[Tuple[str, str], List[str]] = {}
+        disagreements: Dict[str, str] = {}
+        for dom, r in resolved_by_domain.items():
+            for ip, upstreams in r.sources.items():
+                res.append((ip, dom))
+                provenance[(ip, dom)] = upstreams
+            if r.disagreement:
+                disagreements[dom] = r.disagreement
+                get_logger().warning(f"DNS 应答不一致（疑似污染）：{dom}：{r.disagreement}")
+
+        self.last_provenance = provenance
+        self.last_disagreements = disagreements
+        self.last_results = resolved_by_domain
+        if self.fanout is not None:
+            n_upstreams = len({u for v in provenance.values() for u in v})
+            get_logger().info(f"DNS 扇出解析：{len(ds)} 个域名，{n_upstreams} 个上游，合并得到 {len(res)} 个 (IP, 域名)")
+        return res
+
+    def canonical_groups(self, results: Optional[Dict[str, ResolvedDomain]] = None) -> Dict[str, List[str]]:
+        """按 CNAME 目标归并域名：目标 -> [域名...]（默认使用最近一次解析结果）。"""
+        groups: Dict[str, List[str]] = {}
+        for dom, resolved in (self.last_results if results is None else results).items():
+            groups.setdefault(resolved.canonical_name, []).append(dom)
+        return groups
+
+    @staticmethod
+    def _share_group_addresses(results: Dict[str, ResolvedDomain], groups: Dict[str, List[str]]) -> None:
+        """同一 CNAME 目标的域名共享组内所有 IP（测速一次，结果回填到每个域名）。"""
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            union: Dict[str, List[str]] = {}
+            for dom in members:
+                for ip, upstreams in results[dom].sources.items():
+                    labels = union.setdefault(ip, [])
+                    labels.extend(u for u in upstreams if u not in labels)
+            for dom in members:
+                results[dom].sources = {ip: list(labels) for ip, labels in union.items()}
+
+    @staticmethod
+    def _qtypes(ipv4_only: bool, ipv6_only: bool) -> List[int]:
+        qtypes = []
+        if not ipv6_only:
+            qtypes.append(DNS_TYPE_A)
+        if not ipv4_only:
+            qtypes.append(DNS_TYPE_AAAA)
+        return qtypes
+
+    def _probe_fanout_upstreams(self, domain: str) -> "Dict[Tuple[str, int], asyncio.Future[bool]]":
+        """用一个域名分别探测各扇出上游，本轮只向有应答的上游扇出（避免离线时每个域名都等满超时）。"""
+
+        async def probe(upstream: Tuple[str, int]) -> bool:
+            try:
+                await self.fanout.query(domain, DNS_TYPE_A, upstream=upstream)
+                return True
+            except Exception:
+                get_logger().info(f"DNS 扇出：上游 {upstream[0]}:{upstream[1]} 无应答，本轮跳过")
+                return False
+
+        return {u: asyncio.ensure_future(probe(u)) for u in self.fanout.upstreams}
+
+    async def _fanout_answers(
+        self,
+        domain: str,
+        qtypes: List[int],
+        probes: "Dict[Tuple[str, int], asyncio.Future[bool]]",
+        out: List[DnsAnswer],
+    ) -> None:
+        """向本轮可达的扇出上游查询，应答随到随追加到 out（被取消时已收到的应答仍保留）。"""
+
+        async def one(upstream: Tuple[str, int], qtype: int) -> None:
+            try:
+                if await asyncio.shield(probes[upstream]):
+                    out.append(await self.fanout.query(domain, qtype, upstream=upstream))
+            except Exception:
+                pass
+
+        await asyncio.gather(*(one(u, t) for u in probes for t in qtypes))
+
+    def _cached_resolution(self, domain: str, qtypes: List[int]) -> Optional[ResolvedDomain]:
+        """所需的每种记录类型都命中缓存时返回合并后的结果，否则返回 None。"""
+        if self.cache is None:
+            return None
+        resolved = ResolvedDomain(domain)
+        for qtype in qtypes:
+            entry = self.cache.get(domain, qtype)
+            if entry is None:
+                return None
+            sources = entry.get("sources") or {}
+            for ip in entry["addresses"]:
+                resolved.sources.setdefault(ip, list(sources.get(ip, [])))
+            if entry["cnames"] and not resolved.cnames:
+                resolved.cnames = list(entry["cnames"])
+        return resolved
+
+    async def _primary_answers(self, domain: str, qtypes: List[int], ipv4_only: bool, ipv6_only: bool) -> List[DnsAnswer]:
+        """主解析：原生查询，失败时退回系统解析（upstream 记为 "system"，没有 TTL）。"""
+        if self.dns is not None:
+            try:
+                return await self.dns.resolve(domain, ipv4_only=ipv4_only, ipv6_only=ipv6_only)
+            except Exception as e:
+                get_logger().debug(f"原生 DNS 查询失败，改用系统解析：{domain} {e}")
+
+        loop = asyncio.get_running_loop()
+        try:
+            ips = await loop.run_in_executor(
+                self._get_executor(),
+                self._resolve_single_domain,
+                domain,
+                ipv4_only,
+                ipv6_only,
+            )
+        except Exception:
+            ips = []
+        # getaddrinfo 不区分“不存在”与“失败”：没有结果时不产生应答，按失败短期缓存
+        if not ips:
+            return []
+        return [
+            DnsAnswer(
+                name=domain,
+                qtype=qtype,
+                rcode=DNS_RCODE_NOERROR,
+                addresses=[ip for ip in ips if (":" in ip) == (qtype == DNS_TYPE_AAAA)],
+                ttl=0,
+                cnames=[],
+                upstream="system",
+            )
+            for qtype in qtypes
+        ]
+
+    async def _resolve_single_domain_async(
+        self,
+        domain: str,
+        ipv4_only: bool,
+        ipv6_only: bool,
+        probes: "Optional[Dict[Tuple[str, int], asyncio.Future[bool]]]" = None,
+        targets: "Optional[Dict[str, Tuple[asyncio.Future[None], List[DnsAnswer]]]]" = None,
+    ) -> ResolvedDomain:
+        """异步解析单个域名（先查缓存；主解析后向各扇出上游查询其 CNAME 目标，合并应答并记录来源）。
+
+        probes 为各扇出上游的可达性探测（Future），为空时不扇出；
+        targets 在同一批解析内共享：CNAME 目标相同的域名只扇出一次。
+        """
+        qtypes = self._qtypes(ipv4_only, ipv6_only)
+        cached = self._cached_resolution(domain, qtypes)
+        if cached is not None:
+            return cached
+
+        try:
+            answers: List[DnsAnswer] = list(await self._primary_answers(domain, qtypes, ipv4_only, ipv6_only))
+        except Exception:
+            answers = []
+        fanout_task = None
+        if probes:
+            canonical = next((a.cnames[-1] for a in answers if a.cnames), domain.strip().rstrip(".").lower())
+            if targets is None:
+                targets = {}
+            if canonical not in targets:
+                extra: List[DnsAnswer] = []
+                targets[canonical] = (asyncio.ensure_future(self._fanout_answers(canonical, qtypes, probes, extra)), extra)
+            fanout_task, extra = targets[canonical]
+            # 扇出只用来扩充候选：主解析完成后最多再等 fanout_grace 秒，未返回的查询放弃（批次结束时统一取消）
+            await asyncio.wait({fanout_task}, timeout=self.fanout_grace)
+            answers += list(extra)
+
+        resolved = ResolvedDomain(domain)
+        bogus: Set[str] = set()
+        if self.flag_disagreement and fanout_task is not None:
+            by_upstream: Dict[str, Set[str]] = {}
+            for ans in answers:
+                by_upstream.setdefault(ans.upstream, set()).update(ans.addresses)
+            resolved.disagreement, bogus = _dns_disagreement(by_upstream)
+
+        for qtype in qtypes:
+            typed = [a for a in answers if a.qtype == qtype]
+            sources: Dict[str, List[str]] = {}
+            for ans in typed:
+                for ip in ans.addresses:
+                    if ip in bogus:
+                        continue
+                    upstreams = sources.setdefault(ip, [])
+                    if ans.upstream not in upstreams:
+                        upstreams.append(ans.upstream)
+            cnames = next((a.cnames for a in typed if a.cnames), [])
+            if self.cache is not None:
+                ttls = [a.ttl for a in typed if a.upstream != "system" and a.addresses]
+                self.cache.put(
+                    domain,
+                    qtype,
+                    list(sources),
+                    ttl=min(ttls) if ttls else None,
+                    cnames=cnames,
+                    sources=sources,
+                    failure=not typed,
+                )
+            for ip, upstreams in sources.items():
+                resolved.sources.setdefault(ip, upstreams)
+            if cnames and not resolved.cnames:
+                resolved.cnames = list(cnames)
+        return resolved
+
+
+# ---------------------------------------------------------------------
+# Speed Test
+# ---------------------------------------------------------------------
+def ip_prefix(ip: str, ipv4_prefix: int = 24, ipv6_prefix: int = 48) -> str:
+    """IP 所在网段（如 "140.82.112.0/24"）；无法解析的输入原样返回。"""
+    try:
+        addr = ipaddress.ip_address(ip.split("%", 1)[0])
+    except ValueError:
+        return ip
+    bits = ipv6_prefix if addr.version == 6 else ipv4_prefix
+    return str(ipaddress.ip_network(f"{addr}/{bits}", strict=False))
+
+
+class ConnectRateLimiter:
+    """测速 connect 的全局限速器（令牌桶 + 按网段的在途上限，线程安全）。
+
+    - 全局：每秒最多 rate 次 connect，允许 burst 次突发；rate <= 0 表示不限
+    - 按网段：同一 /24（IPv4）或 /48（IPv6）内同时进行的 connect 不超过 per_prefix；<= 0 表示不限
+    - "在途"指从拿到令牌到 connect 完成（成功、失败或超时）为止，调用方必须 release
+
+    同步线程用 acquire（阻塞）、协程用 acquire_async、单线程事件循环（MassTcpProber）用 try_acquire。
+    排队等待时间由 acquire 返回，调用方在拿到令牌之后才开始计时，等待不会混入 RTT 样本。
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float = 0.0,
+        burst: int = 1,
+        per_prefix: int = 0,
+        ipv4_prefix: int = 24,
+        ipv6_prefix: int = 48,
+    ) -> None:
+        self._cond = threading.Condition()
+        self._inflight: Dict[str, int] = {}
+        self.update(rate=rate, burst=burst, per_prefix=per_prefix, ipv4_prefix=ipv4_prefix, ipv6_prefix=ipv6_prefix)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        # 统计：拿到令牌的次数与累计排队秒数
+        self.acquired = 0
+        self.total_wait = 0.0
+
+    def update(
+        self,
+        *,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        per_prefix: Optional[int] = None,
+        ipv4_prefix: Optional[int] = None,
+        ipv6_prefix: Optional[int] = None,
+    ) -> None:
+        """运行中调整参数（GUI 修改测速配置后生效）；未传的参数保持不变。"""
+        with self._cond:
+            if rate is not None:
+                self.rate = max(0.0, float(rate))
+            if burst is not None:
+                self.burst = max(1, int(burst))
+            if per_prefix is not None:
+                self.per_prefix = max(0, int(per_prefix))
+            if ipv4_prefix is not None:
+                self.ipv4_prefix = min(32, max(0, int(ipv4_prefix)))
+            if ipv6_prefix is not None:
+                self.ipv6_prefix = min(128, max(0, int(ipv6_prefix)))
+            self._cond.notify_all()
+
+    def prefix_of(self, ip: str) -> str:
+        return ip_prefix(ip, self.ipv4_prefix, self.ipv6_prefix)
+
+    def try_acquire(self, ip: str) -> Tuple[bool, float]:
+        """不阻塞地尝试拿令牌：成功返回 (True, 0.0)；否则返回 (False, 建议的重试等待秒数)。"""
+        key = self.prefix_of(ip)
+        with self._cond:
+            if self.per_prefix and self._inflight.get(key, 0) >= self.per_prefix:
+                # 等同网段的 connect 完成；具体时刻未知，短间隔轮询
+                return False, 0.005
+            if self.rate > 0:
+                now = time.monotonic()
+                self._tokens = min(float(self.burst), self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens < 1.0:
+                    return False, (1.0 - self._tokens) / self.rate
+                self._tokens -= 1.0
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+            self.acquired += 1
+            return True, 0.0
+
+    def release(self, ip: str) -> None:
+        key = self.prefix_of(ip)
+        with self._cond:
+            n = self._inflight.get(key, 0) - 1
+            if n > 0:
+                self._inflight[key] = n
+            else:
+                self._inflight.pop(key, None)
+            self._cond.notify_all()
+
+    def acquire(self, ip: str, stop: Optional[Callable[[], bool]] = None) -> Optional[float]:
+        """阻塞直到拿到令牌，返回排队秒数；stop() 为真时放弃并返回 None。"""
+        t0 = time.monotonic()
+        while True:
+            ok, retry = self.try_acquire(ip)
+            if ok:
+                waited = time.monotonic() - t0
+                self._account(waited)
+                return waited
+            if stop is not None and stop():
+                return None
+            with self._cond:
+                self._cond.wait(min(retry, 0.1))
+
+    async def acquire_async(self, ip: str, stop: Optional[Callable[[], bool]] = None) -> Optional[float]:
+        """acquire 的协程版本（轮询，不阻塞事件循环）。"""
+        t0 = time.monotonic()
+        while True:
+            ok, retry = self.try_acquire(ip)
+            if ok:
+                waited = time.monotonic() - t0
+                self._account(waited)
+                return waited
+            if stop is not None and stop():
+                return None
+            await asyncio.sleep(min(retry, 0.1))
+
+    def _account(self, waited: float) -> None:
+        with self._cond:
+            self.total_wait += waited
+
+
+_shared_connect_limiter: Optional[ConnectRateLimiter] = None
+_shared_connect_limiter_lock = threading.Lock()
+
+
+def get_shared_connect_limiter(config: Optional[Dict[str, Any]] = None) -> Optional[ConnectRateLimiter]:
+    """进程内共享的 connect 限速器（线程池、异步批量、批量探测、TLS 验证共用）；未启用时返回 None。
+
+    config 为完整的测速配置（缺省为 SPEED_TEST_CONFIG），其 rate_limit 段会同步到共享实例。
+    """
+    global _shared_connect_limiter
+    cfg = config if isinstance(config, dict) else SPEED_TEST_CONFIG
+    rl = cfg.get("rate_limit", {}) if isinstance(cfg, dict) else {}
+    if not isinstance(rl, dict) or not rl.get("enabled", True):
+        return None
+    params = dict(
+        rate=rl.get("connects_per_sec", 500),
+        burst=rl.get("burst", 100),
+        per_prefix=rl.get("per_prefix_inflight", 16),
+        ipv4_prefix=rl.get("ipv4_prefix", 24),
+        ipv6_prefix=rl.get("ipv6_prefix", 48),
+    )
+    with _shared_connect_limiter_lock:
+        if _shared_connect_limiter is None:
+            _shared_connect_limiter = ConnectRateLimiter(**params)
+        else:
+            _shared_connect_limiter.update(**params)
+        return _shared_connect_limiter
+
+
+class AimdConcurrencyController:
+    """测速并发度的自适应控制（AIMD：加性增、乘性减），线程安全。
+
+    后台线程每 interval 秒对一组固定的对照 IP 各做一次 connect：
+    - 对照组 RTT 中位数不超过"历史最低 RTT × rtt_tolerance + rtt_slack_ms"且没有超时：并发度 + step
+    - RTT 明显抬高或对照 IP 出现超时：并发度 × decrease
+    历史最低 RTT 作为基线（类似 LEDBAT 的 base delay），即使开始时已有负载也会随后收敛到真实值。
+    从未连通过的对照 IP 在前几轮后剔除，避免死 IP 的超时被当作拥塞信号。
+
+    使用方式：
+    - 线程池 / 协程：acquire()/release() 或 acquire_async()，同时进行的测速数不超过当前并发度
+    - MassTcpProber：直接读取 level 作为在途连接上限
+    并发度按 key（"pool" / "mass"）保存到用户数据目录，下次以上次的值起步。
+    """
+
+    # 对照 IP 连续这么多轮都没有连通过则剔除
+    WARMUP_TICKS = 3
+
+    def __init__(
+        self,
+        *,
+        key: str = "pool",
+        control_ips: Iterable[str] = (),
+        port: int = 443,
+        initial: int = 30,
+        min_level: int = 4,
+        max_level: int = 120,
+        step: int = 4,
+        decrease: float = 0.7,
+        rtt_tolerance: float = 1.5,
+        rtt_slack_ms: float = 5.0,
+        interval: float = 0.5,
+        timeout: float = 1.0,
+        state_path: Optional[str] = None,
+        app_name: str = APP_NAME,
+    ) -> None:
+        self.key = key
+        self.port = int(port)
+        self.min_level = max(1, int(min_level))
+        self.max_level = max(self.min_level, int(max_level))
+        self.step = max(1, int(step))
+        self.decrease = min(0.95, max(0.1, float(decrease)))
+        self.rtt_tolerance = max(1.0, float(rtt_tolerance))
+        self.rtt_slack_ms = max(0.0, float(rtt_slack_ms))
+        self.interval = max(0.05, float(interval))
+        self.timeout = float(timeout)
+        self.state_path = state_path or user_data_path(app_name, "concurrency.json")
+        self._control: List[str] = list(dict.fromkeys(str(ip).strip() for ip in control_ips if str(ip).strip()))
+        self._seen_ok: Set[str] = set()
+        self._cond = threading.Condition()
+        self._active = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ticks = 0
+        saved = safe_read_json(self.state_path, {})
+        start = saved.get(key, initial) if isinstance(saved, dict) else initial
+        try:
+            start = int(start)
+        except (TypeError, ValueError):
+            start = int(initial)
+        self._level = min(self.max_level, max(self.min_level, start))
+        self.base_rtt: Optional[float] = None
+        self.last_rtt: Optional[float] = None
+        # (时间戳, 并发度, 对照组 RTT 中位数)：每次调整记录一条，供日志 / 界面
+        self.history: List[Tuple[float, int, Optional[float]]] = [(time.time(), self._level, None)]
+        self.on_change: Optional[Callable[[int, int, str], None]] = None
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    @property
+    def control_ips(self) -> List[str]:
+        return list(self._control)
+
+    # ---- 并发闸门 ----
+    def acquire(self, stop: Optional[Callable[[], bool]] = None) -> bool:
+        """阻塞直到正在进行的测速数低于当前并发度；stop() 为真时返回 False。"""
+        with self._cond:
+            while self._active >= self._level:
+                if stop is not None and stop():
+                    return False
+                self._cond.wait(0.1)
+            self._active += 1
+            return True
+
+    async def acquire_async(self, stop: Optional[Callable[[], bool]] = None) -> bool:
+        while True:
+            with self._cond:
+                if self._active < self._level:
+                    self._active += 1
+                    return True
+            if stop is not None and stop():
+                return False
+            await asyncio.sleep(0.01)
+
+    def release(self) -> None:
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify()
+
+    # ---- 控制回路 ----
+    def start(self) -> "AimdConcurrencyController":
+        if self._thread is None and self._control:
+            self._thread = threading.Thread(target=self._loop, name=f"aimd-{self.key}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, *, save: bool = True) -> None:
+        """停止控制回路（不等待后台线程退出，GUI 主线程可直接调用）并保存当前并发度。"""
+        self._stop.set()
+        self._thread = None
+        if save:
+            self.save()
+
+    def save(self) -> None:
+        data = safe_read_json(self.state_path, {})
+        if not isinstance(data, dict):
+            data = {}
+        data[self.key] = self._level
+        try:
+            atomic_write_json(self.state_path, data)
+        except OSError as e:
+            get_logger().debug(f"保存并发度失败: {e}")
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def _measure(self) -> Tuple[List[float], int]:
+        """对照 IP 各 connect 一次，返回 (成功的 RTT 列表, 曾连通过的 IP 中的失败数)。
+
+        对照测量不经过 connect 限速器：要测的正是没有排队时的链路延迟。
+        """
+        rtts: List[float] = []
+        failures = 0
+        for ip in list(self._control):
+            if self._stop.is_set():
+                break
+            s, rtt, _ = SpeedTester._tcp_connect(ip, port=self.port, timeout=self.timeout)
+            if s is not None:
+                s.close()
+                rtts.append(rtt)
+                self._seen_ok.add(ip)
+            elif ip in self._seen_ok:
+                failures += 1
+        return rtts, failures
+
+    def tick(self) -> int:
+        """测量一轮对照组并调整并发度，返回调整后的值。"""
+        rtts, failures = self._measure()
+        self._ticks += 1
+        if self._ticks == self.WARMUP_TICKS:
+            self._control = [ip for ip in self._control if ip in self._seen_ok]
+        if not rtts and not failures:
+            return self._level
+
+        old = self._level
+        med = statistics.median(rtts) if rtts else None
+        self.last_rtt = med
+        if rtts:
+            low = min(rtts)
+            self.base_rtt = low if self.base_rtt is None else min(self.base_rtt, low)
+        limit = (self.base_rtt or 0.0) * self.rtt_tolerance + self.rtt_slack_ms
+        if failures or med is None or med > limit:
+            new = max(self.min_level, int(old * self.decrease))
+            reason = f"对照组超时 {failures} 次" if failures else f"对照组 RTT {med:.1f}ms > {limit:.1f}ms"
+        else:
+            new = min(self.max_level, old + self.step)
+            reason = f"对照组 RTT {med:.1f}ms，基线 {self.base_rtt:.1f}ms"
+        if new != old:
+            with self._cond:
+                self._level = new
+                self._cond.notify_all()
+            self.history.append((time.time(), new, med))
+            if self.on_change is not None:
+                self.on_change(old, new, reason)
+        return new
+
+
+class TlsSessionCache:
+    """TLS 客户端上下文与会话缓存（LRU，线程安全）。
+
+    - context(verify_hostname)：按是否校验证书各复用一个 SSLContext，省去每次握手重新加载 CA 证书；
+    - 会话按 (ip, port, host, verify_hostname) 缓存，用于测量恢复握手（session resumption）耗时。
+      会话只能在创建它的 SSLContext 上使用，因此上下文与会话放在同一个对象里管理。
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max(1, int(max_entries))
+        self._contexts: Dict[bool, ssl.SSLContext] = {}
+        self._sessions: "OrderedDict[Tuple[str, int, str, bool], ssl.SSLSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 统计：恢复握手次数 / 服务器实际接受恢复的次数
+        self.resume_attempts = 0
+        self.resumed = 0
+
+    def context(self, verify_hostname: bool = True) -> ssl.SSLContext:
+        verify = bool(verify_hostname)
+        with self._lock:
+            ctx = self._contexts.get(verify)
+            if ctx is None:
+                ctx = ssl.create_default_context()
+                ctx.check_hostname = verify
+                ctx.verify_mode = ssl.CERT_REQUIRED if verify else ssl.CERT_NONE
+                self._contexts[verify] = ctx
+            return ctx
+
+    def get(self, key: Tuple[str, int, str, bool]) -> Optional[ssl.SSLSession]:
+        with self._lock:
+            sess = self._sessions.get(key)
+            if sess is not None:
+                self._sessions.move_to_end(key)
+            return sess
+
+    def put(self, key: Tuple[str, int, str, bool], session: Optional[ssl.SSLSession], version: Optional[str]) -> bool:
+        """保存可恢复的会话；TLS 1.3 只有收到 NewSessionTicket 后才可恢复。返回是否保存。"""
+        if session is None or (version == "TLSv1.3" and not session.has_ticket):
+            return False
+        if not (session.has_ticket or session.id):
+            return False
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+        return True
+
+    def record_resume(self, resumed: bool) -> None:
+        with self._lock:
+            self.resume_attempts += 1
+            if resumed:
+                self.resumed += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self.resume_attempts = 0
+            self.resumed = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+_shared_tls_session_cache: Optional[TlsSessionCache] = None
+_shared_tls_session_cache_lock = threading.Lock()
+
+
+def get_shared_tls_session_cache() -> TlsSessionCache:
+    """进程内共享的 TLS 上下文与会话缓存（同步/异步握手、批量探测共用）。"""
+    global _shared_tls_session_cache
+    with _shared_tls_session_cache_lock:
+        if _shared_tls_session_cache is None:
+            _shared_tls_session_cache = TlsSessionCache()
+        return _shared_tls_session_cache
+
+
+class IcmpEchoEngine:
+    """进程内 ICMP echo（Linux 非特权 ping 套接字：SOCK_DGRAM + IPPROTO_ICMP / IPPROTO_ICMPV6）。
+
+    每个地址族共用一个套接字，由一个后台线程统一接收回复，按 序号 + 源地址 匹配到等待中的请求，
+    因此任意多个线程 / 协程可以同时有 echo 在途，每次 ping 只是一次 sendto，不再启动 ping 子进程。
+    内核会改写 ICMP 标识符（取套接字的本地“端口”）并填写校验和，所以只用序号区分请求；
+    回复的负载必须与本实例发出的一致，其余报文忽略。
+    系统不允许非特权 ICMP（net.ipv4.ping_group_range 不包含当前用户组）时两个地址族都不可用，
+    available() 为 False，调用方回退到 ping 子进程。
+    """
 
-        res: List[Tuple[str, str]] = []
-        for dom, ips_result in zip(ds, results):
-            if isinstance(ips_result, Exception):
-                continue
-            if isinstance(ips_result, list) and ips_result:
-                for ip in ips_result:
-                    res.append((ip, dom))
+    _ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+    _ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
 
-        return res
+    def __init__(self) -> None:
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._socks: Dict[int, socket.socket] = {}
+        for family, proto in ((socket.AF_INET, socket.IPPROTO_ICMP), (socket.AF_INET6, socket.IPPROTO_ICMPV6)):
+            try:
+                sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+            except OSError:
+                continue
+            try:
+                # 大量 echo 同时在途时回复成批到达，默认接收缓冲区容易溢出丢包
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            except OSError:
+                pass
+            self._socks[family] = sock
+        # (family, seq) -> (目标地址, 发送时刻, 回调)；回调参数为 RTT 毫秒，超时/取消不回调
+        self._pending: Dict[Tuple[int, int], Tuple[str, float, Callable[[float], None]]] = {}
+        self._seq = random.randrange(0x10000)
+        self._payload = os.urandom(16)
+        self._closed = False
+        self.sent = 0
+        self.received = 0
+        if self._socks:
+            threading.Thread(target=self._recv_loop, name="icmp-echo", daemon=True).start()
+
+    def available(self) -> bool:
+        return bool(self._socks) and not self._closed
+
+    def supports(self, ip: str) -> bool:
+        """该地址所在的地址族是否可用。"""
+        try:
+            family = socket.AF_INET6 if ipaddress.ip_address(ip).version == 6 else socket.AF_INET
+        except ValueError:
+            return False
+        return family in self._socks and not self._closed
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._pending.clear()
+            socks, self._socks = list(self._socks.values()), {}
+        for sock in socks:
+            try:
+                sock.close()
+            except OSError:
+                pass
 
-    @staticmethod
-    async def _resolve_single_domain_async(
-        domain: str,
-        ipv4_only: bool,
-        ipv6_only: bool,
-    ) -> List[str]:
-        """异步解析单个域名，返回 IP 列表。"""
-        loop = asyncio.get_event_loop()
+    def _send(self, ip: str, callback: Callable[[float], None]) -> Optional[Tuple[int, int]]:
+        """发出一个 echo 请求并登记回调，返回登记键；地址非法或发送失败返回 None。"""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        family = socket.AF_INET6 if addr.version == 6 else socket.AF_INET
+        with self._lock:
+            sock = self._socks.get(family)
+            if sock is None:
+                return None
+            # 跳过仍在途的序号（在途超过 65536 个时放弃）
+            for _ in range(0x10000):
+                self._seq = (self._seq + 1) & 0xFFFF
+                key = (family, self._seq)
+                if key not in self._pending:
+                    break
+            else:
+                return None
+            packet = struct.pack("!BBHHH", self._ECHO_REQUEST[family], 0, 0, 0, self._seq) + self._payload
+            self._pending[key] = (str(addr), time.perf_counter(), callback)
+        try:
+            sock.sendto(packet, (str(addr), 0))
+        except OSError:
+            self._cancel(key)
+            return None
+        self.sent += 1
+        return key
+
+    def _cancel(self, key: Tuple[int, int]) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _recv_loop(self) -> None:
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                socks = list(self._socks.items())
+            try:
+                readable, _, _ = select.select([s for _, s in socks], [], [], 0.5)
+            except (OSError, ValueError):
+                # 套接字在 select 期间被 close
+                continue
+            now = time.perf_counter()
+            for family, sock in socks:
+                if sock not in readable:
+                    continue
+                try:
+                    data, src = sock.recvfrom(2048)
+                except OSError:
+                    continue
+                self._on_packet(family, data, src[0], now)
 
+    def _on_packet(self, family: int, data: bytes, src: str, now: float) -> None:
+        if len(data) < 8 or data[0] != self._ECHO_REPLY[family] or data[8:] != self._payload:
+            return
+        seq = struct.unpack("!H", data[6:8])[0]
         try:
-            # 使用 run_in_executor 将同步的 getaddrinfo 放到线程池执行
-            results = await loop.run_in_executor(
-                None,
-                lambda: socket.getaddrinfo(domain, None)
-            )
+            src = str(ipaddress.ip_address(src.split("%", 1)[0]))
+        except ValueError:
+            return
+        with self._lock:
+            entry = self._pending.get((family, seq))
+            if entry is None or entry[0] != src:
+                return
+            del self._pending[(family, seq)]
+        self.received += 1
+        try:
+            entry[2]((now - entry[1]) * 1000.0)
+        except Exception as e:
+            self.logger.debug(f"ICMP 回调异常: {e}")
 
-            ips = []
-            for result in results:
-                sockaddr = result[4]
+    def ping(self, ip: str, *, timeout_ms: int = 1200) -> Optional[float]:
+        """ping 一次，返回 RTT 毫秒（浮点），超时或发送失败返回 None。"""
+        done = threading.Event()
+        result: List[float] = []
 
-                if sockaddr:
-                    ip = sockaddr[0]
-                    ip_obj = ipaddress.ip_address(ip)
+        def on_reply(ms: float) -> None:
+            result.append(ms)
+            done.set()
 
-                    # 根据配置过滤
-                    if ipv4_only and ip_obj.version != 4:
-                        continue
-                    if ipv6_only and ip_obj.version != 6:
-                        continue
+        key = self._send(ip, on_reply)
+        if key is None:
+            return None
+        if not done.wait(max(0.0, timeout_ms / 1000.0)):
+            self._cancel(key)
+        return result[0] if result else None
 
-                    if ip not in ips:
-                        ips.append(ip)
+    async def ping_async(self, ip: str, *, timeout_ms: int = 1200) -> Optional[float]:
+        """异步 ping 一次：回复由接收线程投递到事件循环，不占用线程池。"""
+        loop = asyncio.get_running_loop()
+        fut: "asyncio.Future[float]" = loop.create_future()
 
-            return ips
+        def deliver(ms: float) -> None:
+            if not fut.done():
+                fut.set_result(ms)
 
-        except Exception:
-            return []
+        key = self._send(ip, lambda ms: loop.call_soon_threadsafe(deliver, ms))
+        if key is None:
+            return None
+        try:
+            return await asyncio.wait_for(fut, max(0.0, timeout_ms / 1000.0))
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._cancel(key)
+
+    def ping_many(self, ips: Iterable[str], *, timeout_ms: int = 1200) -> Dict[str, Optional[float]]:
+        """同时向一批 IP 发出 echo，共用一个超时，返回 ip -> RTT 毫秒（未回复为 None）。"""
+        cond = threading.Condition()
+        results: Dict[str, Optional[float]] = {}
+        keys: List[Tuple[int, int]] = []
+        waiting = 0
+        for ip in dict.fromkeys(ips):
+            results[ip] = None
+
+            def on_reply(ms: float, ip: str = ip) -> None:
+                nonlocal waiting
+                with cond:
+                    results[ip] = ms
+                    waiting -= 1
+                    cond.notify()
+
+            with cond:
+                waiting += 1
+            key = self._send(ip, on_reply)
+            if key is None:
+                with cond:
+                    waiting -= 1
+            else:
+                keys.append(key)
+        deadline = time.monotonic() + max(0.0, timeout_ms / 1000.0)
+        with cond:
+            while waiting > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                cond.wait(remaining)
+        for key in keys:
+            self._cancel(key)
+        return results
+
+
+_shared_icmp_engine: Optional[IcmpEchoEngine] = None
+_shared_icmp_engine_checked = False
+_shared_icmp_engine_lock = threading.Lock()
+
+
+def get_shared_icmp_engine() -> Optional[IcmpEchoEngine]:
+    """进程内共享的 ICMP echo 引擎；非 Linux 或系统不允许非特权 ICMP 时返回 None（调用方回退到 ping 子进程）。"""
+    global _shared_icmp_engine, _shared_icmp_engine_checked
+    with _shared_icmp_engine_lock:
+        if not _shared_icmp_engine_checked:
+            _shared_icmp_engine_checked = True
+            if sys.platform.startswith("linux"):
+                engine = IcmpEchoEngine()
+                if engine.available():
+                    _shared_icmp_engine = engine
+                else:
+                    get_logger().info("系统未开放非特权 ICMP（net.ipv4.ping_group_range），ICMP 回退不可用")
+        return _shared_icmp_engine
 
 
-# ---------------------------------------------------------------------
-# Speed Test
-# ---------------------------------------------------------------------
 class SpeedTester:
     """TCP 延迟测速（多次取中位数）+ 可选 ICMP ping 回退。
 
@@ -530,6 +4030,8 @@ class SpeedTester:
     - 批量并发测速
 
     stop_event/stop_flag 用于外部中断（GUI 点"暂停测速"）。
+    limiter 为 connect 限速器，缺省使用进程内共享实例（见 get_shared_connect_limiter）；
+    传入 ConnectRateLimiter() 即不限速。
     """
 
     def __init__(
@@ -538,10 +4040,27 @@ class SpeedTester:
         icmp_fallback: bool = True,
         stop_event: Optional["threading.Event"] = None,
         stop_flag: Optional[Callable[[], bool]] = None,
+        limiter: Optional[ConnectRateLimiter] = None,
     ) -> None:
         self.icmp_fallback = bool(icmp_fallback)
         self.stop_event = stop_event
         self.stop_flag = stop_flag
+        self.limiter = limiter if limiter is not None else get_shared_connect_limiter(getattr(self, "config", None))
+
+    def _acquire_connect(self, ip: str) -> Optional[float]:
+        """connect 前向限速器取令牌，返回排队秒数；已停止时返回 None。"""
+        if self.limiter is None:
+            return 0.0
+        return self.limiter.acquire(ip, stop=self._should_stop)
+
+    async def _acquire_connect_async(self, ip: str) -> Optional[float]:
+        if self.limiter is None:
+            return 0.0
+        return await self.limiter.acquire_async(ip, stop=self._should_stop)
+
+    def _release_connect(self, ip: str) -> None:
+        if self.limiter is not None:
+            self.limiter.release(ip)
 
     def _should_stop(self) -> bool:
         if self.stop_event is not None and self.stop_event.is_set():
@@ -559,6 +4078,20 @@ class SpeedTester:
         except Exception:
             return socket.AF_INET  # 默认使用 IPv4
 
+    @staticmethod
+    def _sockaddr(ip: str, port: int) -> Tuple[Any, ...]:
+        """connect 用的 sockaddr：IPv6 为 (host, port, flowinfo, scope_id) 四元组。
+
+        IPv6 经 getaddrinfo(AI_NUMERICHOST) 转换（不触发 DNS），链路本地地址的 "%网卡" 会正确换算成 scope_id。
+        """
+        if SpeedTester._get_ip_family(ip) != socket.AF_INET6:
+            return (ip, port)
+        try:
+            infos = socket.getaddrinfo(ip, port, socket.AF_INET6, socket.SOCK_STREAM, 0, socket.AI_NUMERICHOST)
+            return infos[0][4]
+        except socket.gaierror:
+            return (ip, port, 0, 0)
+
     @staticmethod
     def _tcp_connect_rtt_ms(
         ip: str,
@@ -570,29 +4103,101 @@ class SpeedTester:
 
         成功返回 (rtt_ms, None)，失败返回 (None, err_str)。
         """
-        family = SpeedTester._get_ip_family(ip)
-        s = socket.socket(family, socket.SOCK_STREAM)
+        s, rtt, err = SpeedTester._tcp_connect(ip, port=port, timeout=timeout)
+        if s is not None:
+            s.close()
+        return rtt, err
+
+    @staticmethod
+    def _tcp_connect(
+        ip: str,
+        *,
+        port: int = 443,
+        timeout: float = 2.0,
+    ) -> Tuple[Optional[socket.socket], Optional[float], Optional[str]]:
+        """阻塞式 TCP connect 并计时。
+
+        成功返回 (已连接的 socket, rtt_ms, None)，由调用方负责关闭；失败返回 (None, None, err_str)。
+        """
+        try:
+            s = socket.socket(SpeedTester._get_ip_family(ip), socket.SOCK_STREAM)
+        except Exception as e:
+            return None, None, f"err:{e}"
         try:
             s.settimeout(timeout)
+            addr = SpeedTester._sockaddr(ip, port)
             t0 = time.perf_counter_ns()
-            addr = (ip, port, 0, 0) if family == socket.AF_INET6 else (ip, port)
             err = s.connect_ex(addr)
             t1 = time.perf_counter_ns()
             if err != 0:
-                return None, f"connect_ex_err:{err}"
+                s.close()
+                return None, None, f"connect_ex_err:{err}"
             so_err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
             if so_err != 0:
-                return None, f"so_error:{so_err}"
-            return (t1 - t0) / 1_000_000.0, None
+                s.close()
+                return None, None, f"so_error:{so_err}"
+            return s, (t1 - t0) / 1_000_000.0, None
         except socket.timeout:
-            return None, "timeout"
+            err_str = "timeout"
         except Exception as e:
-            return None, f"err:{e}"
-        finally:
+            err_str = f"err:{e}"
+        try:
+            s.close()
+        except Exception:
+            pass
+        return None, None, err_str
+
+    def _tcp_samples(
+        self,
+        ip: str,
+        *,
+        port: int = 443,
+        attempts: int = 5,
+        timeout: float = 2.0,
+        interval: float = 0.02,
+        keep_socket: bool = False,
+    ) -> Tuple[List[float], Optional[str], Optional[socket.socket], float]:
+        """多次 TCP connect 采样，返回 (latencies, last_err, sock, queue_ms)。
+
+        keep_socket=True 时保留最后一次成功的连接（更早的立即关闭），供 TLS 验证直接在其上握手；
+        否则 sock 恒为 None。queue_ms 为在限速器前累计排队的时间，不计入延迟样本。
+        """
+        latencies: List[float] = []
+        last_err: Optional[str] = None
+        kept: Optional[socket.socket] = None
+        queued = 0.0
+        for _ in range(max(1, int(attempts))):
+            if self._should_stop():
+                break
+            waited = self._acquire_connect(ip)
+            if waited is None:
+                break
+            queued += waited
             try:
-                s.close()
-            except Exception:
-                pass
+                s, rtt, err = self._tcp_connect(ip, port=port, timeout=timeout)
+            finally:
+                self._release_connect(ip)
+            last_err = err
+            if s is not None:
+                latencies.append(rtt)
+                if keep_socket:
+                    if kept is not None:
+                        kept.close()
+                    kept = s
+                else:
+                    s.close()
+            time.sleep(interval)
+        return latencies, last_err, kept, queued * 1000.0
+
+    def _tls_reuse_enabled(self, tls_verify: Optional[bool] = None) -> bool:
+        """TLS 验证开启且 tls.reuse_tcp 为 True 时，TLS 握手复用测速时建立的 TCP 连接。"""
+        cfg = getattr(self, "config", None)
+        base_cfg = cfg if isinstance(cfg, dict) else (SPEED_TEST_CONFIG if isinstance(SPEED_TEST_CONFIG, dict) else {})
+        tls_cfg = base_cfg.get("tls", {}) if isinstance(base_cfg, dict) else {}
+        if not isinstance(tls_cfg, dict):
+            return False
+        tls_enabled = bool(tls_cfg.get("enabled", True)) if tls_verify is None else bool(tls_verify)
+        return tls_enabled and bool(tls_cfg.get("reuse_tcp", True))
 
 
 
@@ -623,39 +4228,276 @@ class SpeedTester:
         port: int = 443,
         timeout: float = 3.0,
         verify_hostname: bool = True,
+        metrics: Optional[Dict[str, Any]] = None,
     ) -> Tuple[bool, Optional[str]]:
         """对 (ip:port) 执行一次 TLS 握手，并使用 host 作为 SNI/主机名校验。
 
         用途：避免“TCP 可连但并不是目标域名服务”的假可用 IP（例如证书/主机名不匹配）。
+        传入 metrics 时记录完整握手耗时 tls_handshake_ms，并按 tls.resume 追加一次恢复握手
+        （tls_resume_ms / tls_resumed，见 _tls_resume_probe）；http_probe 开启时还在该连接上
+        发 HEAD 记录 http_ttfb_ms / http_status（见 _http_head）。
         返回 (ok, err_str)。
         """
         h = self._normalize_sni_host(host)
         if not h:
             return True, None
 
+        resume = metrics is not None and self._tls_resume_enabled()
+        info: Dict[str, Any] = {}
+        ok, err, hs_ms = self._tls_connect_handshake(
+            ip, h, port=port, timeout=timeout, verify_hostname=verify_hostname, store_session=resume,
+            info=info, http_path=self._http_probe_path() if metrics is not None else None,
+        )
+        if ok and metrics is not None:
+            metrics["tls_handshake_ms"] = hs_ms
+            metrics.update(info)
+            if resume:
+                self._tls_resume_probe(ip, h, metrics, port=port, timeout=timeout, verify_hostname=verify_hostname)
+        return ok, err
+
+    def _tls_resume_enabled(self) -> bool:
+        """tls.resume 为 True 时，完整握手成功后再用缓存的会话做一次恢复握手并记录其耗时。"""
+        cfg = getattr(self, "config", None)
+        base_cfg = cfg if isinstance(cfg, dict) else (SPEED_TEST_CONFIG if isinstance(SPEED_TEST_CONFIG, dict) else {})
+        tls_cfg = base_cfg.get("tls", {}) if isinstance(base_cfg, dict) else {}
+        return isinstance(tls_cfg, dict) and bool(tls_cfg.get("resume", True))
+
+    def _tls_connect_handshake(
+        self,
+        ip: str,
+        host: str,
+        *,
+        port: int = 443,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+        store_session: bool = False,
+        resume: bool = False,
+        info: Optional[Dict[str, Any]] = None,
+        http_path: Optional[str] = None,
+    ) -> Tuple[bool, Optional[str], Optional[float]]:
+        """新建 TCP 连接后做 TLS 握手，返回 (ok, err_str, handshake_ms)。参数含义同 _tls_handshake。"""
+        if self._acquire_connect(ip) is None:
+            return False, "stopped", None
         try:
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = bool(verify_hostname)
-            ctx.verify_mode = ssl.CERT_REQUIRED if verify_hostname else ssl.CERT_NONE
-
-            family = self._get_ip_family(ip)
-            with socket.socket(family, socket.SOCK_STREAM) as sock:
-                sock.settimeout(timeout)
-                addr = (ip, port, 0, 0) if family == socket.AF_INET6 else (ip, port)
-                sock.connect(addr)
-                with ctx.wrap_socket(sock, server_hostname=h) as ssock:
-                    ssock.settimeout(timeout)
-                    ssock.do_handshake()
-            return True, None
+            sock, _, err = self._tcp_connect(ip, port=port, timeout=timeout)
+        finally:
+            self._release_connect(ip)
+        if sock is None:
+            return False, "timeout" if err == "timeout" else f"err:{err}", None
+        return self._tls_handshake(
+            sock,
+            host,
+            timeout=timeout,
+            verify_hostname=verify_hostname,
+            session_key=(ip, port, host, bool(verify_hostname)) if (store_session or resume) else None,
+            store_session=store_session,
+            resume=resume,
+            info=info,
+            http_path=http_path,
+        )
+
+    @staticmethod
+    def _tls_handshake(
+        sock: socket.socket,
+        host: str,
+        *,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+        session_key: Optional[Tuple[str, int, str, bool]] = None,
+        store_session: bool = False,
+        resume: bool = False,
+        info: Optional[Dict[str, Any]] = None,
+        http_path: Optional[str] = None,
+    ) -> Tuple[bool, Optional[str], Optional[float]]:
+        """在已连接的 TCP socket 上做 TLS 握手（SNI=host），返回 (ok, err_str, handshake_ms)。
+
+        只计握手本身的耗时；无论成败 socket 都会被关闭。
+        对端已关闭空闲连接时返回 "eof:..."，调用方可据此换新连接重试。
+        session_key 为会话缓存键 (ip, port, host, verify_hostname)：
+        - store_session=True：握手成功后把会话存入共享缓存（TLS 1.3 会短暂等待服务器下发的会话票据）；
+        - resume=True：带上缓存的会话握手，info["resumed"] 记录服务器是否接受了恢复。
+        http_path 不为 None 且传入 info 时，握手后在同一连接上发 HEAD（见 _http_head）。
+        """
+        cache = get_shared_tls_session_cache()
+        try:
+            ctx = cache.context(verify_hostname)
+            session = cache.get(session_key) if (resume and session_key is not None) else None
+            sock.settimeout(timeout)
+            with ctx.wrap_socket(
+                sock, server_hostname=host, do_handshake_on_connect=False, session=session
+            ) as ssock:
+                t0 = time.perf_counter_ns()
+                ssock.do_handshake()
+                t1 = time.perf_counter_ns()
+                hs_ms = (t1 - t0) / 1_000_000.0
+                if resume:
+                    cache.record_resume(ssock.session_reused)
+                    if info is not None:
+                        info["resumed"] = ssock.session_reused
+                if http_path is not None and info is not None:
+                    SpeedTester._http_head(ssock, host, http_path, info)
+                if store_session and session_key is not None:
+                    # 做过 HEAD 时，读响应的过程中通常已收到会话票据，这里会立即返回
+                    if ssock.version() == "TLSv1.3":
+                        SpeedTester._await_session_ticket(ssock, min(timeout, max(0.05, hs_ms * 2 / 1000.0)))
+                    cache.put(session_key, ssock.session, ssock.version())
+            return True, None, hs_ms
         except ssl.SSLCertVerificationError as e:
-            return False, f"cert_verify:{e}"
+            return False, f"cert_verify:{e}", None
+        except (ssl.SSLEOFError, ssl.SSLZeroReturnError, ConnectionResetError, BrokenPipeError) as e:
+            return False, f"eof:{e}", None
         except ssl.SSLError as e:
-            return False, f"ssl_error:{e}"
+            return False, f"ssl_error:{e}", None
         except socket.timeout:
-            return False, "timeout"
+            return False, "timeout", None
         except Exception as e:
-            return False, f"err:{e}"
+            return False, f"err:{e}", None
+        finally:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _await_session_ticket(ssock: ssl.SSLSocket, wait: float) -> None:
+        """TLS 1.3 的会话票据在握手完成后约一个 RTT 才到达：最多等待 wait 秒，收到即返回。
+
+        票据只有在读取时才会被 OpenSSL 处理，因此先非阻塞地读一次（票据可能已在缓冲区里，
+        select 看不到 OpenSSL 已缓冲的记录），再按 select 等待后续数据。
+        等不到票据时不缓存会话，恢复探测记 tls_resume_error="no_ticket"，排序退回完整握手耗时。
+        """
+        def has_ticket() -> bool:
+            return ssock.session is not None and ssock.session.has_ticket
+
+        deadline = time.perf_counter() + wait
+        ssock.setblocking(False)
+        try:
+            while not has_ticket():
+                try:
+                    # 读取会让 OpenSSL 处理 NewSessionTicket；没有应用数据时抛 SSLWantReadError
+                    if not ssock.recv(1):
+                        break
+                    continue
+                except ssl.SSLWantReadError:
+                    if has_ticket():
+                        break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([ssock], [], [], remaining)
+                if not readable:
+                    break
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _http_head_request(host: str, path: str) -> bytes:
+        return (
+            f"HEAD {path or '/'} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: SmartHostsTool\r\n"
+            "Accept: */*\r\nConnection: close\r\n\r\n"
+        ).encode("ascii", "ignore")
+
+    @staticmethod
+    def _parse_http_status(data: bytes) -> Optional[int]:
+        """从响应首行（HTTP/1.x 200 OK）取状态码，格式不对返回 None。"""
+        parts = data.split(b"\r\n", 1)[0].split()
+        if len(parts) >= 2 and parts[0].startswith(b"HTTP/") and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+    @staticmethod
+    def _http_head(ssock: ssl.SSLSocket, host: str, path: str, info: Dict[str, Any]) -> None:
+        """在已握手的 TLS 连接上发一个最小的 HEAD 请求（Host=host）。
+
+        记录 http_ttfb_ms（请求发出到响应首字节）与 http_status；失败时记录 http_error。
+        """
+        try:
+            request = SpeedTester._http_head_request(host, path)
+            t0 = time.perf_counter_ns()
+            ssock.sendall(request)
+            data = ssock.recv(4096)
+            t1 = time.perf_counter_ns()
+            if not data:
+                info["http_error"] = "eof"
+                return
+            info["http_ttfb_ms"] = (t1 - t0) / 1_000_000.0
+            while b"\r\n" not in data and len(data) < 8192:
+                more = ssock.recv(4096)
+                if not more:
+                    break
+                data += more
+            status = SpeedTester._parse_http_status(data)
+            if status is None:
+                info["http_error"] = "bad_response"
+            else:
+                info["http_status"] = status
+        except socket.timeout:
+            info["http_error"] = "timeout"
+        except (ssl.SSLError, OSError) as e:
+            info["http_error"] = f"err:{e}"
+
+    def _http_probe_path(self) -> Optional[str]:
+        """http_probe.enabled 为 True 时返回 HEAD 请求路径，否则 None（不做 HTTP 探测）。"""
+        cfg = getattr(self, "config", None)
+        base_cfg = cfg if isinstance(cfg, dict) else (SPEED_TEST_CONFIG if isinstance(SPEED_TEST_CONFIG, dict) else {})
+        hp = base_cfg.get("http_probe", {}) if isinstance(base_cfg, dict) else {}
+        if not isinstance(hp, dict) or not hp.get("enabled", False):
+            return None
+        return str(hp.get("path") or "/")
+
+    @staticmethod
+    def blended_latency_ms(metrics: Dict[str, Any], weights: Optional[Dict[str, Any]] = None) -> Optional[float]:
+        """按权重合成 建连 + TLS + 首字节 的延迟（ms），用于排序；没有 HTTP 探测结果时返回 None。
+
+        TLS 一项优先取恢复握手耗时（tls_resume_ms），其次完整握手耗时；
+        weights 形如 {"connect": 1.0, "tls": 1.0, "ttfb": 1.0}，缺省各为 1.0（即新建连接到首字节的总耗时）。
+        """
+        if not isinstance(metrics, dict) or metrics.get("http_ttfb_ms") is None:
+            return None
+        w = weights if isinstance(weights, dict) else {}
+        connect = metrics.get("tcp_connect_ms")
+        if connect is None:
+            connect = metrics.get("median")
+        tls = metrics.get("tls_resume_ms")
+        if tls is None:
+            tls = metrics.get("tls_handshake_ms")
+        try:
+            return (
+                float(w.get("connect", 1.0)) * float(connect or 0.0)
+                + float(w.get("tls", 1.0)) * float(tls or 0.0)
+                + float(w.get("ttfb", 1.0)) * float(metrics["http_ttfb_ms"])
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def _tls_resume_probe(
+        self,
+        ip: str,
+        host: str,
+        metrics: Dict[str, Any],
+        *,
+        port: int = 443,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+    ) -> None:
+        """用完整握手时缓存的会话新建连接再握手一次，记录 tls_resume_ms / tls_resumed。
 
+        实际的 git/HTTPS 流量大多走恢复握手，按恢复握手耗时排序更接近真实体验；
+        服务器不给会话（或拒绝恢复）时 tls_resumed=False。
+        完整握手没有拿到可恢复的会话（TLS 1.3 票据未在等待时间内到达）时不做恢复握手，
+        记 tls_resume_error="no_ticket"，blended_latency_ms 退回使用 tls_handshake_ms。
+        """
+        if get_shared_tls_session_cache().get((ip, port, host, bool(verify_hostname))) is None:
+            metrics["tls_resumed"] = False
+            metrics["tls_resume_error"] = "no_ticket"
+            return
+        info: Dict[str, Any] = {}
+        ok, _, ms = self._tls_connect_handshake(
+            ip, host, port=port, timeout=timeout, verify_hostname=verify_hostname, resume=True, info=info
+        )
+        if ok:
+            metrics["tls_resume_ms"] = ms
+            metrics["tls_resumed"] = bool(info.get("resumed"))
 
     def tls_sni_verify_any(
         self,
@@ -666,9 +4508,17 @@ class SpeedTester:
         timeout: float = 3.0,
         verify_hostname: bool = True,
         limit: int = 3,
+        sock: Optional[socket.socket] = None,
+        metrics: Optional[Dict[str, Any]] = None,
     ) -> Tuple[bool, Optional[str], Optional[str]]:
         """对同一 IP 依次用多个 host 做 TLS/SNI 验证，任一通过即视为通过。
 
+        sock 为测速时已建立的 TCP 连接（可选）：第一个 host 直接在其上握手，省去一次 connect；
+        若对端已关闭该连接，换新连接重试同一 host。sock 总会被关闭。
+        传入 metrics 时记录 tls_handshake_ms（完整握手耗时，不含建连）与 tls_reused_tcp，
+        并按 tls.resume 对通过的 host 追加一次恢复握手（tls_resume_ms / tls_resumed）；
+        http_probe 开启时在通过验证的连接上发 HEAD，记录 http_ttfb_ms / http_status / http_error。
+
         返回 (ok, used_host, err_str)：
         - ok=True：used_host 为通过验证的域名
         - ok=False：used_host 为最后一次尝试的域名（若有），err_str 为最后错误
@@ -679,17 +4529,55 @@ class SpeedTester:
             if nh and nh not in hs:
                 hs.append(nh)
         if not hs:
+            if sock is not None:
+                sock.close()
             return True, None, None
 
+        resume = metrics is not None and self._tls_resume_enabled()
+        http_path = self._http_probe_path() if metrics is not None else None
         lim = max(1, int(limit))
         last_err: Optional[str] = None
         last_host: Optional[str] = None
         for h in hs[:lim]:
             if self._should_stop():
+                if sock is not None:
+                    sock.close()
                 return False, h, "stopped"
-            ok, err = self.tls_sni_verify(ip, h, port=port, timeout=timeout, verify_hostname=verify_hostname)
+            reused = sock is not None
+            info: Dict[str, Any] = {}
+            if reused:
+                ok, err, hs_ms = self._tls_handshake(
+                    sock,
+                    h,
+                    timeout=timeout,
+                    verify_hostname=verify_hostname,
+                    session_key=(ip, port, h, bool(verify_hostname)),
+                    store_session=resume,
+                    info=info,
+                    http_path=http_path,
+                )
+                sock = None
+                if not ok and (err or "").startswith("eof"):
+                    reused = False
+                    ok, err, hs_ms = self._tls_connect_handshake(
+                        ip, h, port=port, timeout=timeout, verify_hostname=verify_hostname, store_session=resume,
+                        info=info, http_path=http_path,
+                    )
+            else:
+                ok, err, hs_ms = self._tls_connect_handshake(
+                    ip, h, port=port, timeout=timeout, verify_hostname=verify_hostname, store_session=resume,
+                    info=info, http_path=http_path,
+                )
             last_host = h
             if ok:
+                if metrics is not None:
+                    metrics["tls_handshake_ms"] = hs_ms
+                    metrics["tls_reused_tcp"] = reused
+                    metrics.update(info)
+                    if resume and not self._should_stop():
+                        self._tls_resume_probe(
+                            ip, h, metrics, port=port, timeout=timeout, verify_hostname=verify_hostname
+                        )
                 return True, h, None
             last_err = err
         return False, last_host, last_err
@@ -702,68 +4590,391 @@ class SpeedTester:
         port: int = 443,
         timeout: float = 3.0,
         verify_hostname: bool = True,
+        metrics: Optional[Dict[str, Any]] = None,
     ) -> Tuple[bool, Optional[str]]:
-        """异步 TLS/SNI 验证（与 tls_sni_verify 语义一致）。"""
+        """异步 TLS/SNI 验证（与 tls_sni_verify 语义一致，含 metrics 记录）。"""
         h = self._normalize_sni_host(host)
         if not h:
             return True, None
+        resume = metrics is not None and self._tls_resume_enabled()
+        info: Dict[str, Any] = {}
+        ok, err, hs_ms = await self._tls_connect_handshake_async(
+            ip, h, port=port, timeout=timeout, verify_hostname=verify_hostname, store_session=resume,
+            info=info, http_path=self._http_probe_path() if metrics is not None else None,
+        )
+        if ok and metrics is not None:
+            metrics["tls_handshake_ms"] = hs_ms
+            metrics.update(info)
+            if resume:
+                await self._tls_resume_probe_async(
+                    ip, h, metrics, port=port, timeout=timeout, verify_hostname=verify_hostname
+                )
+        return ok, err
+
+    async def _tls_handshake_async(
+        self,
+        sock: socket.socket,
+        host: str,
+        *,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+        session_key: Optional[Tuple[str, int, str, bool]] = None,
+        store_session: bool = False,
+        resume: bool = False,
+        info: Optional[Dict[str, Any]] = None,
+        http_path: Optional[str] = None,
+    ) -> Tuple[bool, Optional[str], Optional[float]]:
+        """_tls_handshake 的异步版本：在已连接的非阻塞 socket 上握手，返回 (ok, err_str, handshake_ms)。
+
+        用 MemoryBIO 驱动 SSLObject（asyncio 的 SSL 传输不支持指定会话），会话参数含义同 _tls_handshake。
+        """
+        h = self._normalize_sni_host(host)
+        loop = asyncio.get_running_loop()
+        cache = get_shared_tls_session_cache()
         try:
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = bool(verify_hostname)
-            ctx.verify_mode = ssl.CERT_REQUIRED if verify_hostname else ssl.CERT_NONE
+            ctx = cache.context(verify_hostname)
+            session = cache.get(session_key) if (resume and session_key is not None) else None
+            incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+            sslobj = ctx.wrap_bio(incoming, outgoing, server_hostname=h, session=session)
+            t0 = time.perf_counter_ns()
+            await asyncio.wait_for(self._ssl_bio_pump(loop, sock, sslobj.do_handshake, incoming, outgoing), timeout)
+            t1 = time.perf_counter_ns()
+            hs_ms = (t1 - t0) / 1_000_000.0
+            if resume:
+                cache.record_resume(sslobj.session_reused)
+                if info is not None:
+                    info["resumed"] = sslobj.session_reused
+            if http_path is not None and info is not None:
+                await self._http_head_async(loop, sock, sslobj, incoming, outgoing, h, http_path, info, timeout)
+            if store_session and session_key is not None:
+                if sslobj.version() == "TLSv1.3":
+
+                    def _has_ticket() -> bool:
+                        return sslobj.session is not None and sslobj.session.has_ticket
+
+                    def _ticket() -> None:
+                        # 读取会让 OpenSSL 处理 NewSessionTicket（握手时可能已搬进 incoming）；
+                        # 没有应用数据时抛 SSLWantReadError，此时已拿到票据就不再等 socket
+                        if _has_ticket():
+                            return
+                        try:
+                            sslobj.read(1)
+                        except ssl.SSLWantReadError:
+                            if not _has_ticket():
+                                raise
 
-            async def _do():
-                reader, writer = await asyncio.open_connection(
-                    host=ip,
-                    port=port,
-                    ssl=ctx,
-                    server_hostname=h,
-                )
-                try:
-                    writer.close()
                     try:
-                        await writer.wait_closed()
-                    except Exception:
+                        await asyncio.wait_for(
+                            self._ssl_bio_pump(loop, sock, _ticket, incoming, outgoing),
+                            min(timeout, max(0.05, hs_ms * 2 / 1000.0)),
+                        )
+                    except (asyncio.TimeoutError, ssl.SSLError, OSError):
                         pass
-                finally:
-                    return True, None
-
-            return await asyncio.wait_for(_do(), timeout=timeout)
+                cache.put(session_key, sslobj.session, sslobj.version())
+            return True, None, hs_ms
         except asyncio.TimeoutError:
-            return False, "timeout"
+            return False, "timeout", None
         except ssl.SSLCertVerificationError as e:
-            return False, f"cert_verify:{e}"
+            return False, f"cert_verify:{e}", None
+        except (ssl.SSLEOFError, ssl.SSLZeroReturnError, ConnectionResetError, BrokenPipeError) as e:
+            return False, f"eof:{e}", None
         except ssl.SSLError as e:
-            return False, f"ssl_error:{e}"
+            return False, f"ssl_error:{e}", None
         except Exception as e:
-            return False, f"err:{e}"
+            return False, f"err:{e}", None
+        finally:
+            sock.close()
+
+    @staticmethod
+    async def _ssl_bio_pump(
+        loop: asyncio.AbstractEventLoop,
+        sock: socket.socket,
+        op: Callable[[], Any],
+        incoming: ssl.MemoryBIO,
+        outgoing: ssl.MemoryBIO,
+    ) -> Any:
+        """反复执行 op（do_handshake / read），在 socket 与 MemoryBIO 之间搬运数据，直到 op 不再需要读。"""
+        while True:
+            try:
+                result = op()
+                break
+            except ssl.SSLWantReadError:
+                pending = outgoing.read()
+                if pending:
+                    await loop.sock_sendall(sock, pending)
+                data = await loop.sock_recv(sock, 16384)
+                if data:
+                    incoming.write(data)
+                else:
+                    incoming.write_eof()
+        pending = outgoing.read()
+        if pending:
+            await loop.sock_sendall(sock, pending)
+        return result
+
+    async def _http_head_async(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        sock: socket.socket,
+        sslobj: ssl.SSLObject,
+        incoming: ssl.MemoryBIO,
+        outgoing: ssl.MemoryBIO,
+        host: str,
+        path: str,
+        info: Dict[str, Any],
+        timeout: float,
+    ) -> None:
+        """_http_head 的异步版本（在 MemoryBIO 驱动的 SSLObject 上发 HEAD）。"""
+        try:
+            t0 = time.perf_counter_ns()
+            sslobj.write(self._http_head_request(host, path))
+            data = await asyncio.wait_for(
+                self._ssl_bio_pump(loop, sock, lambda: sslobj.read(4096), incoming, outgoing), timeout
+            )
+            t1 = time.perf_counter_ns()
+            if not data:
+                info["http_error"] = "eof"
+                return
+            info["http_ttfb_ms"] = (t1 - t0) / 1_000_000.0
+            while b"\r\n" not in data and len(data) < 8192:
+                more = await asyncio.wait_for(
+                    self._ssl_bio_pump(loop, sock, lambda: sslobj.read(4096), incoming, outgoing), timeout
+                )
+                if not more:
+                    break
+                data += more
+            status = self._parse_http_status(data)
+            if status is None:
+                info["http_error"] = "bad_response"
+            else:
+                info["http_status"] = status
+        except asyncio.TimeoutError:
+            info["http_error"] = "timeout"
+        except (ssl.SSLError, OSError) as e:
+            info["http_error"] = f"err:{e}"
+
+    async def _tls_connect_handshake_async(
+        self,
+        ip: str,
+        host: str,
+        *,
+        port: int = 443,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+        store_session: bool = False,
+        resume: bool = False,
+        info: Optional[Dict[str, Any]] = None,
+        http_path: Optional[str] = None,
+    ) -> Tuple[bool, Optional[str], Optional[float]]:
+        """新建连接后异步握手，返回 (ok, err_str, handshake_ms)。"""
+        if await self._acquire_connect_async(ip) is None:
+            return False, "stopped", None
+        try:
+            sock, _, err = await self._tcp_connect_async(ip, port=port, timeout=timeout)
+        finally:
+            self._release_connect(ip)
+        if sock is None:
+            return False, "timeout" if err == "timeout" else f"err:{err}", None
+        h = self._normalize_sni_host(host)
+        return await self._tls_handshake_async(
+            sock,
+            h,
+            timeout=timeout,
+            verify_hostname=verify_hostname,
+            session_key=(ip, port, h, bool(verify_hostname)) if (store_session or resume) else None,
+            store_session=store_session,
+            resume=resume,
+            info=info,
+            http_path=http_path,
+        )
+
+    async def _tls_resume_probe_async(
+        self,
+        ip: str,
+        host: str,
+        metrics: Dict[str, Any],
+        *,
+        port: int = 443,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+    ) -> None:
+        """_tls_resume_probe 的异步版本。"""
+        h = self._normalize_sni_host(host)
+        if get_shared_tls_session_cache().get((ip, port, h, bool(verify_hostname))) is None:
+            metrics["tls_resumed"] = False
+            metrics["tls_resume_error"] = "no_ticket"
+            return
+        info: Dict[str, Any] = {}
+        ok, _, ms = await self._tls_connect_handshake_async(
+            ip, h, port=port, timeout=timeout, verify_hostname=verify_hostname, resume=True, info=info
+        )
+        if ok:
+            metrics["tls_resume_ms"] = ms
+            metrics["tls_resumed"] = bool(info.get("resumed"))
+
+    async def _tcp_connect_rtt_ms_async(
+        self,
+        ip: str,
+        *,
+        port: int = 443,
+        timeout: float = 2.0,
+    ) -> Tuple[Optional[float], Optional[str]]:
+        """异步 TCP connect 测 RTT（毫秒），支持 IPv4/IPv6。
+
+        成功返回 (rtt_ms, None)，失败返回 (None, err_str)。
+        """
+        sock, rtt, err = await self._tcp_connect_async(ip, port=port, timeout=timeout)
+        if sock is not None:
+            sock.close()
+        return rtt, err
 
-    async def _tcp_connect_rtt_ms_async(
+    async def _tcp_connect_async(
         self,
         ip: str,
         *,
         port: int = 443,
         timeout: float = 2.0,
-    ) -> Tuple[Optional[float], Optional[str]]:
-        """异步 TCP connect 测 RTT（毫秒），支持 IPv4/IPv6。
+    ) -> Tuple[Optional[socket.socket], Optional[float], Optional[str]]:
+        """非阻塞 socket + loop.sock_connect 建立连接，perf_counter_ns 计时（单线程可同时测量大量 IP）。
 
-        成功返回 (rtt_ms, None)，失败返回 (None, err_str)。
+        成功返回 (已连接的 socket, rtt_ms, None)，由调用方负责关闭；失败返回 (None, None, err_str)。
         """
-        family = self._get_ip_family(ip)
+        loop = asyncio.get_running_loop()
         try:
-            _, writer = await asyncio.wait_for(
-                asyncio.open_connection(ip, port, family=family),
-                timeout=timeout
-            )
-            # 连接成功，这里无法直接获取精确的 RTT
-            # 但我们可以近似测量
-            writer.close()
-            await writer.wait_closed()
-            return 0.0, None  # 实际 RTT 需要通过其他方式获取
+            addr = self._sockaddr(ip, port)
+            s = socket.socket(self._get_ip_family(ip), socket.SOCK_STREAM)
+        except Exception as e:
+            return None, None, f"err:{e}"
+        s.setblocking(False)
+        try:
+            t0 = time.perf_counter_ns()
+            await asyncio.wait_for(loop.sock_connect(s, addr), timeout)
+            t1 = time.perf_counter_ns()
+            return s, (t1 - t0) / 1_000_000.0, None
         except asyncio.TimeoutError:
-            return None, "timeout"
+            err = "timeout"
+        except OSError as e:
+            err = f"connect_ex_err:{e.errno}" if e.errno else f"err:{e}"
         except Exception as e:
-            return None, f"err:{e}"
+            err = f"err:{e}"
+        s.close()
+        return None, None, err
+
+    def bandwidth_test(
+        self,
+        ip: str,
+        host: str,
+        path: str,
+        *,
+        port: int = 443,
+        max_bytes: int = 4 * 1024 * 1024,
+        time_cap: float = 4.0,
+        skip_bytes: int = 64 * 1024,
+        timeout: float = 3.0,
+        verify_hostname: bool = True,
+    ) -> Dict[str, Any]:
+        """经由 ip 以 host 为 SNI / Host 下载 path（最多 max_bytes 字节、最长 time_cap 秒），测持续吞吐。
+
+        请求带 Range 限定大小；不支持 Range 的服务器在读满 max_bytes 后直接断开。
+        吞吐只统计前 skip_bytes 字节之后的部分（避开 TCP 慢启动），下载量不足时退回按整个响应体计算。
+        返回 bw_mbps（兆比特/秒）/ bw_bytes / bw_seconds / bw_ttfb_ms / bw_status，失败时含 bw_error。
+        """
+        h = self._normalize_sni_host(host)
+        result: Dict[str, Any] = {"bw_bytes": 0}
+        if self._acquire_connect(ip) is None:
+            result["bw_error"] = "stopped"
+            return result
+        try:
+            sock, _, err = self._tcp_connect(ip, port=port, timeout=timeout)
+        finally:
+            self._release_connect(ip)
+        if sock is None:
+            result["bw_error"] = "timeout" if err == "timeout" else f"err:{err}"
+            return result
+
+        cache = get_shared_tls_session_cache()
+        key = (ip, port, h, bool(verify_hostname))
+        request = (
+            f"GET {path or '/'} HTTP/1.1\r\nHost: {h}\r\nUser-Agent: SmartHostsTool\r\nAccept: */*\r\n"
+            f"Accept-Encoding: identity\r\nRange: bytes=0-{max(1, int(max_bytes)) - 1}\r\nConnection: close\r\n\r\n"
+        ).encode("ascii", "ignore")
+        try:
+            sock.settimeout(timeout)
+            # 实际下载多走恢复握手：有缓存的会话就带上
+            with cache.context(verify_hostname).wrap_socket(sock, server_hostname=h, session=cache.get(key)) as ssock:
+                t_req = time.perf_counter()
+                ssock.sendall(request)
+                deadline = t_req + max(0.1, float(time_cap))
+                head = b""
+                body = 0
+                t_first: Optional[float] = None
+                t_mark: Optional[float] = None
+                mark_bytes = 0
+                t_last = t_req
+                while body < max_bytes:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or self._should_stop():
+                        break
+                    ssock.settimeout(min(timeout, remaining))
+                    try:
+                        chunk = ssock.recv(65536)
+                    except socket.timeout:
+                        if t_first is None:
+                            raise
+                        break
+                    if not chunk:
+                        break
+                    t_last = time.perf_counter()
+                    if t_first is None:
+                        head += chunk
+                        if b"\r\n\r\n" not in head:
+                            if len(head) > 65536:
+                                result["bw_error"] = "bad_response"
+                                return result
+                            continue
+                        head, _, rest = head.partition(b"\r\n\r\n")
+                        status = self._parse_http_status(head)
+                        result["bw_status"] = status
+                        if status not in (200, 206):
+                            result["bw_error"] = f"http_{status}" if status else "bad_response"
+                            return result
+                        t_first = t_last
+                        result["bw_ttfb_ms"] = (t_first - t_req) * 1000.0
+                        chunk = rest
+                    body += len(chunk)
+                    if t_mark is None and body >= skip_bytes:
+                        t_mark, mark_bytes = t_last, body
+                cache.put(key, ssock.session, ssock.version())
+        except ssl.SSLCertVerificationError as e:
+            result["bw_error"] = f"cert_verify:{e}"
+            return result
+        except socket.timeout:
+            result["bw_error"] = "timeout"
+            return result
+        except (ssl.SSLError, OSError) as e:
+            result["bw_error"] = f"err:{e}"
+            return result
+        finally:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+        if t_first is None:
+            result["bw_error"] = "eof"
+            return result
+        # 慢启动之后的部分足够长（至少与跳过的部分一样多）才只统计这一段
+        if t_mark is not None and body - mark_bytes >= mark_bytes and t_last > t_mark:
+            nbytes, seconds = body - mark_bytes, t_last - t_mark
+        else:
+            nbytes, seconds = body, t_last - t_first
+        result["bw_bytes"] = body
+        result["bw_seconds"] = t_last - t_req
+        if nbytes <= 0 or seconds <= 0:
+            result["bw_error"] = "too_small"
+            return result
+        result["bw_mbps"] = nbytes * 8 / seconds / 1_000_000.0
+        return result
 
     def tcp_median_rtt_ms(
         self,
@@ -774,17 +4985,8 @@ class SpeedTester:
         timeout: float = 2.0,
     ) -> Tuple[Optional[float], bool, Optional[str]]:
         """TCP 多次取中位数（更稳），支持 IPv4/IPv6。返回 (median_ms, ok_bool, last_err)。"""
-        lat: List[float] = []
-        last_err: Optional[str] = None
-        for _ in range(max(1, int(attempts))):
-            if self._should_stop():
-                break
-            rtt, err = self._tcp_connect_rtt_ms(ip, port=port, timeout=timeout)
-            last_err = err
-            if rtt is not None:
-                lat.append(rtt)
-            time.sleep(0.01)  # 轻微退避，降低瞬时风暴
-
+        # 两次之间轻微退避，降低瞬时风暴
+        lat, last_err, _, _ = self._tcp_samples(ip, port=port, attempts=attempts, timeout=timeout, interval=0.01)
         if lat:
             return statistics.median(lat), True, None
         return None, False, last_err
@@ -798,29 +5000,25 @@ class SpeedTester:
         timeout: float = 2.0,
     ) -> Tuple[Optional[float], bool, Optional[str]]:
         """异步 TCP 多次取中位数，支持 IPv4/IPv6。返回 (median_ms, ok_bool, last_err)。"""
-        lat: List[float] = []
-        last_err: Optional[str] = None
-        for _ in range(max(1, int(attempts))):
-            if self._should_stop():
-                break
-            rtt, err = await self._tcp_connect_rtt_ms_async(ip, port=port, timeout=timeout)
-            last_err = err
-            if rtt is not None:
-                lat.append(rtt)
-            await asyncio.sleep(0.01)
-
+        lat, last_err, _, _ = await self._tcp_samples_async(
+            ip, port=port, attempts=attempts, timeout=timeout, interval=0.01
+        )
         if lat:
             return statistics.median(lat), True, None
         return None, False, last_err
 
     @staticmethod
     def icmp_ping_once(ip: str, *, timeout_ms: int = 1200) -> Optional[int]:
-        """ICMP ping 一次，返回延迟 ms（支持 IPv4/IPv6，Windows 优先）。
+        """ICMP ping 一次，返回延迟 ms（支持 IPv4/IPv6）。
 
         注意：
         - ICMP 可能被禁用，因此仅作为补充参考。
-        - 非 Windows 平台可能返回 None。
+        - Linux 走进程内 ICMP 引擎（get_shared_icmp_engine），Windows 调用 ping 命令，其余平台返回 None。
         """
+        engine = get_shared_icmp_engine()
+        if engine is not None and engine.supports(ip):
+            ms = engine.ping(ip, timeout_ms=timeout_ms)
+            return None if ms is None else max(1, int(round(ms)))
         if sys.platform != "win32":
             return None
 
@@ -850,6 +5048,16 @@ class SpeedTester:
             pass
         return None
 
+    @staticmethod
+    async def icmp_ping_once_async(ip: str, *, timeout_ms: int = 1200) -> Optional[int]:
+        """异步 ICMP ping 一次：进程内引擎可用时直接等待回复，否则把 ping 命令放到线程池。"""
+        engine = get_shared_icmp_engine()
+        if engine is not None and engine.supports(ip):
+            ms = await engine.ping_async(ip, timeout_ms=timeout_ms)
+            return None if ms is None else max(1, int(round(ms)))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: SpeedTester.icmp_ping_once(ip, timeout_ms=timeout_ms))
+
     def tcp_advanced_metrics(
         self,
         ip: str,
@@ -859,20 +5067,67 @@ class SpeedTester:
         timeout: float = 2.0,
     ) -> Dict[str, Any]:
         """返回详细测速指标，包含延迟波动分析，支持 IPv4/IPv6。"""
-        latencies = []
-        success_count = 0
-        last_err: Optional[str] = None
+        latencies, last_err, _, queue_ms = self._tcp_samples(ip, port=port, attempts=attempts, timeout=timeout)
+        metrics = self._summarize_latencies(latencies, attempts, last_err)
+        metrics["queue_ms"] = queue_ms
+        return metrics
+
+    async def tcp_advanced_metrics_async(
+        self,
+        ip: str,
+        *,
+        port: int = 443,
+        attempts: int = 5,
+        timeout: float = 2.0,
+    ) -> Dict[str, Any]:
+        """tcp_advanced_metrics 的异步版本（原生异步 connect，不占用线程）。"""
+        latencies, last_err, _, queue_ms = await self._tcp_samples_async(ip, port=port, attempts=attempts, timeout=timeout)
+        metrics = self._summarize_latencies(latencies, attempts, last_err)
+        metrics["queue_ms"] = queue_ms
+        return metrics
 
-        for _ in range(attempts):
+    async def _tcp_samples_async(
+        self,
+        ip: str,
+        *,
+        port: int = 443,
+        attempts: int = 5,
+        timeout: float = 2.0,
+        interval: float = 0.02,
+        keep_socket: bool = False,
+    ) -> Tuple[List[float], Optional[str], Optional[socket.socket], float]:
+        """_tcp_samples 的异步版本：返回 (latencies, last_err, sock, queue_ms)。"""
+        latencies: List[float] = []
+        last_err: Optional[str] = None
+        kept: Optional[socket.socket] = None
+        queued = 0.0
+        for _ in range(max(1, int(attempts))):
             if self._should_stop():
                 break
-            rtt, err = self._tcp_connect_rtt_ms(ip, port=port, timeout=timeout)
+            waited = await self._acquire_connect_async(ip)
+            if waited is None:
+                break
+            queued += waited
+            try:
+                s, rtt, err = await self._tcp_connect_async(ip, port=port, timeout=timeout)
+            finally:
+                self._release_connect(ip)
             last_err = err
-            if rtt is not None:
+            if s is not None:
                 latencies.append(rtt)
-                success_count += 1
-            time.sleep(0.02)
+                if keep_socket:
+                    if kept is not None:
+                        kept.close()
+                    kept = s
+                else:
+                    s.close()
+            await asyncio.sleep(interval)
+        return latencies, last_err, kept, queued * 1000.0
 
+    @classmethod
+    def _summarize_latencies(cls, latencies: List[float], attempts: int, last_err: Optional[str]) -> Dict[str, Any]:
+        """由多次 connect 的延迟样本计算中位数、抖动、丢包率与稳定性评分。"""
+        success_count = len(latencies)
         if not latencies:
             return {
                 "median": None,
@@ -893,7 +5148,7 @@ class SpeedTester:
         jitter = statistics.stdev(latencies) if len(latencies) > 1 else 0.0
         packet_loss = ((attempts - success_count) / attempts) * 100
 
-        stability_score = self._calculate_stability_score(median_val, jitter, packet_loss)
+        stability_score = cls._calculate_stability_score(median_val, jitter, packet_loss)
 
         return {
             "median": median_val,
@@ -934,58 +5189,33 @@ class SpeedTester:
 
         新增：TLS/SNI 验证（可选，默认跟随配置开启）
         - 仅在 TCP 可用后做一次 TLS 握手验证（SNI=域名），避免“TCP 可连但并不是目标域名服务”的假可用 IP。
+        - tls.reuse_tcp=True 时握手直接复用最后一次测速的 TCP 连接。
         """
         if self._should_stop():
             return ip, 9999, "已停止"
 
-        # 读取 TLS 配置：EnhancedSpeedTester 有 self.config；否则用全局 SPEED_TEST_CONFIG
-        cfg = getattr(self, "config", None)
-        base_cfg = cfg if isinstance(cfg, dict) else (SPEED_TEST_CONFIG if isinstance(SPEED_TEST_CONFIG, dict) else {})
-        tls_cfg = base_cfg.get("tls", {}) if isinstance(base_cfg, dict) else {}
-        tls_enabled = bool(tls_cfg.get("enabled", True)) if tls_verify is None else bool(tls_verify)
-        tls_timeout = float(tls_cfg.get("timeout", timeout)) if isinstance(tls_cfg, dict) else timeout
-        verify_hostname = bool(tls_cfg.get("verify_hostname", True)) if isinstance(tls_cfg, dict) else True
-        tls_strict = bool(tls_cfg.get("strict", False)) if isinstance(tls_cfg, dict) else False
-        try_hosts_limit = int(tls_cfg.get("try_hosts_limit", 3)) if isinstance(tls_cfg, dict) else 3
-
-        med, ok, err = self.tcp_median_rtt_ms(ip, port=port, attempts=attempts, timeout=timeout)
-        if ok and med is not None:
-            ms = max(1, int(med))
-
-            # TLS/SNI 验证：可传入单个 sni_host 或多个 sni_hosts（将依次尝试）
-            candidates: List[str] = []
-            if sni_hosts:
-                try:
-                    candidates = list(sni_hosts)
-                except Exception:
-                    candidates = []
-            if (not candidates) and sni_host:
-                candidates = [sni_host]
-
-            if tls_enabled and candidates:
-                tls_ok, used_host, tls_err = self.tls_sni_verify_any(
-                    ip,
-                    candidates,
-                    port=port,
-                    timeout=tls_timeout,
-                    verify_hostname=verify_hostname,
-                    limit=try_hosts_limit,
-                )
-                if tls_ok:
-                    return ip, ms, "可用(TLS)"
-                short = (tls_err or "").split(":", 1)[0] if tls_err else "fail"
-                if tls_strict:
-                    return ip, 9999, f"失败(SNI:{short})"
-                return ip, ms, f"可用(TCP,TLS失败:{short})"
-
-            return ip, ms, "可用"
-
-        if (not ok) and self.icmp_fallback and (not self._should_stop()):
-            icmp_ms = self.icmp_ping_once(ip, timeout_ms=icmp_timeout_ms)
-            if icmp_ms is not None:
-                return ip, icmp_ms, "可用(ICMP)"
-
-        return ip, 9999, "失败"
+        reuse = bool(sni_hosts or sni_host) and self._tls_reuse_enabled(tls_verify)
+        lat, err, sock, queue_ms = self._tcp_samples(
+            ip, port=port, attempts=attempts, timeout=timeout, interval=0.01, keep_socket=reuse
+        )
+        metrics: Dict[str, Any] = {
+            "median": statistics.median(lat) if lat else None,
+            "ok": bool(lat),
+            "err": None if lat else err,
+            "queue_ms": queue_ms,
+        }
+        ip, ms, status, _ = self.finish_tcp_metrics(
+            ip,
+            metrics,
+            port=port,
+            timeout=timeout,
+            icmp_timeout_ms=icmp_timeout_ms,
+            sni_host=sni_host,
+            sni_hosts=sni_hosts,
+            tls_verify=tls_verify,
+            sock=sock,
+        )
+        return ip, ms, status
 
     def test_one_ip_advanced(
         self,
@@ -1007,6 +5237,58 @@ class SpeedTester:
         if self._should_stop():
             return ip, 9999, "已停止", {}
 
+        # TLS 握手复用测速时的 TCP 连接：每个 IP 少建一到多次连接
+        reuse = bool(sni_hosts or sni_host) and self._tls_reuse_enabled(tls_verify)
+        if measure_jitter:
+            lat, err, sock, queue_ms = self._tcp_samples(
+                ip, port=port, attempts=attempts, timeout=timeout, keep_socket=reuse
+            )
+            metrics = self._summarize_latencies(lat, attempts, err)
+        else:
+            lat, err, sock, queue_ms = self._tcp_samples(
+                ip, port=port, attempts=attempts, timeout=timeout, interval=0.01, keep_socket=reuse
+            )
+            metrics = {"median": statistics.median(lat) if lat else None, "ok": bool(lat), "err": None if lat else err}
+        # 限速器排队时间单独记录，不混入延迟样本
+        metrics["queue_ms"] = queue_ms
+
+        return self.finish_tcp_metrics(
+            ip,
+            metrics,
+            port=port,
+            timeout=timeout,
+            icmp_timeout_ms=icmp_timeout_ms,
+            sni_host=sni_host,
+            sni_hosts=sni_hosts,
+            tls_verify=tls_verify,
+            sock=sock,
+        )
+
+    def finish_tcp_metrics(
+        self,
+        ip: str,
+        metrics: Dict[str, Any],
+        *,
+        port: int = 443,
+        timeout: float = 2.0,
+        icmp_timeout_ms: int = 2000,
+        sni_host: Optional[str] = None,
+        sni_hosts: Optional[Iterable[str]] = None,
+        tls_verify: Optional[bool] = None,
+        sock: Optional[socket.socket] = None,
+    ) -> Tuple[str, int, str, Dict[str, Any]]:
+        """TCP 阶段之后的收尾：TCP 可用时做 TLS/SNI 验证，失败时 ICMP 回退，返回 (ip, ms, status, metrics)。
+
+        metrics 为 tcp_advanced_metrics 格式（至少含 median / ok），也可以来自 MassTcpProber。
+        sock 为测速时保留的已连接 socket（可选），TLS 握手直接在其上进行；本方法负责关闭它。
+        metrics 中 tcp_connect_ms 为 TCP 建连中位数，tls_handshake_ms 为 TLS 完整握手耗时（不含建连），
+        tls_resume_ms 为会话恢复握手耗时（tls.resume 开启且服务器下发了会话时）。
+        """
+        if self._should_stop():
+            if sock is not None:
+                sock.close()
+            return ip, 9999, "已停止", metrics
+
         # TLS 配置（EnhancedSpeedTester -> self.config；否则全局 SPEED_TEST_CONFIG）
         cfg = getattr(self, "config", None)
         base_cfg = cfg if isinstance(cfg, dict) else (SPEED_TEST_CONFIG if isinstance(SPEED_TEST_CONFIG, dict) else {})
@@ -1017,12 +5299,6 @@ class SpeedTester:
         tls_strict = bool(tls_cfg.get("strict", False)) if isinstance(tls_cfg, dict) else False
         try_hosts_limit = int(tls_cfg.get("try_hosts_limit", 3)) if isinstance(tls_cfg, dict) else 3
 
-        if measure_jitter:
-            metrics = self.tcp_advanced_metrics(ip, port=port, attempts=attempts, timeout=timeout)
-        else:
-            med, ok, err = self.tcp_median_rtt_ms(ip, port=port, attempts=attempts, timeout=timeout)
-            metrics = {"median": med, "ok": ok, "err": err}
-
         # TCP 成功
         if isinstance(metrics, dict) and ("ok" not in metrics):
             metrics["ok"] = (metrics.get("median") is not None)
@@ -1040,6 +5316,7 @@ class SpeedTester:
             if (not candidates) and sni_host:
                 candidates = [sni_host]
 
+            metrics["tcp_connect_ms"] = metrics.get("median")
             if tls_enabled and candidates:
                 tls_ok, used_host, tls_err = self.tls_sni_verify_any(
                     ip,
@@ -1048,6 +5325,8 @@ class SpeedTester:
                     timeout=tls_timeout,
                     verify_hostname=verify_hostname,
                     limit=try_hosts_limit,
+                    sock=sock,
+                    metrics=metrics,
                 )
                 metrics["tls_ok"] = bool(tls_ok)
                 metrics["tls_used_host"] = used_host
@@ -1059,8 +5338,12 @@ class SpeedTester:
                     return ip, ms, f"可用(TCP,TLS失败:{short})", metrics
                 return ip, ms, "可用(TLS)", metrics
 
+            if sock is not None:
+                sock.close()
             return ip, ms, "可用", metrics
 
+        if sock is not None:
+            sock.close()
         # TCP 失败 -> ICMP 回退
         if self.icmp_fallback and (not self._should_stop()):
             icmp_ms = self.icmp_ping_once(ip, timeout_ms=icmp_timeout_ms)
@@ -1096,16 +5379,18 @@ class SpeedTester:
         tls_strict = bool(tls_cfg.get("strict", False)) if isinstance(tls_cfg, dict) else False
         try_hosts_limit = int(tls_cfg.get("try_hosts_limit", 3)) if isinstance(tls_cfg, dict) else 3
 
+        reuse = bool(sni_hosts or sni_host) and self._tls_reuse_enabled(tls_verify)
         if measure_jitter:
-            # 在线程池中执行同步的高级测速（避免阻塞事件循环）
-            loop = asyncio.get_event_loop()
-            metrics = await loop.run_in_executor(
-                None,
-                lambda: self.tcp_advanced_metrics(ip, port=port, attempts=attempts, timeout=timeout),
+            lat, err, sock, queue_ms = await self._tcp_samples_async(
+                ip, port=port, attempts=attempts, timeout=timeout, keep_socket=reuse
             )
+            metrics = self._summarize_latencies(lat, attempts, err)
         else:
-            med, ok, err = await self._tcp_connect_rtt_ms_async(ip, port=port, timeout=timeout)
-            metrics = {"median": med, "ok": ok, "err": err}
+            lat, err, sock, queue_ms = await self._tcp_samples_async(
+                ip, port=port, attempts=attempts, timeout=timeout, interval=0.01, keep_socket=reuse
+            )
+            metrics = {"median": statistics.median(lat) if lat else None, "ok": bool(lat), "err": None if lat else err}
+        metrics["queue_ms"] = queue_ms
 
         if isinstance(metrics, dict) and ("ok" not in metrics):
             metrics["ok"] = (metrics.get("median") is not None)
@@ -1123,18 +5408,52 @@ class SpeedTester:
             if (not candidates) and sni_host:
                 candidates = [sni_host]
 
+            metrics["tcp_connect_ms"] = metrics.get("median")
             if tls_enabled and candidates:
-                # 异步路径：逐个尝试，任一通过即视为通过
+                # 异步路径：逐个尝试，任一通过即视为通过；第一个候选优先复用测速时保留的连接
                 used_host: Optional[str] = None
                 tls_ok: bool = False
                 tls_err: Optional[str] = None
+                resume = self._tls_resume_enabled()
+                http_path = self._http_probe_path()
                 for h in candidates[:max(1, int(try_hosts_limit))]:
-                    tls_ok, tls_err = await self.tls_sni_verify_async(
-                        ip, h, port=port, timeout=tls_timeout, verify_hostname=verify_hostname
-                    )
+                    h = self._normalize_sni_host(h)
+                    info: Dict[str, Any] = {}
+                    if sock is not None:
+                        tls_ok, tls_err, hs_ms = await self._tls_handshake_async(
+                            sock,
+                            h,
+                            timeout=tls_timeout,
+                            verify_hostname=verify_hostname,
+                            session_key=(ip, port, h, bool(verify_hostname)),
+                            store_session=resume,
+                            info=info,
+                            http_path=http_path,
+                        )
+                        sock = None
+                        reused = True
+                        if not tls_ok and (tls_err or "").startswith("eof"):
+                            reused = False
+                            tls_ok, tls_err, hs_ms = await self._tls_connect_handshake_async(
+                                ip, h, port=port, timeout=tls_timeout, verify_hostname=verify_hostname,
+                                store_session=resume, info=info, http_path=http_path,
+                            )
+                    else:
+                        reused = False
+                        tls_ok, tls_err, hs_ms = await self._tls_connect_handshake_async(
+                            ip, h, port=port, timeout=tls_timeout, verify_hostname=verify_hostname,
+                            store_session=resume, info=info, http_path=http_path,
+                        )
                     used_host = h
                     if tls_ok:
                         tls_err = None
+                        metrics["tls_handshake_ms"] = hs_ms
+                        metrics["tls_reused_tcp"] = reused
+                        metrics.update(info)
+                        if resume and not self._should_stop():
+                            await self._tls_resume_probe_async(
+                                ip, h, metrics, port=port, timeout=tls_timeout, verify_hostname=verify_hostname
+                            )
                         break
 
                 metrics["tls_ok"] = bool(tls_ok)
@@ -1147,12 +5466,14 @@ class SpeedTester:
                     return ip, ms, f"可用(TCP,TLS失败:{short})", metrics
                 return ip, ms, "可用(TLS)", metrics
 
+            if sock is not None:
+                sock.close()
             return ip, ms, "可用", metrics
 
+        if sock is not None:
+            sock.close()
         if self.icmp_fallback and (not self._should_stop()):
-            # ICMP ping 仍为同步（Windows ping 命令），放线程池
-            loop = asyncio.get_event_loop()
-            icmp_ms = await loop.run_in_executor(None, lambda: self.icmp_ping_once(ip, timeout_ms=icmp_timeout_ms))
+            icmp_ms = await self.icmp_ping_once_async(ip, timeout_ms=icmp_timeout_ms)
             if icmp_ms is not None:
                 return ip, icmp_ms, "可用(ICMP)", {"median": icmp_ms, "method": "ICMP"}
 
@@ -1166,6 +5487,7 @@ class EnhancedSpeedTester(SpeedTester):
         config: Optional[Dict[str, Any]] = None,
         stop_event: Optional["threading.Event"] = None,
         stop_flag: Optional[Callable[[], bool]] = None,
+        limiter: Optional[ConnectRateLimiter] = None,
     ) -> None:
         self.config = config or SPEED_TEST_CONFIG.copy()
 
@@ -1174,6 +5496,7 @@ class EnhancedSpeedTester(SpeedTester):
             icmp_fallback=icmp_enabled,
             stop_event=stop_event,
             stop_flag=stop_flag,
+            limiter=limiter,
         )
 
     def test_with_retry(
@@ -1283,15 +5606,24 @@ class EnhancedSpeedTester(SpeedTester):
         ips: List[str],
         *,
         concurrent_limit: int = 50,
+        concurrency: Optional[AimdConcurrencyController] = None,
         **kwargs,
     ) -> List[Tuple[str, int, str, Dict[str, Any]]]:
         """批量异步测速，支持重试和 IPv4/IPv6。
 
+        传入 concurrency 时由其自适应决定同时测速的 IP 数，concurrent_limit 不再生效。
         返回 [(ip, ms, status, metadata), ...]
         """
         semaphore = asyncio.Semaphore(concurrent_limit)
 
         async def test_with_semaphore(ip: str) -> Tuple[str, int, str, Dict[str, Any]]:
+            if concurrency is not None:
+                if not await concurrency.acquire_async(stop=self._should_stop):
+                    return ip, 9999, "已停止", {}
+                try:
+                    return await self.test_with_retry_async(ip, **kwargs)
+                finally:
+                    concurrency.release()
             async with semaphore:
                 return await self.test_with_retry_async(ip, **kwargs)
 
@@ -1310,6 +5642,620 @@ class EnhancedSpeedTester(SpeedTester):
         return output
 
 
+class MassTcpProber:
+    """单线程批量 TCP 探测：selectors（Linux 上为 epoll）同时维持成千上万个非阻塞 connect。
+
+    - 每个 IP 依次做 attempts 次 connect，两次之间间隔 interval 秒，与 tcp_advanced_metrics 的采样一致
+    - 连接完成（可写）时立即用 perf_counter_ns 计时，再以 SO_ERROR 区分成功与被拒
+    - 每个 socket 的截止时间放在定时堆里，select 的等待时长取最近的截止时间
+    - 结果格式与 SpeedTester 相同：(ip, ms, status, metrics)
+    - 限速器（limiter）不允许时该 IP 推迟重试、先发起其他网段的 IP；排队时间记在 metrics["queue_ms"]
+    - 传入 concurrency（AimdConcurrencyController）时，在途上限随其 level 实时调整（不超过 max_inflight）
+
+    只做 TCP 阶段；TLS/SNI 验证与 ICMP 回退由调用方对 TCP 结果调用 SpeedTester.finish_tcp_metrics。
+    keep_sockets > 0 时每个可用 IP 保留最后一次成功的连接（总数不超过 keep_sockets），
+    调用方用 take_socket(ip) 取出后传给 finish_tcp_metrics(sock=...)，TLS 握手不必重新建连。
+    """
+
+    CONNECT_BURST = 64
+
+    def __init__(
+        self,
+        *,
+        port: int = 443,
+        attempts: int = 5,
+        timeout: float = 2.0,
+        interval: float = 0.02,
+        max_inflight: int = 1000,
+        keep_sockets: int = 0,
+        limiter: Optional[ConnectRateLimiter] = None,
+        concurrency: Optional[AimdConcurrencyController] = None,
+        stop_event: Optional[threading.Event] = None,
+        stop_flag: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.port = int(port)
+        self.limiter = limiter if limiter is not None else get_shared_connect_limiter()
+        self.concurrency = concurrency
+        self.keep_sockets = max(0, int(keep_sockets))
+        self._kept: Dict[str, socket.socket] = {}
+        self._kept_lock = threading.Lock()
+        self.attempts = max(1, int(attempts))
+        self.timeout = float(timeout)
+        self.interval = max(0.0, float(interval))
+        self.max_inflight = max(1, int(max_inflight))
+        if sys.platform == "win32":
+            # Windows 的 select 最多同时监听 512 个句柄
+            self.max_inflight = min(self.max_inflight, 500)
+        self.stop_event = stop_event
+        self.stop_flag = stop_flag
+        # 最近一次 probe 的原始延迟样本与 connect 次数（TournamentScheduler 跨轮累计用）
+        self.last_samples: Dict[str, List[float]] = {}
+        self.last_connects = 0
+
+    def _should_stop(self) -> bool:
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        if self.stop_flag is not None and self.stop_flag():
+            return True
+        return False
+
+    def take_socket(self, ip: str) -> Optional[socket.socket]:
+        """取出为 ip 保留的已连接 socket（非阻塞模式）；没有则返回 None。取出后由调用方负责关闭。"""
+        with self._kept_lock:
+            return self._kept.pop(ip, None)
+
+    def _keep(self, ip: str, s: socket.socket) -> None:
+        with self._kept_lock:
+            old = self._kept.pop(ip, None)
+            if old is not None:
+                old.close()
+            if len(self._kept) < self.keep_sockets:
+                self._kept[ip] = s
+                return
+        s.close()
+
+    def close(self) -> None:
+        """关闭所有未被取走的保留连接。"""
+        with self._kept_lock:
+            kept, self._kept = self._kept, {}
+        for s in kept.values():
+            s.close()
+
+    def probe(
+        self,
+        ips: Iterable[str],
+        on_result: Optional[Callable[[Tuple[str, int, str, Dict[str, Any]]], None]] = None,
+    ) -> List[Tuple[str, int, str, Dict[str, Any]]]:
+        """探测全部 IP，按输入顺序返回结果；on_result 在每个 IP 完成时（探测线程内）回调。"""
+        order = list(dict.fromkeys(str(ip).strip() for ip in ips if str(ip).strip()))
+        samples: Dict[str, List[float]] = {ip: [] for ip in order}
+        last_err: Dict[str, Optional[str]] = {}
+        remaining: Dict[str, int] = {ip: self.attempts for ip in order}
+        results: Dict[str, Tuple[str, int, str, Dict[str, Any]]] = {}
+
+        ready = deque(order)
+        # (可以再次发起 connect 的时间, 序号, ip)
+        delayed: List[Tuple[float, int, str]] = []
+        # (截止时间, 序号, socket)：已完成的 socket 不从堆中删除，弹出时按 inflight 判断
+        deadlines: List[Tuple[float, int, socket.socket]] = []
+        inflight: Dict[socket.socket, Tuple[str, int]] = {}
+        seq = 0
+        sel = selectors.DefaultSelector()
+        limiter = self.limiter
+        # 被限速器推迟的 IP：开始排队的时间；各 IP 累计排队秒数
+        queued_since: Dict[str, float] = {}
+        queued: Dict[str, float] = {ip: 0.0 for ip in order}
+        self.last_samples = samples
+        self.last_connects = 0
+
+        def finish_attempt(ip: str, rtt_ms: Optional[float], err: Optional[str]) -> None:
+            nonlocal seq
+            if limiter is not None:
+                limiter.release(ip)
+            if rtt_ms is not None:
+                samples[ip].append(rtt_ms)
+            else:
+                last_err[ip] = err
+            remaining[ip] -= 1
+            if remaining[ip] > 0:
+                seq += 1
+                heapq.heappush(delayed, (time.monotonic() + self.interval, seq, ip))
+                return
+            metrics = SpeedTester._summarize_latencies(samples[ip], self.attempts, last_err.get(ip))
+            metrics["queue_ms"] = queued[ip] * 1000.0
+            if metrics["ok"]:
+                result = (ip, max(1, int(metrics["median"])), "可用", metrics)
+            else:
+                result = (ip, 9999, "失败", metrics)
+            results[ip] = result
+            if on_result is not None:
+                on_result(result)
+
+        def keep_or_close(ip: str, s: socket.socket) -> None:
+            # 只保留最后一次成功的连接：它最新，被对端按空闲超时关掉的可能最小
+            if self.keep_sockets and remaining[ip] == 1:
+                self._keep(ip, s)
+            else:
+                s.close()
+
+        def start(ip: str) -> None:
+            nonlocal seq
+            if limiter is not None:
+                now = time.monotonic()
+                ok, retry = limiter.try_acquire(ip)
+                if not ok:
+                    queued_since.setdefault(ip, now)
+                    seq += 1
+                    heapq.heappush(delayed, (now + retry, seq, ip))
+                    return
+                if ip in queued_since:
+                    queued[ip] += now - queued_since.pop(ip)
+            self.last_connects += 1
+            s: Optional[socket.socket] = None
+            try:
+                s = socket.socket(SpeedTester._get_ip_family(ip), socket.SOCK_STREAM)
+                s.setblocking(False)
+                addr = SpeedTester._sockaddr(ip, self.port)
+                t0 = time.perf_counter_ns()
+                rc = s.connect_ex(addr)
+            except OSError as e:
+                if s is not None:
+                    s.close()
+                finish_attempt(ip, None, f"err:{e}")
+                return
+            if rc == 0:
+                # 本机 / 同网段地址可能立即连上
+                t1 = time.perf_counter_ns()
+                keep_or_close(ip, s)
+                finish_attempt(ip, (t1 - t0) / 1_000_000.0, None)
+                return
+            if rc not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, "WSAEWOULDBLOCK", -1)):
+                s.close()
+                finish_attempt(ip, None, f"connect_ex_err:{rc}")
+                return
+            sel.register(s, selectors.EVENT_WRITE)
+            inflight[s] = (ip, t0)
+            seq += 1
+            heapq.heappush(deadlines, (time.monotonic() + self.timeout, seq, s))
+
+        try:
+            while len(results) < len(order) and not self._should_stop():
+                now = time.monotonic()
+                cap = self.max_inflight
+                if self.concurrency is not None:
+                    cap = max(1, min(cap, self.concurrency.level))
+                while delayed and delayed[0][0] <= now:
+                    ready.append(heapq.heappop(delayed)[2])
+                # 每轮只发起有限个 connect，避免先发起的连接在长循环里等着被计时
+                burst = 0
+                while ready and len(inflight) < cap and burst < self.CONNECT_BURST:
+                    start(ready.popleft())
+                    burst += 1
+
+                now = time.monotonic()
+                while deadlines and deadlines[0][0] <= now:
+                    s = heapq.heappop(deadlines)[2]
+                    entry = inflight.pop(s, None)
+                    if entry is None:
+                        continue
+                    sel.unregister(s)
+                    s.close()
+                    finish_attempt(entry[0], None, "timeout")
+
+                if len(results) >= len(order):
+                    break
+                wake = [d[0] for d in (deadlines[:1] + delayed[:1])]
+                wait = max(0.0, min(wake) - now) if wake else 0.05
+                if ready and len(inflight) < cap:
+                    wait = 0.0
+                if not inflight:
+                    time.sleep(wait)
+                    continue
+                events = sel.select(min(wait, 0.5))
+                t1 = time.perf_counter_ns()
+                for key, _ in events:
+                    s = key.fileobj
+                    entry = inflight.pop(s, None)
+                    sel.unregister(s)
+                    if entry is None:
+                        continue
+                    ip, t0 = entry
+                    so_err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if so_err == 0:
+                        keep_or_close(ip, s)
+                        finish_attempt(ip, (t1 - t0) / 1_000_000.0, None)
+                    else:
+                        s.close()
+                        finish_attempt(ip, None, f"so_error:{so_err}")
+        finally:
+            for s, (ip, _) in list(inflight.items()):
+                try:
+                    sel.unregister(s)
+                except Exception:
+                    pass
+                s.close()
+                if limiter is not None:
+                    limiter.release(ip)
+            sel.close()
+
+        return [results.get(ip) or (ip, 9999, "已停止", {}) for ip in order]
+
+
+class TournamentScheduler:
+    """逐轮减半（successive halving）的锦标赛式测速调度。
+
+    - 第 1 轮每个 IP 只采 1 个样本；之后每轮只给排名靠前的 1/eta 追加样本，
+      累计样本数按 eta 倍增长，直到决赛圈达到完整的 attempts 次
+    - 排名按域名分组进行：每个域名至少保留 min_keep 个 IP 进入下一轮，
+      保证每个域名的最优 IP 都经过完整采样（write_best_ip_to_hosts 按域名选优）
+    - 被淘汰的 IP 立即以已有样本出结果（status 为 "可用(未入围)" 或 "失败"），不再重试
+    - 每轮由 MassTcpProber 执行；决赛轮可保留连接供 TLS 握手复用（take_socket）
+
+    结果格式与 SpeedTester 相同：(ip, ms, status, metrics)；metrics["tournament_round"] 为最后参加的轮次，
+    metrics["tournament_final"] 表示是否进入决赛圈。
+    """
+
+    def __init__(
+        self,
+        *,
+        port: int = 443,
+        attempts: int = 5,
+        timeout: float = 2.0,
+        interval: float = 0.02,
+        eta: int = 3,
+        min_keep: int = 3,
+        max_inflight: int = 1000,
+        keep_sockets: int = 0,
+        limiter: Optional[ConnectRateLimiter] = None,
+        concurrency: Optional[AimdConcurrencyController] = None,
+        stop_event: Optional[threading.Event] = None,
+        stop_flag: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.port = int(port)
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.attempts = max(1, int(attempts))
+        self.timeout = float(timeout)
+        self.interval = float(interval)
+        self.eta = max(2, int(eta))
+        self.min_keep = max(1, int(min_keep))
+        self.max_inflight = int(max_inflight)
+        self.keep_sockets = int(keep_sockets)
+        self.stop_event = stop_event
+        self.stop_flag = stop_flag
+        self._final_prober: Optional[MassTcpProber] = None
+        # 最近一次 run 的统计：实际 connect 次数、全量采样所需次数、各轮参赛 IP 数
+        self.last_connects = 0
+        self.last_full_connects = 0
+        self.last_rounds: List[int] = []
+
+    def _should_stop(self) -> bool:
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        if self.stop_flag is not None and self.stop_flag():
+            return True
+        return False
+
+    def schedule(self) -> List[int]:
+        """各轮结束时的累计样本数，例如 attempts=5, eta=3 -> [1, 3, 5]。"""
+        out = [1]
+        while out[-1] < self.attempts:
+            out.append(min(self.attempts, out[-1] * self.eta))
+        return out
+
+    def take_socket(self, ip: str) -> Optional[socket.socket]:
+        """取出决赛轮为 ip 保留的连接（见 MassTcpProber.take_socket）。"""
+        prober = self._final_prober
+        return prober.take_socket(ip) if prober is not None else None
+
+    def close(self) -> None:
+        if self._final_prober is not None:
+            self._final_prober.close()
+
+    def _survivors(self, alive: List[str], samples: Dict[str, List[float]], groups: Dict[str, List[str]]) -> Set[str]:
+        """每个分组内按当前中位数排序，保留前 1/eta（至少 min_keep 个）；没有成功样本的 IP 直接淘汰。"""
+        alive_set = set(alive)
+        grouped = {ip for members in groups.values() for ip in members}
+        ungrouped = [ip for ip in alive if ip not in grouped]
+        keep: Set[str] = set()
+        for members in list(groups.values()) + ([ungrouped] if ungrouped else []):
+            ranked = sorted(
+                (ip for ip in members if ip in alive_set and samples.get(ip)),
+                key=lambda ip: statistics.median(samples[ip]),
+            )
+            n = max(self.min_keep, -(-len(ranked) // self.eta))
+            keep.update(ranked[:n])
+        return keep
+
+    def run(
+        self,
+        ips: Iterable[str],
+        *,
+        groups: Optional[Dict[str, List[str]]] = None,
+        on_result: Optional[Callable[[Tuple[str, int, str, Dict[str, Any]]], None]] = None,
+    ) -> List[Tuple[str, int, str, Dict[str, Any]]]:
+        """按锦标赛方式测速全部 IP，按输入顺序返回结果；on_result 在每个 IP 出结果时回调。
+
+        groups 为 {分组名: [ip, ...]}（通常为域名 -> IP），缺省时全部 IP 视为同一组。
+        """
+        order = list(dict.fromkeys(str(ip).strip() for ip in ips if str(ip).strip()))
+        if groups is None:
+            groups = {"": order}
+        samples: Dict[str, List[float]] = {ip: [] for ip in order}
+        tried: Dict[str, int] = {ip: 0 for ip in order}
+        queued: Dict[str, float] = {ip: 0.0 for ip in order}
+        results: Dict[str, Tuple[str, int, str, Dict[str, Any]]] = {}
+        targets = self.schedule()
+        self.last_connects = 0
+        self.last_full_connects = len(order) * self.attempts
+        self.last_rounds = []
+
+        def emit(ip: str, rnd: int, final: bool) -> None:
+            metrics = SpeedTester._summarize_latencies(samples[ip], max(1, tried[ip]), last_err.get(ip))
+            metrics["queue_ms"] = queued[ip]
+            metrics["tournament_round"] = rnd
+            metrics["tournament_final"] = final
+            if not metrics["ok"]:
+                result = (ip, 9999, "失败", metrics)
+            else:
+                result = (ip, max(1, int(metrics["median"])), "可用" if final else "可用(未入围)", metrics)
+            results[ip] = result
+            if on_result is not None:
+                on_result(result)
+
+        last_err: Dict[str, Optional[str]] = {}
+        alive = order
+        have = 0
+        for rnd, target in enumerate(targets, start=1):
+            if not alive or self._should_stop():
+                break
+            final = rnd == len(targets)
+            self.last_rounds.append(len(alive))
+            prober = MassTcpProber(
+                port=self.port,
+                attempts=target - have,
+                timeout=self.timeout,
+                interval=self.interval,
+                max_inflight=self.max_inflight,
+                keep_sockets=self.keep_sockets if final else 0,
+                limiter=self.limiter,
+                concurrency=self.concurrency,
+                stop_event=self.stop_event,
+                stop_flag=self.stop_flag,
+            )
+            if final:
+                self._final_prober = prober
+            round_results = prober.probe(alive)
+            self.last_connects += prober.last_connects
+            for ip, _, _, metrics in round_results:
+                samples[ip].extend(prober.last_samples.get(ip, []))
+                queued[ip] += metrics.get("queue_ms", 0.0)
+                tried[ip] += target - have
+                if metrics.get("err"):
+                    last_err[ip] = metrics["err"]
+            have = target
+            if self._should_stop():
+                break
+
+            if final:
+                for ip in alive:
+                    emit(ip, rnd, True)
+                break
+            keep = self._survivors(alive, samples, groups)
+            for ip in alive:
+                if ip not in keep:
+                    emit(ip, rnd, False)
+            alive = [ip for ip in alive if ip in keep]
+
+        return [results.get(ip) or (ip, 9999, "已停止", {}) for ip in order]
+
+
+def is_fully_probed_ok(status: Any) -> bool:
+    """是否为完整采样后判定可用的结果。
+
+    锦标赛 / 网段聚类中被淘汰的 IP（「可用(未入围)」）只有 1~2 个筛选样本，「未测(同网段)」没有样本，都不算。
+    """
+    s = str(status)
+    return s.startswith("可用") and "未入围" not in s
+
+
+def pick_best_per_domain(
+    rows: Iterable[Tuple[Any, ...]],
+    rank_key: Callable[[Tuple[Any, ...]], Any],
+) -> Dict[str, Tuple[str, Any]]:
+    """按域名选出写入 hosts 的最优 IP，返回 domain -> (ip, ms)。
+
+    rows 为结果行 (ip, domain, ms, status, selected[, jitter, stability])，不足 7 列的补齐后交给 rank_key（越小越好）。
+    只考虑 is_fully_probed_ok 的结果；TLS/SNI 验证通过（status 含 "(TLS)"）的优先，没有时回退到任意可用项。
+    """
+    best_tls: Dict[str, Tuple[str, Any, Any]] = {}
+    best_any: Dict[str, Tuple[str, Any, Any]] = {}
+    for row in rows:
+        if len(row) >= 7:
+            ip, d, ms, st = row[:4]
+            full = tuple(row[:7])
+        else:
+            ip, d, ms, st = row[:4]
+            full = (ip, d, ms, st, False, 0.0, 0.0)
+        if not is_fully_probed_ok(st):
+            continue
+        rk = rank_key(full)
+        if d not in best_any or rk < best_any[d][2]:
+            best_any[d] = (ip, ms, rk)
+        if "(TLS)" in str(st) and (d not in best_tls or rk < best_tls[d][2]):
+            best_tls[d] = (ip, ms, rk)
+    return {d: best_tls.get(d, v)[:2] for d, v in best_any.items()}
+
+
+class PrefixClusterScheduler:
+    """按网段聚类的两阶段测速：先测每个网段的代表，只在有竞争力的网段内展开。
+
+    远程列表里常有几十个 IP 来自同一个 /24，它们的延迟几乎相同，没必要每个都完整测一遍：
+    - 按 /ipv4_prefix（IPv6 为 /ipv6_prefix）聚类，每簇按输入顺序（共识优先）取 representatives 个代表
+    - 第 1 阶段：所有代表各做 1 次 connect；簇得分为代表中的最低延迟
+    - 按分组（域名）挑选有竞争力的簇：得分不超过 组内最优 × ratio + slack_ms，且每组至少 min_clusters 个
+    - 第 2 阶段：有竞争力的簇全部成员（含代表）交给 inner（TournamentScheduler / MassTcpProber）完整测速
+    - 其余簇：代表以已有样本出结果（"可用(未入围)" / "失败"；只有 1 个筛选样本，不参与 pick_best_per_domain 选优），非代表不再测，
+      status 为 "未测(同网段)"，ms 为该簇得分（全簇代表都失败时为 9999）
+    - 平均每簇不足 min_avg_size 个 IP（几乎没有同网段）时跳过第 1 阶段，全部交给 inner
+
+    结果格式与 SpeedTester 相同：(ip, ms, status, metrics)；metrics["cluster"] 为所属网段。
+    """
+
+    def __init__(
+        self,
+        inner: Union[MassTcpProber, TournamentScheduler],
+        *,
+        representatives: int = 2,
+        ratio: float = 1.5,
+        slack_ms: float = 10.0,
+        min_clusters: int = 2,
+        min_avg_size: float = 2.0,
+        ipv4_prefix: int = 24,
+        ipv6_prefix: int = 48,
+    ) -> None:
+        self.inner = inner
+        self.representatives = max(1, int(representatives))
+        self.ratio = max(1.0, float(ratio))
+        self.slack_ms = max(0.0, float(slack_ms))
+        self.min_clusters = max(1, int(min_clusters))
+        self.min_avg_size = float(min_avg_size)
+        self.ipv4_prefix = int(ipv4_prefix)
+        self.ipv6_prefix = int(ipv6_prefix)
+        # 最近一次 run 的统计：簇数、展开的簇数 / IP 数、实际 connect 次数、全量采样所需次数
+        self.last_clusters = 0
+        self.last_expanded_clusters = 0
+        self.last_expanded_ips = 0
+        self.last_connects = 0
+        self.last_full_connects = 0
+
+    def take_socket(self, ip: str) -> Optional[socket.socket]:
+        return self.inner.take_socket(ip)
+
+    def close(self) -> None:
+        self.inner.close()
+
+    def clusters(self, ips: Iterable[str]) -> Dict[str, List[str]]:
+        """网段 -> 成员（保持输入顺序）。"""
+        out: Dict[str, List[str]] = {}
+        for ip in ips:
+            out.setdefault(ip_prefix(ip, self.ipv4_prefix, self.ipv6_prefix), []).append(ip)
+        return out
+
+    def _competitive(
+        self, clusters: Dict[str, List[str]], scores: Dict[str, float], groups: Dict[str, List[str]]
+    ) -> Set[str]:
+        """每个分组内挑出有竞争力的簇（见类说明）；没有任何成功样本的簇不展开。"""
+        cluster_of = {ip: key for key, members in clusters.items() for ip in members}
+        grouped = {ip for members in groups.values() for ip in members}
+        ungrouped = [ip for members in clusters.values() for ip in members if ip not in grouped]
+        chosen: Set[str] = set()
+        for members in list(groups.values()) + ([ungrouped] if ungrouped else []):
+            keys = sorted({cluster_of[ip] for ip in members if cluster_of.get(ip) in scores}, key=lambda k: scores[k])
+            if not keys:
+                continue
+            limit = scores[keys[0]] * self.ratio + self.slack_ms
+            for i, key in enumerate(keys):
+                if i < self.min_clusters or scores[key] <= limit:
+                    chosen.add(key)
+        return chosen
+
+    def run(
+        self,
+        ips: Iterable[str],
+        *,
+        groups: Optional[Dict[str, List[str]]] = None,
+        on_result: Optional[Callable[[Tuple[str, int, str, Dict[str, Any]]], None]] = None,
+    ) -> List[Tuple[str, int, str, Dict[str, Any]]]:
+        """按网段聚类测速全部 IP，按输入顺序返回结果；on_result 在每个 IP 出结果时回调。
+
+        groups 为 {分组名: [ip, ...]}（通常为域名 -> IP），缺省时全部 IP 视为同一组；
+        inner 为 TournamentScheduler 时 groups 会按展开的 IP 裁剪后传给它。
+        """
+        order = list(dict.fromkeys(str(ip).strip() for ip in ips if str(ip).strip()))
+        if groups is None:
+            groups = {"": order}
+        inner = self.inner
+        results: Dict[str, Tuple[str, int, str, Dict[str, Any]]] = {}
+
+        def emit(result: Tuple[str, int, str, Dict[str, Any]]) -> None:
+            results[result[0]] = result
+            if on_result is not None:
+                on_result(result)
+
+        clusters = self.clusters(order)
+        reps = {key: members[:self.representatives] for key, members in clusters.items()}
+        self.last_clusters = len(clusters)
+        self.last_full_connects = len(order) * inner.attempts
+        self.last_connects = 0
+        self.last_expanded_clusters = len(clusters)
+        self.last_expanded_ips = len(order)
+        if not clusters or len(order) < len(clusters) * self.min_avg_size:
+            if isinstance(inner, TournamentScheduler):
+                out = inner.run(order, groups=groups, on_result=on_result)
+            else:
+                out = inner.probe(order, on_result=on_result)
+            self.last_connects = inner.last_connects
+            return out
+
+        # 第 1 阶段：每个代表 1 次 connect
+        screen = MassTcpProber(
+            port=inner.port,
+            attempts=1,
+            timeout=inner.timeout,
+            max_inflight=inner.max_inflight,
+            limiter=inner.limiter,
+            concurrency=inner.concurrency,
+            stop_event=inner.stop_event,
+            stop_flag=inner.stop_flag,
+        )
+        screened = {r[0]: r for r in screen.probe([ip for members in reps.values() for ip in members])}
+        self.last_connects += screen.last_connects
+        if inner._should_stop():
+            return [results.get(ip) or (ip, 9999, "已停止", {}) for ip in order]
+
+        scores: Dict[str, float] = {}
+        for key, members in reps.items():
+            ok = [screened[ip][3]["median"] for ip in members if ip in screened and screened[ip][3].get("ok")]
+            if ok:
+                scores[key] = min(ok)
+        chosen = self._competitive(clusters, scores, groups)
+
+        expand: List[str] = []
+        for key, members in clusters.items():
+            if key in chosen:
+                expand.extend(members)
+                continue
+            estimate = max(1, int(scores[key])) if key in scores else 9999
+            for ip in members:
+                if ip in screened:
+                    _, ms, st, metrics = screened[ip]
+                    metrics["cluster"] = key
+                    emit((ip, ms, "可用(未入围)" if st == "可用" else st, metrics))
+                else:
+                    emit((ip, estimate, "未测(同网段)", {"median": None, "ok": False, "cluster": key}))
+        self.last_expanded_clusters = len(chosen)
+        self.last_expanded_ips = len(expand)
+
+        # 第 2 阶段：有竞争力的簇完整测速（保持输入顺序）
+        expand_set = set(expand)
+        expand = [ip for ip in order if ip in expand_set]
+        cluster_of = {ip: key for key, members in clusters.items() for ip in members}
+
+        def inner_result(result: Tuple[str, int, str, Dict[str, Any]]) -> None:
+            result[3]["cluster"] = cluster_of.get(result[0])
+            emit(result)
+
+        if expand:
+            if isinstance(inner, TournamentScheduler):
+                sub_groups = {g: [ip for ip in members if ip in expand_set] for g, members in groups.items()}
+                inner.run(expand, groups={g: m for g, m in sub_groups.items() if m}, on_result=inner_result)
+            else:
+                inner.probe(expand, on_result=inner_result)
+            self.last_connects += inner.last_connects
+        return [results.get(ip) or (ip, 9999, "已停止", {}) for ip in order]
+
+
 class SpeedTestConfigManager:
     """测速配置管理器"""
     
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""pytest 公共配置：项目为根目录下的平铺模块，测试前把根目录加入 sys.path。"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def isolated_user_data(tmp_path, monkeypatch):
+    """用户数据目录（缓存 / 健康度 / 快照等的缺省位置）指向临时目录，避免污染真实数据。"""
+    data = tmp_path / "userdata"
+    for var in ("XDG_DATA_HOME", "LOCALAPPDATA", "APPDATA"):
+        monkeypatch.setenv(var, str(data))
+    return data
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""AsyncHTTPClient：分帧、解压、重定向、连接复用与响应体上限（本地 HTTP 替身服务器）。"""
+
+import asyncio
+import gzip
+import tracemalloc
+import zlib
+
+import pytest
+
+from local_servers import LocalHostsServer
+from services import AsyncHTTPClient
+
+
+@pytest.fixture
+def server():
+    with LocalHostsServer() as srv:
+        yield srv
+
+
+def fetch(url, **client_kwargs):
+    async def run():
+        client = AsyncHTTPClient(**client_kwargs)
+        try:
+            return await client.request(url)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_gzip_bomb_stops_at_limit_without_inflating(server):
+    # 64 MiB 的 0 压缩后只有约 64 KB
+    bomb = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    payload = b"".join(bomb.compress(bytes(1 << 20)) for _ in range(64)) + bomb.flush()
+    url = server.route("/bomb", payload, gzip=False, headers={"Content-Encoding": "gzip"})
+
+    tracemalloc.start()
+    try:
+        with pytest.raises(ValueError):
+            fetch(url, max_body_bytes=1 << 20)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 16 << 20
+
+
+@pytest.mark.parametrize("wbits", [zlib.MAX_WBITS, -zlib.MAX_WBITS], ids=["zlib", "raw"])
+def test_deflate_variants(server, wbits):
+    body = b"140.82.112.3 github.com\n" * 5000
+    c = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    url = server.route("/deflate", c.compress(body) + c.flush(), gzip=False, headers={"Content-Encoding": "deflate"})
+    assert fetch(url, chunk_size=1024).body == body
+
+
+def test_gzip_body_exactly_at_limit(server):
+    body = bytes(range(256)) * 4096
+    url = server.route("/exact", gzip.compress(body), gzip=False, headers={"Content-Encoding": "gzip"})
+    assert fetch(url, max_body_bytes=len(body)).body == body
+    with pytest.raises(ValueError):
+        fetch(url, max_body_bytes=len(body) - 1)
+
+
+HOSTS = b"".join(f"140.82.{i // 250}.{i % 250} github.com\n".encode() for i in range(3000))
+
+
+def fetch_all(urls, **client_kwargs):
+    """同一个客户端依次请求多个 URL（用于观察连接复用）。"""
+
+    async def run():
+        client = AsyncHTTPClient(**client_kwargs)
+        try:
+            return [await client.request(u) for u in urls]
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+@pytest.mark.parametrize("compress", [False, True], ids=["identity", "gzip"])
+def test_chunked_framing(server, chunk_size, compress):
+    # 1 字节分块时每块一次 write，缩小正文控制耗时
+    body = HOSTS[:2000] if chunk_size == 1 else HOSTS
+    url = server.route("/chunked", body, chunk_size=chunk_size, gzip=compress)
+    resp = fetch(url, chunk_size=1024)
+    assert resp.status == 200
+    assert resp.headers["transfer-encoding"] == "chunked"
+    assert resp.body == body
+
+
+def test_gzip_is_requested_and_decoded(server):
+    url = server.route("/gz", HOSTS, gzip=True)
+    resp = fetch(url)
+    assert resp.headers["content-encoding"] == "gzip"
+    assert int(resp.headers["content-length"]) < len(HOSTS) // 4
+    assert resp.body == HOSTS
+
+
+@pytest.mark.parametrize("status", [301, 302, 303, 307, 308])
+def test_redirect_followed_with_relative_location(server, status):
+    server.route("/new/hosts", HOSTS)
+    url = server.route("/old", b"moved", status=status, headers={"Location": "new/hosts"})
+    resp = fetch(url)
+    assert resp.status == 200
+    assert resp.url == server.url("/new/hosts")
+    assert resp.body == HOSTS
+    # 重定向响应体被读掉，两次请求走同一条连接
+    assert server.connections == 1
+
+
+def test_redirect_not_followed_when_disabled(server):
+    url = server.route("/old", b"moved", status=302, headers={"Location": "/new"})
+
+    async def run():
+        client = AsyncHTTPClient()
+        try:
+            return await client.request(url, follow_redirects=False)
+        finally:
+            await client.aclose()
+
+    resp = asyncio.run(run())
+    assert resp.status == 302
+    assert resp.headers["location"] == "/new"
+    assert server.hits.get("/new") is None
+
+
+def test_redirect_loop_is_bounded(server):
+    server.route("/a", b"", status=302, headers={"Location": "/b"})
+    server.route("/b", b"", status=302, headers={"Location": "/a"})
+    with pytest.raises(RuntimeError):
+        fetch(server.url("/a"), max_redirects=3)
+    assert server.hits["/a"] + server.hits["/b"] == 4
+
+
+def test_keep_alive_connection_is_reused(server):
+    urls = [
+        server.route("/plain", HOSTS, gzip=False),
+        server.route("/gz", HOSTS, gzip=True),
+        server.route("/chunked", HOSTS, chunk_size=1000),
+        server.route("/plain2", HOSTS, gzip=False),
+    ]
+    resps = fetch_all(urls)
+    assert [r.body for r in resps] == [HOSTS] * 4
+    assert server.connections == 1
+
+
+def test_server_closed_idle_connection_is_replaced(server):
+    first = server.route("/first", HOSTS, headers={"Connection": "close"})
+    second = server.route("/second", HOSTS)
+    resps = fetch_all([first, second])
+    assert [r.body for r in resps] == [HOSTS, HOSTS]
+    assert server.connections == 2
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""DNS 线格式编解码、TC 截断改走 TCP、NXDOMAIN 负缓存。"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from local_servers import StubDnsServer
+from services import (
+    DNS_RCODE_NXDOMAIN,
+    DNS_TYPE_A,
+    AsyncDnsClient,
+    DnsCache,
+    DomainResolver,
+    _dns_build_query,
+    _dns_is_truncated,
+    _dns_parse_response,
+    _dns_read_name,
+)
+
+
+EDGES = ["185.199.108.133", "185.199.109.133", "185.199.110.133", "185.199.111.133", "185.199.112.133"]
+
+
+def _compressed_response() -> bytes:
+    """www.github.com CNAME github.com，A 记录；所有者与 CNAME 目标都用压缩指针。"""
+    _, question = _dns_build_query(0x1234, "www.github.com", DNS_TYPE_A)
+    header = struct.pack("!HHHHHH", 0x1234, 0x8180, 1, 2, 0, 0)
+    # 问题段从偏移 12 开始："www" 标签占 4 字节，因此 github.com 位于偏移 16
+    cname = b"\xc0\x0c" + struct.pack("!HHIH", 5, 1, 600, 2) + b"\xc0\x10"
+    a = b"\xc0\x10" + struct.pack("!HHIH", DNS_TYPE_A, 1, 60, 4) + socket.inet_aton(EDGES[0])
+    return header + question + cname + a
+
+
+def test_parse_follows_compression_pointers():
+    ans = _dns_parse_response(_compressed_response(), "WWW.GitHub.com.", DNS_TYPE_A)
+    assert ans.addresses == [EDGES[0]]
+    assert ans.cnames == ["github.com"]
+    assert ans.canonical_name == "github.com"
+    assert ans.ttl == 60
+    assert not ans.truncated
+
+
+def test_read_name_returns_offset_after_pointer():
+    data = _compressed_response()
+    name, end = _dns_read_name(data, len(data) - 16)
+    assert name == "github.com"
+    assert end == len(data) - 14
+
+
+@pytest.mark.parametrize("keep", [8, 14, 20, -20, -13, -1])
+def test_truncated_packets_raise_value_error(keep):
+    with pytest.raises(ValueError):
+        _dns_parse_response(_compressed_response()[:keep], "www.github.com", DNS_TYPE_A)
+
+
+def test_pointer_loop_raises_value_error():
+    data = struct.pack("!HHHHHH", 1, 0x8180, 1, 0, 0, 0) + b"\xc0\x0c" + b"\x00\x01\x00\x01"
+    with pytest.raises(ValueError):
+        _dns_parse_response(data, "x.test", DNS_TYPE_A)
+
+
+def test_tc_bit_read_from_header_only():
+    data = bytearray(_compressed_response())
+    assert not _dns_is_truncated(bytes(data))
+    data[2] |= 0x02
+    # 记录段被切坏也能识别 TC，不需要先完整解析
+    assert _dns_is_truncated(bytes(data[:14]))
+    assert not _dns_is_truncated(b"\x00\x01")
+
+
+def _query(server: StubDnsServer, name: str, **kwargs):
+    async def run():
+        client = AsyncDnsClient([server.address], timeout=1.0, attempts=1, **kwargs)
+        try:
+            return await client.query(name, DNS_TYPE_A)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("partial", [False, True])
+def test_truncated_udp_answer_falls_back_to_tcp(partial):
+    with StubDnsServer({"github.com": {"A": EDGES}}, truncate_over=2, truncate_partial=partial) as dns:
+        ans = _query(dns, "github.com")
+        assert sorted(ans.addresses) == sorted(EDGES)
+        assert not ans.truncated
+        assert (dns.udp_queries, dns.tcp_queries) == (1, 1)
+
+
+def test_tcp_answer_with_wrong_id_is_rejected():
+    with StubDnsServer({"github.com": {"A": EDGES}}, truncate_over=2) as dns:
+        real_answer = dns.answer
+
+        def wrong_id(data, *, tcp):
+            out = real_answer(data, tcp=tcp)
+            if tcp and out:
+                out = bytes([out[0] ^ 0xFF]) + out[1:]
+            return out
+
+        dns.answer = wrong_id
+        with pytest.raises(RuntimeError, match="不匹配"):
+            _query(dns, "github.com")
+        assert dns.tcp_queries == 1
+
+
+def test_nxdomain_is_an_answer_not_a_failure():
+    with StubDnsServer({"github.com": {"A": EDGES[:1]}}) as dns:
+        ans = _query(dns, "missing.test")
+        assert ans.rcode == DNS_RCODE_NXDOMAIN
+        assert ans.addresses == []
+
+
+def test_nxdomain_is_negatively_cached(tmp_path):
+    with StubDnsServer({"github.com": {"A": EDGES[:1]}}) as dns:
+        cache = DnsCache(path=str(tmp_path / "dns.json"))
+        resolver = DomainResolver(engine="native", upstreams=[dns.address], fanout_upstreams=[], cache=cache)
+
+        assert resolver.resolve(["missing.test"], ipv4_only=True) == []
+        entry = cache.get("missing.test", DNS_TYPE_A)
+        assert entry is not None and entry["negative"] and entry["addresses"] == []
+        queries = dns.udp_queries
+
+        assert resolver.resolve(["missing.test"], ipv4_only=True) == []
+        assert dns.udp_queries == queries
+
+        cache.save()
+        reloaded = DnsCache(path=str(tmp_path / "dns.json")).get("missing.test", DNS_TYPE_A)
+        assert reloaded is not None and reloaded["negative"]
+
+
+def test_fanout_is_opt_in(tmp_path):
+    resolver = DomainResolver(engine="native", upstreams=["127.0.0.1:53"], cache=DnsCache(path=str(tmp_path / "dns.json")))
+    assert resolver.fanout is None
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""HostsParser 与原逐行解析器（RemoteHostsClient.parse_github_hosts_text 的原实现）的差分测试。"""
+
+import ipaddress
+import random
+import re
+
+import pytest
+
+from benchmarks import generate_hosts_corpus
+from services import HostsParser, HostsStreamParser
+
+
+def legacy_parse(txt, *, ipv4_only=False, ipv6_only=False):
+    """原版逐行解析（保留原实现作为参照）。"""
+    out = []
+    seen = set()
+    for raw in (txt or "").splitlines():
+        line = (raw or "").strip()
+        if not line or line.startswith("#"):
+            continue
+        if "#" in line:
+            line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        ip_str = parts[0].strip()
+        try:
+            ip_obj = ipaddress.ip_address(ip_str)
+            if ipv4_only and ip_obj.version != 4:
+                continue
+            if ipv6_only and ip_obj.version != 6:
+                continue
+        except Exception:
+            continue
+        for host in parts[1:]:
+            host = host.strip()
+            if not host:
+                continue
+            if not re.fullmatch(r"[A-Za-z0-9.-]+", host):
+                continue
+            if "." not in host:
+                continue
+            if "github" not in host.lower():
+                continue
+            key = (ip_str, host.lower())
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append((ip_str, host))
+    return out
+
+
+def github_parser():
+    """与原版过滤规则等价：域名包含 "github"。"""
+    return HostsParser(target_suffixes=[], keywords=["github"])
+
+
+EDGE_CASES = "\r\n".join([
+    "140.82.112.3 github.com",
+    "140.82.112.3 GitHub.com github.com  # 大小写重复",
+    "  140.82.112.4\tapi.github.com\tgist.github.com",
+    "#140.82.112.5 commented.github.com",
+    "   # indented comment github.com",
+    "140.82.112.6 # github.com only in comment",
+    "140.82.112.7",
+    "999.1.1.1 github.com",
+    "01.2.3.4 github.com",
+    "1.2.3 github.com",
+    "1.2.3.4 bad_host!.github.com githubnodot raw.githubusercontent.com",
+    "2606:50c0:8000::154 github.io",
+    "::ffff:140.82.112.8 mapped.github.com",
+    "fe80::1 link-local.github.com",
+    "<html><body>140.82.112.9 github.com</body></html>",
+    "0.0.0.0 ads.example.com",
+    "140.82.112.10 github.com#inline",
+    "140.82.112.11\x0bgithub.com",
+    "140.82.112.13\x1fgithub.com\x0cgist.github.com",
+    "140.82.112.14\u3000github.com\u00a0api.github.com",
+    "140.82.112.15\u2028github.com",
+    "140.82.112.16 github.com\u0085140.82.112.17 github.com",
+    "140.82.112.18 gíthub.com github.com",
+    "",
+    "140.82.112.12 github.com",
+])
+
+
+@pytest.mark.parametrize("family", [{}, {"ipv4_only": True}, {"ipv6_only": True}], ids=["all", "v4", "v6"])
+def test_edge_cases_match_legacy(family):
+    expected = legacy_parse(EDGE_CASES, **family)
+    assert expected, "参照解析器应有结果"
+    assert github_parser().parse_text(EDGE_CASES, **family) == expected
+
+
+@pytest.mark.parametrize("seed", [1, 20240101])
+def test_synthetic_corpus_matches_legacy(seed):
+    corpus = generate_hosts_corpus(20_000, seed=seed)
+    assert github_parser().parse_bytes(corpus) == legacy_parse(corpus.decode("utf-8"))
+
+
+def test_random_lines_match_legacy():
+    rnd = random.Random(7)
+    tokens = ["140.82.112.3", "2606:50c0::1", "300.1.1.1", "github.com", "API.GitHub.com", "x.githubassets.com",
+              "foo", "#", "# c", "\t", "  ", "a_b.github.com", "github", "1.1.1.1", "::1", "gist.github.com#x"]
+    lines = [" ".join(rnd.choice(tokens) for _ in range(rnd.randint(0, 5))) for _ in range(5000)]
+    for sep in ("\n", "\r\n", "\r"):
+        txt = sep.join(lines)
+        assert github_parser().parse_text(txt) == legacy_parse(txt)
+
+
+def test_stream_parser_matches_across_chunk_boundaries():
+    corpus = generate_hosts_corpus(5_000, seed=3)
+    parser = github_parser()
+    stream = HostsStreamParser(parser=parser)
+    out = []
+    for i in range(0, len(corpus), 777):
+        out.extend(stream.feed(corpus[i:i + 777]))
+    out.extend(stream.close())
+    assert out == legacy_parse(corpus.decode("utf-8"))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""网段聚类测速：只有筛选样本的代表不会被选为最优 IP。"""
+
+import services
+from services import MassTcpProber, PrefixClusterScheduler, SpeedTester, pick_best_per_domain
+
+
+class _ScriptedProber(MassTcpProber):
+    """按脚本返回延迟的探测器：script[ip] 为依次返回的样本（ms），用完后重复最后一个；None 表示连接失败。"""
+
+    script = {}
+    calls = {}
+
+    def probe(self, ips, on_result=None):
+        out = []
+        self.last_samples = {}
+        self.last_connects = 0
+        for ip in ips:
+            seq = self.script[ip]
+            samples = []
+            for _ in range(self.attempts):
+                n = self.calls.get(ip, 0)
+                self.calls[ip] = n + 1
+                value = seq[min(n, len(seq) - 1)]
+                if value is not None:
+                    samples.append(float(value))
+            self.last_connects += self.attempts
+            self.last_samples[ip] = samples
+            metrics = SpeedTester._summarize_latencies(samples, self.attempts, None if samples else "timeout")
+            metrics["queue_ms"] = 0.0
+            result = (ip, max(1, int(metrics["median"])) if samples else 9999, "可用" if samples else "失败", metrics)
+            out.append(result)
+            if on_result is not None:
+                on_result(result)
+        return out
+
+
+def _run(monkeypatch, script, **kwargs):
+    _ScriptedProber.script = script
+    _ScriptedProber.calls = {}
+    monkeypatch.setattr(services, "MassTcpProber", _ScriptedProber)
+    sch = PrefixClusterScheduler(_ScriptedProber(attempts=5), **kwargs)
+    ips = list(script)
+    return sch, sch.run(ips, groups={"github.com": ips})
+
+
+def test_screening_sample_representative_never_wins(monkeypatch):
+    script = {}
+    # 10.0.1.0/24：代表的筛选样本偶然很快（10 ms），完整测速后中位数 30 ms
+    for h in range(1, 5):
+        script[f"10.0.1.{h}"] = [10, 30]
+    # 10.0.2.0/24：代表筛选样本 12 ms，不在 ratio=1.0 / slack=0 的范围内，不展开
+    for h in range(1, 5):
+        script[f"10.0.2.{h}"] = [12]
+    sch, results = _run(monkeypatch, script, ratio=1.0, slack_ms=0.0, min_clusters=1)
+
+    by_ip = {r[0]: r for r in results}
+    assert sch.last_expanded_clusters == 1
+    assert by_ip["10.0.2.1"][2] == "可用(未入围)" and by_ip["10.0.2.1"][1] == 12
+    assert by_ip["10.0.2.3"][2] == "未测(同网段)"
+    assert by_ip["10.0.1.1"][2] == "可用" and by_ip["10.0.1.1"][1] == 30
+
+    rows = [(ip, "github.com", ms, st, False) for ip, ms, st, _ in results]
+    best = pick_best_per_domain(rows, lambda row: float(row[2]))
+    assert best["github.com"][0].startswith("10.0.1.")
+
+
+def test_competitive_clusters_expand_and_far_ones_are_skipped(monkeypatch):
+    script = {}
+    for c, base in ((1, 20), (2, 24), (3, 200), (4, None)):
+        for h in range(1, 11):
+            script[f"10.0.{c}.{h}"] = [base]
+    script["10.0.2.7"] = [15]
+    sch, results = _run(monkeypatch, script, min_clusters=1)
+
+    by_ip = {r[0]: r for r in results}
+    assert sch.last_clusters == 4 and sch.last_expanded_clusters == 2
+    assert sch.last_connects < sch.last_full_connects
+    assert by_ip["10.0.3.5"][2] == "未测(同网段)" and by_ip["10.0.3.5"][1] == 200
+    assert by_ip["10.0.4.5"][1] == 9999
+    assert all(r[3]["cluster"] for r in results)
+
+    rows = [(ip, "github.com", ms, st, False) for ip, ms, st, _ in results]
+    assert pick_best_per_domain(rows, lambda row: float(row[2]))["github.com"][0] == "10.0.2.7"
+
+
+def test_singleton_prefixes_skip_clustering(monkeypatch):
+    script = {f"10.{i}.0.1": [50] for i in range(20)}
+    sch, results = _run(monkeypatch, script)
+    assert sch.last_expanded_ips == 20
+    assert {r[2] for r in results} == {"可用"}
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""远程 hosts 获取：提供者、多源竞速（本地 HTTP / DNS 替身服务器）。"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from local_servers import LocalHostsServer, StubDnsServer
+from services import (
+    DnsCache,
+    DnsHostsProvider,
+    DomainResolver,
+    HostsSnapshotStore,
+    JsonHostsProvider,
+    LocalHostsProvider,
+    RemoteHostsCache,
+    RemoteHostsClient,
+    SourceHealthStore,
+    _SourceRace,
+    make_hosts_provider,
+)
+
+HOSTS = b"140.82.112.3 github.com\n140.82.112.4 api.github.com\n185.199.108.133 raw.githubusercontent.com\n"
+
+
+@pytest.fixture
+def server():
+    with LocalHostsServer() as srv:
+        yield srv
+
+
+def make_client(urls, workdir, **kwargs):
+    """缓存 / 健康度 / 快照都放在临时目录。"""
+    return RemoteHostsClient(
+        urls=urls,
+        cache=RemoteHostsCache(cache_dir=os.path.join(workdir, "cache"), fresh_seconds=0),
+        health=SourceHealthStore(path=os.path.join(workdir, "health.json")),
+        snapshots=HostsSnapshotStore(snapshot_dir=os.path.join(workdir, "snapshots")),
+        **kwargs,
+    )
+
+
+async def _fetch_async(client, **kwargs):
+    try:
+        return await client.fetch_github_hosts_async(**kwargs)
+    finally:
+        await client.aclose()
+
+
+def test_sync_race_loser_does_not_touch_shared_state(server, tmp_path):
+    fast = server.route("/fast", HOSTS, etag=False)
+    slow = server.route("/slow", HOSTS)
+    client = make_client([fast, slow], str(tmp_path))
+
+    # 先单独获取一次慢源：缓存里有 ETag，竞速时它会在延迟后以 304 返回
+    client.fetch_github_hosts(url_override=slow)
+    cached_at = client.cache.get(slow)["fetched_at"]
+    attempts = client.health._data[slow]["attempts"]
+    server.routes["/slow"].delay = 0.5
+
+    result, race = client._race_fetch_sync([fast, slow], [0.0, 0.0], False, False)
+    assert result is not None and result[1] == fast
+    assert client.last_cache_status is None
+
+    # 等落败的请求在后台结束：它不能再写缓存、健康度或 last_cache_status
+    time.sleep(1.0)
+    assert server.hits["/slow"] == 2
+    assert client.last_cache_status is None
+    assert client.cache.get(slow)["fetched_at"] == cached_at
+    assert client.health._data[slow]["attempts"] == pytest.approx(attempts, rel=1e-3)
+    assert race.diagnostics[slow]["status"] == "cancelled"
+
+
+def test_sync_race_reports_winner_cache_status(server, tmp_path):
+    url = server.route("/hosts", HOSTS)
+    client = make_client([url], str(tmp_path))
+    records, used = client.fetch_github_hosts(url_override=url)
+    assert used == url and len(records) == 3
+    assert client.last_cache_status is None
+
+    records, _ = client.fetch_github_hosts(url_override=url)
+    assert len(records) == 3
+    assert client.last_cache_status == "not_modified"
+
+
+def test_async_race_reports_winner_cache_status(server, tmp_path):
+    v6 = server.route("/v6", b"2606:50c0:8000::154 github.com\n")
+    good = server.route("/good", HOSTS, etag=False, delay=0.3)
+    client = make_client([v6, good], str(tmp_path))
+    client.fetch_github_hosts(url_override=v6)
+
+    async def run():
+        try:
+            return await client._race_fetch_async([v6, good], [0.0, 0.0], True, False)
+        finally:
+            await client.aclose()
+
+    # v6 源先以 304 返回，但按 IPv4 过滤后为空：它的缓存命中不能算到胜者头上
+    result, race = asyncio.run(run())
+    assert result is not None and result[1] == good
+    assert race.diagnostics[v6]["status"] == "empty"
+    assert client.last_cache_status is None
+
+
+def _fetch_http_async(client, url, parse):
+    async def run():
+        try:
+            return await client._fetch_http_records_async(url, parse)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("kind", ["html", "too_large"])
+def test_async_fetch_does_not_retry_deterministic_failures(server, tmp_path, kind):
+    if kind == "html":
+        url = server.route("/hosts", b"<!doctype html><html>mirror down</html>", content_type="text/html")
+    else:
+        url = server.route("/hosts", HOSTS * 100)
+    client = make_client([url], str(tmp_path))
+    client.http.max_body_bytes = 1024
+
+    with pytest.raises(Exception):
+        _fetch_http_async(client, url, lambda data: [])
+    assert server.hits["/hosts"] == 1
+
+
+def test_async_fetch_retries_dropped_connections(server, tmp_path):
+    url = server.route("/hosts", drop=True)
+    client = make_client([url], str(tmp_path))
+    with pytest.raises(RuntimeError, match="重试"):
+        _fetch_http_async(client, url, lambda data: [])
+    assert server.hits["/hosts"] == 3
+
+
+def test_async_fetch_passes_raw_bytes_to_parser(server, tmp_path):
+    body = "# 镜像\n".encode("gbk") + b"\xff\xfe " + HOSTS
+    url = server.route("/hosts", body)
+    client = make_client([url], str(tmp_path))
+    seen = []
+    records = _fetch_http_async(client, url, lambda data: seen.append(data) or [("140.82.112.3", "github.com")])
+    assert seen == [body]
+    assert records == [("140.82.112.3", "github.com")]
+
+
+# ---------------------------------------------------------------------
+# 提供者
+# ---------------------------------------------------------------------
+def test_http_and_json_providers(server, tmp_path):
+    text = server.route("/hosts", HOSTS, chunk_size=16)
+    as_json = server.route(
+        "/hosts.json", json.dumps({"github.com": ["140.82.112.3", "140.82.112.4"], "example.com": "1.2.3.4"}).encode()
+    )
+    client = make_client([text, as_json], str(tmp_path))
+    assert isinstance(make_hosts_provider(as_json), JsonHostsProvider)
+
+    records, _ = client.fetch_github_hosts(url_override=text)
+    assert records == [("140.82.112.3", "github.com"), ("140.82.112.4", "api.github.com"),
+                       ("185.199.108.133", "raw.githubusercontent.com")]
+    records, _ = asyncio.run(_fetch_async(client, url_override=as_json))
+    assert sorted(records) == [("140.82.112.3", "github.com"), ("140.82.112.4", "github.com")]
+
+
+def test_local_provider_directory(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.hosts").write_bytes(HOSTS)
+    (src / "b.json").write_text('[["140.82.112.9", "gist.github.com"]]', encoding="utf-8")
+    (src / ".hidden").write_bytes(b"1.1.1.1 github.com\n")
+    provider = make_hosts_provider(str(src))
+    assert isinstance(provider, LocalHostsProvider)
+    client = make_client([provider], str(tmp_path))
+
+    records, used = client.fetch_github_hosts()
+    assert used == str(src)
+    assert len(records) == 4 and ("140.82.112.9", "gist.github.com") in records
+    assert ("1.1.1.1", "github.com") not in records
+
+
+@pytest.fixture
+def dns_server():
+    records = {
+        "github.com": {"A": ["140.82.112.3"]},
+        "api.github.com": {"CNAME": "github.com"},
+    }
+    with StubDnsServer(records) as dns:
+        yield dns
+
+
+def _stub_resolver(dns, tmp_path):
+    return DomainResolver(
+        engine="native", upstreams=[dns.address], fanout_upstreams=[], cache=DnsCache(path=str(tmp_path / "dns.json"))
+    )
+
+
+def test_dns_provider_sync_and_async_reuse_resolver(dns_server, tmp_path):
+    resolver = _stub_resolver(dns_server, tmp_path)
+    provider = DnsHostsProvider("dns://github.com,api.github.com", resolver=resolver)
+    client = make_client([provider], str(tmp_path))
+
+    records, used = client.fetch_github_hosts()
+    assert used == "dns://github.com,api.github.com"
+    assert sorted(records) == [("140.82.112.3", "api.github.com"), ("140.82.112.3", "github.com")]
+
+    records, _ = asyncio.run(_fetch_async(client))
+    assert len(records) == 2
+    # 同一个解析器被复用，每次获取后 UDP 端点都已释放；第二次命中 DNS 缓存
+    assert provider.resolver is resolver
+    assert resolver.dns._endpoints == {}
+    assert resolver.cache.hits > 0
+
+
+# ---------------------------------------------------------------------
+# 多源竞速
+# ---------------------------------------------------------------------
+def test_health_zero_latency_is_not_unknown(tmp_path):
+    health = SourceHealthStore(path=str(tmp_path / "health.json"))
+    health.record("a", ok=True, latency_ms=0.0)
+    health.record("b", ok=True, latency_ms=100.0)
+    assert health.latency_percentile("a", 0.5) == 0.0
+    assert health.cost("a") < health.cost("b")
+    assert health.ordered(["b", "a"]) == ["a", "b"]
+
+
+def test_health_reads_while_workers_record(tmp_path):
+    health = SourceHealthStore(path=str(tmp_path / "health.json"))
+    stop = threading.Event()
+
+    def writer(prefix):
+        i = 0
+        while not stop.is_set():
+            health.record(f"{prefix}{i}", ok=True, latency_ms=float(i % 50), record_count=i)
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(p,), daemon=True) for p in "xy"]
+    for t in threads:
+        t.start()
+    try:
+        # 写线程不断新增源：读取方遍历全部源时不能遇到“字典在迭代中被修改”
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            health.ordered(["x0", "y0", "z"])
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def test_source_race_promotes_next_source_on_failure():
+    race = _SourceRace(["a", "b", "c"], [0.0, None, None], deadline=5.0)
+    assert race.due() == ["a"]
+    assert race.on_done("a", error=RuntimeError("boom")) is False
+    assert race.due() == ["b"]
+    assert race.on_done("b", records=[]) is False
+    assert race.due() == ["c"]
+    assert race.on_done("c", records=[("1.1.1.1", "github.com")]) is True
+    diag = race.finish()
+    assert [diag[u]["status"] for u in "abc"] == ["error", "empty", "ok"]
+
+
+def test_source_race_marks_running_sources_cancelled_or_timeout():
+    race = _SourceRace(["a", "b"], [0.0, 0.0], deadline=5.0)
+    race.due()
+    race.on_done("a", records=[("1.1.1.1", "github.com")])
+    assert race.finish()["b"]["status"] == "cancelled"
+
+    race = _SourceRace(["a"], [0.0], deadline=0.0)
+    race.due()
+    assert race.expired()
+    assert race.finish()["a"]["status"] == "timeout"
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_fetch_falls_back_past_broken_sources(server, tmp_path, mode):
+    broken = server.route("/broken", b"oops", status=503)
+    html = server.route("/html", b"<!doctype html><html>mirror down</html>", content_type="text/html")
+    dropped = server.route("/drop", drop=True)
+    good = server.route("/good", HOSTS)
+    # 不带重试的会话：默认会话对断连做指数退避重试，测试里只关心切换逻辑
+    client = make_client([broken, html, dropped, good], str(tmp_path), session=requests.Session())
+    # 没有健康度历史：按配置顺序，前一个失败才启动下一个
+    client.health = None
+
+    if mode == "sync":
+        records, used = client.fetch_github_hosts()
+    else:
+        records, used = asyncio.run(_fetch_async(client))
+    assert used == good and len(records) == 3
+    diag = client.last_fetch_diagnostics
+    assert diag[good]["status"] == "ok"
+    if mode == "sync":
+        # 同步版逐个提前启动：每个失败的源都有结论
+        assert [diag[u]["status"] for u in (broken, html, dropped)] == ["error", "empty", "error"]
+    else:
+        # 异步版同时启动：胜者出现时仍在途的源被取消
+        assert all(diag[u]["status"] in ("error", "empty", "cancelled") for u in (broken, html, dropped))
+
+
+def test_fetch_prefers_first_winner_when_hedged(server, tmp_path):
+    slow = server.route("/slow", HOSTS, delay=1.0)
+    fast = server.route("/fast", HOSTS.replace(b"140.82.112.3", b"140.82.112.5"))
+    client = make_client([slow, fast], str(tmp_path))
+    result, race = client._race_fetch_sync([slow, fast], [0.0, 0.05], False, False)
+    assert result[1] == fast
+    assert race.diagnostics[slow]["status"] == "cancelled"
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""HostsSnapshotStore：增量计算、快照往返、淘汰与测速结果复用。"""
+
+from __future__ import annotations
+
+import os
+
+from services import HostsSnapshotStore
+
+
+V1 = [("140.82.112.3", "github.com"), ("185.199.108.133", "raw.githubusercontent.com")]
+V2 = [("140.82.112.3", "GitHub.com"), ("185.199.109.133", "raw.githubusercontent.com"), ("140.82.112.3", "api.github.com")]
+
+
+def test_content_hash_ignores_order_duplicates_and_case():
+    a = HostsSnapshotStore.content_hash(V1)
+    b = HostsSnapshotStore.content_hash(list(reversed(V1)) + [("140.82.112.3", "GITHUB.COM")])
+    assert a == b
+    assert a != HostsSnapshotStore.content_hash(V2)
+
+
+def test_first_save_reports_everything_new(tmp_path):
+    store = HostsSnapshotStore(snapshot_dir=str(tmp_path))
+    delta = store.save(V1, "https://example.invalid/hosts")
+    assert delta.has_previous is False
+    assert delta.unchanged is False
+    assert sorted(delta.added) == sorted(V1)
+    assert delta.new_ips == {ip for ip, _ in V1}
+
+
+def test_save_delta_and_unchanged(tmp_path):
+    store = HostsSnapshotStore(snapshot_dir=str(tmp_path))
+    store.save(V1, "a")
+
+    same = store.save(list(reversed(V1)), "b")
+    assert same.has_previous and same.unchanged
+    assert len(os.listdir(tmp_path)) == 2  # index.json + 一份快照
+
+    delta = store.save(V2, "a")
+    assert delta.has_previous and not delta.unchanged
+    # github.com 仅大小写变化，不算新增 / 移除
+    assert sorted(delta.added) == [("140.82.112.3", "api.github.com"), ("185.199.109.133", "raw.githubusercontent.com")]
+    assert delta.removed == [("185.199.108.133", "raw.githubusercontent.com")]
+    # 140.82.112.3 上一份已出现过，只需重测真正的新 IP
+    assert delta.new_ips == {"185.199.109.133"}
+
+
+def test_latest_round_trip(tmp_path):
+    store = HostsSnapshotStore(snapshot_dir=str(tmp_path))
+    assert store.latest() is None
+    store.save(V1, "first")
+    store.save(V2, "second")
+
+    records, meta = HostsSnapshotStore(snapshot_dir=str(tmp_path)).latest()
+    assert records == V2
+    assert meta["source"] == "second"
+    assert meta["count"] == len(V2)
+    assert meta["sha"] == HostsSnapshotStore.content_hash(V2)
+
+
+def test_keep_evicts_oldest_snapshot_files(tmp_path):
+    store = HostsSnapshotStore(snapshot_dir=str(tmp_path), keep=2)
+    for i in range(4):
+        store.save([(f"10.0.0.{i}", "github.com")], str(i))
+
+    index = store._index()
+    assert [m["source"] for m in index] == ["2", "3"]
+    assert sorted(f for f in os.listdir(tmp_path) if f.endswith(".json.gz")) == sorted(m["file"] for m in index)
+    assert store.latest()[0] == [("10.0.0.3", "github.com")]
+
+
+def test_probe_results_round_trip_by_profile(tmp_path):
+    store = HostsSnapshotStore(snapshot_dir=str(tmp_path))
+    store.store_results(
+        {"140.82.112.3": (42, "可用", {"tls_ok": True}), "185.199.108.133": (9999, "超时", {})},
+        profile="443",
+    )
+
+    got = store.reusable_results(["140.82.112.3", "185.199.108.133", "1.1.1.1"], max_age=60, profile="443")
+    assert got == {
+        "140.82.112.3": (42, "可用", {"tls_ok": True}),
+        "185.199.108.133": (9999, "超时", {}),
+    }
+    assert store.reusable_results(["140.82.112.3"], max_age=60, profile="80") == {}
+    assert store.reusable_results(["140.82.112.3"], max_age=0, profile="443") == {}
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""流水线 / 批量探测收尾：工作线程抛异常的 IP 也要计数，测速必须能结束（不依赖真实 Tk 窗口）。"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import copy
+import logging
+import queue
+import socket
+import threading
+import time
+
+import pytest
+
+main_window = pytest.importorskip("main_window")
+
+from config import SPEED_TEST_CONFIG  # noqa: E402
+
+HostsOptimizer = main_window.HostsOptimizer
+
+
+class _FakeMaster:
+    """after(0, fn) 只入队，由测试线程像 Tk 主循环一样逐个执行。"""
+
+    def __init__(self) -> None:
+        self.calls: "queue.Queue" = queue.Queue()
+
+    def after(self, _ms, fn) -> None:
+        self.calls.put(fn)
+
+
+class _RaisingTester:
+    limiter = None
+
+    def _tls_reuse_enabled(self) -> bool:
+        return False
+
+    def finish_tcp_metrics(self, ip, metrics, **kwargs):
+        raise RuntimeError("boom")
+
+
+class _Harness:
+    """借用 HostsOptimizer 的收尾逻辑；界面相关的方法换成计数。"""
+
+    _mass_probe_thread = HostsOptimizer._mass_probe_thread
+    _on_mass_probe_done = HostsOptimizer._on_mass_probe_done
+    _on_stream_future_done = HostsOptimizer._on_stream_future_done
+    _on_stream_ip_finished = HostsOptimizer._on_stream_ip_finished
+    _maybe_finish_stream_test = HostsOptimizer._maybe_finish_stream_test
+
+    def __init__(self, ips) -> None:
+        cfg = copy.deepcopy(SPEED_TEST_CONFIG)
+        cfg["tournament"]["enabled"] = False
+        cfg["cluster_probe"]["enabled"] = False
+        cfg["tcp"]["attempts"] = 1
+        self.speed_test_config = cfg
+        self.master = _FakeMaster()
+        self.logger = logging.getLogger("test_stream_finish")
+        self.advanced_metrics_var = type("Var", (), {"get": staticmethod(lambda: False)})()
+        self._tester = _RaisingTester()
+        self._concurrency = None
+        self._stop_event = threading.Event()
+        self.stop_test = False
+        self._ip_to_domains = {ip: ["github.com"] for ip in ips}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.total_ip_tests = len(ips)
+        self.completed_ip_tests = 0
+        self._stream_source_done = False
+        self.results = {}
+        self.finished = False
+
+    def _build_sni_candidates(self, domains):
+        return list(domains)
+
+    def _on_one_ip_finished(self, ip, domains, ms, status, metadata=None):
+        self.results[ip] = (ms, status)
+        self.completed_ip_tests += 1
+
+    def _finish_speedtest_ui(self) -> None:
+        self.finished = True
+
+    def check_start_btn(self) -> None:
+        pass
+
+    def pump(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while not self.finished and time.monotonic() < deadline:
+            try:
+                self.master.calls.get(timeout=0.05)()
+            except queue.Empty:
+                pass
+
+
+def test_mass_probe_run_finishes_when_worker_raises():
+    listener = socket.create_server(("0.0.0.0", 0), backlog=128)
+    ips = [f"127.0.0.{i}" for i in range(2, 12)]
+    h = _Harness(ips)
+    h.speed_test_config["tcp"]["port"] = listener.getsockname()[1]
+    try:
+        threading.Thread(target=h._mass_probe_thread, args=(ips,), daemon=True).start()
+        h.pump(timeout=10.0)
+    finally:
+        listener.close()
+        h.executor.shutdown(wait=False)
+
+    assert h.finished
+    assert h.completed_ip_tests == len(ips)
+    assert all(st.startswith("失败:") and ms == 9999 for ms, st in h.results.values())
+
+
+def test_stream_callback_counts_failed_future():
+    h = _Harness(["140.82.112.3"])
+    h._stream_source_done = True
+    fut: concurrent.futures.Future = concurrent.futures.Future()
+    fut.add_done_callback(lambda f: h._on_stream_future_done("140.82.112.3", f))
+    fut.set_exception(OSError("reset"))
+    h.pump(timeout=2.0)
+    h.executor.shutdown(wait=False)
+
+    assert h.finished
+    assert h.results == {"140.82.112.3": (9999, "失败:reset")}
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""TLS 1.3 会话恢复：票据在握手后约一个 RTT 才到达，仍要被捕获；没有票据时退回完整握手。"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from local_servers import LocalHttpsServer
+from services import SpeedTester, get_shared_tls_session_cache
+
+
+class _SlowDownlinkProxy:
+    """把服务器 -> 客户端方向的每段数据延迟 delay 秒转发，模拟有真实 RTT 的链路。"""
+
+    def __init__(self, upstream_port: int, delay: float) -> None:
+        self.upstream_port = upstream_port
+        self.delay = delay
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self.upstream_port))
+            threading.Thread(target=self._pump, args=(client, upstream, 0.0), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, self.delay), daemon=True).start()
+
+    @staticmethod
+    def _pump(src: socket.socket, dst: socket.socket, delay: float) -> None:
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                if delay:
+                    time.sleep(delay)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        self._listener.close()
+
+
+@pytest.fixture
+def https():
+    get_shared_tls_session_cache().clear()
+    with LocalHttpsServer() as srv:
+        yield srv
+    get_shared_tls_session_cache().clear()
+
+
+def _verify(mode: str, port: int) -> dict:
+    tester = SpeedTester()
+    metrics: dict = {}
+    if mode == "sync":
+        ok, _ = tester.tls_sni_verify("127.0.0.1", "github.com", port=port, verify_hostname=False, metrics=metrics)
+    else:
+        ok, _ = asyncio.run(
+            tester.tls_sni_verify_async("127.0.0.1", "github.com", port=port, verify_hostname=False, metrics=metrics)
+        )
+    assert ok
+    return metrics
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_ticket_arriving_one_rtt_late_is_captured(https, mode):
+    proxy = _SlowDownlinkProxy(https.port, 0.04)
+    try:
+        metrics = _verify(mode, proxy.port)
+    finally:
+        proxy.close()
+    assert metrics["tls_resumed"] is True
+    assert "tls_resume_error" not in metrics
+    assert metrics["tls_resume_ms"] is not None
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_no_ticket_falls_back_to_full_handshake(https, mode):
+    https.ssl_context.num_tickets = 0
+    metrics = _verify(mode, https.port)
+    assert metrics["tls_resumed"] is False
+    assert metrics["tls_resume_error"] == "no_ticket"
+    assert "tls_resume_ms" not in metrics
+    assert metrics["tls_handshake_ms"] is not None
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""锦标赛测速：未入围的 IP 不参与按域名选优。"""
+
+import socket
+import threading
+
+import pytest
+
+from services import ConnectRateLimiter, TournamentScheduler, is_fully_probed_ok, pick_best_per_domain
+
+
+def _rank_by_ms(row):
+    return float(row[2])
+
+
+@pytest.fixture
+def listener():
+    """监听 0.0.0.0：127.0.0.0/8 内任意地址都能连上，用来模拟大量不同的 IP。"""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("0.0.0.0", 0))
+    srv.listen(1024)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            conn.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    yield srv.getsockname()[1]
+    try:
+        srv.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    srv.close()
+
+
+def test_is_fully_probed_ok():
+    assert is_fully_probed_ok("可用")
+    assert is_fully_probed_ok("可用(TLS)")
+    assert is_fully_probed_ok("可用(ICMP)")
+    assert not is_fully_probed_ok("可用(未入围)")
+    assert not is_fully_probed_ok("未测(同网段)")
+    assert not is_fully_probed_ok("失败")
+
+
+def test_non_finalist_never_wins_even_when_faster():
+    rows = [
+        ("1.1.1.1", "github.com", 80, "可用", False, 0.0, 0.0),
+        # 只测了 1 次的淘汰者，延迟更低（偶然的一次快样本）
+        ("2.2.2.2", "github.com", 5, "可用(未入围)", False, 0.0, 0.0),
+        ("3.3.3.3", "api.github.com", 3, "可用(未入围)", False),
+    ]
+    best = pick_best_per_domain(rows, _rank_by_ms)
+    assert best == {"github.com": ("1.1.1.1", 80)}
+
+
+def test_tls_verified_preferred_over_faster_plain():
+    rows = [
+        ("1.1.1.1", "github.com", 20, "可用", False),
+        ("2.2.2.2", "github.com", 60, "可用(TLS)", False),
+    ]
+    assert pick_best_per_domain(rows, _rank_by_ms)["github.com"][0] == "2.2.2.2"
+
+
+def test_tournament_winners_are_finalists(listener):
+    ips = [f"127.0.{i // 200}.{i % 200 + 1}" for i in range(120)]
+    groups = {"a.test": ips[:60], "b.test": ips[60:]}
+    tour = TournamentScheduler(port=listener, attempts=5, timeout=2.0, interval=0.0, limiter=ConnectRateLimiter())
+    results = tour.run(ips, groups=groups)
+
+    statuses = {r[2] for r in results}
+    assert "可用(未入围)" in statuses
+    assert tour.last_connects < tour.last_full_connects
+
+    rows = [(ip, d, ms, st, False) for d, members in groups.items() for ip, ms, st, _ in results if ip in members]
+    best = pick_best_per_domain(rows, _rank_by_ms)
+    assert set(best) == set(groups)
+    final = {r[0] for r in results if r[3].get("tournament_final")}
+    for ip, _ in best.values():
+        assert ip in final
@@ -214,6 +214,25 @@ def atomic_write_text(path: str, text: str, *, encoding: str = "utf-8") -> None:
             pass
 
 
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """原子写入二进制文件：写临时文件 -> os.replace 覆盖。"""
+    folder = os.path.dirname(os.path.abspath(path))
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except Exception:
+            pass
+
+
 def atomic_write_json(
     path: str,
     data: Any,